@@ -11,9 +11,14 @@ dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 from modules import create_app
+from modules.quote_renderer import quote_render_service
 
 app = create_app()
 
+# Pool de renderizado de cotizaciones creado al arrancar, no en un hilo de petición
+# (se detiene con atexit al apagar el servidor)
+quote_render_service.start()
+
 # 🚀 ENDPOINT PARA PANEL DE WIDGETS (Agregado sin afectar sistema original)
 from flask import request, jsonify
 import json
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# benchmark_dashboard.py
+"""
+Mide el tiempo del dashboard comercial de un cliente:
+
+1. Siete llamadas a los servicios (patrón anterior de commercial_dashboard)
+2. Resumen agregado en una sola consulta (sin caché)
+3. Resumen materializado (caché por cliente)
+
+Uso:
+    python benchmark_dashboard.py [--client-id 1] [--iterations 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+from modules import create_app, db
+from modules.models import Client
+from modules.commercial.crm_system import CRMSystem
+from modules.commercial.dashboard_summary import DashboardSummaryEngine
+from modules.commercial.inventory_manager import InventoryManager
+from modules.commercial.invoice_generator import InvoiceGenerator
+from modules.commercial.order_processor import OrderProcessor
+
+
+class QueryCounter:
+    """Cuenta las sentencias enviadas a PostgreSQL."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def legacy_dashboard(client_id, crm, orders, inventory, invoices):
+    crm.get_pipeline_overview(client_id)
+    orders.get_order_statistics(client_id)
+    inventory.get_inventory_report(client_id)
+    invoices.get_invoice_statistics(client_id)
+    inventory.get_low_stock_alerts(client_id)
+    crm.get_leads_requiring_attention(client_id, per_page=5)
+    invoices.get_overdue_invoices(client_id)[:5]
+
+
+def measure(label, iterations, counter, action):
+    counter.count = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        action()
+        db.session.rollback()
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"{label}: {elapsed * 1000:.1f} ms/dashboard | {counter.count / iterations:.1f} consultas")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del dashboard comercial")
+    parser.add_argument("--client-id", type=int, help="Cliente a medir (por defecto, el primero)")
+    parser.add_argument("--iterations", type=int, default=20, help="Repeticiones por escenario")
+    args = parser.parse_args()
+
+    print("🚀 === BENCHMARK DASHBOARD COMERCIAL ===")
+    app = create_app()
+
+    with app.app_context():
+        client_id = args.client_id or db.session.query(Client.id).order_by(Client.id).scalar()
+        if client_id is None:
+            print("❌ No hay clientes en la base de datos")
+            sys.exit(1)
+
+        counter = QueryCounter(db.engine)
+        engine = DashboardSummaryEngine()
+        services = (CRMSystem(), OrderProcessor(), InventoryManager(), InvoiceGenerator())
+
+        legacy = measure("🐢 Siete servicios", args.iterations, counter,
+                         lambda: legacy_dashboard(client_id, *services))
+        aggregated = measure("⚡ Consulta agregada", args.iterations, counter,
+                             lambda: engine.compute_summary(client_id))
+        engine.get_summary(client_id, refresh=True)
+        cached = measure("💾 Resumen materializado", args.iterations, counter,
+                         lambda: engine.get_summary(client_id))
+
+        print(f"📈 Aceleración: {legacy / aggregated:.1f}x agregada, {legacy / cached:.1f}x cacheada")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# benchmark_inventory_reservations.py
+"""
+Mide la reserva de inventario bajo ráfagas de órdenes concurrentes sobre
+pocos productos con stock limitado:
+
+1. Leer stock, comprobar y descontar sin bloqueo (patrón anterior): sobreventa
+2. Órdenes directas con reserva atómica (FOR UPDATE en orden de id +
+   tabla inventory_reservations)
+
+Cada orden pide 1-3 productos al azar, así las órdenes comparten filas en
+distinto orden (el caso que provoca interbloqueos). Usa productos y órdenes
+'bench_reservation' que se borran al terminar.
+
+Uso:
+    python benchmark_inventory_reservations.py [--client-id 1] [--threads 16] [--orders 50]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import delete, select
+from modules import create_app, db
+from modules.models import Client
+from modules.commercial_models import (
+    InventoryMovement, InventoryReservation, Order, OrderItem, Product
+)
+from modules.commercial.order_processor import OrderProcessor
+
+BENCH_NAME = 'bench_reservation'
+
+
+def create_products(client_id, count, stock):
+    products = [
+        Product(client_id=client_id, name=f'{BENCH_NAME}_{i}', sku=f'BENCH-RES-{i}',
+                base_price=Decimal('10.00'), stock_quantity=stock, min_stock_alert=0)
+        for i in range(count)
+    ]
+    db.session.add_all(products)
+    db.session.commit()
+    return [product.id for product in products]
+
+
+def reset_stock(product_ids, stock):
+    Product.query.filter(Product.id.in_(product_ids)).update(
+        {'stock_quantity': stock}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def random_basket(product_ids, rng):
+    chosen = rng.sample(product_ids, rng.randint(1, min(3, len(product_ids))))
+    return {product_id: rng.randint(1, 3) for product_id in chosen}
+
+
+def legacy_reserve(basket):
+    """Patrón anterior: comprobar stock_quantity en Python y descontar sin bloqueo."""
+    for product_id, quantity in basket.items():
+        product = Product.query.get(product_id)
+        if product.stock_quantity < quantity:
+            db.session.rollback()
+            return False
+        product.stock_quantity -= quantity
+    db.session.commit()
+    return True
+
+
+def run(app, threads, per_thread, product_ids, place_order):
+    """Lanza la ráfaga y devuelve (segundos, unidades vendidas por producto, rechazos, errores)."""
+    sold = Counter()
+    rejected = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        with app.app_context():
+            for _ in range(per_thread):
+                basket = random_basket(product_ids, rng)
+                try:
+                    accepted, error = place_order(basket)
+                except Exception as e:
+                    db.session.rollback()
+                    accepted, error = False, str(e)
+                with lock:
+                    if accepted:
+                        sold.update(basket)
+                    elif error:
+                        errors.append(error)
+                    else:
+                        rejected.append(basket)
+            db.session.remove()
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, sold, rejected, errors
+
+
+def report(label, elapsed, sold, rejected, errors, product_ids, stock, per_thread, threads):
+    final_stock = dict(db.session.execute(
+        select(Product.id, Product.stock_quantity).where(Product.id.in_(product_ids))
+    ).all())
+    oversold = sum(max(0, sold[product_id] - stock) for product_id in product_ids)
+    drift = sum(abs(stock - sold[product_id] - final_stock[product_id]) for product_id in product_ids)
+    deadlocks = sum(1 for error in errors if 'deadlock' in error.lower())
+    accepted = threads * per_thread - len(rejected) - len(errors)
+    print(f"{label}: {threads * per_thread / elapsed:,.0f} órdenes/s | aceptadas: {accepted} | "
+          f"sin stock: {len(rejected)} | sobreventa: {oversold} uds | descuadre: {drift} uds | "
+          f"interbloqueos: {deadlocks} | errores: {len(errors)}")
+
+
+def cleanup(client_id, product_ids):
+    order_ids = select(Order.id).where(Order.client_id == client_id, Order.customer_name == BENCH_NAME)
+    db.session.execute(delete(InventoryReservation).where(InventoryReservation.order_id.in_(order_ids)))
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.session.execute(delete(Order).where(Order.client_id == client_id, Order.customer_name == BENCH_NAME))
+    db.session.execute(delete(InventoryMovement).where(InventoryMovement.product_id.in_(product_ids)))
+    db.session.execute(delete(Product).where(Product.id.in_(product_ids)))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de reservas de inventario concurrentes")
+    parser.add_argument("--client-id", type=int, help="Cliente para los productos de prueba (por defecto, el primero)")
+    parser.add_argument("--threads", type=int, default=16, help="Hilos concurrentes")
+    parser.add_argument("--orders", type=int, default=50, help="Órdenes por hilo")
+    parser.add_argument("--products", type=int, default=5, help="Productos en disputa")
+    parser.add_argument("--stock", type=int, default=200, help="Stock inicial por producto")
+    args = parser.parse_args()
+
+    print("🚀 === BENCHMARK RESERVAS DE INVENTARIO ===")
+    app = create_app()
+
+    with app.app_context():
+        client_id = args.client_id or db.session.query(Client.id).order_by(Client.id).scalar()
+        if client_id is None:
+            print("❌ No hay clientes en la base de datos")
+            sys.exit(1)
+        product_ids = create_products(client_id, args.products, args.stock)
+
+    processor = OrderProcessor()
+
+    def atomic_order(basket):
+        result = processor.create_direct_order(
+            client_id,
+            {'name': BENCH_NAME},
+            [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in basket.items()]
+        )
+        if result['success']:
+            return True, None
+        # Falta de stock es un rechazo esperado, no un error
+        return False, None if 'Stock insuficiente' in result['error'] else result['error']
+
+    scenarios = [
+        ("🐢 Leer + descontar", lambda basket: (legacy_reserve(basket), None)),
+        ("🔒 Reserva atómica", atomic_order),
+    ]
+
+    try:
+        for label, place_order in scenarios:
+            with app.app_context():
+                reset_stock(product_ids, args.stock)
+            elapsed, sold, rejected, errors = run(app, args.threads, args.orders, product_ids, place_order)
+            with app.app_context():
+                report(label, elapsed, sold, rejected, errors, product_ids,
+                       args.stock, args.orders, args.threads)
+                for error in list(dict.fromkeys(errors))[:3]:
+                    print(f"   ❌ {error}")
+    finally:
+        with app.app_context():
+            cleanup(client_id, product_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# benchmark_ocr.py
+"""
+Mide el rendimiento del OCR por lotes sobre las páginas escaneadas de un PDF:
+clasificación de páginas, OCR secuencial y OCR en pool de procesos.
+
+Uso:
+    python benchmark_ocr.py catalogo_escaneado.pdf [--workers 4] [--max-pages 20]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fitz  # PyMuPDF
+from modules.ocr_extractor import OCRExtractor, OCR_DPI, OCR_LANGUAGE, _ocr_image
+
+
+def render_image_pages(pdf_path, max_pages):
+    """Clasifica las páginas y renderiza solo las escaneadas."""
+    images = []
+    text_pages = 0
+
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            page_text = page.get_text()
+            if OCRExtractor.classify_page(page, page_text) == 'image':
+                images.append(page.get_pixmap(dpi=OCR_DPI).tobytes('png'))
+                if len(images) >= max_pages:
+                    break
+            else:
+                text_pages += 1
+    elapsed = time.perf_counter() - start
+
+    return images, text_pages, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de OCR por lotes")
+    parser.add_argument("pdf_path", help="PDF con páginas escaneadas")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos del pool")
+    parser.add_argument("--max-pages", type=int, default=20, help="Máximo de páginas escaneadas a medir")
+    args = parser.parse_args()
+
+    print("🚀 === BENCHMARK OCR ===")
+
+    if not OCRExtractor.is_ocr_available():
+        print("❌ Tesseract no está instalado (sudo apt install tesseract-ocr tesseract-ocr-spa)")
+        sys.exit(1)
+
+    images, text_pages, classify_time = render_image_pages(args.pdf_path, args.max_pages)
+    print(f"📄 Páginas con texto: {text_pages} | Páginas escaneadas: {len(images)}")
+    print(f"⏱️ Clasificación + render ({OCR_DPI} dpi): {classify_time:.2f}s")
+
+    if not images:
+        print("⚠️ El PDF no tiene páginas escaneadas, no hay nada que medir")
+        return
+
+    jobs = [(png_bytes, OCR_LANGUAGE) for png_bytes in images]
+
+    # 1. OCR secuencial
+    start = time.perf_counter()
+    sequential_texts = [_ocr_image(job) for job in jobs]
+    sequential_time = time.perf_counter() - start
+    print(f"🐢 Secuencial: {sequential_time:.2f}s ({len(jobs) / sequential_time:.2f} páginas/s)")
+
+    # 2. OCR en pool de procesos
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(_ocr_image, jobs[:1]))  # Calentar procesos
+        start = time.perf_counter()
+        pool_texts = list(pool.map(_ocr_image, jobs))
+        pool_time = time.perf_counter() - start
+    print(f"⚡ Pool ({args.workers} procesos): {pool_time:.2f}s ({len(jobs) / pool_time:.2f} páginas/s)")
+    print(f"📈 Aceleración: {sequential_time / pool_time:.1f}x")
+
+    total_chars = sum(len(text.strip()) for text in pool_texts)
+    print(f"🔤 Caracteres reconocidos: {total_chars:,}")
+    if sequential_texts != pool_texts:
+        print("⚠️ El resultado del pool difiere del secuencial")
+
+
+if __name__ == "__main__":
+    main()
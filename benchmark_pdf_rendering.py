@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# benchmark_pdf_rendering.py
+"""
+Mide el throughput de renderizado de cotizaciones PDF con la plantilla de
+página cacheada (caso de un cierre de mes) frente a reconstruirla en cada
+documento.
+
+Uso:
+    python benchmark_pdf_rendering.py [--documents 200] [--items 15]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.pdf_templates import pdf_template_cache
+from modules.quote_system_v2 import QuoteSystemV2
+
+
+def build_quote_data(index, items):
+    """Cotización sintética con N items."""
+    quote_items = [
+        {
+            'description': f"Producto de prueba {i + 1}",
+            'quantity': i % 5 + 1,
+            'unit_price': 1500.0 + i * 125,
+            'total': (i % 5 + 1) * (1500.0 + i * 125)
+        }
+        for i in range(items)
+    ]
+    subtotal = sum(item['total'] for item in quote_items)
+    return {
+        'quote_number': f"COT-BENCH-{index:06d}",
+        'client_name': f"Cliente {index}",
+        'date': '01/01/2026',
+        'valid_until': '31/01/2026',
+        'items': quote_items,
+        'subtotal': subtotal,
+        'tax_rate': 0.19,
+        'tax_amount': subtotal * 0.19,
+        'total': subtotal * 1.19
+    }
+
+
+def run(renderer, documents, items, output_dir, cold):
+    """Renderiza N cotizaciones y devuelve el tiempo total."""
+    start = time.perf_counter()
+    for index in range(documents):
+        if cold:
+            # Sin caché: la plantilla se reconstruye en cada documento
+            pdf_template_cache.clear()
+        filepath = os.path.join(output_dir, f"cotizacion_{index}.pdf")
+        renderer.build_quote_pdf(build_quote_data(index, items), filepath)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de renderizado de PDFs")
+    parser.add_argument("--documents", type=int, default=200, help="Documentos por escenario")
+    parser.add_argument("--items", type=int, default=15, help="Items por cotización")
+    args = parser.parse_args()
+
+    print("🚀 === BENCHMARK RENDERIZADO PDF ===")
+    renderer = QuoteSystemV2()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Calentar imports y fuentes
+        run(renderer, 3, args.items, output_dir, cold=False)
+
+        cold_time = run(renderer, args.documents, args.items, output_dir, cold=True)
+        print(f"🐢 Plantilla por documento: {cold_time:.2f}s ({args.documents / cold_time:.1f} PDFs/s)")
+
+        warm_time = run(renderer, args.documents, args.items, output_dir, cold=False)
+        print(f"⚡ Plantilla cacheada: {warm_time:.2f}s ({args.documents / warm_time:.1f} PDFs/s)")
+
+        sizes = [os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)]
+        print(f"📈 Aceleración: {cold_time / warm_time:.2f}x")
+        print(f"📄 Tamaño medio: {sum(sizes) / len(sizes) / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# benchmark_query_plans.py
+"""
+Compara el plan de ejecución (EXPLAIN ANALYZE) de los filtros frecuentes
+sin y con los índices compuestos de la migración 0003:
+
+1. Antes: los índices se eliminan dentro de una transacción que se deshace
+2. Después: con los índices creados por 'flask db-upgrade'
+
+DROP INDEX bloquea la tabla hasta el ROLLBACK: ejecutar contra una copia
+de staging, no en producción.
+
+Uso:
+    python benchmark_query_plans.py [--client-id 1] [--iterations 5]
+"""
+import argparse
+import os
+import sys
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from modules import create_app, db
+from modules.schema_migrations import HOT_FILTER_INDEXES
+
+# (índice que debería usar, consulta) con los mismos filtros que la aplicación
+HOT_QUERIES = [
+    ('ix_conversations_client_chat_timestamp', """
+        SELECT * FROM salesmind_conversations
+        WHERE client_id = :client_id AND chat_id = :chat_id
+        ORDER BY timestamp DESC LIMIT 20
+    """),
+    ('ix_query_logs_client_timestamp', """
+        SELECT count(*), avg(response_time) FROM query_logs
+        WHERE client_id = :client_id AND timestamp >= now() - interval '30 days'
+    """),
+    ('ix_embeddings_client_document_chunk', """
+        SELECT id, chunk_index FROM embeddings
+        WHERE client_id = :client_id AND document_id = :document_id
+        ORDER BY chunk_index
+    """),
+    ('ix_faiss_indexes_client_name_active', """
+        SELECT id, version FROM faiss_indexes
+        WHERE client_id = :client_id AND index_name = 'main_index' AND is_active = true
+    """),
+    ('ix_leads_client_status_next_action', """
+        SELECT id FROM leads
+        WHERE client_id = :client_id AND status = 'qualified' AND next_action_date < now()
+    """),
+    ('ix_invoices_client_due_status', """
+        SELECT id, total_amount FROM invoices
+        WHERE client_id = :client_id AND due_date < now() AND status <> 'paid'
+    """),
+    ('ix_inventory_movements_reference', """
+        SELECT * FROM inventory_movements
+        WHERE reference_type = :reference_type AND reference_id = :reference_id
+    """),
+]
+
+
+def sample_params(conn, client_id):
+    """Valores reales de la base para que los planes sean representativos"""
+    def first(sql, default, **params):
+        row = conn.execute(text(sql), params).first()
+        return row[0] if row and row[0] is not None else default
+
+    return {
+        'client_id': client_id,
+        'chat_id': first("SELECT chat_id FROM salesmind_conversations WHERE client_id = :c "
+                         "ORDER BY id DESC LIMIT 1", '', c=client_id),
+        'document_id': first("SELECT document_id FROM embeddings WHERE client_id = :c "
+                             "ORDER BY id DESC LIMIT 1", 0, c=client_id),
+        'reference_type': first("SELECT reference_type FROM inventory_movements "
+                                "WHERE reference_id IS NOT NULL ORDER BY id DESC LIMIT 1", 'order'),
+        'reference_id': first("SELECT reference_id FROM inventory_movements "
+                              "WHERE reference_id IS NOT NULL ORDER BY id DESC LIMIT 1", 0),
+    }
+
+
+def index_names(plan):
+    """Índices usados en cualquier nodo del plan"""
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= index_names(child)
+    return names
+
+
+def explain(conn, sql, params, iterations):
+    """Mejor tiempo de ejecución de varias pasadas (la primera calienta la caché)"""
+    best = None
+    for _ in range(iterations):
+        result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params).scalar()
+        report = result[0]
+        if best is None or report['Execution Time'] < best['Execution Time']:
+            best = report
+    plan = best['Plan']
+    return {
+        'node': plan['Node Type'],
+        'indexes': ', '.join(sorted(index_names(plan))) or '-',
+        'cost': plan['Total Cost'],
+        'ms': best['Execution Time'],
+        'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+    }
+
+
+def print_plan(label, plan):
+    print(f"   {label}: {plan['node']:<18} {plan['ms']:8.2f} ms | coste {plan['cost']:10.1f} | "
+          f"{plan['buffers']:6d} bloques | índices: {plan['indexes']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Planes de consulta sin y con índices compuestos")
+    parser.add_argument('--client-id', type=int, default=None)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        with db.engine.connect() as conn:
+            client_id = args.client_id or conn.execute(text("SELECT min(id) FROM client")).scalar()
+            if client_id is None:
+                print("❌ No hay clientes en la base de datos")
+                return 1
+
+            params = sample_params(conn, client_id)
+            conn.rollback()
+            missing = {
+                name for name, _, _ in HOT_FILTER_INDEXES
+                if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is None
+            }
+            conn.rollback()
+            if missing:
+                print(f"⚠️ Faltan índices (ejecuta 'flask db-upgrade'): {', '.join(sorted(missing))}")
+
+            print(f"🔎 Planes de consulta para el cliente {client_id} ({args.iterations} pasadas)\n")
+            for index_name, sql in HOT_QUERIES:
+                print(f"📋 {index_name}")
+
+                # Antes: sin el índice, deshaciendo el DROP al terminar
+                with conn.begin() as transaction:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                    before = explain(conn, sql, params, args.iterations)
+                    transaction.rollback()
+
+                with conn.begin() as transaction:
+                    after = explain(conn, sql, params, args.iterations)
+                    transaction.rollback()
+
+                print_plan("antes  ", before)
+                print_plan("después", after)
+                if after['ms'] > 0:
+                    print(f"   ⚡ {before['ms'] / after['ms']:.1f}x\n")
+                else:
+                    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# benchmark_sequences.py
+"""
+Mide la emisión concurrente de números de documento por cliente:
+
+1. Leer el último número y sumar uno (patrón anterior de facturas): duplicados
+2. Contador bloqueado por fila en la transacción (facturas, sin huecos)
+3. Bloques pre-asignados por worker (cotizaciones y órdenes)
+
+Usa secuencias 'bench_*' que se borran al terminar.
+
+Uso:
+    python benchmark_sequences.py [--client-id 1] [--threads 8] [--per-thread 200]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules import create_app, db
+from modules.models import Client
+from modules.commercial_models import DocumentSequence
+from modules.commercial.sequence_allocator import SequenceAllocator
+
+
+def read_then_increment(client_id, sequence_name):
+    """Patrón anterior: leer el último valor y escribir el siguiente sin bloqueo."""
+    row = DocumentSequence.query.filter_by(
+        client_id=client_id, sequence_name=sequence_name, period=''
+    ).first()
+    if row is None:
+        row = DocumentSequence(client_id=client_id, sequence_name=sequence_name, period='', last_value=0)
+        db.session.add(row)
+    value = row.last_value + 1
+    row.last_value = value
+    db.session.commit()
+    return value
+
+
+def run(app, threads, per_thread, issue):
+    """Emite per_thread números en cada hilo y devuelve (segundos, números, errores)."""
+    numbers = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        with app.app_context():
+            local = []
+            for _ in range(per_thread):
+                try:
+                    local.append(issue())
+                except Exception as e:
+                    db.session.rollback()
+                    with lock:
+                        errors.append(str(e))
+            db.session.remove()
+            with lock:
+                numbers.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, numbers, errors
+
+
+def report(label, elapsed, numbers, errors):
+    duplicates = sum(count - 1 for count in Counter(numbers).values() if count > 1)
+    gaps = (max(numbers) - min(numbers) + 1 - len(set(numbers))) if numbers else 0
+    print(f"{label}: {len(numbers) / elapsed:,.0f} números/s | "
+          f"duplicados: {duplicates} | huecos: {gaps} | errores: {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de numeración concurrente")
+    parser.add_argument("--client-id", type=int, help="Cliente para las secuencias de prueba (por defecto, el primero)")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos concurrentes")
+    parser.add_argument("--per-thread", type=int, default=200, help="Números por hilo")
+    parser.add_argument("--block-size", type=int, default=20, help="Tamaño de bloque por worker")
+    args = parser.parse_args()
+
+    print("🚀 === BENCHMARK NUMERACIÓN DE DOCUMENTOS ===")
+    app = create_app()
+
+    with app.app_context():
+        client_id = args.client_id or db.session.query(Client.id).order_by(Client.id).scalar()
+        if client_id is None:
+            print("❌ No hay clientes en la base de datos")
+            sys.exit(1)
+
+    allocator = SequenceAllocator(block_size=args.block_size)
+
+    def gap_free():
+        value = allocator.next_gap_free(client_id, 'bench_gap_free')
+        db.session.commit()
+        return value
+
+    scenarios = [
+        ("🐢 Leer + incrementar", lambda: read_then_increment(client_id, 'bench_read_increment')),
+        ("🔒 Contador bloqueado", gap_free),
+        (f"⚡ Bloques de {args.block_size}", lambda: allocator.next_value(client_id, 'bench_block')),
+    ]
+
+    try:
+        for label, issue in scenarios:
+            elapsed, numbers, errors = run(app, args.threads, args.per_thread, issue)
+            report(label, elapsed, numbers, errors)
+    finally:
+        with app.app_context():
+            DocumentSequence.query.filter(
+                DocumentSequence.client_id == client_id,
+                DocumentSequence.sequence_name.like('bench_%')
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -35,4 +35,9 @@ class Config:
     # Claves API
     GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
     TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
-    AI_PROVIDER = os.environ.get('AI_PROVIDER', 'google')
\ No newline at end of file
+    AI_PROVIDER = os.environ.get('AI_PROVIDER', 'google')
+
+    # Descarga de cotizaciones: prefijo interno de Nginx para X-Accel-Redirect
+    # (ej: '/protected-quotes/'); vacío para servir el archivo desde Flask
+    QUOTES_X_ACCEL_PREFIX = os.environ.get('QUOTES_X_ACCEL_PREFIX', '')
+    QUOTE_ARTIFACT_MAX_AGE = int(os.environ.get('QUOTE_ARTIFACT_MAX_AGE', 31536000))
\ No newline at end of file
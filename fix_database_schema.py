@@ -2,6 +2,7 @@
 # fix_database_schema.py
 """
 Script para arreglar el esquema de la base de datos después de la migración.
+Los cambios de esquema viven en modules/schema_migrations.py (flask db-upgrade).
 """
 import sys
 import os
@@ -10,11 +11,13 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from modules import create_app, db
+from modules.schema_migrations import upgrade
 from sqlalchemy import text
 
 def fix_client_table():
     """
-    Hace que la columna index_path sea nullable y añade un valor por defecto.
+    Aplica las migraciones de esquema pendientes (modules/schema_migrations.py).
+    Equivale a 'flask db-upgrade'; se mantiene por compatibilidad.
     """
     print("🔧 === ARREGLANDO ESQUEMA DE BASE DE DATOS ===")
     
@@ -22,24 +25,10 @@ def fix_client_table():
     
     with app.app_context():
         try:
-            # Hacer que index_path sea nullable
-            print("📝 Actualizando columna index_path...")
-            
-            # Para PostgreSQL, necesitamos usar ALTER TABLE (SQLAlchemy 2.0 syntax)
-            with db.engine.connect() as conn:
-                conn.execute(text("""
-                    ALTER TABLE client 
-                    ALTER COLUMN index_path DROP NOT NULL;
-                """))
-                
-                # Establecer valores por defecto para registros existentes con NULL
-                conn.execute(text("""
-                    UPDATE client 
-                    SET index_path = 'postgresql_storage' 
-                    WHERE index_path IS NULL;
-                """))
-                
-                conn.commit()
+            result = upgrade()
+            if not result['success']:
+                print(f"❌ Error actualizando esquema: {result['error']}")
+                return False
             
             print("✅ Esquema actualizado correctamente")
             
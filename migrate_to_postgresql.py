@@ -13,11 +13,15 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from modules import create_app, db
-from modules.models import Client, Conversation, Document, Embedding, FAISSIndex
+from modules.models import Client, Conversation, Document, Embedding, FAISSIndex, QueryLog
+from modules.bulk_writer import BulkWriter
 from modules.document_manager import DocumentManager
 from modules.vector_manager import VectorManager
 from config import Config, BASE_DIR
 
+# Marca de los QueryLog reconstruidos desde SQLite (permite reemplazarlos al repetir)
+LEGACY_QUERY_LOG_MODEL = 'legacy-sqlite'
+
 def migrate_existing_clients():
     """
     Migra clientes existentes desde client_indexes/ a PostgreSQL.
@@ -101,9 +105,32 @@ def migrate_existing_clients():
     print(f"\n🎉 Migración completada: {clients_migrated} clientes migrados")
 
 
+def _get_client_ids_by_chat():
+    """
+    Mapa telegram_chat_id -> client_id para resolver clientes sin una consulta por fila.
+    """
+    rows = db.session.query(Client.telegram_chat_id, Client.id).filter(
+        Client.telegram_chat_id.isnot(None)
+    ).all()
+    return {str(chat_id): client_id for chat_id, client_id in rows}
+
+
+def _iter_sqlite_rows(cursor, batch_size=BulkWriter.DEFAULT_BATCH_SIZE):
+    """
+    Recorre un cursor de SQLite por lotes para no cargar toda la tabla en memoria.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
 def migrate_conversations_from_sqlite():
     """
     Migra conversaciones desde SQLite a PostgreSQL.
+    Las filas se escriben por lotes con COPY mediante BulkWriter.
     """
     print("\n💬 === MIGRANDO CONVERSACIONES DESDE SQLITE ===")
     
@@ -119,42 +146,104 @@ def migrate_conversations_from_sqlite():
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
+        cursor.execute("SELECT COUNT(*) FROM conversations")
+        print(f"📊 Encontradas {cursor.fetchone()[0]} conversaciones en SQLite")
+        
+        client_ids = _get_client_ids_by_chat()
+        missing_chats = set()
+        
         # Obtener conversaciones
         cursor.execute("SELECT * FROM conversations ORDER BY timestamp ASC")
-        conversations = cursor.fetchall()
+        
+        with BulkWriter(Conversation, use_copy=True) as writer:
+            for conv in _iter_sqlite_rows(cursor):
+                chat_id = str(conv['chat_id'])
+                client_id = client_ids.get(chat_id)
+                
+                if not client_id:
+                    if chat_id not in missing_chats:
+                        print(f"⚠️ No se encontró cliente para chat_id: {chat_id}")
+                        missing_chats.add(chat_id)
+                    continue
+                
+                writer.add({
+                    'client_id': client_id,
+                    'chat_id': chat_id,
+                    'sender': conv['sender'],
+                    'message_text': conv['message_text'],
+                    'timestamp': conv['timestamp'],
+                    'platform': 'telegram',
+                    'message_type': 'text'
+                })
+        
         conn.close()
+        db.session.commit()
+        print(f"✅ {writer.rows_written} conversaciones migradas a PostgreSQL")
+        
+    except Exception as e:
+        print(f"❌ Error migrando conversaciones: {e}")
+        db.session.rollback()
+
+
+def backfill_query_logs_from_sqlite():
+    """
+    Reconstruye QueryLog a partir del historial de SQLite: cada mensaje del
+    usuario se empareja con la siguiente respuesta del bot en el mismo chat.
+    Las filas se escriben por lotes con COPY mediante BulkWriter.
+    
+    Idempotente: las filas 'legacy-sqlite' de una ejecución anterior se
+    reemplazan en la misma transacción en lugar de duplicarse.
+    """
+    print("\n📝 === RECONSTRUYENDO QUERY LOGS DESDE SQLITE ===")
+    
+    sqlite_path = getattr(Config, 'DATABASE_PATH', 'instance/legal_db.db')
+    
+    if not os.path.exists(sqlite_path):
+        print("⚠️ Base de datos SQLite no encontrada")
+        return
+    
+    try:
+        conn = sqlite3.connect(sqlite_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM conversations ORDER BY chat_id, timestamp ASC, id ASC")
         
-        print(f"📊 Encontradas {len(conversations)} conversaciones en SQLite")
+        client_ids = _get_client_ids_by_chat()
+        pending_questions = {}  # chat_id -> mensaje del usuario sin respuesta
         
-        conversations_migrated = 0
+        replaced = QueryLog.query.filter_by(model_used=LEGACY_QUERY_LOG_MODEL).delete(synchronize_session=False)
+        if replaced:
+            print(f"🔁 Reemplazando {replaced} query logs de una reconstrucción anterior")
         
-        for conv in conversations:
-            # Buscar cliente por chat_id de Telegram
-            client = Client.query.filter_by(telegram_chat_id=str(conv['chat_id'])).first()
-            
-            if not client:
-                print(f"⚠️ No se encontró cliente para chat_id: {conv['chat_id']}")
-                continue
-            
-            # Crear conversación en PostgreSQL
-            new_conv = Conversation(
-                client_id=client.id,
-                chat_id=str(conv['chat_id']),
-                sender=conv['sender'],
-                message_text=conv['message_text'],
-                timestamp=conv['timestamp'],
-                platform='telegram',
-                message_type='text'
-            )
-            
-            db.session.add(new_conv)
-            conversations_migrated += 1
+        with BulkWriter(QueryLog, use_copy=True) as writer:
+            for conv in _iter_sqlite_rows(cursor):
+                chat_id = str(conv['chat_id'])
+                client_id = client_ids.get(chat_id)
+                if not client_id:
+                    continue
+                
+                if conv['sender'] == 'user':
+                    pending_questions[chat_id] = conv
+                    continue
+                
+                question = pending_questions.pop(chat_id, None)
+                if question is None:
+                    continue
+                
+                writer.add({
+                    'client_id': client_id,
+                    'question': question['message_text'],
+                    'answer': conv['message_text'],
+                    'model_used': LEGACY_QUERY_LOG_MODEL,
+                    'timestamp': question['timestamp']
+                })
         
+        conn.close()
         db.session.commit()
-        print(f"✅ {conversations_migrated} conversaciones migradas a PostgreSQL")
+        print(f"✅ {writer.rows_written} query logs reconstruidos en PostgreSQL")
         
     except Exception as e:
-        print(f"❌ Error migrando conversaciones: {e}")
+        print(f"❌ Error reconstruyendo query logs: {e}")
         db.session.rollback()
 
 
@@ -216,6 +305,7 @@ def main():
         try:
             migrate_existing_clients()
             migrate_conversations_from_sqlite()
+            backfill_query_logs_from_sqlite()
             generate_migration_report()
             
             print("\n🎉 ¡MIGRACIÓN COMPLETADA EXITOSAMENTE!")
@@ -8,6 +8,7 @@ from modules.commercial_models import (
     Product, Quote, QuoteItem, Order, OrderItem, 
     Invoice, InventoryMovement, Lead, LeadInteraction
 )
+from modules.schema_migrations import upgrade
 
 def upgrade_database():
     """
@@ -16,8 +17,11 @@ def upgrade_database():
     try:
         print("🚀 Iniciando migración de SalesMind a versión 2.0.0...")
         
-        # Crear todas las nuevas tablas
-        db.create_all()
+        # Crear las tablas nuevas y aplicar las migraciones de esquema pendientes
+        result = upgrade()
+        if not result['success']:
+            print(f"❌ Error durante la migración: {result['error']}")
+            return False
         
         print("✅ Tablas creadas exitosamente:")
         print("   - products (Catálogo de productos/servicios)")
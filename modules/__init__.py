@@ -24,6 +24,14 @@ def create_app():
         pass
 
     db.init_app(app)
+    
+    # Invalidar el resumen del dashboard comercial al cambiar leads, órdenes, facturas o stock
+    from .commercial.dashboard_summary import register_dashboard_invalidation
+    register_dashboard_invalidation()
+    
+    # Mantener el rollup diario de inventario al registrar movimientos
+    from .commercial.inventory_ledger import register_inventory_rollup
+    register_inventory_rollup()
 
     def create_database_if_not_exists():
         db_url = app.config['SQLALCHEMY_DATABASE_URI']
@@ -36,8 +44,29 @@ def create_app():
         with app.app_context():
             from .models import Client
             create_database_if_not_exists()
-            db.create_all()
-            click.echo("Base de datos inicializada.")
+            from .schema_migrations import upgrade
+            # create_all + migraciones: una base nueva queda registrada al día
+            if upgrade()['success']:
+                click.echo("Base de datos inicializada.")
+
+    @app.cli.command("db-upgrade")
+    @click.option("--target", help="Última versión a aplicar (por defecto, todas)")
+    def db_upgrade_command(target):
+        """Crea las tablas nuevas y aplica las migraciones de esquema pendientes."""
+        from .schema_migrations import upgrade
+
+        result = upgrade(target=target)
+        if not result['success']:
+            raise click.ClickException(result['error'])
+
+    @app.cli.command("db-status")
+    def db_status_command():
+        """Muestra las migraciones de esquema aplicadas y pendientes."""
+        from .schema_migrations import status
+
+        for entry in status():
+            mark = f"✅ {entry['applied_at']}" if entry['applied_at'] else "⏳ pendiente"
+            click.echo(f"{entry['version']} | {mark} | {entry['description']}")
 
     @app.cli.command("add-client")
     @click.argument("name")
@@ -217,6 +246,108 @@ def create_app():
             import traceback
             traceback.print_exc()
 
+    @app.cli.command("ingestion-worker")
+    @click.option("--workers", default=1, show_default=True, help="Número de procesos worker")
+    @click.option("--poll-interval", default=2.0, show_default=True, help="Segundos de espera con la cola vacía")
+    @click.option("--once", is_flag=True, help="Procesar como máximo un trabajo y salir")
+    def ingestion_worker_command(workers, poll_interval, once):
+        """Procesa la cola de ingesta de documentos del panel del indexador."""
+        from .ingestion_queue import IngestionQueue, run_worker_process
+        
+        if once or workers <= 1:
+            IngestionQueue.run_worker(poll_interval=poll_interval, once=once)
+            return
+        
+        import multiprocessing
+        
+        click.echo(f"👷 Iniciando {workers} workers de ingesta...")
+        processes = [
+            # No daemon: cada worker puede abrir su propio pool de procesos para OCR
+            multiprocessing.Process(target=run_worker_process, args=(poll_interval,))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            click.echo("🛑 Deteniendo workers de ingesta...")
+            for process in processes:
+                process.terminate()
+
+    @app.cli.command("invoice-batch-worker")
+    @click.option("--poll-interval", default=5.0, show_default=True, help="Segundos de espera con la cola vacía")
+    @click.option("--once", is_flag=True, help="Procesar como máximo un lote y salir")
+    def invoice_batch_worker_command(poll_interval, once):
+        """Procesa los lotes de facturación encolados (cierres de mes)."""
+        from .commercial.invoice_batch import InvoiceBatchProcessor
+        
+        InvoiceBatchProcessor.run_worker(poll_interval=poll_interval, once=once)
+
+    @app.cli.command("artifacts-maintenance")
+    @click.option("--limit", default=1000, show_default=True, help="Documentos por tarea")
+    @click.option("--skip-migration", is_flag=True, help="No migrar los PDFs del directorio plano anterior")
+    def artifacts_maintenance_command(limit, skip_migration):
+        """Migra, compacta y aplica la retención de los PDFs de cotizaciones y facturas."""
+        from .artifact_store import artifact_store
+        
+        if not skip_migration:
+            for kind in ('quote', 'invoice'):
+                migrated = artifact_store.migrate_legacy(kind, limit=limit)
+                click.echo(f"📦 {kind}: {migrated} archivos migrados al esquema por fecha")
+        
+        stats = artifact_store.compact(limit=limit)
+        click.echo(f"🗜️ Compactados: {stats['hashed']} | duplicados: {stats['deduplicated']} | "
+                   f"filas sin archivo: {stats['pruned']}")
+        
+        cleanup = artifact_store.cleanup_expired(limit=limit)
+        click.echo(f"🧹 Cotizaciones caducadas: {cleanup['deleted']} borradas "
+                   f"({cleanup['files_removed']} archivos), {cleanup['retained']} conservadas")
+
+    @app.cli.command("inventory-rollup-backfill")
+    @click.option("--client-id", type=int, help="Solo este cliente")
+    @click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), help="Recalcular desde esta fecha")
+    def inventory_rollup_backfill_command(client_id, since):
+        """Reconstruye el rollup diario de inventario desde los movimientos."""
+        from .commercial.inventory_ledger import rebuild_rollups
+
+        result = rebuild_rollups(client_id=client_id, since=since.date() if since else None)
+        click.echo(f"📊 Rollup reconstruido: {result['clients']} clientes, {result['rows']} filas")
+        for error in result['errors']:
+            click.echo(f"❌ Cliente {error['client_id']}: {error['error']}")
+
+    @app.cli.command("crm-event-worker")
+    @click.option("--poll-interval", default=2.0, show_default=True, help="Segundos de espera con la cola vacía")
+    @click.option("--once", is_flag=True, help="Procesar como máximo un lote y salir")
+    def crm_event_worker_command(poll_interval, once):
+        """Lleva al CRM (leads e interacciones) los eventos del chat encolados."""
+        from .commercial.lead_pipeline import lead_pipeline
+
+        lead_pipeline.run_worker(poll_interval=poll_interval, once=once)
+
+    @app.cli.command("quote-store-worker")
+    @click.option("--poll-interval", default=2.0, show_default=True, help="Segundos de espera con la cola vacía")
+    @click.option("--once", is_flag=True, help="Procesar como máximo un lote y salir")
+    def quote_store_worker_command(poll_interval, once):
+        """Guarda en quotes las cotizaciones del chat que siguen en la cola persistente."""
+        from .commercial.quote_store import quote_store
+
+        quote_store.run_worker(poll_interval=poll_interval, once=once)
+
+    @app.cli.command("expire-inventory-reservations")
+    @click.option("--limit", default=500, show_default=True, help="Órdenes por pasada")
+    def expire_inventory_reservations_command(limit):
+        """Devuelve al stock las reservas de órdenes pendientes que caducaron."""
+        from .commercial.inventory_manager import InventoryManager
+
+        result = InventoryManager().expire_stale_reservations(limit=limit)
+        click.echo(f"⏳ Reservas caducadas: {result['expired_orders']} órdenes, "
+                   f"{result['released_units']} unidades devueltas al stock")
+        for error in result['errors']:
+            click.echo(f"❌ Orden {error['order_id']}: {error['error']}")
+
     from .assistant.routes import assistant_bp
     app.register_blueprint(assistant_bp)
     
@@ -228,13 +359,20 @@ def create_app():
     @app.route("/secure-download/<token>")
     def secure_download(token):
         """Descarga segura con token temporal"""
-        from flask import send_file, abort, Response
+        from flask import send_file, abort, Response, jsonify
         from .quote_system_v2 import quote_system_v2
         
         file_data = quote_system_v2.get_file_by_token(token)
         if not file_data:
             abort(404)
         
+        if not os.path.exists(file_data['filepath']):
+            # El PDF sigue en el servicio de renderizado
+            response = jsonify({'status': 'pending', 'message': 'La cotización se está generando, intenta en unos segundos'})
+            response.status_code = 202
+            response.headers['Retry-After'] = '2'
+            return response
+        
         try:
             response = send_file(
                 file_data['filepath'],
@@ -251,18 +389,93 @@ def create_app():
             print(f"❌ Error en descarga segura: {e}")
             abort(500)
     
+    @app.route("/quote-status/<quote_number>")
+    def quote_status(quote_number):
+        """Estado del renderizado de una cotización (consultado por el widget)"""
+        from flask import abort, jsonify
+        from werkzeug.utils import secure_filename
+        from .quote_system_v2 import quote_system_v2
+        
+        if secure_filename(quote_number) != quote_number:
+            abort(404)
+        
+        status = quote_system_v2.get_render_status(quote_number)
+        status['quote_number'] = quote_number
+        
+        response = jsonify(status)
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        return response
+    
+    @app.route("/quote-artifact/<quote_number>")
+    def quote_artifact(quote_number):
+        """
+        PDF de una cotización con URL firmada: soporta ETag/Last-Modified,
+        peticiones Range y caché de larga duración (el PDF no cambia).
+        """
+        from flask import send_file, abort, request, jsonify
+        from werkzeug.utils import secure_filename
+        from .quote_system_v2 import quote_system_v2
+        
+        if secure_filename(quote_number) != quote_number:
+            abort(404)
+        if not quote_system_v2.verify_quote_signature(quote_number, request.args.get('sig')):
+            abort(404)
+        
+        # Ruta desde el índice de artefactos (directorios por fecha/cliente)
+        artifact = quote_system_v2.resolve_quote_file(quote_number)
+        if not artifact:
+            abort(404)
+        
+        filename = artifact['filename']
+        filepath = os.path.abspath(artifact['filepath'])
+        
+        if not os.path.exists(filepath):
+            if quote_system_v2.get_render_status(quote_number)['status'] == 'pending':
+                response = jsonify({'status': 'pending', 'message': 'La cotización se está generando, intenta en unos segundos'})
+                response.status_code = 202
+                response.headers['Retry-After'] = '2'
+                return response
+            abort(404)
+        
+        as_attachment = request.args.get('download') == '1'
+        max_age = app.config.get('QUOTE_ARTIFACT_MAX_AGE', 31536000)
+        accel_prefix = app.config.get('QUOTES_X_ACCEL_PREFIX')
+        
+        if accel_prefix:
+            # Nginx sirve el archivo (sendfile, Range y condicionales) desde su location interna
+            response = app.response_class(mimetype='application/pdf')
+            response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{artifact['relative_path']}"
+            disposition = 'attachment' if as_attachment else 'inline'
+            response.headers['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+        else:
+            response = send_file(
+                filepath,
+                mimetype='application/pdf',
+                as_attachment=as_attachment,
+                download_name=filename,
+                conditional=True,
+                etag=True,
+                max_age=max_age
+            )
+        
+        response.headers['Cache-Control'] = f'private, max-age={max_age}, immutable'
+        return response
+    
     @app.route("/download-quote/<filename>")  
     def download_quote_fallback(filename):
         """Descarga tradicional (fallback)"""
-        from flask import send_from_directory, abort
-        import os
+        from flask import send_file, abort
+        from .artifact_store import artifact_store
+        
+        artifact = artifact_store.resolve_filename('quote', filename)
+        if not artifact:
+            abort(404)
         
-        quotes_dir = os.path.join(app.instance_path, 'quotes')
         try:
-            response = send_from_directory(
-                quotes_dir, 
-                filename, 
+            response = send_file(
+                os.path.abspath(artifact['filepath']),
                 as_attachment=True,
+                download_name=artifact['filename'],
                 mimetype='application/pdf'
             )
             # Headers anti-refresh
@@ -0,0 +1,390 @@
+# modules/artifact_store.py
+"""
+Ciclo de vida de los PDFs generados (instance/quotes e instance/invoices).
+
+- Directorios por fecha y cliente (<raíz>/<AAAA>/<MM>/<cliente>/<archivo>) en
+  lugar de un directorio plano con cientos de miles de archivos.
+- Índice en PostgreSQL (salesmind_artifacts): número de documento -> ruta,
+  resuelto con una consulta indexada en vez de os.path.exists sobre el
+  directorio plano.
+- Compactación: calcula el hash de contenido de los archivos ya publicados y
+  hace que los duplicados compartan un único archivo; Invoice.pdf_path y
+  Quote.pdf_path se actualizan antes de borrar un archivo.
+- Retención: las cotizaciones que no llegan a convertirse en orden caducan
+  tras QUOTE_ARTIFACT_TTL_DAYS días y se borran con `flask artifacts-maintenance`.
+"""
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .models import Artifact
+from . import db
+
+ARTIFACT_ROOTS = {
+    'quote': 'instance/quotes',
+    'invoice': 'instance/invoices'
+}
+ARTIFACT_FILENAME_PATTERNS = {
+    'quote': re.compile(r'^cotizacion_(?P<name>[A-Za-z0-9_-]+)\.pdf$'),
+    'invoice': re.compile(r'^factura_(?P<name>[A-Za-z0-9_-]+)\.pdf$')
+}
+
+QUOTE_ARTIFACT_TTL = timedelta(days=int(os.environ.get('QUOTE_ARTIFACT_TTL_DAYS', 90)))
+# Los archivos más recientes no se compactan: pueden estar renderizándose o
+# referenciados por tokens de descarga vigentes
+COMPACT_MIN_AGE = timedelta(days=1)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(filepath: str) -> str:
+    """SHA-256 del contenido de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """Ubicación, índice y mantenimiento de los PDFs de cotizaciones y facturas."""
+
+    def __init__(self, roots: Dict[str, str] = None):
+        self.roots = dict(roots or ARTIFACT_ROOTS)
+
+    def absolute_path(self, kind: str, storage_path: str) -> str:
+        return os.path.join(self.roots[kind], storage_path)
+
+    @staticmethod
+    def shard_dir(client_id: Optional[int], when: datetime) -> str:
+        """Subdirectorio relativo de un documento: AAAA/MM/<cliente>"""
+        return os.path.join(when.strftime('%Y'), when.strftime('%m'), str(client_id) if client_id else 'shared')
+
+    def allocate(self, kind: str, name: str, filename: str, client_id: int = None,
+                 ttl: timedelta = None) -> str:
+        """
+        Registra la ruta definitiva de un documento antes de renderizarlo.
+
+        Returns:
+            Ruta donde debe escribirse el PDF
+        """
+        entry = {'name': name, 'filename': filename, 'client_id': client_id}
+        return self.allocate_many(kind, [entry], ttl)[name]
+
+    def allocate_many(self, kind: str, entries: List[Dict], ttl: timedelta = None) -> Dict[str, str]:
+        """
+        Registra varias rutas en una sola sentencia (facturación por lotes).
+        Conexión propia: la ruta queda indexada aunque la transacción del
+        llamador haga rollback; las filas sin archivo se podan al compactar.
+
+        Args:
+            entries: Dicts con name, filename y client_id
+
+        Returns:
+            Dict nombre -> ruta donde escribir cada PDF
+        """
+        now = datetime.utcnow()
+        rows = []
+        paths = {}
+
+        for entry in entries:
+            storage_path = os.path.join(self.shard_dir(entry.get('client_id'), now), entry['filename'])
+            rows.append({
+                'kind': kind,
+                'name': entry['name'],
+                'client_id': entry.get('client_id'),
+                'filename': entry['filename'],
+                'storage_path': storage_path,
+                'expires_at': now + ttl if ttl else None,
+                'created_at': now
+            })
+            paths[entry['name']] = self.absolute_path(kind, storage_path)
+
+        for directory in {os.path.dirname(path) for path in paths.values()}:
+            os.makedirs(directory, exist_ok=True)
+
+        if rows:
+            statement = pg_insert(Artifact.__table__).values(rows)
+            statement = statement.on_conflict_do_update(
+                constraint='unique_artifact_kind_name',
+                set_={
+                    'client_id': statement.excluded.client_id,
+                    'filename': statement.excluded.filename,
+                    'storage_path': statement.excluded.storage_path,
+                    'expires_at': statement.excluded.expires_at,
+                    'content_hash': None,
+                    'file_size': None
+                }
+            )
+            with db.engine.begin() as conn:
+                conn.execute(statement)
+
+        return paths
+
+    def resolve(self, kind: str, name: str, legacy_filename: str = None) -> Optional[Dict]:
+        """
+        Ubica el archivo de un documento por su número.
+
+        Args:
+            legacy_filename: Nombre en el directorio plano anterior, para los
+                             documentos generados antes del índice
+
+        Returns:
+            Dict con filepath, filename y relative_path (relativa a la raíz del tipo), o None
+        """
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(Artifact.storage_path, Artifact.filename)
+                .where(Artifact.kind == kind, Artifact.name == name)
+            ).first()
+
+        if row:
+            return {
+                'filepath': self.absolute_path(kind, row.storage_path),
+                'filename': row.filename,
+                'relative_path': row.storage_path
+            }
+
+        if legacy_filename:
+            filepath = self.absolute_path(kind, legacy_filename)
+            if os.path.exists(filepath):
+                return {'filepath': filepath, 'filename': legacy_filename, 'relative_path': legacy_filename}
+
+        return None
+
+    def resolve_filename(self, kind: str, filename: str) -> Optional[Dict]:
+        """Ubica un documento a partir de su nombre de descarga (ej: cotizacion_<número>.pdf)"""
+        match = ARTIFACT_FILENAME_PATTERNS[kind].match(filename)
+        if not match:
+            return None
+        return self.resolve(kind, match.group('name'), legacy_filename=filename)
+
+    def retain(self, kind: str, name: str):
+        """Conserva indefinidamente un documento (ej: cotización convertida en orden)."""
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(Artifact)
+                .where(Artifact.kind == kind, Artifact.name == name)
+                .values(expires_at=None)
+            )
+
+    @staticmethod
+    def _document_model(kind: str):
+        """Modelo y columna de número del documento que guarda la ruta del PDF en pdf_path"""
+        from .commercial_models import Invoice, Quote
+        if kind == 'invoice':
+            return Invoice, Invoice.invoice_number
+        return Quote, Quote.quote_number
+
+    def _repoint_documents(self, conn, kind: str, name: str, old_path: str, new_path: Optional[str]):
+        """
+        Actualiza pdf_path de la factura o cotización que apunta a un archivo
+        que va a borrarse (new_path None si el documento deja de tener PDF).
+        """
+        model, number = self._document_model(kind)
+        conn.execute(
+            update(model)
+            .where(number == name, model.pdf_path == self.absolute_path(kind, old_path))
+            .values(pdf_path=self.absolute_path(kind, new_path) if new_path else None)
+        )
+
+    def _delete_unreferenced_files(self, conn, kind: str, storage_paths: List[str]) -> int:
+        """
+        Borra los archivos que ya no referencia ninguna fila del índice ni
+        ningún pdf_path de facturas o cotizaciones.
+        """
+        if not storage_paths:
+            return 0
+
+        referenced = set(conn.execute(
+            select(Artifact.storage_path)
+            .where(Artifact.kind == kind, Artifact.storage_path.in_(storage_paths))
+        ).scalars())
+
+        model, _ = self._document_model(kind)
+        absolute_paths = {self.absolute_path(kind, path): path for path in storage_paths}
+        referenced |= {absolute_paths[path] for path in conn.execute(
+            select(model.pdf_path).where(model.pdf_path.in_(list(absolute_paths)))
+        ).scalars()}
+
+        removed = 0
+        for storage_path in set(storage_paths) - referenced:
+            try:
+                os.remove(self.absolute_path(kind, storage_path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def cleanup_expired(self, limit: int = 1000) -> Dict:
+        """
+        Borra las cotizaciones caducadas que no se convirtieron en orden. Las
+        aceptadas o convertidas se conservan y dejan de caducar.
+
+        Returns:
+            Dict con conteo de documentos conservados, borrados y archivos eliminados
+        """
+        from .commercial_models import Order, Quote
+
+        now = datetime.utcnow()
+        converted = exists().where(
+            Quote.quote_number == Artifact.name,
+            (Quote.status == 'accepted') | exists().where(Order.quote_id == Quote.id)
+        )
+
+        with db.engine.begin() as conn:
+            retained = conn.execute(
+                update(Artifact)
+                .where(Artifact.kind == 'quote', Artifact.expires_at <= now, converted)
+                .values(expires_at=None)
+            ).rowcount
+
+            expired_ids = select(Artifact.id).where(
+                Artifact.kind == 'quote', Artifact.expires_at <= now
+            ).order_by(Artifact.expires_at).limit(limit)
+
+            deleted = conn.execute(
+                delete(Artifact)
+                .where(Artifact.id.in_(expired_ids))
+                .returning(Artifact.name, Artifact.storage_path)
+            ).all()
+
+            names = [row.name for row in deleted]
+            if names:
+                conn.execute(
+                    update(Quote)
+                    .where(Quote.quote_number.in_(names), Quote.status.in_(('draft', 'sent')))
+                    .values(status='expired')
+                )
+                # El PDF se borra: la cotización deja de apuntar a él
+                conn.execute(
+                    update(Quote)
+                    .where(Quote.quote_number.in_(names))
+                    .values(pdf_path=None)
+                )
+
+            removed = self._delete_unreferenced_files(conn, 'quote', [row.storage_path for row in deleted])
+
+        if deleted:
+            print(f"🧹 {len(deleted)} cotizaciones caducadas eliminadas ({removed} archivos)")
+        return {'retained': retained, 'deleted': len(deleted), 'files_removed': removed}
+
+    def compact(self, limit: int = 1000) -> Dict:
+        """
+        Calcula el hash de los documentos aún sin compactar. Si otro documento
+        del mismo tipo tiene el mismo contenido, pasa a compartir su archivo.
+        Las filas cuyo archivo nunca llegó a escribirse se eliminan.
+
+        Returns:
+            Dict con documentos procesados, duplicados fusionados y filas podadas
+        """
+        limit_date = datetime.utcnow() - COMPACT_MIN_AGE
+        stats = {'hashed': 0, 'deduplicated': 0, 'pruned': 0}
+
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(Artifact.id, Artifact.kind, Artifact.name, Artifact.storage_path)
+                .where(Artifact.content_hash.is_(None), Artifact.created_at < limit_date)
+                .order_by(Artifact.id)
+                .limit(limit)
+            ).all()
+
+        for row in rows:
+            filepath = self.absolute_path(row.kind, row.storage_path)
+
+            with db.engine.begin() as conn:
+                if not os.path.exists(filepath):
+                    # Renderizado fallido o transacción revertida
+                    conn.execute(delete(Artifact).where(Artifact.id == row.id))
+                    self._repoint_documents(conn, row.kind, row.name, row.storage_path, None)
+                    stats['pruned'] += 1
+                    continue
+
+                digest = file_sha256(filepath)
+                values = {'content_hash': digest, 'file_size': os.path.getsize(filepath)}
+
+                canonical = conn.execute(
+                    select(Artifact.storage_path).where(
+                        Artifact.kind == row.kind,
+                        Artifact.content_hash == digest,
+                        Artifact.storage_path != row.storage_path
+                    ).limit(1)
+                ).scalar()
+
+                if canonical and os.path.exists(self.absolute_path(row.kind, canonical)):
+                    values['storage_path'] = canonical
+                    stats['deduplicated'] += 1
+
+                conn.execute(update(Artifact).where(Artifact.id == row.id).values(**values))
+
+                if 'storage_path' in values:
+                    # Antes de borrar el duplicado, la factura/cotización pasa al archivo compartido
+                    self._repoint_documents(conn, row.kind, row.name, row.storage_path, canonical)
+                    self._delete_unreferenced_files(conn, row.kind, [row.storage_path])
+
+            stats['hashed'] += 1
+
+        if rows:
+            print(f"🗜️ Compactación: {stats['hashed']} documentos, {stats['deduplicated']} duplicados, "
+                  f"{stats['pruned']} filas sin archivo")
+        return stats
+
+    def migrate_legacy(self, kind: str, limit: int = 1000) -> int:
+        """
+        Mueve al esquema por fecha/cliente los PDFs del directorio plano
+        anterior y los registra en el índice.
+
+        Returns:
+            Número de archivos migrados
+        """
+        root = self.roots[kind]
+        if not os.path.isdir(root):
+            return 0
+
+        pattern = ARTIFACT_FILENAME_PATTERNS[kind]
+        migrated = 0
+
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if migrated >= limit:
+                    break
+                match = pattern.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+
+                modified = datetime.utcfromtimestamp(entry.stat().st_mtime)
+                storage_path = os.path.join(self.shard_dir(None, modified), entry.name)
+                expires_at = modified + QUOTE_ARTIFACT_TTL if kind == 'quote' else None
+
+                with db.engine.begin() as conn:
+                    inserted = conn.execute(
+                        pg_insert(Artifact.__table__).values(
+                            kind=kind,
+                            name=match.group('name'),
+                            filename=entry.name,
+                            storage_path=storage_path,
+                            expires_at=expires_at,
+                            created_at=modified
+                        ).on_conflict_do_nothing(constraint='unique_artifact_kind_name')
+                        .returning(Artifact.id)
+                    ).first()
+
+                    if inserted is None:
+                        # Ya indexado con otra ruta: el archivo plano es una copia antigua
+                        continue
+
+                    target = self.absolute_path(kind, storage_path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(entry.path, target)
+
+                migrated += 1
+
+        if migrated:
+            print(f"📦 {migrated} archivos de {root} migrados al esquema por fecha")
+        return migrated
+
+
+# Instancia global
+artifact_store = ArtifactStore()
@@ -1,6 +1,7 @@
 # modules/assistant/core.py
 import os
 import traceback
+from flask import g
 from config import Config
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
@@ -240,9 +241,11 @@ def get_commercial_response(question: str, client_id: int) -> str:
         # 6. Verificar si necesita generar cotización con SISTEMA V2 (SIN REFRESH)
         try:
             from ..quote_system_v2 import generate_quote_v2_if_requested
-            result, quote_result = generate_quote_v2_if_requested(result, question, client.name)
+            result, quote_result = generate_quote_v2_if_requested(result, question, client.name, client.id)
             if quote_result:
-                print(f"✅ Cotización V2 generada: {quote_result['quote_number']} (SIN REFRESH)")
+                # El endpoint del chat lo devuelve al widget para consultar el estado del PDF
+                g.quote_result = quote_result
+                print(f"✅ Cotización V2 encolada: {quote_result['quote_number']} (SIN REFRESH)")
             else:
                 print(f"✅ Respuesta generada exitosamente (sin cotización)")
         except ImportError:
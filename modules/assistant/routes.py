@@ -1,5 +1,5 @@
 # modules/assistant/routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 import requests
 import os
 import time
@@ -120,11 +120,24 @@ def chat_api():
         send_telegram_notification(notification_message, client.telegram_chat_id)
 
     # 8. Devolver respuesta al widget de chat
-    return jsonify({
+    payload = {
         "reply": ai_response,
         "timestamp": user_conversation.timestamp.isoformat() if 'user_conversation' in locals() else None,
         "client_name": client.name
-    })
+    }
+    
+    # Cotización en renderizado: el widget consulta status_url hasta que el PDF esté listo
+    quote_result = g.pop('quote_result', None)
+    if quote_result:
+        payload["quote"] = {
+            "quote_number": quote_result['quote_number'],
+            "status": quote_result['status'],
+            "status_url": quote_result['access_methods']['status_url'],
+            "download_url": quote_result['access_methods']['secure_token'],
+            "view_url": quote_result['access_methods']['artifact_url']
+        }
+    
+    return jsonify(payload)
 
 # --- RUTA PARA DESCARGAR COTIZACIONES PDF ---
 @assistant_bp.route("/download-quote/<filename>", methods=['GET'])
@@ -135,20 +148,18 @@ def download_quote(filename):
     try:
         from flask import send_file
         import os
+        from ..artifact_store import artifact_store
         
-        # Directorio de cotizaciones
-        quotes_dir = "instance/quotes"
-        file_path = os.path.join(quotes_dir, filename)
-        
-        # Verificar que el archivo existe y es un PDF
-        if not os.path.exists(file_path) or not filename.endswith('.pdf'):
+        # Ruta desde el índice de artefactos (o el directorio plano anterior)
+        artifact = artifact_store.resolve_filename('quote', filename)
+        if not artifact or not os.path.exists(artifact['filepath']):
             return jsonify({"error": "Archivo no encontrado"}), 404
         
         # Enviar archivo
         return send_file(
-            file_path,
+            os.path.abspath(artifact['filepath']),
             as_attachment=True,
-            download_name=filename,
+            download_name=artifact['filename'],
             mimetype='application/pdf'
         )
         
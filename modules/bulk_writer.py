@@ -0,0 +1,155 @@
+# modules/bulk_writer.py
+import io
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+from psycopg2.extras import execute_values
+from . import db
+
+
+class BulkWriter:
+    """
+    Escritor masivo de filas hacia PostgreSQL que evita crear un objeto ORM por fila.
+
+    Las filas se acumulan en lotes de tamaño fijo (memoria acotada) y cada lote
+    se envía con COPY ... FROM STDIN o, si se necesitan los IDs generados, con
+    INSERT ... VALUES ... RETURNING id (execute_values). La escritura usa la
+    conexión de la sesión actual, así que forma parte de su transacción: el
+    llamador sigue siendo responsable de db.session.commit().
+
+    Uso:
+        with BulkWriter(Conversation, use_copy=True) as writer:
+            for row in rows:
+                writer.add(row)
+        db.session.commit()
+    """
+
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(self, model, columns: Optional[List[str]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, use_copy: bool = True):
+        """
+        Args:
+            model: Modelo SQLAlchemy destino (ej: Embedding, Conversation)
+            columns: Columnas a escribir; por defecto todas excepto la clave primaria
+            batch_size: Filas por lote enviado a PostgreSQL
+            use_copy: True para COPY (más rápido, sin IDs); False para INSERT con RETURNING id
+        """
+        self.table = model.__table__
+        self.columns = columns or [col.name for col in self.table.columns if not col.primary_key]
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+
+        self._defaults = self._collect_python_defaults()
+        self._buffer = []
+        self.inserted_ids = []
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._buffer = []
+        return False
+
+    def _collect_python_defaults(self) -> Dict:
+        """Obtiene los valores por defecto del lado Python (ej: default=datetime.utcnow)."""
+        defaults = {}
+        for name in self.columns:
+            default = self.table.columns[name].default
+            if default is None or default.is_sequence or default.is_clause_element:
+                continue
+            defaults[name] = default
+        return defaults
+
+    def _resolve_defaults(self, row: Dict) -> tuple:
+        values = []
+        for name in self.columns:
+            if name in row:
+                values.append(row[name])
+            elif name in self._defaults:
+                default = self._defaults[name]
+                values.append(default.arg(None) if default.is_callable else default.arg)
+            else:
+                values.append(None)
+        return tuple(values)
+
+    def add(self, row: Dict) -> List[int]:
+        """
+        Añade una fila (dict columna -> valor). Envía el lote si se llena.
+
+        Returns:
+            IDs insertados en el lote enviado (vacío si no hubo envío o se usa COPY)
+        """
+        self._buffer.append(self._resolve_defaults(row))
+        if len(self._buffer) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def extend(self, rows: Iterable[Dict]) -> int:
+        """Añade todas las filas de un iterable (puede ser un generador)."""
+        count = 0
+        for row in rows:
+            self.add(row)
+            count += 1
+        return count
+
+    def flush(self) -> List[int]:
+        """Envía las filas pendientes a PostgreSQL."""
+        if not self._buffer:
+            return []
+
+        batch, self._buffer = self._buffer, []
+        cursor = db.session.connection().connection.cursor()
+        try:
+            if self.use_copy:
+                ids = []
+                self._copy_batch(cursor, batch)
+            else:
+                ids = self._insert_batch(cursor, batch)
+        finally:
+            cursor.close()
+
+        self.inserted_ids.extend(ids)
+        self.rows_written += len(batch)
+        return ids
+
+    def _insert_batch(self, cursor, batch: List[tuple]) -> List[int]:
+        sql = 'INSERT INTO {} ({}) VALUES %s RETURNING id'.format(
+            self.table.name, ', '.join(self.columns)
+        )
+        result = execute_values(cursor, sql, batch, page_size=len(batch), fetch=True)
+        return [row[0] for row in result]
+
+    def _copy_batch(self, cursor, batch: List[tuple]):
+        buffer = io.StringIO()
+        for values in batch:
+            buffer.write('\t'.join(self._format_copy_value(value) for value in values))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        sql = 'COPY {} ({}) FROM STDIN'.format(self.table.name, ', '.join(self.columns))
+        cursor.copy_expert(sql, buffer)
+
+    @staticmethod
+    def _format_copy_value(value) -> str:
+        """Convierte un valor Python al formato de texto de COPY."""
+        if value is None:
+            return '\\N'
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            # BYTEA en hexadecimal; la barra se duplica por el escape de COPY
+            return '\\\\x' + bytes(value).hex()
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, (int, float, Decimal)):
+            return str(value)
+        return (str(value)
+                .replace('\\', '\\\\')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r')
+                .replace('\t', '\\t'))
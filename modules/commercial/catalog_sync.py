@@ -0,0 +1,320 @@
+"""
+Sincronización masiva del catálogo de productos para SalesMind
+Importa miles de productos (CSV o JSON) por SKU con INSERT ... ON CONFLICT
+por lotes y registra los movimientos de stock en bloque
+"""
+
+import csv
+import io
+import json
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from modules.models import db
+from modules.bulk_writer import BulkWriter
+from modules.text_extractors import decode_text
+from modules.commercial_models import InventoryMovement, Product
+from .dashboard_summary import invalidate_dashboard
+from .inventory_ledger import record_movements
+
+# Productos escritos por transacción
+CATALOG_SYNC_BATCH_SIZE = int(os.environ.get('CATALOG_SYNC_BATCH_SIZE', 500))
+
+# Columnas del catálogo que se sincronizan (además del SKU)
+CATALOG_FIELDS = [
+    'name', 'description', 'category', 'base_price', 'discount_percentage', 'tax_rate',
+    'stock_quantity', 'min_stock_alert', 'is_active', 'is_featured'
+]
+
+PRODUCT_DEFAULTS = {
+    'description': '',
+    'category': '',
+    'discount_percentage': 0.0,
+    'tax_rate': 19.0,  # IVA 19% por defecto, como add_product
+    'stock_quantity': 0,
+    'min_stock_alert': 10,
+    'is_active': True,
+    'is_featured': False
+}
+
+MOVEMENT_COLUMNS = [
+    'product_id', 'movement_type', 'quantity', 'reference_type', 'reason', 'created_by'
+]
+
+TRUE_VALUES = {'1', 'true', 'si', 'sí', 'yes', 'y', 's', 'x'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', ''}
+
+
+class CatalogSync:
+    """
+    Sincronizador del catálogo de un cliente identificando productos por SKU.
+
+    Compara cada fila con el producto existente y solo escribe las que
+    cambian, así repetir la misma importación no modifica nada ni registra
+    movimientos. Cada lote se confirma por separado: un error en un lote no
+    deshace los anteriores y se informa por fila.
+    """
+
+    def __init__(self, batch_size: int = CATALOG_SYNC_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def parse_file(file_content: bytes, filename: str = '') -> List[Dict]:
+        """
+        Convierte un archivo CSV (separador ',' ';' o tabulador) o JSON
+        (lista de productos u objeto con clave 'products') en filas.
+        """
+        text = decode_text(file_content)
+
+        if filename.lower().endswith('.json') or text.lstrip().startswith(('[', '{')):
+            data = json.loads(text)
+            rows = data.get('products', []) if isinstance(data, dict) else data
+            if not isinstance(rows, list):
+                raise ValueError('El JSON debe ser una lista de productos')
+            return rows
+
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+        return [
+            {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            for row in reader
+        ]
+
+    def sync(self, client_id: int, rows: List[Dict], deactivate_missing: bool = False,
+             created_by: str = 'catalog_sync') -> Dict:
+        """
+        Sincroniza el catálogo del cliente con las filas recibidas.
+
+        Args:
+            client_id: ID del cliente empresarial
+            rows: Productos con 'sku' y las columnas de CATALOG_FIELDS
+                  (las columnas ausentes conservan su valor actual)
+            deactivate_missing: Desactiva los productos con SKU que no vienen
+                                en la importación (catálogo completo). No se
+                                aplica si alguna fila tuvo errores
+            created_by: Autor de los movimientos de inventario
+
+        Returns:
+            Dict con contadores y errores por fila (número de fila 1-based)
+        """
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0, 'movements': 0}
+        errors = []
+
+        records = []
+        seen_skus = set()
+        for index, row in enumerate(rows, start=1):
+            record, error = self._normalize_row(row)
+            if error is None and record['sku'] in seen_skus:
+                error = 'SKU repetido en la importación'
+            if error:
+                sku = row.get('sku') if isinstance(row, dict) else None
+                errors.append({'row': index, 'sku': sku, 'error': error})
+                continue
+            seen_skus.add(record['sku'])
+            records.append((index, record))
+
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                batch_stats, batch_errors = self._sync_batch(client_id, batch, created_by)
+            except Exception as e:
+                db.session.rollback()
+                errors.extend({'row': index, 'sku': record['sku'], 'error': str(e)} for index, record in batch)
+                continue
+
+            # Solo los lotes confirmados cuentan en el resultado
+            for key, value in batch_stats.items():
+                stats[key] += value
+            errors.extend(batch_errors)
+
+        if deactivate_missing and not errors:
+            try:
+                stats['deactivated'] = self._deactivate_missing(client_id, seen_skus)
+            except Exception as e:
+                db.session.rollback()
+                errors.append({'row': None, 'sku': None, 'error': f'Error desactivando productos: {str(e)}'})
+
+        if stats['inserted'] or stats['updated'] or stats['deactivated']:
+            invalidate_dashboard([client_id])
+
+        print(f"📦 Catálogo cliente {client_id}: {stats['inserted']} nuevos, {stats['updated']} actualizados, "
+              f"{stats['unchanged']} sin cambios, {stats['deactivated']} desactivados, {len(errors)} errores")
+
+        return {
+            'success': not errors,
+            'client_id': client_id,
+            'received': len(rows),
+            **stats,
+            'errors': errors
+        }
+
+    @staticmethod
+    def _normalize_row(row) -> Tuple[Optional[Dict], Optional[str]]:
+        """Valida y convierte una fila; devuelve (registro, error)"""
+        if not isinstance(row, dict):
+            return None, 'Formato de fila no válido'
+
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            return None, 'SKU requerido'
+        if len(sku) > 50:
+            return None, 'SKU demasiado largo (máximo 50 caracteres)'
+
+        record = {'sku': sku}
+        try:
+            for field in CATALOG_FIELDS:
+                value = row.get(field)
+                if value is None or (value == '' and field not in ('description', 'category')):
+                    continue  # Columna ausente: se conserva el valor actual
+
+                if field == 'base_price':
+                    value = Decimal(str(value).replace(',', '.')).quantize(Decimal('0.01'))
+                    if value < 0:
+                        return None, 'El precio no puede ser negativo'
+                elif field in ('discount_percentage', 'tax_rate'):
+                    value = float(str(value).replace(',', '.'))
+                elif field in ('stock_quantity', 'min_stock_alert'):
+                    value = int(float(str(value)))
+                    if value < 0:
+                        return None, f'{field} no puede ser negativo'
+                elif field in ('is_active', 'is_featured'):
+                    if not isinstance(value, bool):
+                        normalized = str(value).strip().lower()
+                        if normalized not in TRUE_VALUES | FALSE_VALUES:
+                            return None, f'Valor no válido para {field}: {value}'
+                        value = normalized in TRUE_VALUES
+                else:
+                    value = str(value).strip()
+                    if field == 'name' and len(value) > 255:
+                        return None, 'Nombre demasiado largo (máximo 255 caracteres)'
+                    if field == 'category':
+                        value = value[:100]
+                record[field] = value
+        except (InvalidOperation, ValueError, TypeError):
+            return None, f'Valor numérico no válido en {field}: {row.get(field)}'
+
+        return record, None
+
+    def _sync_batch(self, client_id: int, batch: List[Tuple[int, Dict]],
+                    created_by: str) -> Tuple[Dict, List[Dict]]:
+        """
+        Aplica un lote en su propia transacción: bloquea los productos
+        existentes (en orden de id, igual que las reservas de inventario),
+        calcula el diff y hace un único INSERT ... ON CONFLICT con las filas
+        nuevas o modificadas.
+
+        Returns:
+            (contadores, errores por fila) del lote, ya confirmado
+        """
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'movements': 0}
+        errors = []
+        table = Product.__table__
+        skus = [record['sku'] for _, record in batch]
+        existing = {
+            row.sku: row for row in db.session.execute(
+                select(table).where(table.c.client_id == client_id, table.c.sku.in_(skus))
+                .order_by(table.c.id)
+                .with_for_update()
+            )
+        }
+
+        upserts = []
+        stock_changes = {}  # sku -> (stock anterior, stock nuevo)
+        for index, record in batch:
+            current = existing.get(record['sku'])
+
+            if current is None:
+                missing = [field for field in ('name', 'base_price') if field not in record]
+                if missing:
+                    errors.append({'row': index, 'sku': record['sku'],
+                                   'error': f'Producto nuevo sin {", ".join(missing)}'})
+                    continue
+                values = {**PRODUCT_DEFAULTS, **record}
+                values.update(client_id=client_id, public_id=str(uuid.uuid4()))
+                upserts.append(values)
+                stock_changes[record['sku']] = (0, values['stock_quantity'])
+                stats['inserted'] += 1
+                continue
+
+            values = {field: getattr(current, field) for field in CATALOG_FIELDS}
+            changed = {
+                field: value for field, value in record.items()
+                if field != 'sku' and value != values[field]
+            }
+            if not changed:
+                stats['unchanged'] += 1
+                continue
+
+            values.update(changed)
+            values.update(client_id=client_id, sku=record['sku'], public_id=current.public_id)
+            upserts.append(values)
+            if 'stock_quantity' in changed:
+                stock_changes[record['sku']] = (current.stock_quantity or 0, values['stock_quantity'])
+            stats['updated'] += 1
+
+        if not upserts:
+            db.session.commit()
+            return stats, errors
+
+        statement = pg_insert(table).values(upserts)
+        statement = statement.on_conflict_do_update(
+            index_elements=['client_id', 'sku'],
+            index_where=and_(table.c.sku.isnot(None), table.c.sku != ''),
+            set_={
+                **{field: statement.excluded[field] for field in CATALOG_FIELDS},
+                'updated_at': func.now()
+            }
+        ).returning(table.c.id, table.c.sku)
+        product_ids = {row.sku: row.id for row in db.session.execute(statement)}
+
+        movements = []
+        for sku, (old_stock, new_stock) in stock_changes.items():
+            difference = new_stock - old_stock
+            if difference == 0 or sku not in product_ids:
+                continue
+            is_new = sku not in existing
+            movements.append({
+                'product_id': product_ids[sku],
+                'movement_type': 'in' if difference > 0 else 'out',
+                'quantity': abs(difference),
+                'reference_type': 'initial_stock' if is_new else 'catalog_sync',
+                'reason': 'Stock inicial' if is_new else 'Sincronización de catálogo',
+                'created_by': created_by
+            })
+        
+        with BulkWriter(InventoryMovement, columns=MOVEMENT_COLUMNS) as writer:
+            writer.extend(movements)
+        # COPY no pasa por el ORM: actualizar el rollup diario a mano
+        record_movements(db.session.connection(), movements)
+        stats['movements'] += len(movements)
+
+        db.session.commit()
+        return stats, errors
+
+    def _deactivate_missing(self, client_id: int, skus: set) -> int:
+        """Desactiva los productos con SKU del cliente que no vinieron en la importación"""
+        table = Product.__table__
+        conditions = [
+            table.c.client_id == client_id,
+            table.c.is_active == True,
+            table.c.sku.isnot(None),
+            table.c.sku != ''
+        ]
+        if skus:
+            conditions.append(table.c.sku.notin_(skus))
+
+        result = db.session.execute(
+            update(table).where(*conditions).values(is_active=False, updated_at=func.now())
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+# Instancia global
+catalog_sync = CatalogSync()
@@ -3,11 +3,63 @@ Sistema CRM completo para SalesMind
 Gestión de leads, pipeline de ventas y seguimiento de clientes
 """
 
+import os
+import re
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from sqlalchemy import and_, func, or_
+from typing import Dict, List, Optional, Set
+from sqlalchemy import Float, and_, case, cast, func, literal, or_, select
+from sqlalchemy.orm import selectinload
 from modules.models import db
 from modules.commercial_models import Lead, LeadInteraction, Quote, Order
+from .pagination import keyset_page, select_fields
+
+PIPELINE_STATUSES = ['new', 'contacted', 'qualified', 'proposal', 'negotiation', 'won', 'lost']
+CLOSED_LEAD_STATUSES = ('won', 'lost')
+
+# Leads por página en la lista de atención
+ATTENTION_PAGE_SIZE = int(os.environ.get('CRM_ATTENTION_PAGE_SIZE', 50))
+
+
+# Búsqueda de leads: resultados por página y dígitos mínimos para buscar por teléfono
+SEARCH_PAGE_SIZE = int(os.environ.get('CRM_SEARCH_PAGE_SIZE', 25))
+MIN_PHONE_DIGITS = 4
+
+
+def lead_priority_score(now: datetime):
+    """Puntuación de prioridad de un lead como expresión SQL (0-10)"""
+    value = func.coalesce(Lead.estimated_value, 0)
+    probability = func.coalesce(Lead.probability, 0)
+    return (
+        case((value > 1000000, 3), (value > 500000, 2), (value > 100000, 1), else_=0)
+        + case((probability >= 70, 3), (probability >= 40, 2), (probability >= 20, 1), else_=0)
+        + case(
+            (Lead.last_contact <= now - timedelta(days=7), 2),
+            (Lead.last_contact <= now - timedelta(days=3), 1),
+            else_=0
+        )
+        + case((Lead.next_action_date < now, 2), else_=0)
+    )
+
+
+def priority_label(score: int) -> str:
+    """Convierte la puntuación de lead_priority_score en high/medium/low"""
+    if score >= 6:
+        return 'high'
+    elif score >= 3:
+        return 'medium'
+    return 'low'
+
+
+def attention_filter(now: datetime):
+    """Leads abiertos con acción vencida, sin acción definida o sin contacto por 7 días"""
+    return and_(
+        Lead.status.notin_(CLOSED_LEAD_STATUSES),
+        or_(
+            Lead.next_action_date <= now,
+            Lead.last_contact <= now - timedelta(days=7),  # Sin contacto por 7 días
+            Lead.next_action_date.is_(None)  # Sin próxima acción definida
+        )
+    )
 
 class CRMSystem:
     """Sistema completo de gestión de relaciones con clientes (CRM)"""
@@ -170,40 +222,42 @@ class CRMSystem:
             return {'success': False, 'error': f'Error registrando interacción: {str(e)}'}
     
     def get_pipeline_overview(self, client_id: int) -> Dict:
-        """Obtiene resumen del pipeline de ventas"""
-        leads = Lead.query.filter_by(client_id=client_id).all()
+        """Obtiene resumen del pipeline de ventas (una consulta agrupada por estado)"""
+        rows = db.session.query(
+            Lead.status,
+            func.count(Lead.id),
+            func.coalesce(func.sum(Lead.estimated_value), 0),
+            func.coalesce(func.sum(Lead.estimated_value * Lead.probability / 100.0), 0)
+        ).filter(Lead.client_id == client_id).group_by(Lead.status).all()
+        
+        stats = {status: (count, float(value), float(weighted)) for status, count, value, weighted in rows}
+        total_leads = sum(count for count, _, _ in stats.values())
         
         # Contar leads por estado
         pipeline_counts = {}
         total_value = 0
         weighted_value = 0
         
-        for status in ['new', 'contacted', 'qualified', 'proposal', 'negotiation', 'won', 'lost']:
-            status_leads = [l for l in leads if l.status == status]
-            pipeline_counts[status] = {
-                'count': len(status_leads),
-                'value': sum(float(l.estimated_value or 0) for l in status_leads)
-            }
+        for status in PIPELINE_STATUSES:
+            count, value, weighted = stats.get(status, (0, 0.0, 0.0))
+            pipeline_counts[status] = {'count': count, 'value': value}
             
-            if status not in ['won', 'lost']:  # Solo contar leads activos
-                total_value += pipeline_counts[status]['value']
+            if status not in CLOSED_LEAD_STATUSES:  # Solo contar leads activos
+                total_value += value
                 # Valor ponderado por probabilidad
-                weighted_value += sum(
-                    float(l.estimated_value or 0) * (l.probability / 100)
-                    for l in status_leads
-                )
+                weighted_value += weighted
         
         # Estadísticas adicionales
-        active_leads = len([l for l in leads if l.status not in ['won', 'lost']])
-        won_leads = len([l for l in leads if l.status == 'won'])
-        lost_leads = len([l for l in leads if l.status == 'lost'])
+        won_leads = pipeline_counts['won']['count']
+        lost_leads = pipeline_counts['lost']['count']
+        active_leads = total_leads - won_leads - lost_leads
         
-        conversion_rate = (won_leads / len(leads) * 100) if leads else 0
+        conversion_rate = (won_leads / total_leads * 100) if total_leads else 0
         
         return {
             'pipeline': pipeline_counts,
             'summary': {
-                'total_leads': len(leads),
+                'total_leads': total_leads,
                 'active_leads': active_leads,
                 'won_leads': won_leads,
                 'lost_leads': lost_leads,
@@ -213,60 +267,94 @@ class CRMSystem:
             }
         }
     
-    def get_leads_requiring_attention(self, client_id: int) -> List[Dict]:
-        """Obtiene leads que requieren atención inmediata"""
-        today = datetime.now().date()
+    def get_leads_requiring_attention(self, client_id: int, page: int = 1,
+                                      per_page: int = ATTENTION_PAGE_SIZE) -> Dict:
+        """
+        Obtiene leads que requieren atención inmediata, ordenados por
+        prioridad (calculada en SQL) y paginados
         
-        # Leads con próxima acción vencida o para hoy
-        attention_leads = Lead.query.filter(
-            and_(
-                Lead.client_id == client_id,
-                Lead.status.notin_(['won', 'lost']),
-                or_(
-                    Lead.next_action_date <= datetime.now(),
-                    Lead.last_contact <= datetime.now() - timedelta(days=7),  # Sin contacto por 7 días
-                    Lead.next_action_date.is_(None)  # Sin próxima acción definida
-                )
-            )
-        ).all()
+        Returns:
+            Dict con los leads de la página y los datos de paginación
+        """
+        now = datetime.now()
+        page = max(page, 1)
+        per_page = max(min(per_page, 500), 1)
+        score = lead_priority_score(now)
         
-        return [
-            {
-                'id': lead.id,
-                'name': lead.name,
-                'company': lead.company,
-                'status': lead.status,
-                'estimated_value': float(lead.estimated_value or 0),
-                'last_contact': lead.last_contact.isoformat() if lead.last_contact else None,
-                'next_action': lead.next_action,
-                'next_action_date': lead.next_action_date.isoformat() if lead.next_action_date else None,
-                'days_without_contact': (datetime.now() - lead.last_contact).days if lead.last_contact else None,
-                'priority': self._calculate_lead_priority(lead)
-            }
-            for lead in attention_leads
-        ]
+        rows = db.session.query(
+            Lead.id, Lead.name, Lead.company, Lead.status, Lead.estimated_value,
+            Lead.last_contact, Lead.next_action, Lead.next_action_date,
+            score.label('score'),
+            func.count().over().label('total')
+        ).filter(
+            Lead.client_id == client_id,
+            attention_filter(now)
+        ).order_by(score.desc(), Lead.id).limit(per_page).offset((page - 1) * per_page).all()
+        
+        total = rows[0].total if rows else self._count_leads_requiring_attention(client_id, now, page)
+        
+        return {
+            'leads': [
+                {
+                    'id': row.id,
+                    'name': row.name,
+                    'company': row.company,
+                    'status': row.status,
+                    'estimated_value': float(row.estimated_value or 0),
+                    'last_contact': row.last_contact.isoformat() if row.last_contact else None,
+                    'next_action': row.next_action,
+                    'next_action_date': row.next_action_date.isoformat() if row.next_action_date else None,
+                    'days_without_contact': (now - row.last_contact).days if row.last_contact else None,
+                    'priority': priority_label(row.score)
+                }
+                for row in rows
+            ],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page
+        }
+    
+    def _count_leads_requiring_attention(self, client_id: int, now: datetime, page: int) -> int:
+        """Total de la lista cuando la página pedida está vacía (más allá del final)"""
+        if page == 1:
+            return 0
+        return db.session.query(func.count(Lead.id)).filter(
+            Lead.client_id == client_id,
+            attention_filter(now)
+        ).scalar()
     
     def get_lead_details(self, lead_id: int) -> Optional[Dict]:
         """Obtiene detalles completos de un lead"""
-        lead = Lead.query.get(lead_id)
+        lead = Lead.query.options(selectinload(Lead.interactions)).filter(Lead.id == lead_id).first()
         if not lead:
             return None
         
-        # Obtener historial de interacciones
-        interactions = LeadInteraction.query.filter_by(lead_id=lead_id).order_by(
-            LeadInteraction.completed_at.desc()
-        ).all()
-        
-        # Buscar cotizaciones y órdenes relacionadas
-        related_quotes = Quote.query.filter_by(
-            client_id=lead.client_id,
-            customer_email=lead.email
-        ).all() if lead.email else []
+        # Historial de interacciones (más recientes primero)
+        interactions = sorted(
+            lead.interactions,
+            key=lambda i: i.completed_at or datetime.min,
+            reverse=True
+        )
         
-        related_orders = Order.query.filter_by(
-            client_id=lead.client_id,
-            customer_email=lead.email
-        ).all() if lead.email else []
+        # Totales de cotizaciones y órdenes relacionadas en una sola consulta
+        # (índices (client_id, customer_email) de quotes y orders)
+        related = {'quotes': 0, 'orders': 0, 'quoted': 0.0, 'ordered': 0.0}
+        if lead.email:
+            def totals(model):
+                return select(
+                    func.count(model.id), func.coalesce(func.sum(model.total_amount), 0)
+                ).where(
+                    model.client_id == lead.client_id,
+                    model.customer_email == lead.email
+                ).subquery()
+            
+            quotes, orders = totals(Quote), totals(Order)
+            row = db.session.execute(select(quotes, orders)).one()
+            related = {
+                'quotes': row[0], 'quoted': float(row[1]),
+                'orders': row[2], 'ordered': float(row[3])
+            }
         
         return {
             'id': lead.id,
@@ -299,10 +387,10 @@ class CRMSystem:
                 }
                 for i in interactions
             ],
-            'related_quotes': len(related_quotes),
-            'related_orders': len(related_orders),
-            'total_quoted': sum(float(q.total_amount) for q in related_quotes),
-            'total_ordered': sum(float(o.total_amount) for o in related_orders)
+            'related_quotes': related['quotes'],
+            'related_orders': related['orders'],
+            'total_quoted': related['quoted'],
+            'total_ordered': related['ordered']
         }
     
     def get_crm_statistics(self, client_id: int, days: int = 30) -> Dict:
@@ -315,27 +403,26 @@ class CRMSystem:
             Lead.created_at >= start_date
         ).count()
         
-        # Leads cerrados (ganados/perdidos)
-        closed_leads = Lead.query.filter(
+        # Leads cerrados (ganados/perdidos), agregados en una consulta
+        is_won = Lead.status == 'won'
+        closed = db.session.query(
+            func.count(Lead.id).filter(is_won).label('won'),
+            func.count(Lead.id).filter(Lead.status == 'lost').label('lost'),
+            func.coalesce(func.sum(Lead.estimated_value).filter(is_won), 0).label('won_value'),
+            func.avg(func.date_part('day', Lead.closed_at - Lead.created_at)).label('avg_days')
+        ).filter(
             Lead.client_id == client_id,
             Lead.closed_at >= start_date,
-            Lead.status.in_(['won', 'lost'])
-        ).all()
-        
-        won_leads = [l for l in closed_leads if l.status == 'won']
-        lost_leads = [l for l in closed_leads if l.status == 'lost']
+            Lead.status.in_(CLOSED_LEAD_STATUSES)
+        ).one()
         
-        # Valor de leads ganados
-        won_value = sum(float(l.estimated_value or 0) for l in won_leads)
+        won_leads = closed.won
+        lost_leads = closed.lost
+        closed_leads = won_leads + lost_leads
+        won_value = float(closed.won_value)
         
         # Tiempo promedio en el pipeline
-        avg_pipeline_time = 0
-        if closed_leads:
-            pipeline_times = [
-                (l.closed_at - l.created_at).days for l in closed_leads
-                if l.closed_at and l.created_at
-            ]
-            avg_pipeline_time = sum(pipeline_times) / len(pipeline_times) if pipeline_times else 0
+        avg_pipeline_time = float(closed.avg_days or 0)
         
         # Fuentes de leads más efectivas
         lead_sources = db.session.query(
@@ -350,11 +437,11 @@ class CRMSystem:
         return {
             'period_days': days,
             'new_leads': new_leads,
-            'closed_leads': len(closed_leads),
-            'won_leads': len(won_leads),
-            'lost_leads': len(lost_leads),
+            'closed_leads': closed_leads,
+            'won_leads': won_leads,
+            'lost_leads': lost_leads,
             'won_value': won_value,
-            'conversion_rate': (len(won_leads) / len(closed_leads) * 100) if closed_leads else 0,
+            'conversion_rate': (won_leads / closed_leads * 100) if closed_leads else 0,
             'average_pipeline_days': round(avg_pipeline_time, 1),
             'lead_sources': [
                 {
@@ -367,31 +454,60 @@ class CRMSystem:
             ]
         }
     
-    def search_leads(self, client_id: int, query: str, status: str = None) -> List[Dict]:
-        """Busca leads por nombre, email, empresa, etc."""
-        search_filter = Lead.client_id == client_id
+    def search_leads(self, client_id: int, query: str, status: str = None,
+                     limit: int = SEARCH_PAGE_SIZE, cursor: str = None,
+                     fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Busca leads por nombre, empresa, email o teléfono usando los índices
+        de trigramas (tolera errores de escritura) y pagina por cursor.
         
-        if query:
-            search_filter = and_(
-                search_filter,
-                or_(
-                    Lead.name.ilike(f'%{query}%'),
-                    Lead.email.ilike(f'%{query}%'),
-                    Lead.company.ilike(f'%{query}%'),
-                    Lead.phone.ilike(f'%{query}%')
-                )
-            )
+        Con texto de búsqueda los resultados se ordenan por relevancia; sin
+        texto, por fecha de creación (más recientes primero).
         
+        Args:
+            cursor: Valor 'next_cursor' de la página anterior
+            
+        Returns:
+            Dict con los leads de la página y next_cursor (None si no hay más)
+            
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        text_query = (query or '').strip().lower()
+        digits = re.sub(r'\D', '', text_query)
+        
+        search = Lead.query.filter(Lead.client_id == client_id)
         if status:
-            search_filter = and_(search_filter, Lead.status == status)
+            search = search.filter(Lead.status == status)
+        
+        if text_query:
+            matches = [
+                Lead.search_text.contains(text_query, autoescape=True),
+                literal(text_query).op('<%')(Lead.search_text)  # Similitud por palabra (errores de escritura)
+            ]
+            phone_match = None
+            if len(digits) >= MIN_PHONE_DIGITS:
+                phone_match = Lead.phone_digits.contains(digits, autoescape=True)
+                matches.append(phone_match)
+            search = search.filter(or_(*matches))
+            
+            rank = func.word_similarity(text_query, Lead.search_text)
+            if phone_match is not None:
+                rank = case((phone_match, 1.0), else_=rank)
+            rank = cast(rank + case((func.lower(Lead.email) == text_query, 1.0), else_=0.0), Float)
+            sort_keys = (rank, Lead.id)
+        else:
+            sort_keys = (Lead.created_at, Lead.id)
         
-        leads = Lead.query.filter(search_filter).order_by(Lead.created_at.desc()).all()
+        rows, next_cursor = keyset_page(search, sort_keys, cursor, limit or SEARCH_PAGE_SIZE)
         
-        return [
-            {
+        leads = []
+        for lead, sort_value, _ in rows:
+            item = {
                 'id': lead.id,
                 'name': lead.name,
                 'email': lead.email,
+                'phone': lead.phone,
                 'company': lead.company,
                 'status': lead.status,
                 'estimated_value': float(lead.estimated_value or 0),
@@ -399,8 +515,11 @@ class CRMSystem:
                 'created_at': lead.created_at.isoformat(),
                 'last_contact': lead.last_contact.isoformat() if lead.last_contact else None
             }
-            for lead in leads
-        ]
+            if text_query:
+                item['score'] = round(sort_value, 4)
+            leads.append(item)
+        
+        return {'leads': select_fields(leads, fields), 'next_cursor': next_cursor}
     
     def _record_interaction(self, lead_id: int, interaction_type: str, direction: str,
                            subject: str, description: str, outcome: str = None):
@@ -433,42 +552,3 @@ class CRMSystem:
     def _calculate_expected_close_date(self, days_ahead: int = 30) -> datetime:
         """Calcula fecha esperada de cierre"""
         return datetime.now() + timedelta(days=days_ahead)
-    
-    def _calculate_lead_priority(self, lead: Lead) -> str:
-        """Calcula prioridad de un lead"""
-        priority_score = 0
-        
-        # Valor estimado
-        if lead.estimated_value and lead.estimated_value > 1000000:
-            priority_score += 3
-        elif lead.estimated_value and lead.estimated_value > 500000:
-            priority_score += 2
-        elif lead.estimated_value and lead.estimated_value > 100000:
-            priority_score += 1
-        
-        # Probabilidad
-        if lead.probability >= 70:
-            priority_score += 3
-        elif lead.probability >= 40:
-            priority_score += 2
-        elif lead.probability >= 20:
-            priority_score += 1
-        
-        # Tiempo sin contacto
-        if lead.last_contact:
-            days_without_contact = (datetime.now() - lead.last_contact).days
-            if days_without_contact >= 7:
-                priority_score += 2
-            elif days_without_contact >= 3:
-                priority_score += 1
-        
-        # Próxima acción vencida
-        if lead.next_action_date and lead.next_action_date < datetime.now():
-            priority_score += 2
-        
-        if priority_score >= 6:
-            return 'high'
-        elif priority_score >= 3:
-            return 'medium'
-        else:
-            return 'low'
\ No newline at end of file
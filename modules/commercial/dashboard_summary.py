@@ -0,0 +1,389 @@
+"""
+Resumen del dashboard comercial para SalesMind
+Todos los KPIs en una sola consulta agregada (GROUP BY, FILTER y funciones de
+ventana), materializados por cliente en commercial_dashboard_summaries e
+invalidados por eventos al cambiar leads, órdenes, facturas o stock
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+from sqlalchemy import and_, event, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import Session
+from modules.models import db
+from modules.commercial_models import DashboardSummary, Invoice, InventoryDailyRollup, Lead, Order, Product
+from .crm_system import (
+    CLOSED_LEAD_STATUSES, PIPELINE_STATUSES, attention_filter, lead_priority_score, priority_label
+)
+
+# Los KPIs con ventana de tiempo (últimos N días, vencidas) cambian sin eventos
+DASHBOARD_SUMMARY_MAX_AGE = timedelta(seconds=int(os.environ.get('DASHBOARD_SUMMARY_MAX_AGE', 300)))
+DASHBOARD_PERIOD_DAYS = 30
+DASHBOARD_ALERT_LIMIT = 5
+DASHBOARD_LOW_STOCK_LIMIT = 20
+
+ORDER_STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+
+# Modelos cuyos cambios invalidan el resumen de su cliente
+TRACKED_MODELS = (Lead, Order, Invoice, Product)
+
+
+def _json_rows(source, order_by=None):
+    """Filas de un CTE como un array JSON (subconsulta escalar)."""
+    pairs = []
+    for column in source.c:
+        pairs.extend([literal_column(f"'{column.name}'"), column])
+    row = func.json_build_object(*pairs)
+    if order_by is not None:
+        row = aggregate_order_by(row, order_by)
+    return select(
+        func.coalesce(func.json_agg(row), literal_column("'[]'::json"))
+    ).select_from(source).scalar_subquery()
+
+
+class DashboardSummaryEngine:
+    """
+    KPIs del dashboard comercial de un cliente.
+
+    compute_summary() ejecuta una única sentencia con un CTE por sección;
+    get_summary() sirve el resumen materializado mientras ningún cambio de
+    leads, órdenes, facturas o productos haya incrementado su versión y no
+    supere DASHBOARD_SUMMARY_MAX_AGE.
+    """
+
+    def __init__(self, max_age: timedelta = DASHBOARD_SUMMARY_MAX_AGE,
+                 period_days: int = DASHBOARD_PERIOD_DAYS):
+        self.max_age = max_age
+        self.period_days = period_days
+
+    def get_summary(self, client_id: int, refresh: bool = False) -> Dict:
+        """
+        Resumen del dashboard desde la caché materializada o recalculado.
+
+        Args:
+            refresh: Si True, ignora la caché
+        """
+        table = DashboardSummary.__table__
+        with db.engine.connect() as conn:
+            cached = conn.execute(
+                select(table.c.payload, table.c.version, table.c.computed_version, table.c.computed_at)
+                .where(table.c.client_id == client_id)
+            ).first()
+
+        if (not refresh and cached and cached.payload
+                and cached.computed_version == cached.version
+                and cached.computed_at >= datetime.utcnow() - self.max_age):
+            summary = json.loads(cached.payload)
+            summary['cached'] = True
+            return summary
+
+        # La versión se lee antes de calcular: un cambio durante el cálculo
+        # deja el resumen guardado como obsoleto
+        version = cached.version if cached else 0
+        summary = self.compute_summary(client_id)
+        self._store(client_id, version, summary)
+
+        summary['cached'] = False
+        return summary
+
+    def _store(self, client_id: int, version: int, summary: Dict):
+        table = DashboardSummary.__table__
+        computed_at = datetime.utcnow()
+        statement = pg_insert(table).values(
+            client_id=client_id,
+            payload=json.dumps(summary),
+            version=version,
+            computed_version=version,
+            computed_at=computed_at
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['client_id'],
+            set_={
+                'payload': statement.excluded.payload,
+                'computed_version': statement.excluded.computed_version,
+                'computed_at': statement.excluded.computed_at
+            }
+        )
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(statement)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el resumen del dashboard (cliente {client_id}): {e}")
+
+    def compute_summary(self, client_id: int) -> Dict:
+        """Calcula todos los KPIs del dashboard con una sola consulta."""
+        now = datetime.now()
+        since = now - timedelta(days=self.period_days)
+
+        lead_stats = select(
+            Lead.status.label('status'),
+            func.count().label('count'),
+            func.coalesce(func.sum(Lead.estimated_value), 0).label('value'),
+            func.coalesce(func.sum(Lead.estimated_value * Lead.probability / 100.0), 0).label('weighted'),
+            func.sum(func.count()).over().label('total')
+        ).where(Lead.client_id == client_id).group_by(Lead.status).cte('lead_stats')
+
+        order_stats = select(
+            Order.status.label('status'),
+            func.count().label('count'),
+            func.coalesce(func.sum(Order.total_amount), 0).label('revenue')
+        ).where(
+            Order.client_id == client_id,
+            Order.created_at >= since
+        ).group_by(Order.status).cte('order_stats')
+
+        in_period = Invoice.issue_date >= since
+        is_paid = Invoice.status == 'paid'
+        is_overdue = and_(Invoice.due_date < now, Invoice.status != 'paid')
+        invoice_stats = select(
+            func.count().filter(in_period).label('total_invoices'),
+            func.coalesce(func.sum(Invoice.total_amount).filter(in_period), 0).label('total_billed'),
+            func.count().filter(and_(in_period, is_paid)).label('paid_invoices'),
+            func.coalesce(func.sum(Invoice.total_amount).filter(and_(in_period, is_paid)), 0).label('total_paid'),
+            func.count().filter(is_overdue).label('overdue_invoices')
+        ).where(Invoice.client_id == client_id).cte('invoice_stats')
+
+        is_low = Product.stock_quantity <= Product.min_stock_alert
+        inventory_stats = select(
+            func.count().label('total_products'),
+            func.coalesce(func.sum(Product.stock_quantity * Product.base_price), 0).label('total_stock_value'),
+            func.count().filter(is_low).label('low_stock_alerts'),
+            func.count().filter(Product.stock_quantity == 0).label('out_of_stock')
+        ).where(Product.client_id == client_id, Product.is_active == True).cte('inventory_stats')
+
+        total_sold = func.sum(InventoryDailyRollup.units_sold)
+        ranked_products = select(
+            Product.name.label('name'),
+            total_sold.label('total_sold'),
+            func.row_number().over(order_by=total_sold.desc()).label('rank')
+        ).join(InventoryDailyRollup, InventoryDailyRollup.product_id == Product.id).where(
+            InventoryDailyRollup.client_id == client_id
+        ).group_by(Product.id, Product.name).having(total_sold > 0).cte('ranked_products')
+        top_products = select(ranked_products).where(ranked_products.c.rank <= 5).cte('top_products')
+
+        low_stock = select(
+            Product.id.label('id'),
+            Product.name.label('name'),
+            Product.sku.label('sku'),
+            Product.stock_quantity.label('current_stock'),
+            Product.min_stock_alert.label('min_stock_alert')
+        ).where(
+            Product.client_id == client_id,
+            Product.is_active == True,
+            is_low
+        ).order_by(Product.stock_quantity.asc(), Product.id).limit(DASHBOARD_LOW_STOCK_LIMIT).cte('low_stock')
+
+        score = lead_priority_score(now)
+        attention_leads = select(
+            Lead.id.label('id'),
+            Lead.name.label('name'),
+            Lead.company.label('company'),
+            Lead.status.label('status'),
+            func.coalesce(Lead.estimated_value, 0).label('estimated_value'),
+            Lead.last_contact.label('last_contact'),
+            Lead.next_action.label('next_action'),
+            Lead.next_action_date.label('next_action_date'),
+            score.label('score')
+        ).where(
+            Lead.client_id == client_id,
+            attention_filter(now)
+        ).order_by(score.desc(), Lead.id).limit(DASHBOARD_ALERT_LIMIT).cte('attention_leads')
+
+        overdue_invoices = select(
+            Invoice.id.label('id'),
+            Invoice.invoice_number.label('invoice_number'),
+            Order.customer_name.label('customer_name'),
+            Invoice.total_amount.label('total_amount'),
+            Invoice.due_date.label('due_date')
+        ).join(Order, Order.id == Invoice.order_id).where(
+            Invoice.client_id == client_id,
+            is_overdue
+        ).order_by(Invoice.due_date.asc()).limit(DASHBOARD_ALERT_LIMIT).cte('overdue_invoices')
+
+        row = db.session.execute(select(
+            _json_rows(lead_stats).label('leads'),
+            _json_rows(order_stats).label('orders'),
+            _json_rows(invoice_stats).label('invoices'),
+            _json_rows(inventory_stats).label('inventory'),
+            _json_rows(top_products, order_by=top_products.c.rank).label('top_products'),
+            _json_rows(low_stock, order_by=low_stock.c.current_stock).label('low_stock'),
+            _json_rows(attention_leads, order_by=attention_leads.c.score.desc()).label('attention_leads'),
+            _json_rows(overdue_invoices, order_by=overdue_invoices.c.due_date).label('overdue_invoices')
+        )).one()
+
+        return {
+            'client_id': client_id,
+            'computed_at': now.isoformat(),
+            'pipeline': self._build_pipeline(row.leads),
+            'order_stats': self._build_order_stats(row.orders),
+            'inventory': self._build_inventory(row.inventory[0], row.top_products),
+            'invoice_stats': self._build_invoice_stats(row.invoices[0]),
+            'alerts': {
+                'low_stock': [
+                    dict(product, status='critical' if product['current_stock'] == 0 else 'low')
+                    for product in row.low_stock
+                ],
+                'attention_leads': [self._build_attention_lead(lead, now) for lead in row.attention_leads],
+                'overdue_invoices': [self._build_overdue_invoice(invoice, now) for invoice in row.overdue_invoices]
+            }
+        }
+
+    @staticmethod
+    def _build_pipeline(lead_rows) -> Dict:
+        by_status = {lead['status']: lead for lead in lead_rows}
+        total_leads = int(lead_rows[0]['total']) if lead_rows else 0
+
+        pipeline = {
+            status: {
+                'count': by_status.get(status, {}).get('count', 0),
+                'value': float(by_status.get(status, {}).get('value', 0))
+            }
+            for status in PIPELINE_STATUSES
+        }
+        active = [lead for lead in lead_rows if lead['status'] in PIPELINE_STATUSES
+                  and lead['status'] not in CLOSED_LEAD_STATUSES]
+        won_leads = pipeline['won']['count']
+
+        return {
+            'pipeline': pipeline,
+            'summary': {
+                'total_leads': total_leads,
+                'active_leads': total_leads - won_leads - pipeline['lost']['count'],
+                'won_leads': won_leads,
+                'lost_leads': pipeline['lost']['count'],
+                'total_pipeline_value': sum(float(lead['value']) for lead in active),
+                'weighted_pipeline_value': sum(float(lead['weighted']) for lead in active),
+                'conversion_rate': round(won_leads / total_leads * 100, 2) if total_leads else 0
+            }
+        }
+
+    def _build_order_stats(self, order_rows) -> Dict:
+        by_status = {order['status']: order for order in order_rows}
+        total_orders = sum(order['count'] for order in order_rows)
+        total_revenue = sum(float(order['revenue']) for order in order_rows)
+        orders_by_status = {status: by_status.get(status, {}).get('count', 0) for status in ORDER_STATUSES}
+
+        return {
+            'period_days': self.period_days,
+            'total_orders': total_orders,
+            'total_revenue': total_revenue,
+            'average_order_value': total_revenue / total_orders if total_orders else 0,
+            'orders_by_status': orders_by_status,
+            'conversion_rate': orders_by_status['delivered'] / total_orders * 100 if total_orders else 0
+        }
+
+    @staticmethod
+    def _build_inventory(stats: Dict, top_products) -> Dict:
+        return {
+            'summary': {
+                'total_products': stats['total_products'],
+                'total_stock_value': float(stats['total_stock_value']),
+                'low_stock_alerts': stats['low_stock_alerts'],
+                'out_of_stock': stats['out_of_stock']
+            },
+            'top_selling_products': [
+                {'name': product['name'], 'total_sold': int(product['total_sold'])}
+                for product in top_products
+            ]
+        }
+
+    def _build_invoice_stats(self, stats: Dict) -> Dict:
+        total_billed = float(stats['total_billed'])
+        total_paid = float(stats['total_paid'])
+        total_invoices = stats['total_invoices']
+
+        return {
+            'period_days': self.period_days,
+            'total_invoices': total_invoices,
+            'total_billed': total_billed,
+            'total_paid': total_paid,
+            'pending_amount': total_billed - total_paid,
+            'paid_invoices': stats['paid_invoices'],
+            'overdue_invoices': stats['overdue_invoices'],
+            'payment_rate': stats['paid_invoices'] / total_invoices * 100 if total_invoices else 0
+        }
+
+    @staticmethod
+    def _build_attention_lead(lead: Dict, now: datetime) -> Dict:
+        score = lead.pop('score')
+        last_contact = datetime.fromisoformat(lead['last_contact']) if lead['last_contact'] else None
+        lead['estimated_value'] = float(lead['estimated_value'])
+        lead['days_without_contact'] = (now - last_contact).days if last_contact else None
+        lead['priority'] = priority_label(score)
+        return lead
+
+    @staticmethod
+    def _build_overdue_invoice(invoice: Dict, now: datetime) -> Dict:
+        invoice['total_amount'] = float(invoice['total_amount'])
+        invoice['days_overdue'] = (now - datetime.fromisoformat(invoice['due_date'])).days
+        return invoice
+
+
+def invalidate_dashboard(client_ids: Iterable[int]):
+    """
+    Marca como obsoletos los resúmenes de los clientes indicados. Para
+    escrituras que no pasan por el ORM (UPDATE/INSERT directos); los cambios
+    de modelos se detectan solos con register_dashboard_invalidation().
+    """
+    client_ids = sorted({client_id for client_id in client_ids if client_id})
+    if not client_ids:
+        return
+
+    table = DashboardSummary.__table__
+    statement = pg_insert(table).values([
+        {'client_id': client_id, 'version': 1} for client_id in client_ids
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=['client_id'],
+        set_={'version': table.c.version + 1}
+    )
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(statement)
+    except Exception as e:
+        print(f"⚠️ No se pudo invalidar el resumen del dashboard ({client_ids}): {e}")
+
+
+def _collect_changed_clients(session, flush_context):
+    """after_flush: anota los clientes con leads, órdenes, facturas o productos modificados."""
+    changed = session.info.setdefault('dashboard_clients', set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, TRACKED_MODELS):
+            changed.add(obj.client_id)
+    for obj in session.dirty:
+        if isinstance(obj, TRACKED_MODELS) and session.is_modified(obj, include_collections=False):
+            changed.add(obj.client_id)
+
+
+def _invalidate_after_commit(session):
+    """
+    after_commit: invalida con una conexión propia y corta, sin bloquear la
+    fila del resumen durante la transacción que hizo los cambios.
+    """
+    changed = session.info.pop('dashboard_clients', None)
+    if changed:
+        invalidate_dashboard(changed)
+
+
+def _discard_after_rollback(session):
+    session.info.pop('dashboard_clients', None)
+
+
+_invalidation_registered = False
+
+
+def register_dashboard_invalidation():
+    """Conecta la invalidación por eventos a todas las sesiones del ORM (una vez por proceso)."""
+    global _invalidation_registered
+    if _invalidation_registered:
+        return
+    event.listen(Session, 'after_flush', _collect_changed_clients)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_rollback', _discard_after_rollback)
+    _invalidation_registered = True
+
+
+# Instancia global
+dashboard_summary_engine = DashboardSummaryEngine()
@@ -0,0 +1,182 @@
+"""
+Ledger diario de inventario para SalesMind
+Mantiene inventory_daily_rollups (movimientos agregados por producto y día)
+para que los reportes de más vendidos, rotación e historial de stock no
+recorran toda la tabla inventory_movements
+"""
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable
+from sqlalchemy import Date, Integer, cast, column, event, func, select, text, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from modules.models import db
+from modules.commercial_models import InventoryDailyRollup, InventoryMovement, Product
+
+# Movimientos que cuentan como venta y los que la anulan
+SOLD_REFERENCE_TYPES = ('order_reservation', 'order_confirmed')
+RETURNED_REFERENCE_TYPES = ('order_cancelled', 'reservation_expired')
+
+ROLLUP_COLUMNS = ['client_id', 'product_id', 'day', 'units_in', 'units_out', 'units_sold', 'movement_count']
+
+
+def _rollup_upsert(source, increment: bool):
+    """INSERT ... SELECT sobre el rollup; increment suma a los totales existentes en lugar de reemplazarlos"""
+    table = InventoryDailyRollup.__table__
+    statement = pg_insert(table).from_select(ROLLUP_COLUMNS, source)
+    totals = ROLLUP_COLUMNS[3:]
+    set_ = {
+        name: (table.c[name] + statement.excluded[name]) if increment else statement.excluded[name]
+        for name in totals
+    }
+    set_['updated_at'] = func.now()
+    return statement.on_conflict_do_update(
+        index_elements=['client_id', 'product_id', 'day'],
+        set_=set_
+    )
+
+
+def record_movements(connection, movements: Iterable[Dict]) -> int:
+    """
+    Suma al rollup del día los movimientos recién insertados, en la misma
+    transacción que los insertó (una sola sentencia por lote).
+
+    Args:
+        connection: Conexión de la transacción que escribió los movimientos
+        movements: Dicts con product_id, movement_type, quantity y reference_type
+
+    Returns:
+        Número de productos actualizados
+    """
+    totals = defaultdict(lambda: [0, 0, 0, 0])  # in, out, vendidas, movimientos
+    for movement in movements:
+        quantity = movement['quantity'] or 0
+        product_totals = totals[movement['product_id']]
+        if movement['movement_type'] == 'in':
+            product_totals[0] += quantity
+            if movement.get('reference_type') in RETURNED_REFERENCE_TYPES:
+                product_totals[2] -= quantity
+        elif movement['movement_type'] == 'out':
+            product_totals[1] += quantity
+            if movement.get('reference_type') in SOLD_REFERENCE_TYPES:
+                product_totals[2] += quantity
+        product_totals[3] += 1
+
+    if not totals:
+        return 0
+
+    deltas = values(
+        column('product_id', Integer), column('units_in', Integer), column('units_out', Integer),
+        column('units_sold', Integer), column('movement_count', Integer),
+        name='deltas'
+    ).data([(product_id, *product_totals) for product_id, product_totals in sorted(totals.items())])
+
+    products = Product.__table__
+    source = select(
+        products.c.client_id, deltas.c.product_id, func.current_date(),
+        deltas.c.units_in, deltas.c.units_out, deltas.c.units_sold, deltas.c.movement_count
+    ).join_from(deltas, products, products.c.id == deltas.c.product_id)
+
+    connection.execute(_rollup_upsert(source, increment=True))
+    return len(totals)
+
+
+def rebuild_rollups(client_id: int = None, since: date = None) -> Dict:
+    """
+    Recalcula el rollup desde inventory_movements (carga inicial o
+    reparación). Cada cliente se reconstruye en su propia transacción con
+    la tabla bloqueada frente a escrituras, para no perder los incrementos
+    de movimientos registrados mientras tanto.
+
+    Args:
+        client_id: Solo este cliente (por defecto, todos)
+        since: Solo los días desde esta fecha (por defecto, todo el historial)
+
+    Returns:
+        Dict con clientes procesados, filas escritas y errores
+    """
+    if client_id:
+        client_ids = [client_id]
+    else:
+        client_ids = [row.client_id for row in db.session.query(Product.client_id).distinct().order_by(Product.client_id)]
+        db.session.rollback()
+
+    table = InventoryDailyRollup.__table__
+    movements = InventoryMovement.__table__
+    products = Product.__table__
+    day = cast(movements.c.created_at, Date)
+    is_in = movements.c.movement_type == 'in'
+    is_out = movements.c.movement_type == 'out'
+    sold = (
+        func.coalesce(func.sum(movements.c.quantity).filter(is_out, movements.c.reference_type.in_(SOLD_REFERENCE_TYPES)), 0)
+        - func.coalesce(func.sum(movements.c.quantity).filter(is_in, movements.c.reference_type.in_(RETURNED_REFERENCE_TYPES)), 0)
+    )
+
+    rows_written = 0
+    errors = []
+    for current_client_id in client_ids:
+        try:
+            db.session.execute(text('LOCK TABLE inventory_daily_rollups IN SHARE ROW EXCLUSIVE MODE'))
+
+            stale = table.delete().where(table.c.client_id == current_client_id)
+            source = select(
+                products.c.client_id, movements.c.product_id, day,
+                func.coalesce(func.sum(movements.c.quantity).filter(is_in), 0),
+                func.coalesce(func.sum(movements.c.quantity).filter(is_out), 0),
+                sold,
+                func.count()
+            ).join_from(movements, products, products.c.id == movements.c.product_id).where(
+                products.c.client_id == current_client_id
+            )
+            if since:
+                stale = stale.where(table.c.day >= since)
+                source = source.where(movements.c.created_at >= since)
+            source = source.group_by(products.c.client_id, movements.c.product_id, day)
+
+            db.session.execute(stale)
+            rows_written += db.session.execute(_rollup_upsert(source, increment=False)).rowcount
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+            errors.append({'client_id': current_client_id, 'error': str(e)})
+
+    print(f"📊 Rollup de inventario: {len(client_ids) - len(errors)} clientes, {rows_written} filas")
+    return {
+        'success': not errors,
+        'clients': len(client_ids) - len(errors),
+        'rows': rows_written,
+        'errors': errors
+    }
+
+
+def _rollup_new_movements(session, flush_context):
+    """after_flush: agrega al rollup los InventoryMovement creados por el ORM en este flush."""
+    movements = [
+        {
+            'product_id': obj.product_id,
+            'movement_type': obj.movement_type,
+            'quantity': obj.quantity,
+            'reference_type': obj.reference_type
+        }
+        for obj in session.new if isinstance(obj, InventoryMovement)
+    ]
+    if movements:
+        record_movements(session.connection(), movements)
+
+
+_rollup_registered = False
+
+
+def register_inventory_rollup():
+    """
+    Conecta el mantenimiento incremental del rollup a todas las sesiones del
+    ORM (una vez por proceso). Las escrituras que no pasan por el ORM (COPY)
+    deben llamar a record_movements.
+    """
+    global _rollup_registered
+    if _rollup_registered:
+        return
+    event.listen(Session, 'after_flush', _rollup_new_movements)
+    _rollup_registered = True
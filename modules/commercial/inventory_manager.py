@@ -3,12 +3,23 @@ Gestor de inventarios para SalesMind
 Controla stock, movimientos y alertas de productos
 """
 
-from datetime import datetime
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional
-from sqlalchemy import and_, func
+from typing import Dict, List, Optional, Set
+from sqlalchemy import Integer, and_, column, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import contains_eager, joinedload
 from modules.models import db
-from modules.commercial_models import Product, InventoryMovement, Order, OrderItem
+from modules.commercial_models import (
+    Product, InventoryDailyRollup, InventoryMovement, InventoryReservation, Order, OrderItem
+)
+from .dashboard_summary import invalidate_dashboard
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page, select_fields, wants
+
+# Horas que una orden pendiente retiene su stock antes de devolverlo
+INVENTORY_RESERVATION_TTL_HOURS = int(os.environ.get('INVENTORY_RESERVATION_TTL_HOURS', 48))
 
 class InventoryManager:
     """Gestor completo de inventarios y stock"""
@@ -83,7 +94,8 @@ class InventoryManager:
             Dict con resultado de la operación
         """
         try:
-            product = Product.query.get(product_id)
+            # Bloquear la fila: un ajuste no debe pisar una reserva simultánea
+            product = Product.query.filter(Product.id == product_id).with_for_update().first()
             if not product:
                 return {'success': False, 'error': 'Producto no encontrado'}
             
@@ -123,131 +135,163 @@ class InventoryManager:
             db.session.rollback()
             return {'success': False, 'error': f'Error actualizando stock: {str(e)}'}
     
-    def reserve_inventory_for_order(self, order_id: int) -> Dict:
+    def reserve_inventory_for_order(self, order_id: int, commit: bool = True) -> Dict:
         """
-        Reserva inventario para una orden (no lo descuenta aún)
+        Reserva el stock de una orden de forma atómica: o se reservan todos
+        sus productos o ninguno.
+        
+        Las filas de productos se bloquean con SELECT ... FOR UPDATE en orden
+        de id, así dos órdenes simultáneas nunca se interbloquean ni venden
+        más unidades de las disponibles. El stock reservado se descuenta de
+        stock_quantity (stock disponible) y queda registrado en
+        inventory_reservations hasta que la orden se confirme, se cancele
+        o la reserva caduque.
         
         Args:
             order_id: ID de la orden
+            commit: False para reservar dentro de la transacción del llamador
             
         Returns:
             Dict con resultado de la operación
         """
         try:
-            order = Order.query.get(order_id)
+            order = self._lock_order(order_id)
             if not order:
                 return {'success': False, 'error': 'Orden no encontrada'}
             
-            # Verificar disponibilidad y reservar
-            reserved_items = []
-            for item in order.order_items:
-                product = item.product
-                
-                if product.stock_quantity < item.quantity:
-                    # Liberar reservas ya hechas si una falla
-                    self._release_reservations(reserved_items)
-                    return {
-                        'success': False,
-                        'error': f'Stock insuficiente para {product.name}. Disponible: {product.stock_quantity}, Solicitado: {item.quantity}'
-                    }
-                
-                # "Reservar" actualizando el stock temporalmente
-                # En una implementación más robusta, se usaría una tabla separada de reservas
-                product.stock_quantity -= item.quantity
-                reserved_items.append((product.id, item.quantity))
-                
-                # Registrar movimiento de reserva
-                self._record_inventory_movement(
-                    product_id=product.id,
-                    movement_type='out',
-                    quantity=item.quantity,
-                    reason=f'Reserva para orden {order.order_number}',
-                    reference_type='order_reservation',
-                    reference_id=order_id
-                )
-            
-            db.session.commit()
-            
-            return {
-                'success': True,
-                'order_id': order_id,
-                'reserved_items': len(reserved_items),
-                'message': 'Inventario reservado exitosamente'
-            }
+            result = self._reserve_locked(order)
+            self._finish_reservation_change(result, order, commit)
+            return result
             
         except Exception as e:
             db.session.rollback()
             return {'success': False, 'error': f'Error reservando inventario: {str(e)}'}
     
-    def confirm_inventory_reservation(self, order_id: int) -> Dict:
+    def confirm_inventory_reservation(self, order_id: int, commit: bool = True) -> Dict:
         """
-        Confirma la reserva de inventario (descuento definitivo)
+        Confirma la reserva de inventario: el stock ya descontado deja de caducar.
+        Si la reserva había caducado, se intenta reservar de nuevo.
         """
-        # En esta implementación simple, la reserva ya descontó el stock
-        # En una implementación más robusta, aquí se haría el descuento real
         try:
-            order = Order.query.get(order_id)
+            order = self._lock_order(order_id)
             if not order:
                 return {'success': False, 'error': 'Orden no encontrada'}
             
-            # Actualizar razón en movimientos existentes
-            movements = InventoryMovement.query.filter_by(
-                reference_type='order_reservation',
-                reference_id=order_id
-            ).all()
-            
-            for movement in movements:
-                movement.reason = f'Confirmación orden {order.order_number}'
-                movement.reference_type = 'order_confirmed'
+            statuses = self._reservation_statuses(order_id)
+            if not statuses and self._has_legacy_reservation(order_id):
+                # Orden reservada antes de existir inventory_reservations
+                result = {'success': True, 'order_id': order_id}
+            elif 'active' not in statuses and 'confirmed' not in statuses:
+                result = self._reserve_locked(order)
+            else:
+                result = {'success': True, 'order_id': order_id}
             
-            db.session.commit()
+            if result['success']:
+                db.session.query(InventoryReservation).filter(
+                    InventoryReservation.order_id == order_id,
+                    InventoryReservation.status == 'active'
+                ).update({'status': 'confirmed', 'expires_at': None}, synchronize_session=False)
+                
+                # Actualizar razón en movimientos existentes
+                db.session.query(InventoryMovement).filter_by(
+                    reference_type='order_reservation',
+                    reference_id=order_id
+                ).update({
+                    'reason': f'Confirmación orden {order.order_number}',
+                    'reference_type': 'order_confirmed'
+                }, synchronize_session=False)
+                
+                result['message'] = 'Reserva de inventario confirmada'
             
-            return {
-                'success': True,
-                'order_id': order_id,
-                'message': 'Reserva de inventario confirmada'
-            }
+            self._finish_reservation_change(result, order, commit)
+            return result
             
         except Exception as e:
             db.session.rollback()
             return {'success': False, 'error': f'Error confirmando reserva: {str(e)}'}
     
-    def release_inventory_reservation(self, order_id: int) -> Dict:
+    def release_inventory_reservation(self, order_id: int, commit: bool = True) -> Dict:
         """
-        Libera la reserva de inventario (devuelve stock)
+        Libera la reserva de inventario (devuelve stock). Liberar dos veces
+        la misma orden no devuelve el stock dos veces.
         """
         try:
-            order = Order.query.get(order_id)
+            order = self._lock_order(order_id)
             if not order:
                 return {'success': False, 'error': 'Orden no encontrada'}
             
-            # Devolver stock de cada item
-            for item in order.order_items:
-                product = item.product
-                product.stock_quantity += item.quantity
-                
-                # Registrar movimiento de devolución
-                self._record_inventory_movement(
-                    product_id=product.id,
-                    movement_type='in',
-                    quantity=item.quantity,
-                    reason=f'Liberación reserva orden {order.order_number}',
-                    reference_type='order_cancelled',
-                    reference_id=order_id
-                )
-            
-            db.session.commit()
-            
-            return {
-                'success': True,
-                'order_id': order_id,
-                'message': 'Inventario liberado exitosamente'
-            }
+            result = self._release_locked(
+                order,
+                statuses=('active', 'confirmed'),
+                new_status='released',
+                reference_type='order_cancelled',
+                reason=f'Liberación reserva orden {order.order_number}'
+            )
+            self._finish_reservation_change(result, order, commit)
+            return result
             
         except Exception as e:
             db.session.rollback()
             return {'success': False, 'error': f'Error liberando inventario: {str(e)}'}
     
+    def expire_stale_reservations(self, limit: int = 500) -> Dict:
+        """
+        Devuelve al stock las reservas activas caducadas (órdenes pendientes
+        que no se confirmaron a tiempo). Cada orden se libera en su propia
+        transacción; la orden sigue pendiente y al confirmarse se reserva
+        de nuevo si aún hay stock.
+        
+        Args:
+            limit: Máximo de órdenes a procesar en esta pasada
+            
+        Returns:
+            Dict con órdenes liberadas y unidades devueltas
+        """
+        now = datetime.now()
+        order_ids = [
+            row.order_id for row in db.session.query(InventoryReservation.order_id).filter(
+                InventoryReservation.status == 'active',
+                InventoryReservation.expires_at < now
+            ).distinct().order_by(InventoryReservation.order_id).limit(limit)
+        ]
+        db.session.rollback()
+        
+        expired_orders = 0
+        released_units = 0
+        errors = []
+        
+        for order_id in order_ids:
+            try:
+                order = self._lock_order(order_id)
+                if not order:
+                    db.session.rollback()
+                    continue
+                
+                result = self._release_locked(
+                    order,
+                    statuses=('active',),
+                    new_status='expired',
+                    reference_type='reservation_expired',
+                    reason=f'Reserva caducada orden {order.order_number}',
+                    expired_before=now
+                )
+                self._finish_reservation_change(result, order, commit=True)
+                
+                if result['released_units']:
+                    expired_orders += 1
+                    released_units += result['released_units']
+                    
+            except Exception as e:
+                db.session.rollback()
+                errors.append({'order_id': order_id, 'error': str(e)})
+        
+        return {
+            'success': not errors,
+            'expired_orders': expired_orders,
+            'released_units': released_units,
+            'errors': errors
+        }
+    
     def get_low_stock_alerts(self, client_id: int) -> List[Dict]:
         """
         Obtiene productos con stock bajo para un cliente
@@ -288,17 +332,8 @@ class InventoryManager:
         low_stock_count = len([p for p in products if p.stock_quantity <= p.min_stock_alert])
         out_of_stock_count = len([p for p in products if p.stock_quantity == 0])
         
-        # Productos más vendidos (basado en movimientos)
-        top_products_query = db.session.query(
-            Product.name,
-            func.sum(InventoryMovement.quantity).label('total_sold')
-        ).join(InventoryMovement).filter(
-            and_(
-                Product.client_id == client_id,
-                InventoryMovement.movement_type == 'out',
-                InventoryMovement.reference_type.in_(['order_confirmed', 'order_reservation'])
-            )
-        ).group_by(Product.id).order_by(func.sum(InventoryMovement.quantity).desc()).limit(5).all()
+        # Productos más vendidos (desde el rollup diario)
+        top_products = self.get_top_selling_products(client_id, limit=5)
         
         return {
             'summary': {
@@ -308,8 +343,8 @@ class InventoryManager:
                 'out_of_stock': out_of_stock_count
             },
             'top_selling_products': [
-                {'name': name, 'total_sold': int(total_sold)}
-                for name, total_sold in top_products_query
+                {'name': product['name'], 'total_sold': product['total_sold']}
+                for product in top_products
             ],
             'products': [
                 {
@@ -330,25 +365,146 @@ class InventoryManager:
             ]
         }
     
-    def get_inventory_movements(self, product_id: int = None, 
-                               movement_type: str = None, limit: int = 50) -> List[Dict]:
+    def get_top_selling_products(self, client_id: int, limit: int = 5, days: int = None) -> List[Dict]:
+        """
+        Productos más vendidos (unidades netas de cancelaciones) leyendo
+        inventory_daily_rollups
+        
+        Args:
+            client_id: ID del cliente empresarial
+            limit: Número de productos
+            days: Solo los últimos N días (por defecto, todo el historial)
+        """
+        total_sold = func.sum(InventoryDailyRollup.units_sold)
+        query = db.session.query(
+            Product.id, Product.name, Product.sku, total_sold.label('total_sold')
+        ).join(InventoryDailyRollup, InventoryDailyRollup.product_id == Product.id).filter(
+            InventoryDailyRollup.client_id == client_id
+        )
+        if days:
+            query = query.filter(InventoryDailyRollup.day >= date.today() - timedelta(days=days))
+        
+        rows = query.group_by(Product.id).having(total_sold > 0).order_by(
+            total_sold.desc(), Product.id
+        ).limit(limit).all()
+        
+        return [
+            {'id': row.id, 'name': row.name, 'sku': row.sku, 'total_sold': int(row.total_sold)}
+            for row in rows
+        ]
+    
+    def get_product_velocity(self, client_id: int, days: int = 30, limit: int = 50) -> List[Dict]:
         """
-        Obtiene historial de movimientos de inventario
+        Rotación por producto: unidades vendidas por día en la ventana y días
+        de cobertura con el stock actual
+        """
+        since = date.today() - timedelta(days=days - 1)
+        sold = func.coalesce(func.sum(InventoryDailyRollup.units_sold), 0)
+        rows = db.session.query(
+            Product.id, Product.name, Product.sku, Product.stock_quantity, sold.label('sold')
+        ).outerjoin(InventoryDailyRollup, and_(
+            InventoryDailyRollup.client_id == Product.client_id,
+            InventoryDailyRollup.product_id == Product.id,
+            InventoryDailyRollup.day >= since
+        )).filter(
+            Product.client_id == client_id,
+            Product.is_active == True
+        ).group_by(Product.id).order_by(sold.desc(), Product.id).limit(limit).all()
+        
+        velocity = []
+        for row in rows:
+            per_day = max(int(row.sold), 0) / days
+            stock = row.stock_quantity or 0
+            velocity.append({
+                'id': row.id,
+                'name': row.name,
+                'sku': row.sku,
+                'stock_quantity': stock,
+                'units_sold': int(row.sold),
+                'units_per_day': round(per_day, 2),
+                'days_of_cover': round(stock / per_day, 1) if per_day else None
+            })
+        return velocity
+    
+    def get_stock_history(self, product_id: int, days: int = 30) -> Optional[Dict]:
+        """
+        Stock al cierre de cada día de los últimos N días, reconstruido hacia
+        atrás desde el stock actual con los netos diarios del rollup
+        """
+        product = Product.query.get(product_id)
+        if not product:
+            return None
+        
+        today = date.today()
+        since = today - timedelta(days=days - 1)
+        daily = {
+            row.day: row for row in InventoryDailyRollup.query.filter(
+                InventoryDailyRollup.client_id == product.client_id,
+                InventoryDailyRollup.product_id == product_id,
+                InventoryDailyRollup.day >= since
+            )
+        }
+        
+        history = []
+        closing_stock = product.stock_quantity or 0
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            row = daily.get(day)
+            units_in = row.units_in if row else 0
+            units_out = row.units_out if row else 0
+            history.append({
+                'day': day.isoformat(),
+                'closing_stock': closing_stock,
+                'units_in': units_in,
+                'units_out': units_out,
+                'units_sold': row.units_sold if row else 0
+            })
+            closing_stock -= units_in - units_out
+        history.reverse()
+        
+        return {
+            'product_id': product.id,
+            'name': product.name,
+            'current_stock': product.stock_quantity,
+            'history': history
+        }
+    
+    def get_inventory_movements(self, product_id: int = None, movement_type: str = None,
+                               limit: int = DEFAULT_PAGE_SIZE, client_id: int = None,
+                               cursor: str = None, fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Obtiene historial de movimientos de inventario (más recientes
+        primero), paginado por cursor
+        
+        Returns:
+            Dict con 'movements' y 'next_cursor' (None en la última página)
         """
         query = InventoryMovement.query
+        with_product = wants(fields, 'product_name')
+        
+        if client_id:
+            query = query.join(Product, InventoryMovement.product_id == Product.id).filter(
+                Product.client_id == client_id
+            )
+            if with_product:
+                query = query.options(contains_eager(InventoryMovement.product))
+        elif with_product:
+            query = query.options(joinedload(InventoryMovement.product).load_only(Product.name))
         
         if product_id:
-            query = query.filter_by(product_id=product_id)
+            query = query.filter(InventoryMovement.product_id == product_id)
         
         if movement_type:
-            query = query.filter_by(movement_type=movement_type)
+            query = query.filter(InventoryMovement.movement_type == movement_type)
         
-        movements = query.order_by(InventoryMovement.created_at.desc()).limit(limit).all()
+        rows, next_cursor = keyset_page(
+            query, (InventoryMovement.created_at, InventoryMovement.id), cursor, limit
+        )
         
-        return [
+        movements = [
             {
                 'id': m.id,
-                'product_name': m.product.name if m.product else 'N/A',
+                'product_name': (m.product.name if m.product else 'N/A') if with_product else None,
                 'movement_type': m.movement_type,
                 'quantity': m.quantity,
                 'reference_type': m.reference_type,
@@ -357,8 +513,9 @@ class InventoryManager:
                 'created_at': m.created_at.isoformat(),
                 'created_by': m.created_by
             }
-            for m in movements
+            for m, *_ in rows
         ]
+        return {'movements': select_fields(movements, fields), 'next_cursor': next_cursor}
     
     def _record_inventory_movement(self, product_id: int, movement_type: str,
                                   quantity: int, reason: str, reference_type: str = None,
@@ -378,11 +535,202 @@ class InventoryManager:
         
         db.session.add(movement)
     
-    def _release_reservations(self, reserved_items: List[tuple]):
+    def _lock_order(self, order_id: int) -> Optional[Order]:
         """
-        Libera reservas parciales en caso de error
+        Bloquea la orden: serializa reservar, confirmar y liberar una misma
+        orden. Siempre se bloquea la orden antes que sus productos.
         """
-        for product_id, quantity in reserved_items:
-            product = Product.query.get(product_id)
-            if product:
-                product.stock_quantity += quantity
\ No newline at end of file
+        return Order.query.filter(Order.id == order_id).with_for_update(of=Order).first()
+    
+    def _lock_products(self, product_ids) -> Dict[int, object]:
+        """
+        Bloquea las filas de los productos en orden de id (orden global de
+        bloqueo, evita interbloqueos entre órdenes con productos comunes)
+        """
+        rows = db.session.execute(
+            select(Product.id, Product.name, Product.stock_quantity)
+            .where(Product.id.in_(sorted(product_ids)))
+            .order_by(Product.id)
+            .with_for_update()
+        ).all()
+        return {row.id: row for row in rows}
+    
+    def _apply_stock_deltas(self, deltas: Dict[int, int]):
+        """Suma a stock_quantity la variación de cada producto en un solo UPDATE"""
+        table = Product.__table__
+        changes = values(
+            column('product_id', Integer), column('delta', Integer), name='stock_changes'
+        ).data(sorted(deltas.items()))
+        
+        db.session.execute(
+            update(table)
+            .where(table.c.id == changes.c.product_id)
+            .values(
+                stock_quantity=func.coalesce(table.c.stock_quantity, 0) + changes.c.delta,
+                updated_at=func.now()
+            )
+        )
+    
+    def _reservation_statuses(self, order_id: int) -> set:
+        rows = db.session.query(InventoryReservation.status).filter_by(order_id=order_id).distinct()
+        return {row.status for row in rows}
+    
+    def _has_legacy_reservation(self, order_id: int) -> bool:
+        """Orden que descontó stock con el esquema anterior (solo movimientos)"""
+        return db.session.query(InventoryMovement.id).filter(
+            InventoryMovement.reference_id == order_id,
+            InventoryMovement.reference_type.in_(['order_reservation', 'order_confirmed'])
+        ).first() is not None
+    
+    def _reserve_locked(self, order: Order) -> Dict:
+        """
+        Reserva el stock de una orden ya bloqueada, sin confirmar la
+        transacción. Si falta stock no escribe nada.
+        """
+        if self._reservation_statuses(order.id) & {'active', 'confirmed'}:
+            return {
+                'success': True,
+                'order_id': order.id,
+                'reserved_items': 0,
+                'message': 'El inventario ya estaba reservado'
+            }
+        
+        requested = defaultdict(int)
+        for item in db.session.query(OrderItem.product_id, OrderItem.quantity).filter_by(order_id=order.id):
+            requested[item.product_id] += item.quantity
+        
+        if not requested:
+            return {'success': True, 'order_id': order.id, 'reserved_items': 0,
+                    'message': 'La orden no tiene productos'}
+        
+        products = self._lock_products(requested)
+        for product_id, quantity in sorted(requested.items()):
+            product = products.get(product_id)
+            if product is None:
+                return {'success': False, 'error': f'Producto no encontrado: {product_id}'}
+            
+            available = product.stock_quantity or 0
+            if available < quantity:
+                return {
+                    'success': False,
+                    'error': f'Stock insuficiente para {product.name}. Disponible: {available}, Solicitado: {quantity}'
+                }
+        
+        self._apply_stock_deltas({product_id: -quantity for product_id, quantity in requested.items()})
+        
+        expires_at = datetime.now() + timedelta(hours=INVENTORY_RESERVATION_TTL_HOURS)
+        statement = pg_insert(InventoryReservation.__table__).values([
+            {
+                'order_id': order.id,
+                'product_id': product_id,
+                'quantity': quantity,
+                'status': 'active',
+                'expires_at': expires_at
+            }
+            for product_id, quantity in sorted(requested.items())
+        ])
+        # Una reserva caducada o liberada se reactiva en su misma fila
+        db.session.execute(statement.on_conflict_do_update(
+            constraint='unique_order_product_reservation',
+            set_={
+                'quantity': statement.excluded.quantity,
+                'status': 'active',
+                'expires_at': statement.excluded.expires_at,
+                'updated_at': func.now()
+            }
+        ))
+        
+        for product_id, quantity in sorted(requested.items()):
+            self._record_inventory_movement(
+                product_id=product_id,
+                movement_type='out',
+                quantity=quantity,
+                reason=f'Reserva para orden {order.order_number}',
+                reference_type='order_reservation',
+                reference_id=order.id
+            )
+        
+        return {
+            'success': True,
+            'order_id': order.id,
+            'reserved_items': len(requested),
+            'expires_at': expires_at.isoformat(),
+            'message': 'Inventario reservado exitosamente'
+        }
+    
+    def _release_locked(self, order: Order, statuses: tuple, new_status: str,
+                        reference_type: str, reason: str, expired_before: datetime = None) -> Dict:
+        """
+        Devuelve al stock las reservas de una orden ya bloqueada y las marca
+        con new_status, sin confirmar la transacción.
+        """
+        query = db.session.query(InventoryReservation).filter(
+            InventoryReservation.order_id == order.id,
+            InventoryReservation.status.in_(statuses)
+        )
+        if expired_before is not None:
+            query = query.filter(InventoryReservation.expires_at < expired_before)
+        reservations = query.order_by(InventoryReservation.product_id).with_for_update().all()
+        
+        returned = defaultdict(int)
+        for reservation in reservations:
+            returned[reservation.product_id] += reservation.quantity
+            reservation.status = new_status
+            reservation.expires_at = None
+        
+        if not reservations and new_status == 'released' and not self._reservation_statuses(order.id):
+            returned = self._legacy_reserved_quantities(order)
+        
+        if returned:
+            self._lock_products(returned)
+            self._apply_stock_deltas(returned)
+            
+            for product_id, quantity in sorted(returned.items()):
+                self._record_inventory_movement(
+                    product_id=product_id,
+                    movement_type='in',
+                    quantity=quantity,
+                    reason=reason,
+                    reference_type=reference_type,
+                    reference_id=order.id
+                )
+        
+        return {
+            'success': True,
+            'order_id': order.id,
+            'released_units': sum(returned.values()),
+            'message': 'Inventario liberado exitosamente'
+        }
+    
+    def _legacy_reserved_quantities(self, order: Order) -> Dict[int, int]:
+        """
+        Stock retenido por una orden reservada con el esquema anterior, si
+        todavía no se había devuelto
+        """
+        if not self._has_legacy_reservation(order.id):
+            return {}
+        
+        already_released = db.session.query(InventoryMovement.id).filter_by(
+            reference_type='order_cancelled',
+            reference_id=order.id
+        ).first()
+        if already_released:
+            return {}
+        
+        returned = defaultdict(int)
+        for item in db.session.query(OrderItem.product_id, OrderItem.quantity).filter_by(order_id=order.id):
+            returned[item.product_id] += item.quantity
+        return returned
+    
+    def _finish_reservation_change(self, result: Dict, order: Order, commit: bool):
+        """Confirma o deshace la transacción de una reserva según su resultado"""
+        if not commit:
+            return
+        
+        if result['success']:
+            client_id = order.client_id
+            db.session.commit()
+            # Los UPDATE directos de stock no pasan por el listener del ORM
+            invalidate_dashboard([client_id])
+        else:
+            db.session.rollback()
@@ -0,0 +1,478 @@
+"""
+Facturación por lotes para SalesMind
+Cierres de mes: precarga de órdenes en bloque, numeración reservada por tramo,
+PDFs renderizados en un pool de procesos y commits por tramos con punto de
+reanudación
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import update
+from sqlalchemy.orm import selectinload
+from modules.models import db
+from modules.artifact_store import artifact_store
+from modules.bulk_writer import BulkWriter
+from modules.commercial_models import Invoice, InvoiceBatchItem, InvoiceBatchJob, Order, OrderItem
+from .invoice_generator import (
+    INVOICEABLE_ORDER_STATUSES, InvoiceGenerator, build_invoice_pdf_data, render_invoice_pdf
+)
+from .sequence_allocator import sequence_allocator
+
+# Órdenes facturadas por commit (también acota el tiempo que se bloquea el contador)
+INVOICE_BATCH_CHUNK = int(os.environ.get('INVOICE_BATCH_CHUNK', 100))
+INVOICE_RENDER_WORKERS = int(os.environ.get('INVOICE_RENDER_WORKERS', os.cpu_count() or 2))
+
+FINAL_BATCH_STATES = ('completed', 'completed_with_errors', 'failed')
+
+
+class InvoiceBatchProcessor:
+    """
+    Lotes de facturación persistentes en PostgreSQL.
+
+    La API crea el trabajo con la lista de órdenes facturables y responde de
+    inmediato; los workers (`flask invoice-batch-worker`) lo toman con
+    SELECT ... FOR UPDATE SKIP LOCKED y lo procesan por tramos. Cada tramo se
+    confirma con sus facturas, el estado de cada orden y el punto de control,
+    así que un trabajo interrumpido continúa desde la última orden confirmada.
+    """
+
+    # Un trabajo 'running' sin latido durante este tiempo se considera abandonado
+    STALE_AFTER = timedelta(minutes=10)
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                try:
+                    cls._executor = ProcessPoolExecutor(max_workers=INVOICE_RENDER_WORKERS)
+                except Exception as e:
+                    # Ej: procesos daemon que no pueden crear hijos
+                    print(f"⚠️ Pool de procesos no disponible para facturas, usando hilos: {e}")
+                    cls._executor = ThreadPoolExecutor(max_workers=INVOICE_RENDER_WORKERS)
+            return cls._executor
+
+    @classmethod
+    def create_job(cls, client_id: int, date_from: datetime = None, date_to: datetime = None,
+                   order_ids: List[int] = None, tax_info: Dict = None) -> Dict:
+        """
+        Crea un lote con las órdenes facturables del cliente.
+
+        Args:
+            client_id: ID del cliente
+            date_from: Fecha inicial de la orden (inclusive)
+            date_to: Fecha final de la orden (exclusiva)
+            order_ids: Lista explícita de órdenes (opcional)
+            tax_info: Información fiscal de la empresa para todas las facturas
+
+        Returns:
+            Dict con resultado de la operación
+        """
+        try:
+            if not order_ids and not (date_from and date_to):
+                return {'success': False, 'error': 'Indique un rango de fechas o una lista de órdenes'}
+
+            query = db.session.query(Order.id).outerjoin(
+                Invoice, Invoice.order_id == Order.id
+            ).filter(
+                Order.client_id == client_id,
+                Order.status.in_(INVOICEABLE_ORDER_STATUSES),
+                Invoice.id.is_(None)
+            )
+            if order_ids:
+                query = query.filter(Order.id.in_(order_ids))
+            if date_from:
+                query = query.filter(Order.order_date >= date_from)
+            if date_to:
+                query = query.filter(Order.order_date < date_to)
+
+            eligible = [row.id for row in query.order_by(Order.id)]
+            # Órdenes pedidas explícitamente que no se pueden facturar
+            skipped = sorted(set(order_ids or []) - set(eligible))
+
+            if not eligible:
+                return {'success': False, 'error': 'No hay órdenes pendientes de facturar', 'skipped_orders': skipped}
+
+            job = InvoiceBatchJob(
+                client_id=client_id,
+                date_from=date_from,
+                date_to=date_to,
+                tax_info=json.dumps(tax_info or {}),
+                status='pending',
+                total_orders=len(eligible)
+            )
+            db.session.add(job)
+            db.session.flush()
+
+            now = datetime.utcnow()
+            with BulkWriter(InvoiceBatchItem, columns=['job_id', 'order_id', 'status', 'updated_at']) as writer:
+                writer.extend(
+                    {'job_id': job.id, 'order_id': order_id, 'status': 'pending', 'updated_at': now}
+                    for order_id in eligible
+                )
+
+            db.session.commit()
+
+            print(f"📥 Lote de facturación {job.id} encolado: {len(eligible)} órdenes para cliente {client_id}")
+            return {
+                'success': True,
+                'job_id': job.id,
+                'total_orders': len(eligible),
+                'skipped_orders': skipped
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            return {'success': False, 'error': f'Error creando lote de facturación: {str(e)}'}
+
+    @classmethod
+    def get_job_status(cls, job_id: int) -> Optional[Dict]:
+        """
+        Obtiene el progreso de un lote y el detalle de las órdenes fallidas.
+        """
+        job = InvoiceBatchJob.query.get(job_id)
+        if not job:
+            return None
+
+        failures = InvoiceBatchItem.query.filter(
+            InvoiceBatchItem.job_id == job_id,
+            InvoiceBatchItem.status.in_(('failed', 'skipped'))
+        ).order_by(InvoiceBatchItem.order_id).all()
+
+        # Las órdenes omitidas (ya facturadas o en otro estado) no cuentan como facturadas
+        skipped = sum(1 for item in failures if item.status == 'skipped')
+        finished = job.processed_orders + job.failed_orders + skipped
+
+        return {
+            'job_id': job.id,
+            'client_id': job.client_id,
+            'status': job.status,
+            'is_final': job.status in FINAL_BATCH_STATES,
+            'total_orders': job.total_orders,
+            'processed_orders': job.processed_orders,
+            'failed_orders': job.failed_orders,
+            'skipped_orders': skipped,
+            'progress': round(finished / job.total_orders * 100, 1) if job.total_orders else 0.0,
+            'last_order_id': job.last_order_id,
+            'error': job.error_message,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'failures': [
+                {'order_id': item.order_id, 'status': item.status, 'error': item.error_message}
+                for item in failures
+            ]
+        }
+
+    @classmethod
+    def resume_job(cls, job_id: int) -> Dict:
+        """
+        Devuelve a la cola un lote fallido; continúa desde su punto de control.
+        """
+        try:
+            job = InvoiceBatchJob.query.with_for_update().get(job_id)
+            if not job:
+                return {'success': False, 'error': 'Lote no encontrado'}
+
+            if job.status != 'failed':
+                return {'success': False, 'error': f'Solo se pueden reanudar lotes fallidos ({job.status})'}
+
+            job.status = 'pending'
+            job.worker_id = None
+            job.error_message = None
+            job.finished_at = None
+            db.session.commit()
+
+            return {'success': True, 'job_id': job_id, 'status': job.status, 'last_order_id': job.last_order_id}
+
+        except Exception as e:
+            db.session.rollback()
+            return {'success': False, 'error': f'Error reanudando lote: {str(e)}'}
+
+    @classmethod
+    def claim_next_job(cls, worker_id: str) -> Optional[InvoiceBatchJob]:
+        """
+        Toma el siguiente lote pendiente de forma atómica (SKIP LOCKED).
+        """
+        try:
+            job = InvoiceBatchJob.query.filter_by(status='pending').order_by(
+                InvoiceBatchJob.created_at.asc(), InvoiceBatchJob.id.asc()
+            ).with_for_update(skip_locked=True).first()
+
+            if not job:
+                db.session.rollback()
+                return None
+
+            now = datetime.utcnow()
+            job.status = 'running'
+            job.worker_id = worker_id
+            job.started_at = job.started_at or now
+            job.heartbeat_at = now
+            db.session.commit()
+
+            return job
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error tomando lote de facturación: {e}")
+            return None
+
+    @classmethod
+    def requeue_stale_jobs(cls) -> int:
+        """
+        Devuelve a la cola los lotes cuyo worker dejó de enviar latidos.
+        """
+        try:
+            limit = datetime.utcnow() - cls.STALE_AFTER
+            result = db.session.execute(
+                update(InvoiceBatchJob)
+                .where(InvoiceBatchJob.status == 'running', InvoiceBatchJob.heartbeat_at < limit)
+                .values(status='pending', worker_id=None)
+            )
+            db.session.commit()
+
+            if result.rowcount:
+                print(f"♻️ {result.rowcount} lotes de facturación abandonados devueltos a la cola")
+            return result.rowcount
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error recuperando lotes abandonados: {e}")
+            return 0
+
+    @classmethod
+    def process_job(cls, job_id: int, chunk_size: int = INVOICE_BATCH_CHUNK) -> bool:
+        """
+        Ejecuta un lote ya tomado, tramo a tramo en orden de order_id.
+
+        Returns:
+            True si el lote terminó, False si falló
+        """
+        job = InvoiceBatchJob.query.get(job_id)
+        if not job:
+            print(f"❌ Lote de facturación no encontrado: {job_id}")
+            return False
+
+        print(f"🚀 Procesando lote de facturación {job.id} (cliente {job.client_id}, {job.total_orders} órdenes)")
+
+        tax_info = json.loads(job.tax_info or '{}')
+        executor = cls._get_executor()
+
+        try:
+            while True:
+                order_ids = [
+                    row.order_id for row in db.session.query(InvoiceBatchItem.order_id).filter(
+                        InvoiceBatchItem.job_id == job.id,
+                        InvoiceBatchItem.status == 'pending'
+                    ).order_by(InvoiceBatchItem.order_id).limit(chunk_size)
+                ]
+                if not order_ids:
+                    break
+
+                start = time.perf_counter()
+                created = cls._process_chunk(job, order_ids, tax_info, executor)
+                print(f"🧾 Lote {job.id}: {created}/{len(order_ids)} facturas en "
+                      f"{time.perf_counter() - start:.2f}s (hasta orden {job.last_order_id})")
+
+            job.status = 'completed_with_errors' if job.failed_orders else 'completed'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+            skipped = job.total_orders - job.processed_orders - job.failed_orders
+            print(f"✅ Lote {job.id} terminado: {job.processed_orders} facturadas, "
+                  f"{job.failed_orders} fallidas, {skipped} omitidas")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+            print(f"❌ Lote {job.id} fallido en orden {job.last_order_id}: {e}")
+            return False
+
+    @classmethod
+    def _process_chunk(cls, job: InvoiceBatchJob, order_ids: List[int], tax_info: Dict,
+                       executor) -> int:
+        """
+        Factura un tramo de órdenes y lo confirma junto con el punto de control.
+
+        Returns:
+            Número de facturas creadas
+        """
+        # Órdenes con sus items y productos en tres consultas
+        orders = Order.query.options(
+            selectinload(Order.order_items).joinedload(OrderItem.product)
+        ).filter(Order.id.in_(order_ids)).order_by(Order.id).all()
+
+        # Pueden haberse facturado individualmente desde que se creó el lote
+        invoiced = {
+            row.order_id: row.invoice_number for row in db.session.query(
+                Invoice.order_id, Invoice.invoice_number
+            ).filter(Invoice.order_id.in_(order_ids))
+        }
+
+        results = {}  # order_id -> (estado, mensaje)
+        ready = []
+        for order in orders:
+            if order.id in invoiced:
+                results[order.id] = ('skipped', f'Ya existe factura {invoiced[order.id]}')
+            elif order.status not in INVOICEABLE_ORDER_STATUSES:
+                results[order.id] = ('skipped', f'Orden en estado {order.status}')
+            elif not order.order_items:
+                results[order.id] = ('failed', 'La orden no tiene productos')
+            else:
+                ready.append(order)
+        for order_id in set(order_ids) - {order.id for order in orders}:
+            results[order_id] = ('failed', 'Orden no encontrada')
+
+        invoices = {}
+        while ready:
+            invoices = cls._build_invoices(job, ready, tax_info)
+            render_errors = cls._render_pdfs(invoices, ready, tax_info, executor)
+
+            if not render_errors:
+                break
+
+            # Liberar el bloque de números y reintentar sin las órdenes fallidas,
+            # para que la numeración siga sin huecos
+            db.session.rollback()
+            for invoice in invoices.values():
+                if invoice.pdf_path and os.path.exists(invoice.pdf_path):
+                    os.remove(invoice.pdf_path)
+            for order_id, error in render_errors.items():
+                results[order_id] = ('failed', f'Error generando PDF: {error}')
+            ready = [order for order in ready if order.id not in render_errors]
+            invoices = {}
+
+        if invoices:
+            db.session.add_all(invoices.values())
+            db.session.flush()
+
+        # Resultado de cada orden del tramo
+        now = datetime.utcnow()
+        items = InvoiceBatchItem.query.filter(
+            InvoiceBatchItem.job_id == job.id,
+            InvoiceBatchItem.order_id.in_(order_ids)
+        ).all()
+        for item in items:
+            if item.order_id in invoices:
+                item.status = 'completed'
+                item.invoice_id = invoices[item.order_id].id
+                item.error_message = None
+            else:
+                item.status, item.error_message = results.get(
+                    item.order_id, ('failed', 'Orden no procesada')
+                )
+            item.updated_at = now
+
+        failed = sum(1 for status, _ in results.values() if status == 'failed')
+        job.processed_orders += len(invoices)
+        job.failed_orders += failed
+        job.last_order_id = max(order_ids)
+        job.heartbeat_at = now
+        db.session.commit()
+
+        return len(invoices)
+
+    @classmethod
+    def _build_invoices(cls, job: InvoiceBatchJob, orders: List[Order], tax_info: Dict) -> Dict[int, Invoice]:
+        """
+        Crea las facturas del tramo con un bloque de números consecutivos,
+        reservado en la transacción del tramo.
+        """
+        first_number = sequence_allocator.reserve_gap_free(
+            job.client_id, 'invoice', len(orders),
+            seed=InvoiceGenerator.invoice_number_seed(job.client_id)
+        )
+        issue_date = datetime.now()
+
+        invoices = {}
+        for offset, order in enumerate(orders):
+            invoices[order.id] = Invoice(
+                client_id=order.client_id,
+                order_id=order.id,
+                invoice_number=InvoiceGenerator.format_invoice_number(job.client_id, first_number + offset),
+                tax_id=tax_info.get('company_tax_id', ''),
+                customer_tax_id=tax_info.get('customer_tax_id', ''),
+                subtotal=order.subtotal,
+                discount_amount=order.discount_amount,
+                tax_amount=order.tax_amount,
+                total_amount=order.total_amount,
+                issue_date=issue_date,
+                due_date=issue_date + timedelta(days=30),  # 30 días para pago
+                status='generated'
+            )
+        return invoices
+
+    @classmethod
+    def _render_pdfs(cls, invoices: Dict[int, Invoice], orders: List[Order], tax_info: Dict,
+                     executor) -> Dict[int, str]:
+        """
+        Renderiza los PDFs del tramo en paralelo.
+
+        Returns:
+            Errores por order_id (vacío si todos se generaron)
+        """
+        # Rutas del tramo registradas en el índice de artefactos con una sola sentencia
+        paths = artifact_store.allocate_many('invoice', [
+            {
+                'name': invoice.invoice_number,
+                'filename': InvoiceGenerator.get_invoice_filename(invoice.invoice_number),
+                'client_id': invoice.client_id
+            }
+            for invoice in invoices.values()
+        ])
+
+        futures = {}
+        for order in orders:
+            invoice = invoices[order.id]
+            invoice.pdf_path = paths[invoice.invoice_number]
+            futures[order.id] = executor.submit(
+                render_invoice_pdf, build_invoice_pdf_data(invoice, order), tax_info, invoice.pdf_path
+            )
+
+        errors = {}
+        for order_id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[order_id] = str(e)
+        return errors
+
+    @classmethod
+    def run_worker(cls, poll_interval: float = 5.0, once: bool = False):
+        """
+        Bucle principal de un worker de facturación.
+
+        Args:
+            poll_interval: Segundos de espera cuando la cola está vacía
+            once: Si True, procesa como máximo un lote y termina
+        """
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        print(f"👷 Worker de facturación iniciado: {worker_id}")
+
+        while True:
+            cls.requeue_stale_jobs()
+            job = cls.claim_next_job(worker_id)
+
+            if job:
+                cls.process_job(job.id)
+                db.session.remove()
+            elif once:
+                return
+            else:
+                time.sleep(poll_interval)
+
+            if once:
+                return
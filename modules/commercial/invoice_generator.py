@@ -7,15 +7,197 @@ import os
 import uuid
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
+from xml.sax.saxutils import escape
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import joinedload
 from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from modules.models import db
 from modules.commercial_models import Invoice, Order, Product
+from modules.artifact_store import artifact_store
+from modules.commercial.sequence_allocator import sequence_allocator
+from modules.commercial.pagination import DEFAULT_PAGE_SIZE, keyset_page, select_fields, wants
+from modules.pdf_templates import CachedPageTemplate, get_base_styles, pdf_template_cache, template_key
+
+# Campos de la cabecera de empresa (tax_info) y sus valores por defecto
+INVOICE_HEADER_FIELDS = (
+    ('company_name', 'Mi Empresa'),
+    ('company_tax_id', 'N/A'),
+    ('company_address', 'N/A'),
+    ('company_phone', 'N/A'),
+)
+
+INVOICE_TERMS = """
+<b>TÉRMINOS Y CONDICIONES:</b><br/>
+• Esta factura debe ser pagada antes de la fecha de vencimiento.<br/>
+• Los pagos pueden realizarse por transferencia bancaria o efectivo.<br/>
+• Para reclamos sobre esta factura, contactar dentro de 5 días hábiles.
+"""
+
+INVOICE_INFO_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+INVOICE_DATES_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+INVOICE_PRODUCTS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),  # Números alineados a la derecha
+])
+
+INVOICE_TOTALS_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, -1), (-1, -1), 14),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightblue),
+    ('TEXTCOLOR', (0, -1), (-1, -1), colors.darkblue),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+# Estados de orden que se pueden facturar
+INVOICEABLE_ORDER_STATUSES = ('confirmed', 'processing', 'shipped', 'delivered')
+
+
+def build_invoice_pdf_data(invoice: Invoice, order: Order) -> Dict:
+    """
+    Datos planos del PDF de una factura, serializables para renderizar
+    en otro proceso sin acceso a la sesión de base de datos.
+    """
+    return {
+        'client_id': invoice.client_id,
+        'invoice_number': invoice.invoice_number,
+        'customer_name': order.customer_name,
+        'customer_email': order.customer_email,
+        'customer_phone': order.customer_phone,
+        'customer_tax_id': invoice.customer_tax_id,
+        'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
+        'due_date': invoice.due_date.strftime('%d/%m/%Y') if invoice.due_date else 'N/A',
+        'order_number': order.order_number,
+        'items': [
+            {
+                'name': item.product.name,
+                'sku': item.product.sku,
+                'quantity': item.quantity,
+                'unit_price': float(item.unit_price),
+                'discount_percentage': item.discount_percentage,
+                'line_total': float(item.line_total)
+            }
+            for item in order.order_items
+        ],
+        'subtotal': float(invoice.subtotal or 0),
+        'discount_amount': float(invoice.discount_amount or 0),
+        'tax_amount': float(invoice.tax_amount or 0),
+        'total_amount': float(invoice.total_amount or 0),
+        'notes': invoice.notes
+    }
+
+
+def render_invoice_pdf(data: Dict, tax_info: Dict, filepath: str) -> str:
+    """
+    Construye el PDF de una factura sobre la plantilla cacheada del cliente.
+    Función de módulo para poder enviarse a un pool de procesos; escribe en
+    un archivo temporal y lo publica con os.replace.
+    """
+    story = []
+    
+    # Título (la cabecera de la empresa y los términos van en la plantilla)
+    story.append(Paragraph(f"No. {data['invoice_number']}", get_base_styles()['Heading2']))
+    story.append(Spacer(1, 12))
+    
+    # Información del cliente
+    info_data = [
+        ['INFORMACIÓN DEL CLIENTE'],
+        [
+            f"Cliente: {data['customer_name']}\n"
+            f"Email: {data['customer_email'] or 'N/A'}\n"
+            f"Teléfono: {data['customer_phone'] or 'N/A'}\n"
+            f"NIT/CC: {data['customer_tax_id'] or 'N/A'}"
+        ]
+    ]
+    
+    info_table = Table(info_data, colWidths=[6*inch])
+    info_table.setStyle(INVOICE_INFO_TABLE_STYLE)
+    
+    story.append(info_table)
+    story.append(Spacer(1, 20))
+    
+    # Fechas
+    dates_data = [
+        ['Fecha de Emisión:', data['issue_date']],
+        ['Fecha de Vencimiento:', data['due_date']],
+        ['Orden Relacionada:', data['order_number']]
+    ]
+    
+    dates_table = Table(dates_data, colWidths=[2*inch, 2*inch])
+    dates_table.setStyle(INVOICE_DATES_TABLE_STYLE)
+    
+    story.append(dates_table)
+    story.append(Spacer(1, 20))
+    
+    # Detalles de productos
+    products_data = [['Producto', 'SKU', 'Cant.', 'Precio Unit.', 'Desc.%', 'Total']]
+    
+    for item in data['items']:
+        products_data.append([
+            item['name'],
+            item['sku'] or 'N/A',
+            str(item['quantity']),
+            f"${item['unit_price']:,.0f}",
+            f"{item['discount_percentage']}%",
+            f"${item['line_total']:,.0f}"
+        ])
+    
+    products_table = Table(products_data, colWidths=[2.5*inch, 0.8*inch, 0.6*inch, 1*inch, 0.6*inch, 1*inch],
+                           repeatRows=1)
+    products_table.setStyle(INVOICE_PRODUCTS_TABLE_STYLE)
+    
+    story.append(products_table)
+    story.append(Spacer(1, 20))
+    
+    # Totales
+    totals_data = [
+        ['Subtotal:', f"${data['subtotal']:,.0f}"],
+        ['Descuento:', f"${data['discount_amount']:,.0f}"],
+        ['IVA (19%):', f"${data['tax_amount']:,.0f}"],
+        ['TOTAL A PAGAR:', f"${data['total_amount']:,.0f}"]
+    ]
+    
+    totals_table = Table(totals_data, colWidths=[3*inch, 2*inch])
+    totals_table.setStyle(INVOICE_TOTALS_TABLE_STYLE)
+    
+    story.append(totals_table)
+    story.append(Spacer(1, 30))
+    
+    # Notas propias de esta factura
+    if data['notes']:
+        story.append(Paragraph(f"<b>Notas:</b> {data['notes']}", get_base_styles()['Normal']))
+    
+    temp_path = f"{filepath}.tmp"
+    InvoiceGenerator._get_page_template(data['client_id'], tax_info).build(temp_path, story)
+    os.replace(temp_path, filepath)
+    return filepath
+
 
 class InvoiceGenerator:
     """Generador automático de facturas en PDF"""
@@ -40,7 +222,7 @@ class InvoiceGenerator:
             if not order:
                 return {'success': False, 'error': 'Orden no encontrada'}
             
-            if order.status not in ['confirmed', 'processing', 'shipped', 'delivered']:
+            if order.status not in INVOICEABLE_ORDER_STATUSES:
                 return {
                     'success': False, 
                     'error': 'La orden debe estar confirmada para generar factura'
@@ -171,20 +353,31 @@ class InvoiceGenerator:
         }
     
     def list_invoices_by_client(self, client_id: int, status: Optional[str] = None,
-                               limit: int = 50) -> List[Dict]:
-        """Lista facturas de un cliente"""
+                               limit: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+                               fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Lista facturas de un cliente (más recientes primero), paginadas por cursor
+        
+        Returns:
+            Dict con 'invoices' y 'next_cursor' (None en la última página)
+        """
         query = Invoice.query.filter_by(client_id=client_id)
         
         if status:
             query = query.filter_by(status=status)
         
-        invoices = query.order_by(Invoice.created_at.desc()).limit(limit).all()
+        # El nombre del cliente final viene de la orden: cargarla en la misma consulta
+        with_customer = wants(fields, 'customer_name')
+        if with_customer:
+            query = query.options(joinedload(Invoice.order).load_only(Order.customer_name))
         
-        return [
+        rows, next_cursor = keyset_page(query, (Invoice.created_at, Invoice.id), cursor, limit)
+        
+        invoices = [
             {
                 'id': invoice.id,
                 'invoice_number': invoice.invoice_number,
-                'customer_name': invoice.order.customer_name,
+                'customer_name': invoice.order.customer_name if with_customer else None,
                 'status': invoice.status,
                 'total_amount': float(invoice.total_amount),
                 'issue_date': invoice.issue_date.isoformat(),
@@ -195,8 +388,9 @@ class InvoiceGenerator:
                     invoice.status != 'paid'
                 )
             }
-            for invoice in invoices
+            for invoice, *_ in rows
         ]
+        return {'invoices': select_fields(invoices, fields), 'next_cursor': next_cursor}
     
     def get_overdue_invoices(self, client_id: int) -> List[Dict]:
         """Obtiene facturas vencidas de un cliente"""
@@ -254,146 +448,44 @@ class InvoiceGenerator:
             'payment_rate': (paid_invoices / total_invoices * 100) if total_invoices > 0 else 0
         }
     
+    @staticmethod
+    def _get_page_template(client_id: int, tax_info: Dict = None) -> CachedPageTemplate:
+        """
+        Plantilla estática de factura (datos de la empresa y términos) por cliente.
+        La clave incluye los datos fiscales, así que un cambio genera una plantilla nueva.
+        """
+        company_info = tax_info or {}
+        header_values = tuple(
+            company_info.get(field, default) for field, default in INVOICE_HEADER_FIELDS
+        )
+        key = template_key('invoice', client_id, *header_values)
+        
+        def build_template():
+            company_name, tax_id, address, phone = (escape(str(value)) for value in header_values)
+            return CachedPageTemplate(
+                key,
+                "FACTURA DE VENTA",
+                [
+                    f"<b>{company_name}</b>",
+                    f"NIT: {tax_id}",
+                    f"Dirección: {address}",
+                    f"Teléfono: {phone}"
+                ],
+                INVOICE_TERMS,
+                accent_color='#00008B'
+            )
+        
+        return pdf_template_cache.get(key, build_template)
+    
     def _generate_invoice_pdf(self, invoice: Invoice, order: Order, tax_info: Dict = None) -> Dict:
         """Genera el archivo PDF de la factura"""
         try:
-            # Nombre del archivo
-            filename = f"factura_{invoice.invoice_number}.pdf"
-            filepath = os.path.join(self.invoice_dir, filename)
-            
-            # Crear documento
-            doc = SimpleDocTemplate(filepath, pagesize=A4)
-            story = []
-            
-            # Estilos
-            styles = getSampleStyleSheet()
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=20,
-                textColor=colors.darkblue,
-                alignment=TA_CENTER,
-                spaceAfter=20
-            )
-            
-            # Título
-            story.append(Paragraph(f"FACTURA DE VENTA", title_style))
-            story.append(Paragraph(f"No. {invoice.invoice_number}", styles['Heading2']))
-            story.append(Spacer(1, 20))
-            
-            # Información de la empresa y cliente
-            company_info = tax_info or {}
-            info_data = [
-                ['INFORMACIÓN DE LA EMPRESA', 'INFORMACIÓN DEL CLIENTE'],
-                [
-                    f"Empresa: {company_info.get('company_name', 'Mi Empresa')}\\n"
-                    f"NIT: {company_info.get('company_tax_id', 'N/A')}\\n"
-                    f"Dirección: {company_info.get('company_address', 'N/A')}\\n"
-                    f"Teléfono: {company_info.get('company_phone', 'N/A')}",
-                    
-                    f"Cliente: {order.customer_name}\\n"
-                    f"Email: {order.customer_email or 'N/A'}\\n"
-                    f"Teléfono: {order.customer_phone or 'N/A'}\\n"
-                    f"NIT/CC: {invoice.customer_tax_id or 'N/A'}"
-                ]
-            ]
-            
-            info_table = Table(info_data, colWidths=[3*inch, 3*inch])
-            info_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ]))
-            
-            story.append(info_table)
-            story.append(Spacer(1, 20))
-            
-            # Fechas
-            dates_data = [
-                ['Fecha de Emisión:', invoice.issue_date.strftime('%d/%m/%Y')],
-                ['Fecha de Vencimiento:', invoice.due_date.strftime('%d/%m/%Y') if invoice.due_date else 'N/A'],
-                ['Orden Relacionada:', order.order_number]
-            ]
-            
-            dates_table = Table(dates_data, colWidths=[2*inch, 2*inch])
-            dates_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-            
-            story.append(dates_table)
-            story.append(Spacer(1, 20))
-            
-            # Detalles de productos
-            products_data = [['Producto', 'SKU', 'Cant.', 'Precio Unit.', 'Desc.%', 'Total']]
-            
-            for item in order.order_items:
-                products_data.append([
-                    item.product.name,
-                    item.product.sku or 'N/A',
-                    str(item.quantity),
-                    f"${item.unit_price:,.0f}",
-                    f"{item.discount_percentage}%",
-                    f"${item.line_total:,.0f}"
-                ])
+            # Nombre del archivo (directorio por fecha/cliente del índice de artefactos)
+            filename = self.get_invoice_filename(invoice.invoice_number)
+            filepath = artifact_store.allocate('invoice', invoice.invoice_number, filename,
+                                               client_id=invoice.client_id)
             
-            products_table = Table(products_data, colWidths=[2.5*inch, 0.8*inch, 0.6*inch, 1*inch, 0.6*inch, 1*inch])
-            products_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),  # Números alineados a la derecha
-            ]))
-            
-            story.append(products_table)
-            story.append(Spacer(1, 20))
-            
-            # Totales
-            totals_data = [
-                ['Subtotal:', f"${invoice.subtotal:,.0f}"],
-                ['Descuento:', f"${invoice.discount_amount:,.0f}"],
-                ['IVA (19%):', f"${invoice.tax_amount:,.0f}"],
-                ['TOTAL A PAGAR:', f"${invoice.total_amount:,.0f}"]
-            ]
-            
-            totals_table = Table(totals_data, colWidths=[3*inch, 2*inch])
-            totals_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-                ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, -1), (-1, -1), 14),
-                ('BACKGROUND', (0, -1), (-1, -1), colors.lightblue),
-                ('TEXTCOLOR', (0, -1), (-1, -1), colors.darkblue),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-            
-            story.append(totals_table)
-            story.append(Spacer(1, 30))
-            
-            # Notas y términos
-            notes_text = f"""
-            <b>TÉRMINOS Y CONDICIONES:</b><br/>
-            • Esta factura debe ser pagada antes de la fecha de vencimiento.<br/>
-            • Los pagos pueden realizarse por transferencia bancaria o efectivo.<br/>
-            • Para reclamos sobre esta factura, contactar dentro de 5 días hábiles.<br/>
-            • {invoice.notes or ''}
-            """
-            
-            story.append(Paragraph(notes_text, styles['Normal']))
-            
-            # Generar PDF
-            doc.build(story)
+            render_invoice_pdf(build_invoice_pdf_data(invoice, order), tax_info, filepath)
             
             return {
                 'success': True,
@@ -407,26 +499,36 @@ class InvoiceGenerator:
                 'error': f'Error generando PDF: {str(e)}'
             }
     
-    def _generate_invoice_number(self, client_id: int) -> str:
-        """Genera número secuencial de factura por cliente"""
-        # Obtener el último número de factura del cliente
-        last_invoice = Invoice.query.filter_by(client_id=client_id).order_by(
-            Invoice.id.desc()
-        ).first()
-        
-        if last_invoice:
-            # Extraer número secuencial del último invoice_number
-            try:
-                last_number = int(last_invoice.invoice_number.split('-')[-1])
-                next_number = last_number + 1
-            except:
-                next_number = 1
-        else:
-            next_number = 1
-        
+    @staticmethod
+    def get_invoice_filename(invoice_number: str) -> str:
+        """Nombre del archivo PDF de una factura"""
+        return f"factura_{invoice_number}.pdf"
+    
+    @staticmethod
+    def invoice_number_seed(client_id: int):
+        """Último número de factura ya emitido (expresión SQL), para crear el contador"""
+        return select(
+            func.coalesce(func.max(cast(func.split_part(Invoice.invoice_number, '-', 4), Integer)), 0)
+        ).where(
+            Invoice.client_id == client_id,
+            Invoice.invoice_number.op('~')(r'^FAC-[0-9]{6}-[0-9]+-[0-9]+$')
+        ).scalar_subquery()
+    
+    @staticmethod
+    def format_invoice_number(client_id: int, number: int) -> str:
         # Formato: FAC-YYYYMM-CLIENTEID-NNNN
         year_month = datetime.now().strftime("%Y%m")
-        return f"FAC-{year_month}-{client_id}-{next_number:04d}"
+        return f"FAC-{year_month}-{client_id}-{number:04d}"
+    
+    def _generate_invoice_number(self, client_id: int) -> str:
+        """
+        Genera número secuencial de factura por cliente. El contador se incrementa
+        en la misma transacción que crea la factura (sin huecos ni duplicados).
+        """
+        next_number = sequence_allocator.next_gap_free(
+            client_id, 'invoice', seed=self.invoice_number_seed(client_id)
+        )
+        return self.format_invoice_number(client_id, next_number)
     
     def _ensure_invoice_directory(self):
         """Crea el directorio de facturas si no existe"""
@@ -0,0 +1,504 @@
+"""
+Pipeline de leads del chat al CRM para SalesMind
+El chat solo registra eventos (chat_message_received, quote_generated) en la
+cola persistente crm_events y responde; un worker los procesa por lotes:
+puntúa la intención de compra, deduplica leads por email y teléfono
+normalizados y escribe Lead y LeadInteraction en bloque
+"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import DateTime, Integer, Numeric, String, case, column, func, insert, or_, select, text, update, values
+from modules.models import db
+from modules.bulk_writer import BulkWriter
+from modules.commercial_models import CRMEvent, Lead, LeadInteraction
+from .dashboard_summary import invalidate_dashboard
+
+# Eventos procesados por transacción e intentos antes de marcar un evento como fallido
+CRM_EVENT_BATCH_SIZE = int(os.environ.get('CRM_EVENT_BATCH_SIZE', 200))
+CRM_EVENT_MAX_ATTEMPTS = int(os.environ.get('CRM_EVENT_MAX_ATTEMPTS', 5))
+
+CHAT_EVENT_TYPES = ('chat_message_received', 'quote_generated')
+
+# Palabras que piden una cotización en el chat
+QUOTE_KEYWORDS = ['precio', 'cotizar', 'cuesta', 'valor', 'comprar', 'adquirir']
+
+# Palabras que indican alta / baja intención de compra
+HIGH_INTENT_WORDS = [
+    'comprar', 'buy', 'purchase', 'cotización', 'quote', 'precio', 'price',
+    'cuando', 'when', 'disponible', 'available', 'financiamiento', 'financing'
+]
+LOW_INTENT_WORDS = [
+    'información', 'info', 'curious', 'maybe', 'thinking', 'considering'
+]
+
+# Dígitos mínimos para identificar a una persona por teléfono (evita unir extensiones cortas)
+MIN_DEDUPE_PHONE_DIGITS = 7
+
+DEFAULT_LEAD_NAME = 'Cliente desde Chat'
+QUOTE_PROBABILITY = 30  # Probabilidad mínima de un lead con cotización
+
+# Espacio de nombres del advisory lock por cliente (deduplicación entre workers)
+LEAD_DEDUPE_LOCK = 7305050
+
+LEAD_COLUMNS = [
+    'client_id', 'name', 'email', 'phone', 'company', 'status', 'source', 'assigned_to',
+    'estimated_value', 'probability', 'created_at', 'last_contact', 'expected_close_date',
+    'notes', 'next_action', 'next_action_date'
+]
+INTERACTION_COLUMNS = [
+    'lead_id', 'interaction_type', 'direction', 'subject', 'description', 'outcome',
+    'completed_at', 'created_by'
+]
+
+
+def score_intent(message: str) -> int:
+    """Score de intención de compra de un mensaje (1-100, 50 = neutro)"""
+    message_lower = (message or '').lower()
+
+    high_matches = sum(1 for word in HIGH_INTENT_WORDS if word in message_lower)
+    low_matches = sum(1 for word in LOW_INTENT_WORDS if word in message_lower)
+
+    score = 50 + (high_matches * 15) - (low_matches * 10)
+    return max(1, min(100, score))
+
+
+def wants_quote(message: str) -> bool:
+    """True si el mensaje pide precio o cotización"""
+    message_lower = (message or '').lower()
+    return any(keyword in message_lower for keyword in QUOTE_KEYWORDS)
+
+
+def normalize_email(email: Optional[str]) -> str:
+    return (email or '').strip().lower()
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Solo dígitos, igual que la columna generada leads.phone_digits"""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits if len(digits) >= MIN_DEDUPE_PHONE_DIGITS else ''
+
+
+def emit_event(client_id: int, event_type: str, payload: Dict) -> Optional[int]:
+    """
+    Registra un evento del chat en la cola persistente (un INSERT con
+    conexión propia, sin tocar la transacción de la petición). Nunca
+    lanza: un fallo del CRM no debe romper la respuesta del chat.
+
+    Args:
+        client_id: ID del cliente empresarial
+        event_type: 'chat_message_received' o 'quote_generated'
+        payload: message, customer_info y, en cotizaciones, quote_number y total_amount
+
+    Returns:
+        ID del evento o None si no se pudo registrar
+    """
+    if event_type not in CHAT_EVENT_TYPES:
+        raise ValueError(f'Tipo de evento CRM no válido: {event_type}')
+
+    try:
+        with db.engine.begin() as conn:
+            return conn.execute(
+                insert(CRMEvent.__table__).values(
+                    client_id=client_id,
+                    event_type=event_type,
+                    payload=json.dumps(payload, default=str),
+                    status='pending'
+                ).returning(CRMEvent.__table__.c.id)
+            ).scalar()
+    except Exception as e:
+        print(f"❌ Error registrando evento CRM {event_type} (cliente {client_id}): {e}")
+        return None
+
+
+class LeadPipeline:
+    """
+    Consumidor de la cola crm_events.
+
+    Cada lote se toma con SELECT ... FOR UPDATE SKIP LOCKED (varios workers
+    no se pisan) y se aplica en una transacción: los eventos de una misma
+    persona se agrupan, se buscan sus leads existentes con los índices de
+    email y teléfono normalizados y se hace un INSERT multi-fila para los
+    leads nuevos, un UPDATE ... FROM VALUES para los existentes y COPY para
+    las interacciones. Si un lote falla se reintenta evento a evento para
+    aislar el que lo rompe.
+    """
+
+    def __init__(self, batch_size: int = CRM_EVENT_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def process_batch(self, limit: int = None) -> Dict:
+        """
+        Procesa un lote de eventos pendientes.
+
+        Returns:
+            Dict con eventos tomados, leads creados/actualizados, omitidos y fallidos
+        """
+        stats = {'events': 0, 'leads_created': 0, 'leads_updated': 0, 'skipped': 0, 'failed': 0}
+
+        event_ids, error = self._run_batch(self._claim(limit or self.batch_size), stats)
+        if error and len(event_ids) > 1:
+            print(f"⚠️ Lote de {len(event_ids)} eventos CRM fallido ({error}); reintentando uno a uno")
+            for event_id in event_ids:
+                _, single_error = self._run_batch(self._claim(1, event_id), stats)
+                if single_error:
+                    self._record_failure(event_id, single_error)
+                    stats['failed'] += 1
+        elif error and event_ids:
+            self._record_failure(event_ids[0], error)
+            stats['failed'] += 1
+        elif error:
+            print(f"❌ Error tomando eventos CRM de la cola: {error}")
+
+        stats['events'] = len(event_ids)
+        return stats
+
+    @staticmethod
+    def _claim(limit: int, event_id: int = None):
+        table = CRMEvent.__table__
+        statement = select(table).where(table.c.status == 'pending')
+        if event_id is not None:
+            statement = statement.where(table.c.id == event_id)
+        return statement.order_by(table.c.id).limit(limit).with_for_update(skip_locked=True)
+
+    def _run_batch(self, statement, stats: Dict) -> Tuple[List[int], Optional[str]]:
+        """Toma y aplica los eventos en una transacción; devuelve (ids, error)"""
+        event_ids = []
+        try:
+            events = db.session.execute(statement).all()
+            event_ids = [event.id for event in events]
+            if not events:
+                db.session.rollback()
+                return event_ids, None
+
+            batch_stats, client_ids = self._apply(events)
+            db.session.commit()
+
+            # Después del commit, como el listener after_commit: la fila del
+            # resumen no queda bloqueada y un lote revertido no invalida nada
+            invalidate_dashboard(client_ids)
+
+            for key, value in batch_stats.items():
+                stats[key] += value
+            return event_ids, None
+
+        except Exception as e:
+            db.session.rollback()
+            return event_ids, str(e)
+
+    def _apply(self, events) -> Tuple[Dict, List[int]]:
+        """Aplica los eventos en la transacción actual; devuelve (contadores, clientes modificados)"""
+        stats = {'leads_created': 0, 'leads_updated': 0, 'skipped': 0}
+        outcomes = {}  # event_id -> (status, lead_id)
+
+        by_client = {}
+        for event in events:
+            try:
+                payload = json.loads(event.payload)
+            except (TypeError, ValueError):
+                payload = {}
+            info = payload.get('customer_info') or {}
+            email = normalize_email(info.get('email'))
+            phone = normalize_phone(info.get('phone'))
+            if not email and not phone:
+                outcomes[event.id] = ('skipped', None)
+                stats['skipped'] += 1
+                continue
+            by_client.setdefault(event.client_id, []).append((event, payload, email, phone))
+
+        for client_id, client_events in sorted(by_client.items()):
+            created, updated = self._apply_client(client_id, client_events, outcomes)
+            stats['leads_created'] += created
+            stats['leads_updated'] += updated
+
+        self._mark_events(outcomes)
+        return stats, list(by_client)
+
+    def _apply_client(self, client_id: int, client_events: List, outcomes: Dict) -> Tuple[int, int]:
+        """Agrupa los eventos de un cliente por persona y escribe sus leads e interacciones"""
+        # Serializa la deduplicación de este cliente entre workers hasta el commit
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :client_id)"),
+            {'namespace': LEAD_DEDUPE_LOCK, 'client_id': client_id}
+        )
+
+        existing_by_email, existing_by_phone = self._find_existing(
+            client_id,
+            {email for _, _, email, _ in client_events if email},
+            {phone for _, _, _, phone in client_events if phone}
+        )
+
+        # Personas del lote: los eventos que comparten email, teléfono o lead existente
+        # forman un grupo (union-find), así el resultado no depende del orden del lote
+        parent = {}
+
+        def root_of(key):
+            parent.setdefault(key, key)
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        resolved = []
+        for event, payload, email, phone in client_events:
+            lead_id = ((existing_by_email.get(email) if email else None)
+                       or (existing_by_phone.get(phone) if phone else None))
+            keys = [key for key in (('email', email) if email else None,
+                                    ('phone', phone) if phone else None,
+                                    ('lead', lead_id) if lead_id else None) if key]
+            for key in keys[1:]:
+                parent[root_of(key)] = root_of(keys[0])
+            resolved.append((event, payload, keys[0], lead_id))
+
+        # Los eventos sin lead propio van al lead existente de su grupo (el más antiguo)
+        group_leads = {}
+        for _, _, key, lead_id in resolved:
+            if lead_id:
+                root = root_of(key)
+                group_leads[root] = min(lead_id, group_leads.get(root, lead_id))
+
+        candidates = []
+        by_slot = {}
+        for event, payload, key, lead_id in resolved:
+            root = root_of(key)
+            lead_id = lead_id or group_leads.get(root)
+            slot = ('lead', lead_id) if lead_id else root
+            candidate = by_slot.get(slot)
+            if candidate is None:
+                candidate = {
+                    'lead_id': lead_id, 'is_new': lead_id is None,
+                    'events': [], 'name': None, 'email': '', 'phone': '',
+                    'company': '', 'probability': 0, 'value': 0.0, 'last_contact': None
+                }
+                candidates.append(candidate)
+                by_slot[slot] = candidate
+            self._merge_event(candidate, event, payload)
+
+        new_candidates = [candidate for candidate in candidates if candidate['is_new']]
+        known_candidates = [candidate for candidate in candidates if not candidate['is_new']]
+
+        if new_candidates:
+            self._insert_leads(client_id, new_candidates)
+        if known_candidates:
+            self._update_leads(known_candidates)
+
+        with BulkWriter(LeadInteraction, columns=INTERACTION_COLUMNS) as writer:
+            for candidate in candidates:
+                if candidate['is_new']:
+                    writer.add({
+                        'lead_id': candidate['lead_id'],
+                        'interaction_type': 'lead_created',
+                        'direction': 'inbound',
+                        'subject': 'Nuevo lead registrado',
+                        'description': 'Lead creado desde chat_bot',
+                        'outcome': 'lead_registered',
+                        'completed_at': candidate['events'][0]['created_at'],
+                        'created_by': 'lead_pipeline'
+                    })
+                for interaction in candidate['events']:
+                    writer.add(dict(interaction, lead_id=candidate['lead_id']))
+                    outcomes[interaction['event_id']] = ('done', candidate['lead_id'])
+
+        return len(new_candidates), len(known_candidates)
+
+    @staticmethod
+    def _find_existing(client_id: int, emails: set, phones: set) -> Tuple[Dict, Dict]:
+        """Leads existentes por email/teléfono normalizado (el más antiguo gana)"""
+        table = Lead.__table__
+        normalized_email = func.lower(func.trim(table.c.email))
+        conditions = []
+        if emails:
+            conditions.append(normalized_email.in_(emails))
+        if phones:
+            conditions.append(table.c.phone_digits.in_(phones))
+
+        rows = db.session.execute(
+            select(table.c.id, normalized_email.label('email'), table.c.phone_digits)
+            .where(table.c.client_id == client_id, or_(*conditions))
+            .order_by(table.c.id)
+        ).all()
+
+        existing_by_email, existing_by_phone = {}, {}
+        for row in rows:
+            if row.email in emails:
+                existing_by_email.setdefault(row.email, row.id)
+            if row.phone_digits in phones:
+                existing_by_phone.setdefault(row.phone_digits, row.id)
+        return existing_by_email, existing_by_phone
+
+    @staticmethod
+    def _merge_event(candidate: Dict, event, payload: Dict):
+        """Acumula en el candidato los datos, la puntuación y la interacción de un evento"""
+        info = payload.get('customer_info') or {}
+        message = payload.get('message') or ''
+        created_at = event.created_at or datetime.now()
+        intent = score_intent(message)
+        probability = intent // 5  # Mensaje neutro (50) -> 10%, como create_lead
+
+        candidate['name'] = info.get('name') or candidate['name']
+        candidate['email'] = info.get('email') or candidate['email']
+        candidate['phone'] = info.get('phone') or candidate['phone']
+        candidate['company'] = info.get('company') or candidate['company']
+        candidate['last_contact'] = max(filter(None, [candidate['last_contact'], created_at]))
+
+        if event.event_type == 'quote_generated':
+            probability = max(probability, QUOTE_PROBABILITY)
+            candidate['value'] = max(candidate['value'], float(payload.get('total_amount') or 0))
+            subject = f"Cotización {payload.get('quote_number') or ''}".strip()
+            interaction_type = 'quote'
+        else:
+            subject = 'Mensaje del chat'
+            interaction_type = 'chat'
+        candidate['probability'] = max(candidate['probability'], probability)
+
+        candidate['events'].append({
+            'event_id': event.id,
+            'interaction_type': interaction_type,
+            'direction': 'inbound',
+            'subject': subject,
+            'description': message,
+            'outcome': f'intent_{intent}',
+            'completed_at': created_at,
+            'created_at': created_at,
+            'created_by': 'lead_pipeline'
+        })
+
+    @staticmethod
+    def _insert_leads(client_id: int, candidates: List[Dict]):
+        """INSERT multi-fila de los leads nuevos; asigna el id a cada candidato"""
+        now = datetime.now()
+        with BulkWriter(Lead, columns=LEAD_COLUMNS, use_copy=False) as writer:
+            for candidate in candidates:
+                first_message = candidate['events'][0]['description']
+                writer.add({
+                    'client_id': client_id,
+                    'name': candidate['name'] or DEFAULT_LEAD_NAME,
+                    'email': candidate['email'],
+                    'phone': candidate['phone'],
+                    'company': candidate['company'],
+                    'status': 'new',
+                    'source': 'chat_bot',
+                    'assigned_to': '',
+                    'estimated_value': candidate['value'],
+                    'probability': candidate['probability'],
+                    'created_at': candidate['events'][0]['created_at'],
+                    'last_contact': candidate['last_contact'],
+                    'expected_close_date': now + timedelta(days=30),
+                    'notes': f'Consulta original: {first_message}',
+                    'next_action': 'Contactar al lead',
+                    'next_action_date': now + timedelta(days=1)
+                })
+
+        for candidate, lead_id in zip(candidates, writer.inserted_ids):
+            candidate['lead_id'] = lead_id
+
+    @staticmethod
+    def _update_leads(candidates: List[Dict]):
+        """
+        Actualiza los leads existentes en un solo UPDATE ... FROM VALUES: la
+        probabilidad y el valor solo suben, y los datos de contacto vacíos
+        se completan con los del chat.
+        """
+        table = Lead.__table__
+        changes = values(
+            column('lead_id', Integer), column('name', String), column('email', String),
+            column('phone', String), column('probability', Integer),
+            column('estimated_value', Numeric), column('last_contact', DateTime),
+            name='lead_changes'
+        ).data([
+            (
+                candidate['lead_id'], candidate['name'], candidate['email'] or None,
+                candidate['phone'] or None, candidate['probability'], candidate['value'],
+                candidate['last_contact']
+            )
+            for candidate in sorted(candidates, key=lambda c: c['lead_id'])
+        ])
+
+        db.session.execute(
+            update(table)
+            .where(table.c.id == changes.c.lead_id)
+            .values(
+                name=func.coalesce(
+                    func.nullif(func.nullif(table.c.name, DEFAULT_LEAD_NAME), ''),
+                    changes.c.name, table.c.name
+                ),
+                email=func.coalesce(func.nullif(table.c.email, ''), changes.c.email),
+                phone=func.coalesce(func.nullif(table.c.phone, ''), changes.c.phone),
+                probability=func.greatest(func.coalesce(table.c.probability, 0), changes.c.probability),
+                estimated_value=func.greatest(func.coalesce(table.c.estimated_value, 0), changes.c.estimated_value),
+                last_contact=func.greatest(table.c.last_contact, changes.c.last_contact)
+            )
+        )
+
+    @staticmethod
+    def _mark_events(outcomes: Dict):
+        if not outcomes:
+            return
+        table = CRMEvent.__table__
+        results = values(
+            column('event_id', Integer), column('status', String), column('lead_id', Integer),
+            name='event_results'
+        ).data([(event_id, status, lead_id) for event_id, (status, lead_id) in sorted(outcomes.items())])
+
+        db.session.execute(
+            update(table)
+            .where(table.c.id == results.c.event_id)
+            .values(
+                status=results.c.status,
+                lead_id=results.c.lead_id,
+                attempts=table.c.attempts + 1,
+                error_message=None,
+                processed_at=func.now()
+            )
+        )
+
+    @staticmethod
+    def _record_failure(event_id: int, error: str):
+        """Suma un intento al evento; al agotar CRM_EVENT_MAX_ATTEMPTS queda 'failed'"""
+        table = CRMEvent.__table__
+        try:
+            db.session.execute(
+                update(table)
+                .where(table.c.id == event_id)
+                .values(
+                    attempts=table.c.attempts + 1,
+                    error_message=error,
+                    status=case((table.c.attempts + 1 >= CRM_EVENT_MAX_ATTEMPTS, 'failed'), else_='pending')
+                )
+            )
+            db.session.commit()
+            print(f"❌ Evento CRM {event_id} fallido: {error}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error registrando fallo del evento CRM {event_id}: {e}")
+
+    def run_worker(self, poll_interval: float = 2.0, once: bool = False):
+        """
+        Bucle del worker: procesa lotes mientras haya eventos pendientes y
+        espera poll_interval con la cola vacía.
+
+        Args:
+            once: Si True, procesa como máximo un lote y termina
+        """
+        print("👷 Worker del pipeline de leads iniciado")
+
+        while True:
+            stats = self.process_batch()
+            db.session.remove()
+
+            if stats['events']:
+                print(f"📇 {stats['events']} eventos CRM: {stats['leads_created']} leads nuevos, "
+                      f"{stats['leads_updated']} actualizados, {stats['skipped']} sin contacto, "
+                      f"{stats['failed']} fallidos")
+            if once:
+                return
+            if not stats['events']:
+                time.sleep(poll_interval)
+
+
+# Instancia global
+lead_pipeline = LeadPipeline()
@@ -6,11 +6,13 @@ Gestiona el ciclo completo de órdenes desde creación hasta entrega
 import uuid
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional
-from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Set
+from sqlalchemy.orm import Session, selectinload
 from modules.models import db
+from modules.artifact_store import artifact_store
 from modules.commercial_models import Order, OrderItem, Quote, Product
 from .inventory_manager import InventoryManager
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page, select_fields
 
 class OrderProcessor:
     """Procesador completo de órdenes y pedidos"""
@@ -38,6 +40,14 @@ class OrderProcessor:
             if quote.status != 'accepted':
                 return {'success': False, 'error': 'La cotización debe estar aceptada'}
             
+            # Las cotizaciones del chat pueden tener items fuera del catálogo
+            unmatched = [item.description for item in quote.quote_items if item.product_id is None]
+            if unmatched:
+                return {
+                    'success': False,
+                    'error': f'Items sin producto del catálogo: {", ".join(unmatched)}'
+                }
+            
             # Verificar disponibilidad de inventario
             availability_check = self._check_inventory_availability(quote)
             if not availability_check['available']:
@@ -50,7 +60,7 @@ class OrderProcessor:
             order = Order(
                 client_id=quote.client_id,
                 quote_id=quote_id,
-                order_number=self._generate_order_number(),
+                order_number=self._generate_order_number(quote.client_id),
                 customer_name=quote.customer_name,
                 customer_email=quote.customer_email,
                 customer_phone=quote.customer_phone,
@@ -75,12 +85,19 @@ class OrderProcessor:
                 )
                 order.order_items.append(order_item)
             
-            # Guardar orden
+            # Guardar orden y reservar su inventario en la misma transacción
             db.session.add(order)
+            db.session.flush()
+            
+            reservation = self.inventory_manager.reserve_inventory_for_order(order.id, commit=False)
+            if not reservation['success']:
+                db.session.rollback()
+                return reservation
+            
             db.session.commit()
             
-            # Reservar inventario
-            self.inventory_manager.reserve_inventory_for_order(order.id)
+            # El PDF de una cotización convertida en orden ya no caduca
+            artifact_store.retain('quote', quote.quote_number)
             
             return {
                 'success': True,
@@ -166,7 +183,7 @@ class OrderProcessor:
             # Crear orden
             order = Order(
                 client_id=client_id,
-                order_number=self._generate_order_number(),
+                order_number=self._generate_order_number(client_id),
                 customer_name=customer_info.get('name', 'Cliente'),
                 customer_email=customer_info.get('email', ''),
                 customer_phone=customer_info.get('phone', ''),
@@ -191,12 +208,16 @@ class OrderProcessor:
                 )
                 order.order_items.append(order_item)
             
-            # Guardar
+            # Guardar orden y reservar su inventario en la misma transacción
             db.session.add(order)
-            db.session.commit()
+            db.session.flush()
             
-            # Reservar inventario
-            self.inventory_manager.reserve_inventory_for_order(order.id)
+            reservation = self.inventory_manager.reserve_inventory_for_order(order.id, commit=False)
+            if not reservation['success']:
+                db.session.rollback()
+                return reservation
+            
+            db.session.commit()
             
             return {
                 'success': True,
@@ -228,9 +249,10 @@ class OrderProcessor:
                 order.notes = (order.notes or '') + f"\n{datetime.now()}: {notes}"
             
             # Acciones específicas por estado
+            inventory = None
             if new_status == 'confirmed' and old_status == 'pending':
-                # Confirmar reservas de inventario
-                self.inventory_manager.confirm_inventory_reservation(order_id)
+                # Confirmar reservas de inventario (se reservan de nuevo si caducaron)
+                inventory = self.inventory_manager.confirm_inventory_reservation(order_id, commit=False)
             
             elif new_status == 'delivered' and old_status in ['shipped', 'processing']:
                 order.delivered_at = datetime.now()
@@ -238,7 +260,11 @@ class OrderProcessor:
             
             elif new_status == 'cancelled':
                 # Liberar inventario reservado
-                self.inventory_manager.release_inventory_reservation(order_id)
+                inventory = self.inventory_manager.release_inventory_reservation(order_id, commit=False)
+            
+            if inventory is not None and not inventory['success']:
+                db.session.rollback()
+                return inventory
             
             db.session.commit()
             
@@ -253,9 +279,16 @@ class OrderProcessor:
             db.session.rollback()
             return {'success': False, 'error': f'Error actualizando orden: {str(e)}'}
     
+    @staticmethod
+    def _order_with_items():
+        """Consulta de órdenes con items y productos precargados (2 consultas por orden, sin N+1)"""
+        return Order.query.options(
+            selectinload(Order.order_items).joinedload(OrderItem.product)
+        )
+    
     def get_order_details(self, order_id: int) -> Optional[Dict]:
         """Obtiene detalles completos de una orden"""
-        order = Order.query.get(order_id)
+        order = self._order_with_items().filter(Order.id == order_id).first()
         if not order:
             return None
         
@@ -292,16 +325,22 @@ class OrderProcessor:
         }
     
     def list_orders_by_client(self, client_id: int, status: Optional[str] = None,
-                             limit: int = 50) -> List[Dict]:
-        """Lista órdenes de un cliente"""
+                             limit: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+                             fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Lista órdenes de un cliente (más recientes primero), paginadas por cursor
+        
+        Returns:
+            Dict con 'orders' y 'next_cursor' (None en la última página)
+        """
         query = Order.query.filter_by(client_id=client_id)
         
         if status:
             query = query.filter_by(status=status)
         
-        orders = query.order_by(Order.created_at.desc()).limit(limit).all()
+        rows, next_cursor = keyset_page(query, (Order.created_at, Order.id), cursor, limit)
         
-        return [
+        orders = [
             {
                 'id': order.id,
                 'order_number': order.order_number,
@@ -311,8 +350,9 @@ class OrderProcessor:
                 'order_date': order.order_date.isoformat(),
                 'estimated_delivery': order.estimated_delivery.isoformat() if order.estimated_delivery else None
             }
-            for order in orders
+            for order, *_ in rows
         ]
+        return {'orders': select_fields(orders, fields), 'next_cursor': next_cursor}
     
     def get_order_statistics(self, client_id: int, days: int = 30) -> Dict:
         """Obtiene estadísticas de órdenes de un cliente"""
@@ -321,19 +361,23 @@ class OrderProcessor:
         
         start_date = datetime.now() - timedelta(days=days)
         
-        # Consultas estadísticas
-        orders_query = Order.query.filter(
+        # Conteo e ingresos por estado en una sola consulta agrupada
+        rows = db.session.query(
+            Order.status,
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.total_amount), 0)
+        ).filter(
             Order.client_id == client_id,
             Order.created_at >= start_date
-        )
+        ).group_by(Order.status).all()
         
-        total_orders = orders_query.count()
-        total_revenue = orders_query.with_entities(func.sum(Order.total_amount)).scalar() or 0
+        total_orders = sum(count for _, count, _ in rows)
+        total_revenue = sum(revenue for _, _, revenue in rows) or 0
         
+        counts = {status: count for status, count, _ in rows}
         orders_by_status = {}
         for status in ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']:
-            count = orders_query.filter_by(status=status).count()
-            orders_by_status[status] = count
+            orders_by_status[status] = counts.get(status, 0)
         
         avg_order_value = float(total_revenue / total_orders) if total_orders > 0 else 0
         
@@ -378,8 +422,8 @@ class OrderProcessor:
         
         return base_shipping
     
-    def _generate_order_number(self) -> str:
-        """Genera número único de orden"""
+    def _generate_order_number(self, client_id: int) -> str:
+        """Genera número único de orden (secuencia del cliente)"""
         timestamp = datetime.now().strftime("%Y%m%d")
-        unique_id = str(uuid.uuid4())[:8].upper()
-        return f"ORD-{timestamp}-{unique_id}"
\ No newline at end of file
+        sequence = sequence_allocator.next_value(client_id, 'order')
+        return f"ORD-{timestamp}-{client_id}-{sequence:06d}"
\ No newline at end of file
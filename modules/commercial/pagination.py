@@ -0,0 +1,130 @@
+"""
+Paginación por cursor (keyset) para los listados comerciales de SalesMind
+Cada página continúa después de la clave de orden del último elemento de la
+anterior, así el coste no crece con la profundidad (sin OFFSET)
+
+Cada listado conserva su clave de siempre y añade next_cursor:
+    /quotes/client/<id>       {'quotes': [...], 'next_cursor': ...}
+    /orders/client/<id>       {'orders': [...], 'next_cursor': ...}
+    /invoices/client/<id>     {'invoices': [...], 'next_cursor': ...}
+    /inventory/movements      {'movements': [...], 'next_cursor': ...}
+    /crm/search/<id>          {'leads': [...], 'next_cursor': ...}
+Sin 'limit' se devuelven DEFAULT_PAGE_SIZE elementos (máximo MAX_PAGE_SIZE);
+el listado de cotizaciones antes no tenía límite: hay que seguir next_cursor
+hasta que sea None para leerlas todas.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import Date, DateTime, Float, Integer, Numeric, literal, tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Cursor opaco (base64 de JSON) con los valores de la clave de orden"""
+    serializable = [
+        value.isoformat() if isinstance(value, (date, datetime))
+        else float(value) if isinstance(value, Decimal)
+        else value
+        for value in values
+    ]
+    payload = json.dumps(serializable).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_keys: Sequence) -> tuple:
+    """
+    Recupera los valores de un cursor convirtiéndolos al tipo SQL de cada
+    columna de sort_keys.
+
+    Raises:
+        ValueError: Si el cursor está mal formado o no corresponde a la clave
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            raise ValueError
+        return tuple(_from_json(value, key.type) for value, key in zip(values, sort_keys))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor de paginación no válido')
+
+
+def _from_json(value, sql_type):
+    if value is None:
+        raise ValueError
+    if isinstance(sql_type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(sql_type, Date):
+        return date.fromisoformat(value)
+    if isinstance(sql_type, Float):
+        return float(value)
+    if isinstance(sql_type, Numeric):
+        return Decimal(str(value))
+    if isinstance(sql_type, Integer):
+        return int(value)
+    return value
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Tamaño de página acotado a 1..MAX_PAGE_SIZE"""
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(min(int(limit), MAX_PAGE_SIZE), 1)
+
+
+def keyset_page(query, sort_keys: Sequence, cursor: Optional[str] = None,
+                limit: Optional[int] = DEFAULT_PAGE_SIZE) -> Tuple[List[tuple], Optional[str]]:
+    """
+    Ejecuta una página de una consulta ORM de una entidad en orden
+    descendente por sort_keys, que debe ser única (termina en el id).
+
+    La consulta no debe tener ORDER BY; las opciones de carga
+    (selectinload/joinedload) se respetan.
+
+    Returns:
+        (filas, next_cursor): cada fila es (entidad, valor_clave_1, ...);
+        next_cursor es None en la última página
+    """
+    limit = page_size(limit)
+    keyed = query.add_columns(*[key.label(f'keyset_{index}') for index, key in enumerate(sort_keys)])
+
+    if cursor:
+        after = decode_cursor(cursor, sort_keys)
+        keyed = keyed.filter(tuple_(*sort_keys) < tuple_(*[
+            literal(value, type_=key.type) for value, key in zip(after, sort_keys)
+        ]))
+
+    rows = keyed.order_by(*[key.desc() for key in sort_keys]).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1:])
+    return [tuple(row) for row in rows], next_cursor
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Set[str]]:
+    """Convierte el parámetro 'fields' (campos separados por comas) en un conjunto"""
+    if not fields:
+        return None
+    selected = {field.strip() for field in fields.split(',') if field.strip()}
+    return selected or None
+
+
+def select_fields(items: Iterable[Dict], fields: Optional[Set[str]]) -> List[Dict]:
+    """Deja en cada elemento solo los campos pedidos (el id siempre se conserva)"""
+    if not fields:
+        return list(items)
+    keep = fields | {'id'}
+    return [{key: value for key, value in item.items() if key in keep} for item in items]
+
+
+def wants(fields: Optional[Set[str]], *names: str) -> bool:
+    """True si la selección de campos incluye alguno de names (o no hay selección)"""
+    return fields is None or any(name in fields for name in names)
@@ -0,0 +1,365 @@
+"""
+Emparejador local de productos para el motor de cotizaciones
+Reconoce productos y cantidades en la consulta del cliente sin llamar al LLM
+"""
+
+import difflib
+import hashlib
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from modules.models import db
+from modules.commercial_models import Product
+from modules.quote_parser import ProductCatalog, get_catalog_stamp, normalize_text
+
+# Por debajo de esta confianza se consulta al LLM
+MATCH_CONFIDENCE_THRESHOLD = 0.75
+# Similitud mínima entre palabras para el emparejamiento difuso (plurales, erratas)
+FUZZY_TOKEN_CUTOFF = 0.8
+# Fracción mínima del nombre del producto que debe aparecer en la consulta
+FUZZY_MIN_SCORE = 0.5
+# Similitud coseno mínima para aceptar un producto por embeddings
+EMBEDDING_MIN_SIMILARITY = 0.6
+# Productos candidatos que se envían al LLM cuando hace falta
+LLM_CANDIDATES = 10
+
+NUMBER_WORDS = {
+    # Español / portugués
+    'un': 1, 'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5, 'seis': 6,
+    'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10, 'doce': 12, 'docena': 12,
+    'um': 1, 'uma': 1, 'duas': 2, 'quatro': 4, 'sete': 7, 'oito': 8, 'nove': 9, 'dez': 10, 'dúzia': 12,
+    # Inglés ('a' no: en español es preposición, "casa a 3 cuadras")
+    'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'twelve': 12, 'dozen': 12,
+    # Francés
+    'une': 1, 'deux': 2, 'trois': 3, 'quatre': 4, 'cinq': 5, 'sept': 7, 'huit': 8, 'neuf': 9,
+    'dix': 10, 'douze': 12,
+    # Alemán
+    'ein': 1, 'eine': 1, 'einen': 1, 'zwei': 2, 'drei': 3, 'vier': 4, 'fünf': 5, 'sechs': 6,
+    'sieben': 7, 'acht': 8, 'neun': 9, 'zehn': 10, 'zwölf': 12,
+}
+
+_NUMBER_WORDS_PATTERN = '|'.join(sorted(map(re.escape, NUMBER_WORDS), key=len, reverse=True))
+
+# Cantidad justo antes del producto ("3 apartamentos", "dos unidades de", "5 x")
+QUANTITY_BEFORE = re.compile(
+    rf"(?:^|(?<=\W))(?P<number>\d{{1,4}}|{_NUMBER_WORDS_PATTERN})"
+    r"(?:\s*(?:x|×|unidades?|units?|unités?|uds?\.?|st[üu]ck|pcs))?(?:\s+[^\s\d]+){0,2}\s*$",
+    re.IGNORECASE
+)
+# Cantidad justo después del producto ("Widget x 3", "Widget (3)")
+QUANTITY_AFTER = re.compile(r"^\s*(?:x|×|\(|:)\s*(?P<number>\d{1,4})\b", re.IGNORECASE)
+# Límites de cláusula: la cantidad de un producto no se busca más allá
+CLAUSE_BREAK = re.compile(r"[,;.\n]|\s(?:y|e|and|et|und|o|or|ou|oder)\s", re.IGNORECASE)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def extract_quantity(text: str, start: int, end: int) -> Optional[int]:
+    """
+    Cantidad asociada a una mención de producto en text[start:end], buscada
+    en la misma cláusula justo antes o justo después de la mención.
+    """
+    before = text[max(0, start - 60):start]
+    breaks = list(CLAUSE_BREAK.finditer(before))
+    if breaks:
+        before = before[breaks[-1].end():]
+
+    match = QUANTITY_BEFORE.search(before)
+    if not match:
+        match = QUANTITY_AFTER.match(text[end:end + 12])
+    if not match:
+        return None
+
+    number = match.group('number').lower()
+    quantity = int(number) if number.isdigit() else NUMBER_WORDS.get(number)
+    return quantity if quantity and quantity > 0 else None
+
+
+class ProductMatcher:
+    """
+    Índice de productos de un cliente: nombres y SKUs exactos, palabras del
+    nombre con coincidencia difusa y embeddings de nombre + descripción.
+
+    La parte léxica se construye al crear el emparejador; los embeddings los
+    calcula build_embedding_index en segundo plano y, hasta que están listos,
+    match() solo usa coincidencias exactas y difusas.
+    """
+
+    def __init__(self, client_id: int, products: List[Dict], stamp: tuple = None,
+                 previous_vectors: Dict[Tuple[int, str], np.ndarray] = None):
+        self.client_id = client_id
+        self.stamp = stamp
+        self.products = {product['id']: product for product in products}
+        self.catalog = ProductCatalog(products)
+        self.names = {normalize_text(product['name']).strip(): product['id'] for product in products}
+
+        # Índice invertido palabra -> productos
+        self.name_tokens = {}
+        self.token_index = {}
+        for product in products:
+            tokens = [token for token in WORD_PATTERN.findall(normalize_text(product['name'])) if len(token) >= 3]
+            self.name_tokens[product['id']] = set(tokens)
+            for token in tokens:
+                self.token_index.setdefault(token, set()).add(product['id'])
+        self._vocabulary = list(self.token_index)
+        self._close_tokens = {}
+
+        # (ids, matriz normalizada) cuando los embeddings están listos; se asigna de una vez
+        self._embedding_index = None
+        # Vectores reutilizables por el siguiente emparejador (los anteriores hasta completar el índice)
+        self._vector_keys = dict(previous_vectors or {})
+
+    @staticmethod
+    def _embedding_text(product: Dict) -> str:
+        return f"{product['name']}. {product.get('description') or ''}".strip()
+
+    @property
+    def embeddings_ready(self) -> bool:
+        return self._embedding_index is not None
+
+    def build_embedding_index(self, previous_vectors: Dict = None):
+        """
+        Embeddings normalizados de los productos, reutilizando los que no han
+        cambiado. Pensado para un hilo de fondo: llama a Ollama por todo el
+        catálogo nuevo o modificado, así que no debe bloquear una petición.
+        """
+        products = list(self.products.values())
+        previous_vectors = previous_vectors if previous_vectors is not None else self._vector_keys
+        if not products:
+            return
+
+        keys = {}
+        pending = []
+        for product in products:
+            text = self._embedding_text(product)
+            key = (product['id'], hashlib.sha256(text.encode('utf-8')).hexdigest())
+            keys[product['id']] = key
+            if key not in previous_vectors:
+                pending.append((product['id'], text))
+
+        vectors = dict(previous_vectors)
+        if pending:
+            try:
+                embedded = get_embedding_model().embed_documents([text for _, text in pending])
+                for (product_id, _), vector in zip(pending, embedded):
+                    vectors[keys[product_id]] = np.asarray(vector, dtype=np.float32)
+            except Exception as e:
+                print(f"⚠️ Índice de embeddings de productos no disponible (cliente {self.client_id}): {e}")
+                return
+
+        vector_ids = [product['id'] for product in products]
+        matrix = np.vstack([vectors[keys[product_id]] for product_id in vector_ids])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._vector_keys = {keys[product_id]: vectors[keys[product_id]] for product_id in vector_ids}
+        self._embedding_index = (vector_ids, matrix / np.where(norms == 0, 1, norms))
+        print(f"🧠 Embeddings de productos listos para el cliente {self.client_id}: {len(vector_ids)} productos")
+
+    def _similar_tokens(self, token: str) -> List[Tuple[str, float]]:
+        """Palabras del vocabulario iguales o parecidas a token, con su similitud."""
+        if token in self.token_index:
+            return [(token, 1.0)]
+        if token not in self._close_tokens:
+            close = difflib.get_close_matches(token, self._vocabulary, n=3, cutoff=FUZZY_TOKEN_CUTOFF)
+            self._close_tokens[token] = [
+                (candidate, difflib.SequenceMatcher(None, token, candidate).ratio()) for candidate in close
+            ]
+        return self._close_tokens[token]
+
+    def _fuzzy_matches(self, normalized: str, taken: List[Tuple[int, int]]) -> List[Dict]:
+        """Productos cuyo nombre aparece (total o parcialmente, con erratas) en la consulta."""
+        scores = {}
+        for word in WORD_PATTERN.finditer(normalized):
+            token = word.group()
+            if len(token) < 3 or any(start <= word.start() < end for start, end in taken):
+                continue
+            for vocabulary_token, similarity in self._similar_tokens(token):
+                for product_id in self.token_index[vocabulary_token]:
+                    entry = scores.setdefault(product_id, {'tokens': {}, 'spans': []})
+                    if similarity > entry['tokens'].get(vocabulary_token, 0):
+                        entry['tokens'][vocabulary_token] = similarity
+                        entry['spans'].append((word.start(), word.end()))
+
+        candidates = []
+        for product_id, entry in scores.items():
+            score = sum(entry['tokens'].values()) / max(len(self.name_tokens[product_id]), 1)
+            if score >= FUZZY_MIN_SCORE:
+                candidates.append({
+                    'product_id': product_id,
+                    'confidence': round(min(score, 1.0) * 0.95, 3),  # Nunca tan segura como la exacta
+                    'start': min(start for start, _ in entry['spans']),
+                    'end': max(end for _, end in entry['spans']),
+                    'spans': entry['spans'],
+                    'method': 'fuzzy'
+                })
+
+        # Cada palabra de la consulta se asigna al producto con mejor puntuación
+        accepted = []
+        used = set()
+        for candidate in sorted(candidates, key=lambda c: -c['confidence']):
+            if used.isdisjoint(candidate['spans']):
+                used.update(candidate['spans'])
+                accepted.append(candidate)
+        return accepted
+
+    def embedding_scores(self, query: str) -> List[Tuple[int, float]]:
+        """Productos ordenados por similitud coseno con la consulta (vacío si el índice no está listo)."""
+        embedding_index = self._embedding_index
+        if embedding_index is None:
+            return []
+        vector_ids, vectors = embedding_index
+        try:
+            query_vector = np.asarray(get_embedding_model().embed_query(query), dtype=np.float32)
+        except Exception as e:
+            print(f"⚠️ No se pudo calcular el embedding de la consulta: {e}")
+            return []
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
+        similarities = vectors @ (query_vector / norm)
+        order = np.argsort(-similarities)
+        return [(vector_ids[i], float(similarities[i])) for i in order]
+
+    def match(self, query: str) -> List[Dict]:
+        """
+        Productos y cantidades de una consulta.
+
+        Returns:
+            Lista de dicts con product_id, quantity, confidence y method
+            ('exact', 'fuzzy' o 'embedding'), en orden de aparición
+        """
+        normalized = normalize_text(query)
+        matches = []
+
+        # 1. Nombre o SKU exacto
+        seen = set()
+        # Sobre el texto ya normalizado, para que las posiciones coincidan con las difusas
+        for token in self.catalog.find(normalized):
+            product_id = token['product']['id']
+            if product_id not in seen:
+                seen.add(product_id)
+                matches.append({'product_id': product_id, 'confidence': 1.0, 'method': 'exact',
+                                'start': token['pos'], 'end': token['end']})
+
+        # 2. Coincidencia difusa por palabras del nombre
+        taken = [(match['start'], match['end']) for match in matches]
+        for candidate in self._fuzzy_matches(normalized, taken):
+            if candidate['product_id'] not in seen:
+                seen.add(candidate['product_id'])
+                matches.append(candidate)
+
+        # 3. Embeddings: la consulta describe el producto sin nombrarlo
+        if not any(match['confidence'] >= MATCH_CONFIDENCE_THRESHOLD for match in matches):
+            scores = self.embedding_scores(query)
+            if scores and scores[0][1] >= EMBEDDING_MIN_SIMILARITY and scores[0][0] not in seen:
+                matches.append({'product_id': scores[0][0], 'confidence': round(scores[0][1], 3),
+                                'method': 'embedding', 'start': None, 'end': None})
+
+        result = []
+        for match in sorted(matches, key=lambda m: m['start'] if m['start'] is not None else len(query)):
+            if match['start'] is not None:
+                quantity = extract_quantity(normalized, match['start'], match['end'])
+            else:
+                quantity = extract_quantity(normalized, len(normalized), len(normalized))
+            result.append({
+                'product_id': match['product_id'],
+                'name': self.products[match['product_id']]['name'],
+                'quantity': quantity or 1,
+                'confidence': match['confidence'],
+                'method': match['method']
+            })
+        return result
+
+    def resolve_name(self, name: str) -> Optional[int]:
+        """Producto por su nombre (exacto o difuso), para mapear la respuesta del LLM."""
+        normalized = normalize_text(name or '').strip()
+        if normalized in self.names:
+            return self.names[normalized]
+        fuzzy = self._fuzzy_matches(normalized, [])
+        return max(fuzzy, key=lambda c: c['confidence'])['product_id'] if fuzzy else None
+
+    def candidates(self, query: str, limit: int = LLM_CANDIDATES) -> List[Dict]:
+        """Productos más probables para la consulta (lo que se envía al LLM)."""
+        ranked = [match['product_id'] for match in self.match(query)]
+        for product_id, _ in self.embedding_scores(query):
+            if len(ranked) >= limit:
+                break
+            if product_id not in ranked:
+                ranked.append(product_id)
+        if not ranked:
+            ranked = list(self.products)
+        return [self.products[product_id] for product_id in ranked[:limit]]
+
+
+_embedding_model = None
+
+
+def get_embedding_model():
+    """Modelo de embeddings de Ollama (el mismo que usa el índice de documentos)."""
+    global _embedding_model
+    if _embedding_model is None:
+        from langchain_community.embeddings import OllamaEmbeddings
+        _embedding_model = OllamaEmbeddings(model="nomic-embed-text")
+    return _embedding_model
+
+
+class ProductMatcherRegistry:
+    """
+    Emparejadores por cliente, reconstruidos cuando cambia su catálogo. El
+    índice léxico se construye en la petición; los embeddings, en un hilo de
+    fondo por emparejador.
+    """
+
+    def __init__(self):
+        self._matchers = {}
+        self._lock = threading.Lock()
+
+    def get(self, client_id: int) -> ProductMatcher:
+        stamp = get_catalog_stamp(client_id)
+
+        with self._lock:
+            matcher = self._matchers.get(client_id)
+        if matcher and matcher.stamp == stamp:
+            return matcher
+
+        rows = db.session.query(
+            Product.id, Product.name, Product.description, Product.sku, Product.base_price
+        ).filter(Product.client_id == client_id, Product.is_active == True).all()
+
+        products = [
+            {'id': row.id, 'name': row.name, 'description': row.description, 'sku': row.sku,
+             'base_price': float(row.base_price or 0)}
+            for row in rows
+        ]
+
+        # Los embeddings de productos sin cambios se reutilizan del emparejador anterior
+        matcher = ProductMatcher(
+            client_id, products, stamp=stamp,
+            previous_vectors=matcher._vector_keys if matcher else None
+        )
+        print(f"🔎 Emparejador de productos construido para el cliente {client_id}: {len(products)} productos")
+
+        with self._lock:
+            current = self._matchers.get(client_id)
+            if current and current.stamp == stamp:
+                return current  # Otra petición lo construyó mientras tanto
+            self._matchers[client_id] = matcher
+
+        if products:
+            threading.Thread(
+                target=matcher.build_embedding_index, name=f'product-embeddings-{client_id}', daemon=True
+            ).start()
+        return matcher
+
+    def invalidate(self, client_id: int = None):
+        """Descarta el emparejador de un cliente (o todos)."""
+        with self._lock:
+            if client_id is None:
+                self._matchers.clear()
+            else:
+                self._matchers.pop(client_id, None)
+
+
+# Instancia global
+product_matcher_registry = ProductMatcherRegistry()
@@ -6,10 +6,13 @@ Genera cotizaciones inteligentes basadas en consultas de IA
 import uuid
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
-from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session, selectinload
 from modules.models import db
 from modules.commercial_models import Product, Quote, QuoteItem
+from .sequence_allocator import sequence_allocator
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page, select_fields
+from .product_matcher import MATCH_CONFIDENCE_THRESHOLD, ProductMatcher, product_matcher_registry
 import re
 import json
 import google.generativeai as genai
@@ -82,18 +85,35 @@ class QuoteEngine:
     
     def _analyze_query_for_products(self, client_id: int, query: str) -> List[Dict]:
         """
-        Utiliza IA para analizar la consulta y extraer productos con cantidades
+        Extrae productos con cantidades de la consulta. Primero con el emparejador
+        local del catálogo; el LLM solo se consulta si la confianza es baja.
         """
-        # Obtener productos disponibles del cliente
-        products = Product.query.filter_by(client_id=client_id, is_active=True).all()
+        matcher = product_matcher_registry.get(client_id)
         
-        if not products:
+        if not matcher.products:
             return []
         
-        # Crear prompt especializado para extracción de productos
+        matches = matcher.match(query)
+        
+        if matches and all(match['confidence'] >= MATCH_CONFIDENCE_THRESHOLD for match in matches):
+            print(f"🎯 Productos identificados sin LLM: {[match['name'] for match in matches]}")
+            return self._load_requested_products(matches)
+        
+        llm_matches = self._analyze_query_with_llm(matcher, query)
+        
+        # Si el LLM no responde, se usan las coincidencias locales disponibles
+        return self._load_requested_products(llm_matches if llm_matches is not None else matches)
+    
+    def _analyze_query_with_llm(self, matcher: ProductMatcher, query: str) -> Optional[List[Dict]]:
+        """
+        Utiliza IA para analizar la consulta, enviando solo los productos candidatos
+        
+        Returns:
+            Coincidencias (product_id, quantity) o None si el LLM falla
+        """
         products_info = "\n".join([
-            f"- {p.name}: ${p.base_price} (SKU: {p.sku or 'N/A'})"
-            for p in products
+            f"- {p['name']}: ${p['base_price']} (SKU: {p['sku'] or 'N/A'})"
+            for p in matcher.candidates(query)
         ])
         
         analysis_prompt = f"""
@@ -127,17 +147,13 @@ class QuoteEngine:
             if json_match:
                 analysis = json.loads(json_match.group())
                 
-                # Mapear nombres de productos a objetos Product
+                # Mapear nombres de productos con el índice del emparejador
                 result = []
                 for item in analysis.get('products', []):
-                    product = next(
-                        (p for p in products if p.name.lower() in item['product_name'].lower() 
-                         or item['product_name'].lower() in p.name.lower()),
-                        None
-                    )
-                    if product and item.get('confidence', 0) > 0.7:
+                    product_id = matcher.resolve_name(item.get('product_name'))
+                    if product_id and item.get('confidence', 0) > 0.7:
                         result.append({
-                            'product': product,
+                            'product_id': product_id,
                             'quantity': max(1, int(item.get('quantity', 1)))
                         })
                 
@@ -146,7 +162,22 @@ class QuoteEngine:
         except Exception as e:
             print(f"Error analizando consulta: {e}")
         
-        return []
+        return None
+    
+    def _load_requested_products(self, matches: List[Dict]) -> List[Dict]:
+        """Carga los productos emparejados en una sola consulta"""
+        if not matches:
+            return []
+        
+        products = {
+            product.id: product
+            for product in Product.query.filter(Product.id.in_([match['product_id'] for match in matches])).all()
+        }
+        
+        return [
+            {'product': products[match['product_id']], 'quantity': match['quantity']}
+            for match in matches if match['product_id'] in products
+        ]
     
     def _create_quote(self, client_id: int, customer_info: Dict, 
                      products_requested: List[Dict]) -> Quote:
@@ -154,7 +185,7 @@ class QuoteEngine:
         
         quote = Quote(
             client_id=client_id,
-            quote_number=self._generate_quote_number(),
+            quote_number=self._generate_quote_number(client_id),
             customer_name=customer_info.get('name', 'Cliente'),
             customer_email=customer_info.get('email', ''),
             customer_phone=customer_info.get('phone', ''),
@@ -211,21 +242,38 @@ class QuoteEngine:
         quote.tax_amount = tax_amount
         quote.total_amount = taxable_amount + tax_amount
     
-    def _generate_quote_number(self) -> str:
-        """Genera un número único de cotización"""
+    def _generate_quote_number(self, client_id: int) -> str:
+        """Genera un número único de cotización (secuencia del cliente)"""
         timestamp = datetime.now().strftime("%Y%m%d")
-        unique_id = str(uuid.uuid4())[:8].upper()
-        return f"COT-{timestamp}-{unique_id}"
+        sequence = sequence_allocator.next_value(client_id, 'quote')
+        return f"COT-{timestamp}-{client_id}-{sequence:06d}"
     
     def get_quote_details(self, quote_id: int) -> Optional[Dict]:
         """Obtiene los detalles completos de una cotización"""
-        quote = Quote.query.get(quote_id)
+        # Items y productos precargados, igual que quote_store.get_by_number
+        quote = Quote.query.options(
+            selectinload(Quote.quote_items).joinedload(QuoteItem.product)
+        ).filter(Quote.id == quote_id).first()
         if not quote:
             return None
         
+        return self._serialize_quote(quote)
+    
+    def get_quote_by_number(self, quote_number: str) -> Optional[Dict]:
+        """Detalles de una cotización por su número (incluye las generadas en el chat)"""
+        from .quote_store import quote_store
+        
+        quote = quote_store.get_by_number(quote_number)
+        if not quote:
+            return None
+        
+        return self._serialize_quote(quote)
+    
+    def _serialize_quote(self, quote: Quote) -> Dict:
         return {
             'id': quote.id,
             'quote_number': quote.quote_number,
+            'source': quote.source,
             'customer_name': quote.customer_name,
             'customer_email': quote.customer_email,
             'customer_phone': quote.customer_phone,
@@ -234,12 +282,15 @@ class QuoteEngine:
             'discount_amount': float(quote.discount_amount),
             'tax_amount': float(quote.tax_amount),
             'total_amount': float(quote.total_amount),
+            'currency': quote.currency,
             'valid_until': quote.valid_until.isoformat() if quote.valid_until else None,
             'created_at': quote.created_at.isoformat(),
+            'pdf_path': quote.pdf_path,
             'items': [
                 {
-                    'product_name': item.product.name,
-                    'product_description': item.product.description,
+                    'product_id': item.product_id,
+                    'product_name': item.product.name if item.product else item.description,
+                    'product_description': item.product.description if item.product else None,
                     'quantity': item.quantity,
                     'unit_price': float(item.unit_price),
                     'discount_percentage': item.discount_percentage,
@@ -263,27 +314,40 @@ class QuoteEngine:
         
         return False
     
-    def list_quotes_by_client(self, client_id: int, status: Optional[str] = None) -> List[Dict]:
-        """Lista todas las cotizaciones de un cliente"""
+    def list_quotes_by_client(self, client_id: int, status: Optional[str] = None,
+                              source: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                              cursor: str = None, fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Lista las cotizaciones de un cliente (source: 'engine' o 'chat'), más
+        recientes primero y paginadas por cursor
+        
+        Returns:
+            Dict con 'quotes' y 'next_cursor' (None en la última página)
+        """
         query = Quote.query.filter_by(client_id=client_id)
         
         if status:
             query = query.filter_by(status=status)
         
-        quotes = query.order_by(Quote.created_at.desc()).all()
+        if source:
+            query = query.filter_by(source=source)
         
-        return [
+        rows, next_cursor = keyset_page(query, (Quote.created_at, Quote.id), cursor, limit)
+        
+        quotes = [
             {
                 'id': quote.id,
                 'quote_number': quote.quote_number,
                 'customer_name': quote.customer_name,
+                'source': quote.source,
                 'status': quote.status,
                 'total_amount': float(quote.total_amount),
                 'created_at': quote.created_at.isoformat(),
                 'valid_until': quote.valid_until.isoformat() if quote.valid_until else None
             }
-            for quote in quotes
+            for quote, *_ in rows
         ]
+        return {'quotes': select_fields(quotes, fields), 'next_cursor': next_cursor}
     
     def generate_quote_pdf(self, quote_id: int) -> Optional[str]:
         """Genera un PDF de la cotización (implementar con reportlab o similar)"""
@@ -0,0 +1,350 @@
+"""
+Almacén unificado de cotizaciones para SalesMind
+Persiste las cotizaciones del chat (quote_system_v2) como filas Quote/QuoteItem:
+el chat solo las registra en la cola persistente pending_quotes y un hilo de
+fondo las escribe por lotes, sin retrasar la respuesta del chat
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+from modules.models import db
+from modules.bulk_writer import BulkWriter
+from modules.commercial_models import PendingQuote, Quote, QuoteItem
+
+# Cotizaciones escritas por transacción, espera máxima para completar un lote
+# e intentos antes de marcar una cotización como fallida
+QUOTE_STORE_BATCH_SIZE = int(os.environ.get('QUOTE_STORE_BATCH_SIZE', 50))
+QUOTE_STORE_FLUSH_INTERVAL = float(os.environ.get('QUOTE_STORE_FLUSH_INTERVAL', 1.0))
+QUOTE_STORE_MAX_ATTEMPTS = int(os.environ.get('QUOTE_STORE_MAX_ATTEMPTS', 5))
+
+QUOTE_ITEM_COLUMNS = [
+    'quote_id', 'product_id', 'description', 'quantity',
+    'unit_price', 'discount_percentage', 'line_total'
+]
+
+# Columnas de fecha del registro, serializadas en ISO en la cola
+RECORD_DATETIME_FIELDS = ('valid_until', 'created_at', 'updated_at')
+
+
+class QuoteStore:
+    """
+    Cola de escritura de cotizaciones del chat.
+
+    enqueue() convierte los datos a un registro plano y lo guarda en
+    pending_quotes con un INSERT en conexión propia: si el proceso cae, la
+    cotización sigue en la cola. Un hilo daemon (o `flask quote-store-worker`)
+    toma lotes con FOR UPDATE SKIP LOCKED y, en una transacción, inserta las
+    cotizaciones con un INSERT multi-fila, sus items con COPY y borra los
+    registros de la cola. Si un lote falla se reintenta registro a registro
+    para aislar el que lo rompe. Las cotizaciones quedan consultables por
+    quote_number y convertibles en órdenes con
+    OrderProcessor.create_order_from_quote.
+    """
+
+    def __init__(self, batch_size: int = QUOTE_STORE_BATCH_SIZE,
+                 flush_interval: float = QUOTE_STORE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._wakeup = threading.Event()
+        self._enqueued = 0
+        self._thread = None
+        self._app = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, quote_data: Dict, pdf_path: str = None, source: str = 'chat') -> bool:
+        """
+        Registra una cotización generada en el chat (ver extract_quote_data_v2)
+        en la cola persistente.
+
+        Returns:
+            False si la cotización no tiene cliente o no se pudo registrar
+        """
+        if not quote_data.get('client_id'):
+            return False
+
+        record = self._to_record(quote_data, pdf_path, source)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(PendingQuote.__table__).values(
+                    client_id=record['quote']['client_id'],
+                    quote_number=record['quote']['quote_number'],
+                    payload=self._dump_record(record),
+                    status='pending'
+                ))
+        except Exception as e:
+            print(f"❌ Error registrando la cotización {record['quote']['quote_number']} para guardarla: {e}")
+            return False
+
+        self._ensure_worker()
+        with self._lock:
+            self._enqueued += 1
+            if self._enqueued >= self.batch_size:
+                # Lote completo: no esperar al intervalo
+                self._enqueued = 0
+                self._wakeup.set()
+        return True
+
+    def _ensure_worker(self):
+        """Arranca el hilo de escritura con la app de la petición actual."""
+        from flask import current_app
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = current_app._get_current_object()
+            self._thread = threading.Thread(target=self._run, name='quote-store', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _dump_record(record: Dict) -> str:
+        quote = dict(record['quote'])
+        for field in RECORD_DATETIME_FIELDS:
+            if quote.get(field) is not None:
+                quote[field] = quote[field].isoformat()
+        return json.dumps({'quote': quote, 'items': record['items']}, default=str)
+
+    @staticmethod
+    def _load_record(payload: str) -> Dict:
+        record = json.loads(payload)
+        for field in RECORD_DATETIME_FIELDS:
+            if record['quote'].get(field):
+                record['quote'][field] = datetime.fromisoformat(record['quote'][field])
+        return record
+
+    @staticmethod
+    def _to_record(quote_data: Dict, pdf_path: str, source: str) -> Dict:
+        """Registro plano con las columnas de Quote y QuoteItem."""
+        created_at = datetime.now()
+        try:
+            valid_until = datetime.strptime(quote_data['valid_until'], '%d/%m/%Y')
+        except (KeyError, ValueError):
+            valid_until = created_at + timedelta(days=30)
+
+        items = [
+            {
+                'product_id': item.get('product_id'),
+                'description': (item.get('description') or '')[:255],
+                'quantity': int(item.get('quantity') or 1),
+                'unit_price': item.get('unit_price') or 0,
+                'discount_percentage': 0.0,
+                'line_total': item.get('total') or 0
+            }
+            for item in quote_data.get('items', [])
+        ]
+
+        return {
+            'quote': {
+                'client_id': quote_data['client_id'],
+                'quote_number': quote_data['quote_number'],
+                'customer_name': quote_data.get('client_name') or 'Cliente',
+                'subtotal': quote_data.get('subtotal') or 0,
+                'discount_amount': 0,
+                'tax_amount': quote_data.get('tax_amount') or 0,
+                'total_amount': quote_data.get('total') or 0,
+                'currency': quote_data.get('currency'),
+                'status': 'sent',  # Ya se envió al usuario en el chat
+                'source': source,
+                'pdf_path': pdf_path,
+                'valid_until': valid_until,
+                'created_at': created_at,
+                'updated_at': created_at,
+                'notes': quote_data.get('notes')
+            },
+            'items': items
+        }
+
+    def _run(self):
+        """Bucle del hilo de escritura: vacía la cola cada flush_interval o al completarse un lote."""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    try:
+                        while self.process_batch()['claimed'] >= self.batch_size:
+                            pass
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"❌ Error guardando cotizaciones del chat: {e}")
+
+    def process_batch(self, limit: int = None) -> Dict:
+        """
+        Guarda un lote de cotizaciones pendientes de la cola.
+
+        Returns:
+            Dict con registros tomados, cotizaciones nuevas y fallidas
+        """
+        stats = {'claimed': 0, 'saved': 0, 'failed': 0}
+
+        pending_ids, error = self._run_batch(self._claim(limit or self.batch_size), stats)
+        if error and len(pending_ids) > 1:
+            print(f"⚠️ Lote de {len(pending_ids)} cotizaciones fallido ({error}); reintentando una a una")
+            for pending_id in pending_ids:
+                _, single_error = self._run_batch(self._claim(1, pending_id), stats)
+                if single_error:
+                    self._record_failure(pending_id, single_error)
+                    stats['failed'] += 1
+        elif error and pending_ids:
+            self._record_failure(pending_ids[0], error)
+            stats['failed'] += 1
+        elif error:
+            print(f"❌ Error tomando cotizaciones de la cola: {error}")
+
+        stats['claimed'] = len(pending_ids)
+        return stats
+
+    @staticmethod
+    def _claim(limit: int, pending_id: int = None):
+        table = PendingQuote.__table__
+        statement = select(table.c.id, table.c.payload).where(table.c.status == 'pending')
+        if pending_id is not None:
+            statement = statement.where(table.c.id == pending_id)
+        return statement.order_by(table.c.id).limit(limit).with_for_update(skip_locked=True)
+
+    def _run_batch(self, statement, stats: Dict) -> Tuple[List[int], Optional[str]]:
+        """Toma los registros, los guarda y los quita de la cola en una transacción; devuelve (ids, error)"""
+        pending_ids = []
+        try:
+            rows = db.session.execute(statement).all()
+            pending_ids = [row.id for row in rows]
+            if not rows:
+                db.session.rollback()
+                return pending_ids, None
+
+            saved = self._write_records([self._load_record(row.payload) for row in rows])
+            db.session.execute(delete(PendingQuote.__table__).where(PendingQuote.__table__.c.id.in_(pending_ids)))
+            db.session.commit()
+
+            if saved:
+                print(f"💾 {saved} cotizaciones del chat guardadas")
+            stats['saved'] += saved
+            return pending_ids, None
+
+        except Exception as e:
+            db.session.rollback()
+            return pending_ids, str(e)
+
+    @staticmethod
+    def _record_failure(pending_id: int, error: str):
+        """Suma un intento al registro; al agotar QUOTE_STORE_MAX_ATTEMPTS queda 'failed'"""
+        table = PendingQuote.__table__
+        try:
+            db.session.execute(
+                update(table)
+                .where(table.c.id == pending_id)
+                .values(
+                    attempts=table.c.attempts + 1,
+                    error_message=error,
+                    status=case((table.c.attempts + 1 >= QUOTE_STORE_MAX_ATTEMPTS, 'failed'), else_='pending')
+                )
+            )
+            db.session.commit()
+            print(f"❌ Cotización pendiente {pending_id} fallida: {error}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error registrando fallo de la cotización pendiente {pending_id}: {e}")
+
+    @staticmethod
+    def _write_records(records: List[Dict]) -> int:
+        """
+        Inserta las cotizaciones con sus items en la transacción de db.session
+        (el commit queda a cargo del llamador). Las cotizaciones ya guardadas
+        (mismo quote_number) se omiten.
+
+        Returns:
+            Número de cotizaciones nuevas
+        """
+        table = Quote.__table__
+        inserted = db.session.execute(
+            pg_insert(table)
+            .values([record['quote'] for record in records])
+            .on_conflict_do_nothing(index_elements=['quote_number'])
+            .returning(table.c.id, table.c.quote_number)
+        ).all()
+        quote_ids = {row.quote_number: row.id for row in inserted}
+
+        with BulkWriter(QuoteItem, columns=QUOTE_ITEM_COLUMNS) as writer:
+            for record in records:
+                quote_id = quote_ids.get(record['quote']['quote_number'])
+                if quote_id is None:
+                    continue
+                writer.extend(dict(item, quote_id=quote_id) for item in record['items'])
+
+        return len(quote_ids)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Guarda en este hilo las cotizaciones pendientes de la cola.
+
+        Returns:
+            True si la cola quedó vacía antes del timeout
+        """
+        if self._app is None:
+            return True
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._app.app_context():
+            try:
+                while deadline is None or time.monotonic() < deadline:
+                    if self.process_batch()['claimed'] == 0:
+                        return True
+                return False
+            finally:
+                db.session.remove()
+
+    def run_worker(self, poll_interval: float = 2.0, once: bool = False):
+        """
+        Bucle del worker: guarda lotes mientras haya cotizaciones pendientes y
+        espera poll_interval con la cola vacía (p. ej. para vaciar la cola de
+        un proceso web caído).
+
+        Args:
+            once: Si True, procesa como máximo un lote y termina
+        """
+        print("👷 Worker del almacén de cotizaciones iniciado")
+
+        while True:
+            stats = self.process_batch()
+            db.session.remove()
+
+            if stats['claimed']:
+                print(f"🧾 {stats['claimed']} cotizaciones de la cola: {stats['saved']} guardadas, "
+                      f"{stats['failed']} fallidas")
+            if once:
+                return
+            if not stats['claimed']:
+                time.sleep(poll_interval)
+
+    @staticmethod
+    def pending() -> int:
+        """Cotizaciones en la cola aún sin escribir"""
+        table = PendingQuote.__table__
+        return db.session.execute(
+            select(func.count()).select_from(table).where(table.c.status == 'pending')
+        ).scalar()
+
+    @staticmethod
+    def get_by_number(quote_number: str) -> Optional[Quote]:
+        """Cotización (del chat o del motor) por su número, con items y productos"""
+        return Quote.query.options(
+            selectinload(Quote.quote_items).joinedload(QuoteItem.product)
+        ).filter_by(quote_number=quote_number).first()
+
+
+# Instancia global
+quote_store = QuoteStore()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Guardar lo pendiente al apagar; lo que no dé tiempo sigue en la cola
+    quote_store.flush(timeout=5)
@@ -3,14 +3,20 @@ Rutas para el módulo comercial de SalesMind
 Endpoints para cotizaciones, órdenes, inventario, facturas y CRM
 """
 
+from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, render_template
 from modules.models import db
 from modules.commercial_models import Product, Quote, Order, Invoice, Lead
 from .quote_engine import QuoteEngine
 from .order_processor import OrderProcessor
 from .inventory_manager import InventoryManager
+from .catalog_sync import catalog_sync
 from .invoice_generator import InvoiceGenerator
-from .crm_system import CRMSystem
+from .invoice_batch import InvoiceBatchProcessor
+from .crm_system import ATTENTION_PAGE_SIZE, SEARCH_PAGE_SIZE, CRMSystem
+from .dashboard_summary import dashboard_summary_engine
+from .pagination import DEFAULT_PAGE_SIZE, parse_fields
+from .lead_pipeline import emit_event, wants_quote
 
 # Crear blueprint
 commercial_bp = Blueprint('commercial', __name__, url_prefix='/commercial')
@@ -46,6 +52,14 @@ def get_quote_details(quote_id):
         return jsonify({'success': True, 'quote': result})
     return jsonify({'success': False, 'error': 'Cotización no encontrada'}), 404
 
+@commercial_bp.route('/quote/number/<quote_number>', methods=['GET'])
+def get_quote_by_number(quote_number):
+    """Obtiene una cotización por su número (incluye las del chat)"""
+    result = quote_engine.get_quote_by_number(quote_number)
+    if result:
+        return jsonify({'success': True, 'quote': result})
+    return jsonify({'success': False, 'error': 'Cotización no encontrada'}), 404
+
 @commercial_bp.route('/quote/<int:quote_id>/status', methods=['PUT'])
 def update_quote_status(quote_id):
     """Actualiza estado de cotización"""
@@ -55,19 +69,33 @@ def update_quote_status(quote_id):
 
 @commercial_bp.route('/quotes/client/<int:client_id>', methods=['GET'])
 def list_client_quotes(client_id):
-    """Lista cotizaciones de un cliente"""
+    """Lista cotizaciones de un cliente (paginado con 'cursor' = next_cursor anterior)"""
     status = request.args.get('status')
-    quotes = quote_engine.list_quotes_by_client(client_id, status)
-    return jsonify({'success': True, 'quotes': quotes})
+    source = request.args.get('source')
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        result = quote_engine.list_quotes_by_client(client_id, status, source, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
 
 # ==================== RUTAS DE ÓRDENES ====================
 
 @commercial_bp.route('/order/create-from-quote', methods=['POST'])
 def create_order_from_quote():
-    """Crea orden desde cotización aceptada"""
+    """Crea orden desde cotización aceptada (por quote_id o quote_number)"""
     data = request.json
+    quote_id = data.get('quote_id')
+    if quote_id is None and data.get('quote_number'):
+        quote = quote_engine.get_quote_by_number(data['quote_number'])
+        if not quote:
+            return jsonify({'success': False, 'error': 'Cotización no encontrada'}), 404
+        quote_id = quote['id']
+    
     result = order_processor.create_order_from_quote(
-        quote_id=data['quote_id'],
+        quote_id=quote_id,
         additional_info=data.get('additional_info', {})
     )
     return jsonify(result)
@@ -105,11 +133,16 @@ def update_order_status(order_id):
 
 @commercial_bp.route('/orders/client/<int:client_id>', methods=['GET'])
 def list_client_orders(client_id):
-    """Lista órdenes de un cliente"""
+    """Lista órdenes de un cliente (paginado con 'cursor' = next_cursor anterior)"""
     status = request.args.get('status')
-    limit = int(request.args.get('limit', 50))
-    orders = order_processor.list_orders_by_client(client_id, status, limit)
-    return jsonify({'success': True, 'orders': orders})
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        result = order_processor.list_orders_by_client(client_id, status, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
 
 @commercial_bp.route('/orders/statistics/<int:client_id>', methods=['GET'])
 def get_order_statistics(client_id):
@@ -138,6 +171,34 @@ def update_product_stock(product_id):
     )
     return jsonify(result)
 
+@commercial_bp.route('/inventory/catalog/sync', methods=['POST'])
+def sync_catalog():
+    """
+    Sincroniza el catálogo por SKU (altas, cambios y bajas en bloque).
+    Acepta un archivo CSV/JSON en 'file' (multipart) o JSON con 'products'.
+    """
+    try:
+        if 'file' in request.files:
+            upload = request.files['file']
+            client_id = request.form.get('client_id', type=int)
+            deactivate_missing = request.form.get('deactivate_missing', '').lower() in ('1', 'true', 'si', 'sí')
+            rows = catalog_sync.parse_file(upload.read(), upload.filename or '')
+        else:
+            data = request.json or {}
+            client_id = data.get('client_id')
+            deactivate_missing = bool(data.get('deactivate_missing', False))
+            rows = data.get('products', [])
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Archivo no válido: {str(e)}'}), 400
+    
+    if not client_id:
+        return jsonify({'success': False, 'error': 'client_id requerido'}), 400
+    if not rows:
+        return jsonify({'success': False, 'error': 'No hay productos para sincronizar'}), 400
+    
+    result = catalog_sync.sync(client_id, rows, deactivate_missing=deactivate_missing)
+    return jsonify(result)
+
 @commercial_bp.route('/inventory/alerts/<int:client_id>', methods=['GET'])
 def get_low_stock_alerts(client_id):
     """Obtiene alertas de stock bajo"""
@@ -152,13 +213,46 @@ def get_inventory_report(client_id):
 
 @commercial_bp.route('/inventory/movements', methods=['GET'])
 def get_inventory_movements():
-    """Obtiene historial de movimientos de inventario"""
+    """Obtiene historial de movimientos de inventario (paginado con 'cursor' = next_cursor anterior)"""
     product_id = request.args.get('product_id', type=int)
     movement_type = request.args.get('movement_type')
-    limit = int(request.args.get('limit', 50))
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    client_id = request.args.get('client_id', type=int)
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
     
-    movements = inventory_manager.get_inventory_movements(product_id, movement_type, limit)
-    return jsonify({'success': True, 'movements': movements})
+    try:
+        result = inventory_manager.get_inventory_movements(
+            product_id, movement_type, limit, client_id, cursor, fields
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
+
+@commercial_bp.route('/inventory/top-selling/<int:client_id>', methods=['GET'])
+def get_top_selling_products(client_id):
+    """Productos más vendidos (opcionalmente en los últimos N días)"""
+    days = request.args.get('days', type=int)
+    limit = int(request.args.get('limit', 10))
+    products = inventory_manager.get_top_selling_products(client_id, limit, days)
+    return jsonify({'success': True, 'products': products})
+
+@commercial_bp.route('/inventory/velocity/<int:client_id>', methods=['GET'])
+def get_product_velocity(client_id):
+    """Rotación de productos y días de cobertura"""
+    days = int(request.args.get('days', 30))
+    limit = int(request.args.get('limit', 50))
+    velocity = inventory_manager.get_product_velocity(client_id, days, limit)
+    return jsonify({'success': True, 'velocity': velocity})
+
+@commercial_bp.route('/inventory/product/<int:product_id>/history', methods=['GET'])
+def get_stock_history(product_id):
+    """Historial diario de stock de un producto"""
+    days = int(request.args.get('days', 30))
+    history = inventory_manager.get_stock_history(product_id, days)
+    if history:
+        return jsonify({'success': True, 'stock_history': history})
+    return jsonify({'success': False, 'error': 'Producto no encontrado'}), 404
 
 # ==================== RUTAS DE FACTURACIÓN ====================
 
@@ -193,11 +287,16 @@ def update_invoice_status(invoice_id):
 
 @commercial_bp.route('/invoices/client/<int:client_id>', methods=['GET'])
 def list_client_invoices(client_id):
-    """Lista facturas de un cliente"""
+    """Lista facturas de un cliente (paginado con 'cursor' = next_cursor anterior)"""
     status = request.args.get('status')
-    limit = int(request.args.get('limit', 50))
-    invoices = invoice_generator.list_invoices_by_client(client_id, status, limit)
-    return jsonify({'success': True, 'invoices': invoices})
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        result = invoice_generator.list_invoices_by_client(client_id, status, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
 
 @commercial_bp.route('/invoices/overdue/<int:client_id>', methods=['GET'])
 def get_overdue_invoices(client_id):
@@ -212,6 +311,42 @@ def get_invoice_statistics(client_id):
     stats = invoice_generator.get_invoice_statistics(client_id, days)
     return jsonify({'success': True, 'statistics': stats})
 
+@commercial_bp.route('/invoices/batch', methods=['POST'])
+def create_invoice_batch():
+    """Encola la facturación por lotes de un cliente (cierre de mes)"""
+    data = request.json
+    try:
+        date_from = datetime.strptime(data['date_from'], '%Y-%m-%d') if data.get('date_from') else None
+        # Fecha final inclusive: se factura hasta el final de ese día
+        date_to = datetime.strptime(data['date_to'], '%Y-%m-%d') + timedelta(days=1) if data.get('date_to') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fechas inválidas (formato YYYY-MM-DD)'}), 400
+    
+    result = InvoiceBatchProcessor.create_job(
+        client_id=data['client_id'],
+        date_from=date_from,
+        date_to=date_to,
+        order_ids=data.get('order_ids'),
+        tax_info=data.get('tax_info', {})
+    )
+    if not result['success']:
+        return jsonify(result), 400
+    return jsonify(result), 202
+
+@commercial_bp.route('/invoices/batch/<int:job_id>', methods=['GET'])
+def get_invoice_batch_status(job_id):
+    """Progreso de un lote de facturación y órdenes fallidas"""
+    status = InvoiceBatchProcessor.get_job_status(job_id)
+    if status:
+        return jsonify({'success': True, 'batch': status})
+    return jsonify({'success': False, 'error': 'Lote no encontrado'}), 404
+
+@commercial_bp.route('/invoices/batch/<int:job_id>/resume', methods=['POST'])
+def resume_invoice_batch(job_id):
+    """Reanuda un lote fallido desde su punto de control"""
+    result = InvoiceBatchProcessor.resume_job(job_id)
+    return jsonify(result), (202 if result['success'] else 400)
+
 # ==================== RUTAS DE CRM ====================
 
 @commercial_bp.route('/crm/lead/create', methods=['POST'])
@@ -257,9 +392,11 @@ def get_pipeline_overview(client_id):
 
 @commercial_bp.route('/crm/attention/<int:client_id>', methods=['GET'])
 def get_leads_requiring_attention(client_id):
-    """Obtiene leads que requieren atención"""
-    leads = crm_system.get_leads_requiring_attention(client_id)
-    return jsonify({'success': True, 'leads': leads})
+    """Obtiene leads que requieren atención (paginados por prioridad)"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', ATTENTION_PAGE_SIZE, type=int)
+    result = crm_system.get_leads_requiring_attention(client_id, page, per_page)
+    return jsonify({'success': True, **result})
 
 @commercial_bp.route('/crm/statistics/<int:client_id>', methods=['GET'])
 def get_crm_statistics(client_id):
@@ -270,39 +407,40 @@ def get_crm_statistics(client_id):
 
 @commercial_bp.route('/crm/search/<int:client_id>', methods=['GET'])
 def search_leads(client_id):
-    """Busca leads por criterios"""
+    """Busca leads por criterios (paginado con 'cursor' = next_cursor anterior)"""
     query = request.args.get('q', '')
     status = request.args.get('status')
-    leads = crm_system.search_leads(client_id, query, status)
-    return jsonify({'success': True, 'leads': leads})
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        result = crm_system.search_leads(client_id, query, status, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **result})
 
 # ==================== DASHBOARD COMERCIAL ====================
 
 @commercial_bp.route('/dashboard/<int:client_id>')
 def commercial_dashboard(client_id):
     """Dashboard comercial principal"""
-    # Obtener estadísticas generales
-    pipeline_overview = crm_system.get_pipeline_overview(client_id)
-    order_stats = order_processor.get_order_statistics(client_id)
-    inventory_report = inventory_manager.get_inventory_report(client_id)
-    invoice_stats = invoice_generator.get_invoice_statistics(client_id)
-    
-    # Alertas importantes
-    low_stock_alerts = inventory_manager.get_low_stock_alerts(client_id)
-    attention_leads = crm_system.get_leads_requiring_attention(client_id)
-    overdue_invoices = invoice_generator.get_overdue_invoices(client_id)
+    # Todos los KPIs y alertas en una sola consulta agregada, cacheada por cliente
+    summary = dashboard_summary_engine.get_summary(client_id)
     
     return render_template('commercial/dashboard.html',
                          client_id=client_id,
-                         pipeline=pipeline_overview,
-                         order_stats=order_stats,
-                         inventory=inventory_report,
-                         invoice_stats=invoice_stats,
-                         alerts={
-                             'low_stock': low_stock_alerts,
-                             'attention_leads': attention_leads[:5],  # Top 5
-                             'overdue_invoices': overdue_invoices[:5]
-                         })
+                         pipeline=summary['pipeline'],
+                         order_stats=summary['order_stats'],
+                         inventory=summary['inventory'],
+                         invoice_stats=summary['invoice_stats'],
+                         alerts=summary['alerts'])
+
+@commercial_bp.route('/dashboard/<int:client_id>/summary', methods=['GET'])
+def get_dashboard_summary(client_id):
+    """KPIs del dashboard en JSON (?refresh=1 ignora la caché)"""
+    refresh = request.args.get('refresh') == '1'
+    summary = dashboard_summary_engine.get_summary(client_id, refresh=refresh)
+    return jsonify({'success': True, 'summary': summary})
 
 # ==================== RUTAS DE INTEGRACIÓN CON IA ====================
 
@@ -311,19 +449,20 @@ def process_customer_message():
     """
     Procesa mensaje de cliente y determina si se debe generar cotización,
     crear lead, etc.
+    
+    El lead no se escribe aquí: se registra un evento en la cola del CRM y
+    el worker del pipeline de leads (flask crm-event-worker) lo crea o
+    actualiza sin retrasar la respuesta.
     """
     try:
         data = request.json
         client_id = data['client_id']
         customer_message = data['message']
         customer_info = data.get('customer_info', {})
-        
-        # Usar IA para analizar intención del mensaje
-        # Esta es la integración clave que convierte SalesMind en un sistema comercial completo
+        has_contact = bool(customer_info.get('email') or customer_info.get('phone'))
         
         # Determinar si el mensaje requiere cotización
-        if any(keyword in customer_message.lower() for keyword in 
-               ['precio', 'cotizar', 'cuesta', 'valor', 'comprar', 'adquirir']):
+        if wants_quote(customer_message):
             
             # Generar cotización automática
             quote_result = quote_engine.generate_quote_from_query(
@@ -333,18 +472,15 @@ def process_customer_message():
             )
             
             if quote_result['success']:
-                # También crear lead si no existe
-                lead_data = {
-                    'name': customer_info.get('name', 'Cliente desde Chat'),
-                    'email': customer_info.get('email', ''),
-                    'phone': customer_info.get('phone', ''),
-                    'source': 'chat_bot',
-                    'estimated_value': quote_result.get('total_amount', 0),
-                    'probability': 30,  # 30% por consulta de precio
-                    'notes': f'Consulta original: {customer_message}'
-                }
-                
-                crm_system.create_lead(client_id, lead_data)
+                # Lead (nuevo o existente) con el valor de la cotización
+                if has_contact:
+                    emit_event(client_id, 'quote_generated', {
+                        'message': customer_message,
+                        'customer_info': customer_info,
+                        'quote_id': quote_result.get('quote_id'),
+                        'quote_number': quote_result.get('quote_number'),
+                        'total_amount': quote_result.get('total_amount', 0)
+                    })
                 
                 return jsonify({
                     'success': True,
@@ -353,22 +489,17 @@ def process_customer_message():
                     'message': f'He generado una cotización automática por ${quote_result["total_amount"]:,.0f}. ¿Te interesa proceder con la orden?'
                 })
         
-        # Si no es una consulta de precio, crear lead básico
-        elif customer_info.get('email') or customer_info.get('phone'):
-            lead_data = {
-                'name': customer_info.get('name', 'Cliente desde Chat'),
-                'email': customer_info.get('email', ''),
-                'phone': customer_info.get('phone', ''),
-                'source': 'chat_bot',
-                'notes': f'Consulta: {customer_message}'
-            }
-            
-            crm_result = crm_system.create_lead(client_id, lead_data)
+        # Si no es una consulta de precio, registrar el lead básico
+        elif has_contact:
+            event_id = emit_event(client_id, 'chat_message_received', {
+                'message': customer_message,
+                'customer_info': customer_info
+            })
             
             return jsonify({
                 'success': True,
                 'action': 'lead_created',
-                'lead': crm_result,
+                'lead': {'success': event_id is not None, 'queued': True, 'event_id': event_id},
                 'message': 'Gracias por tu consulta. He registrado tu información para seguimiento.'
             })
         
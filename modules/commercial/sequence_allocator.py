@@ -0,0 +1,139 @@
+"""
+Asignador de numeración por cliente para SalesMind
+Contadores en PostgreSQL bloqueados por fila: facturas sin huecos dentro de la
+transacción que las crea, y bloques pre-asignados por worker para cotizaciones
+y órdenes
+"""
+
+import os
+import threading
+from typing import Dict, Tuple
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import func
+from modules.models import db
+from modules.commercial_models import DocumentSequence
+
+# Números que cada worker reserva de una vez para secuencias que admiten huecos
+SEQUENCE_BLOCK_SIZE = int(os.environ.get('SEQUENCE_BLOCK_SIZE', 20))
+
+
+class SequenceAllocator:
+    """
+    Asigna números consecutivos por (cliente, secuencia, periodo).
+
+    - next_gap_free: incrementa el contador en la transacción del llamador. La
+      fila queda bloqueada hasta su commit y, si hace rollback, el número se
+      libera: numeración fiscal sin huecos ni duplicados.
+    - next_value: reserva bloques de SEQUENCE_BLOCK_SIZE números en una
+      transacción propia y los reparte desde memoria. Un worker que se
+      reinicia pierde el resto de su bloque (huecos admitidos).
+    """
+
+    def __init__(self, block_size: int = SEQUENCE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks: Dict[Tuple, list] = {}  # clave -> [siguiente, último reservado]
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._known_keys = set()  # Contadores ya creados en PostgreSQL
+
+    def _key_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _ensure_counter(self, key: Tuple, seed):
+        """
+        Crea el contador con el último número ya emitido (seed, expresión SQL)
+        en una transacción propia. Crear el contador no consume números, así
+        que puede confirmarse aunque la transacción del llamador haga rollback.
+        La clave solo se recuerda después del commit de esa transacción: si se
+        recordara con el contador creado en la del llamador y esta hiciera
+        rollback, el siguiente número empezaría en 1 y repetiría numeración.
+        """
+        if seed is None:
+            return
+        with self._lock:
+            if key in self._known_keys:
+                return
+
+        client_id, sequence_name, period = key
+        with db.engine.begin() as conn:
+            conn.execute(pg_insert(DocumentSequence.__table__).values(
+                client_id=client_id,
+                sequence_name=sequence_name,
+                period=period,
+                last_value=seed,
+                updated_at=func.now()
+            ).on_conflict_do_nothing(constraint='unique_document_sequence'))
+        with self._lock:
+            self._known_keys.add(key)
+
+    def _increment_statement(self, key: Tuple, increment: int):
+        """UPSERT que suma increment al contador y devuelve el nuevo valor."""
+        client_id, sequence_name, period = key
+        table = DocumentSequence.__table__
+
+        statement = pg_insert(table).values(
+            client_id=client_id,
+            sequence_name=sequence_name,
+            period=period,
+            last_value=increment,
+            updated_at=func.now()
+        )
+        return statement.on_conflict_do_update(
+            constraint='unique_document_sequence',
+            set_={'last_value': table.c.last_value + increment, 'updated_at': func.now()}
+        ).returning(table.c.last_value)
+
+    def next_gap_free(self, client_id: int, sequence_name: str, period: str = '', seed=None) -> int:
+        """
+        Siguiente número sin huecos, dentro de la transacción de db.session.
+
+        Args:
+            seed: Expresión SQL escalar con el último número ya emitido, para
+                  continuar la numeración existente al crear el contador
+        """
+        return self.reserve_gap_free(client_id, sequence_name, 1, period, seed)
+
+    def reserve_gap_free(self, client_id: int, sequence_name: str, count: int,
+                         period: str = '', seed=None) -> int:
+        """
+        Reserva count números consecutivos en la transacción de db.session
+        (facturación por lotes). Si la transacción hace rollback, el bloque
+        completo se libera.
+
+        Returns:
+            Primer número del bloque
+        """
+        key = (client_id, sequence_name, period)
+        self._ensure_counter(key, seed)
+        last = db.session.execute(self._increment_statement(key, count)).scalar_one()
+        return last - count + 1
+
+    def next_value(self, client_id: int, sequence_name: str, period: str = '', seed=None) -> int:
+        """Siguiente número del bloque pre-asignado a este worker."""
+        key = (client_id, sequence_name, period)
+
+        with self._key_lock(key):
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                self._ensure_counter(key, seed)
+                # Transacción propia: la reserva no depende del commit del llamador
+                with db.engine.begin() as conn:
+                    last = conn.execute(self._increment_statement(key, self.block_size)).scalar_one()
+                block = [last - self.block_size + 1, last]
+                self._blocks[key] = block
+
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def reset_cache(self):
+        """Descarta los bloques reservados y los contadores conocidos en memoria (ej: tras un fork)."""
+        with self._lock:
+            self._blocks.clear()
+            self._key_locks.clear()
+            self._known_keys.clear()
+
+
+# Instancia global
+sequence_allocator = SequenceAllocator()
@@ -3,9 +3,9 @@ Modelos comerciales extendidos para SalesMind
 Versión 2.0.0 - Sistema Comercial Completo
 """
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, Date, DateTime, Text, ForeignKey, Numeric, UniqueConstraint, Index, Computed, DDL, event
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from modules.models import db
 import uuid
 from datetime import datetime
@@ -46,6 +46,12 @@ class Product(db.Model):
     quote_items = relationship("QuoteItem", back_populates="product")
     order_items = relationship("OrderItem", back_populates="product")
     inventory_movements = relationship("InventoryMovement", back_populates="product")
+    
+    __table_args__ = (
+        # Clave de sincronización del catálogo: un SKU por cliente (los vacíos no cuentan)
+        Index('ux_products_client_sku', 'client_id', 'sku', unique=True,
+              postgresql_where=text("sku IS NOT NULL AND sku <> ''")),
+    )
 
 class Quote(db.Model):
     """Modelo para cotizaciones automáticas"""
@@ -66,10 +72,16 @@ class Quote(db.Model):
     tax_amount = Column(Numeric(10, 2), default=0)
     total_amount = Column(Numeric(10, 2), nullable=False)
     
+    currency = Column(String(3))
+    
     # Estados
     status = Column(String(20), default='draft')  # draft, sent, accepted, rejected, expired
     valid_until = Column(DateTime)
     
+    # Origen: 'engine' (QuoteEngine) o 'chat' (quote_system_v2)
+    source = Column(String(20), nullable=False, default='engine')
+    pdf_path = Column(String(500))
+    
     # Metadatos
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -78,6 +90,12 @@ class Quote(db.Model):
     # Relaciones
     client = relationship("Client", back_populates="quotes")
     quote_items = relationship("QuoteItem", back_populates="quote", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index('ix_quotes_client_source_created', 'client_id', 'source', 'created_at'),
+        Index('ix_quotes_client_created_id', 'client_id', 'created_at', 'id'),  # Paginación por cursor
+        Index('ix_quotes_client_customer_email', 'client_id', 'customer_email'),
+    )
 
 class QuoteItem(db.Model):
     """Elementos individuales de una cotización"""
@@ -85,7 +103,8 @@ class QuoteItem(db.Model):
     
     id = Column(Integer, primary_key=True)
     quote_id = Column(Integer, ForeignKey('quotes.id'), nullable=False)
-    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'))  # Nulo en items del chat fuera del catálogo
+    description = Column(String(255))
     
     quantity = Column(Integer, nullable=False, default=1)
     unit_price = Column(Numeric(10, 2), nullable=False)
@@ -134,6 +153,11 @@ class Order(db.Model):
     quote = relationship("Quote", backref="orders")
     order_items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
     invoices = relationship("Invoice", back_populates="order")
+    
+    __table_args__ = (
+        Index('ix_orders_client_created_id', 'client_id', 'created_at', 'id'),  # Paginación por cursor
+        Index('ix_orders_client_customer_email', 'client_id', 'customer_email'),
+    )
 
 class OrderItem(db.Model):
     """Elementos individuales de una orden"""
@@ -188,6 +212,11 @@ class Invoice(db.Model):
     # Relaciones
     client = relationship("Client", back_populates="invoices")
     order = relationship("Order", back_populates="invoices")
+    
+    __table_args__ = (
+        Index('ix_invoices_client_created_id', 'client_id', 'created_at', 'id'),  # Paginación por cursor
+        Index('ix_invoices_client_due_status', 'client_id', 'due_date', 'status'),
+    )
 
 class InventoryMovement(db.Model):
     """Registro de movimientos de inventario"""
@@ -207,6 +236,51 @@ class InventoryMovement(db.Model):
     
     # Relaciones
     product = relationship("Product", back_populates="inventory_movements")
+    
+    __table_args__ = (
+        Index('ix_inventory_movements_product_created', 'product_id', 'created_at'),
+        Index('ix_inventory_movements_reference', 'reference_type', 'reference_id'),
+    )
+
+class InventoryDailyRollup(db.Model):
+    """Movimientos de inventario agregados por producto y día (ledger para reportes)"""
+    __tablename__ = 'inventory_daily_rollups'
+    
+    client_id = Column(Integer, ForeignKey('client.id'), primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    
+    units_in = Column(Integer, nullable=False, default=0)
+    units_out = Column(Integer, nullable=False, default=0)
+    # Vendidas netas: reservas de órdenes menos cancelaciones y reservas caducadas
+    units_sold = Column(Integer, nullable=False, default=0)
+    movement_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class InventoryReservation(db.Model):
+    """Stock retenido por una orden, por producto, con caducidad"""
+    __tablename__ = 'inventory_reservations'
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+    # active (retenido), confirmed (orden confirmada), released (cancelada), expired
+    status = Column(String(20), nullable=False, default='active')
+    expires_at = Column(DateTime)  # Solo aplica a reservas activas
+
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    # Relaciones
+    order = relationship("Order", backref="inventory_reservations")
+    product = relationship("Product")
+
+    __table_args__ = (
+        UniqueConstraint('order_id', 'product_id', name='unique_order_product_reservation'),
+        Index('ix_inventory_reservations_status_expires', 'status', 'expires_at'),
+    )
 
 class Lead(db.Model):
     """Modelo para leads y CRM"""
@@ -241,9 +315,34 @@ class Lead(db.Model):
     next_action = Column(String(500))
     next_action_date = Column(DateTime)
     
+    # Búsqueda: columnas generadas por PostgreSQL con índices de trigramas (pg_trgm)
+    search_text = Column(Text, Computed(
+        "lower(coalesce(name, '') || ' ' || coalesce(company, '') || ' ' || coalesce(email, ''))",
+        persisted=True
+    ))
+    phone_digits = Column(String(50), Computed(
+        "regexp_replace(coalesce(phone, ''), '[^0-9]', '', 'g')", persisted=True
+    ))
+    
     # Relaciones
     client = relationship("Client", back_populates="leads")
     interactions = relationship("LeadInteraction", back_populates="lead", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index('ix_leads_search_text_trgm', 'search_text', postgresql_using='gin',
+              postgresql_ops={'search_text': 'gin_trgm_ops'}),
+        Index('ix_leads_phone_digits_trgm', 'phone_digits', postgresql_using='gin',
+              postgresql_ops={'phone_digits': 'gin_trgm_ops'}),
+        Index('ix_leads_client_created_id', 'client_id', 'created_at', 'id'),  # Paginación por cursor
+        Index('ix_leads_client_status_next_action', 'client_id', 'status', 'next_action_date'),
+        Index('ix_leads_client_phone_digits', 'client_id', 'phone_digits'),  # Deduplicación por teléfono
+    )
+
+# Deduplicación de leads por email normalizado (pipeline chat -> CRM)
+Index('ix_leads_client_email_normalized', Lead.client_id, func.lower(func.trim(Lead.email)))
+
+# Los índices de búsqueda de leads necesitan la extensión pg_trgm
+event.listen(Lead.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
 
 class LeadInteraction(db.Model):
     """Interacciones con leads para seguimiento CRM"""
@@ -266,6 +365,128 @@ class LeadInteraction(db.Model):
     # Relaciones
     lead = relationship("Lead", back_populates="interactions")
 
+class DocumentSequence(db.Model):
+    """Contadores de numeración por cliente (facturas, cotizaciones, órdenes)"""
+    __tablename__ = 'document_sequences'
+    
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey('client.id'), nullable=False)
+    sequence_name = Column(String(30), nullable=False)  # invoice, quote, order
+    period = Column(String(10), nullable=False, default='')  # '' = sin reinicio periódico
+    last_value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint('client_id', 'sequence_name', 'period', name='unique_document_sequence'),
+    )
+
+class InvoiceBatchJob(db.Model):
+    """Trabajo de facturación por lotes (cierre de mes) con progreso y punto de reanudación"""
+    __tablename__ = 'invoice_batch_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey('client.id'), nullable=False)
+    
+    # Criterios de selección de órdenes
+    date_from = Column(DateTime)
+    date_to = Column(DateTime)
+    tax_info = Column(Text)  # JSON con los datos fiscales de la empresa
+    
+    # Estados: pending, running, completed, completed_with_errors, failed
+    status = Column(String(30), nullable=False, default='pending')
+    total_orders = Column(Integer, nullable=False, default=0)
+    processed_orders = Column(Integer, nullable=False, default=0)
+    failed_orders = Column(Integer, nullable=False, default=0)
+    last_order_id = Column(Integer)  # Punto de control: última orden confirmada
+    error_message = Column(Text)
+    
+    # Control de workers
+    worker_id = Column(String(100))
+    heartbeat_at = Column(DateTime)
+    
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    # Relaciones
+    items = relationship("InvoiceBatchItem", back_populates="job", cascade="all, delete-orphan",
+                         order_by="InvoiceBatchItem.order_id")
+
+class InvoiceBatchItem(db.Model):
+    """Orden incluida en un lote de facturación, con su resultado"""
+    __tablename__ = 'invoice_batch_items'
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('invoice_batch_jobs.id'), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
+    
+    status = Column(String(20), nullable=False, default='pending')  # pending, completed, failed, skipped
+    invoice_id = Column(Integer, ForeignKey('invoices.id'))
+    error_message = Column(Text)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    # Relaciones
+    job = relationship("InvoiceBatchJob", back_populates="items")
+    
+    __table_args__ = (
+        UniqueConstraint('job_id', 'order_id', name='unique_invoice_batch_order'),
+    )
+
+class DashboardSummary(db.Model):
+    """Resumen materializado del dashboard comercial por cliente"""
+    __tablename__ = 'commercial_dashboard_summaries'
+    
+    client_id = Column(Integer, ForeignKey('client.id'), primary_key=True)
+    payload = Column(Text)  # JSON con todos los KPIs
+    
+    # Cada cambio de leads, órdenes, facturas o stock incrementa version; el
+    # resumen es válido mientras computed_version == version
+    version = Column(BigInteger, nullable=False, default=0)
+    computed_version = Column(BigInteger, nullable=False, default=-1)
+    computed_at = Column(DateTime)
+
+class CRMEvent(db.Model):
+    """Evento del chat pendiente de llevar al CRM (cola persistente del pipeline de leads)"""
+    __tablename__ = 'crm_events'
+    
+    id = Column(BigInteger, primary_key=True)
+    client_id = Column(Integer, ForeignKey('client.id'), nullable=False)
+    event_type = Column(String(50), nullable=False)  # chat_message_received, quote_generated
+    payload = Column(Text, nullable=False)  # JSON con el mensaje, datos de contacto y cotización
+    
+    # Estados: pending, done, skipped (sin datos de contacto), failed
+    status = Column(String(20), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    lead_id = Column(Integer, ForeignKey('leads.id'))
+    error_message = Column(Text)
+    
+    created_at = Column(DateTime, default=func.now())
+    processed_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_crm_events_pending', 'id', postgresql_where=text("status = 'pending'")),
+    )
+
+class PendingQuote(db.Model):
+    """Cotización del chat pendiente de guardar en quotes (cola persistente de QuoteStore)"""
+    __tablename__ = 'pending_quotes'
+    
+    id = Column(BigInteger, primary_key=True)
+    client_id = Column(Integer, ForeignKey('client.id'), nullable=False)
+    quote_number = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON con las columnas de Quote y sus items
+    
+    # Estados: pending, failed (se borra al guardarse en quotes)
+    status = Column(String(20), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text)
+    
+    created_at = Column(DateTime, default=func.now())
+    
+    __table_args__ = (
+        Index('ix_pending_quotes_pending', 'id', postgresql_where=text("status = 'pending'")),
+    )
+
 # Actualizar modelo Client existente con nuevas relaciones
 def extend_client_model():
     """Función para extender el modelo Client existente"""
@@ -1,11 +1,11 @@
 # modules/document_manager.py
 import hashlib
 import os
-import fitz  # PyMuPDF
-import io
 from datetime import datetime
 from typing import Optional, List, Dict, Tuple
 from .models import Document, Client, Embedding, FAISSIndex
+from .ocr_extractor import OCRExtractor, MIN_TEXT_CHARS
+from .text_extractors import get_extractor, supported_extensions
 from . import db
 from sqlalchemy.exc import IntegrityError
 
@@ -23,24 +23,45 @@ class DocumentManager:
     def extract_text_from_pdf(file_content: bytes) -> str:
         """
         Extrae texto de un PDF almacenado como bytes.
+        Las páginas escaneadas (solo imagen) se procesan con OCR.
         """
         try:
-            # Crear un objeto BytesIO desde los bytes
-            pdf_stream = io.BytesIO(file_content)
-            
-            # Abrir PDF con PyMuPDF
-            with fitz.open(stream=pdf_stream, filetype="pdf") as doc:
-                full_text = ""
-                for page in doc:
-                    full_text += page.get_text()
-                    full_text += "\n\n"  # Separar páginas
-                
-                return full_text.strip()
+            extracted_text, stats = OCRExtractor.extract_text(file_content)
+            return extracted_text
         
         except Exception as e:
             print(f"❌ Error extrayendo texto del PDF: {e}")
             return ""
     
+    @classmethod
+    def extract_text(cls, filename: str, file_content: bytes) -> str:
+        """
+        Extrae texto de un archivo usando el extractor registrado para su extensión
+        (PDF, DOCX, TXT, CSV/XLSX, HTML; ver modules/text_extractors.py).
+        """
+        extractor = get_extractor(filename)
+        
+        if extractor is None:
+            file_extension = filename.lower().split('.')[-1] if '.' in filename else 'unknown'
+            print(f"⚠️ Tipo de archivo no soportado para extracción de texto: {file_extension}")
+            return ""
+        
+        try:
+            return extractor(file_content)
+        except Exception as e:
+            print(f"❌ Error extrayendo texto de {filename}: {e}")
+            return ""
+    
+    @classmethod
+    def get_previous_versions(cls, client_id: int, filename: str) -> List[Document]:
+        """
+        Obtiene los documentos de un cliente con el mismo nombre de archivo
+        (versiones anteriores de un catálogo o lista de precios).
+        """
+        return Document.query.filter_by(client_id=client_id, filename=filename).order_by(
+            Document.upload_date.desc()
+        ).all()
+    
     @classmethod
     def add_document_from_file(cls, client_id: int, file_path: str) -> Optional[Document]:
         """
@@ -59,15 +80,34 @@ class DocumentManager:
                 print(f"❌ Archivo no encontrado: {file_path}")
                 return None
             
-            # Obtener información del archivo
-            filename = os.path.basename(file_path)
-            file_extension = filename.lower().split('.')[-1] if '.' in filename else 'unknown'
-            file_size = os.path.getsize(file_path)
-            
             # Leer contenido del archivo
             with open(file_path, 'rb') as f:
                 file_content = f.read()
             
+        except Exception as e:
+            print(f"❌ Error al leer documento {file_path}: {e}")
+            return None
+        
+        return cls.add_document_from_bytes(client_id, os.path.basename(file_path), file_content)
+    
+    @classmethod
+    def add_document_from_bytes(cls, client_id: int, filename: str, file_content: bytes) -> Optional[Document]:
+        """
+        Añade un documento a PostgreSQL a partir de su contenido en memoria.
+        
+        Args:
+            client_id: ID del cliente
+            filename: Nombre original del archivo
+            file_content: Contenido binario del archivo
+            
+        Returns:
+            Document object si se crea exitosamente, None si hay error
+        """
+        try:
+            # Obtener información del archivo
+            file_extension = filename.lower().split('.')[-1] if '.' in filename else 'unknown'
+            file_size = len(file_content)
+            
             # Calcular hash para evitar duplicados por cliente
             content_hash = cls.calculate_file_hash(file_content)
             
@@ -81,11 +121,7 @@ class DocumentManager:
                 return existing_doc
             
             # Extraer texto según el tipo de archivo
-            extracted_text = ""
-            if file_extension == 'pdf':
-                extracted_text = cls.extract_text_from_pdf(file_content)
-            else:
-                print(f"⚠️ Tipo de archivo no soportado para extracción de texto: {file_extension}")
+            extracted_text = cls.extract_text(filename, file_content)
             
             # Crear nuevo documento en PostgreSQL
             new_document = Document(
@@ -96,7 +132,7 @@ class DocumentManager:
                 file_content=file_content,
                 extracted_text=extracted_text,
                 content_hash=content_hash,
-                is_processed=bool(extracted_text)  # True si se extrajo texto exitosamente
+                is_processed=len(extracted_text.strip()) >= MIN_TEXT_CHARS  # True si se extrajo texto útil
             )
             
             db.session.add(new_document)
@@ -115,17 +151,18 @@ class DocumentManager:
             return None
         except Exception as e:
             db.session.rollback()
-            print(f"❌ Error al procesar documento {file_path}: {e}")
+            print(f"❌ Error al procesar documento {filename}: {e}")
             return None
     
     @classmethod
     def add_documents_from_folder(cls, client_id: int, folder_path: str) -> List[Document]:
         """
-        Añade todos los PDFs de una carpeta a PostgreSQL.
+        Añade todos los documentos soportados de una carpeta a PostgreSQL
+        (PDF, DOCX, TXT, CSV/XLSX, HTML).
         
         Args:
             client_id: ID del cliente
-            folder_path: Ruta a la carpeta con PDFs
+            folder_path: Ruta a la carpeta con documentos
             
         Returns:
             Lista de documentos creados exitosamente
@@ -136,17 +173,18 @@ class DocumentManager:
             print(f"❌ Carpeta no encontrada: {folder_path}")
             return documents_added
         
-        # Buscar archivos PDF en la carpeta
-        pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
+        # Buscar archivos con extractor registrado en la carpeta
+        extensions = tuple(f".{ext}" for ext in supported_extensions())
+        document_files = [f for f in os.listdir(folder_path) if f.lower().endswith(extensions)]
         
-        if not pdf_files:
-            print(f"⚠️ No se encontraron archivos PDF en: {folder_path}")
+        if not document_files:
+            print(f"⚠️ No se encontraron documentos soportados en: {folder_path}")
             return documents_added
         
-        print(f"📁 Procesando {len(pdf_files)} archivos PDF...")
+        print(f"📁 Procesando {len(document_files)} archivos...")
         
-        for pdf_file in pdf_files:
-            file_path = os.path.join(folder_path, pdf_file)
+        for document_file in document_files:
+            file_path = os.path.join(folder_path, document_file)
             document = cls.add_document_from_file(client_id, file_path)
             
             if document:
@@ -92,28 +92,9 @@ class CRMExtension(BaseExtension):
             print(f"⚠️ Error configurando CRM: {e}")
     
     def _calculate_intent_score(self, message: str) -> int:
-        """Calcula score de intención de compra."""
-        # Palabras que indican alta intención
-        high_intent_words = [
-            'comprar', 'buy', 'purchase', 'cotización', 'quote', 'precio', 'price',
-            'cuando', 'when', 'disponible', 'available', 'financiamiento', 'financing'
-        ]
-        
-        # Palabras que indican baja intención  
-        low_intent_words = [
-            'información', 'info', 'curious', 'maybe', 'thinking', 'considering'
-        ]
-        
-        message_lower = message.lower()
-        
-        high_matches = sum(1 for word in high_intent_words if word in message_lower)
-        low_matches = sum(1 for word in low_intent_words if word in message_lower)
-        
-        # Score de 1 a 100
-        base_score = 50
-        score = base_score + (high_matches * 15) - (low_matches * 10)
-        
-        return max(1, min(100, score))
+        """Calcula score de intención de compra (mismo criterio que el pipeline de leads)."""
+        from ..commercial.lead_pipeline import score_intent
+        return score_intent(message)
     
     def _update_lead_score(self, client_id: int, intent_score: int):
         """Actualiza score del lead en sistema CRM separado."""
@@ -2,20 +2,34 @@
 import os
 import uuid
 import json
+import time
 from datetime import datetime
-from flask import render_template, request, jsonify, flash, redirect, url_for, current_app
+from flask import render_template, request, jsonify, flash, redirect, url_for, current_app, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from . import indexer_bp
 from .. import db
 from ..models import Client, Conversation, QueryLog, Document
+from ..text_extractors import supported_extensions
 import subprocess
 import sys
 
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'doc', 'docx'}
+ALLOWED_EXTENSIONS = set(supported_extensions())
+
+# Duración máxima de una conexión SSE de progreso: cada conexión ocupa un hilo
+# de waitress; al cumplirse, el cliente abre una nueva
+JOB_STREAM_MAX_SECONDS = int(os.environ.get('JOB_STREAM_MAX_SECONDS', 30))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def read_uploaded_files(uploaded_files):
+    """Lee los archivos válidos de la petición como tuplas (nombre, contenido)"""
+    files = []
+    for file in uploaded_files:
+        if file and file.filename and allowed_file(file.filename):
+            files.append((secure_filename(file.filename), file.read()))
+    return files
+
 @indexer_bp.route('/')
 def dashboard():
     """Panel principal del administrador de indexación"""
@@ -140,50 +154,24 @@ def add_client():
             
             client_id = new_client.id
             
-            # Si se subieron archivos, procesarlos
-            uploaded_files = request.files.getlist('documents')
-            processed_files = 0
+            # Si se subieron archivos, encolarlos para procesamiento en segundo plano
+            files = read_uploaded_files(request.files.getlist('documents'))
             
-            if uploaded_files and uploaded_files[0].filename:
-                # Crear directorio temporal para los archivos
-                temp_dir = os.path.join(current_app.instance_path, 'temp_uploads', str(uuid.uuid4()))
-                os.makedirs(temp_dir, exist_ok=True)
+            if files:
+                from modules.ingestion_queue import IngestionQueue
                 
-                try:
-                    for file in uploaded_files:
-                        if file and allowed_file(file.filename):
-                            filename = secure_filename(file.filename)
-                            file_path = os.path.join(temp_dir, filename)
-                            file.save(file_path)
-                            processed_files += 1
-                    
-                    # Crear índice con los archivos subidos
-                    if processed_files > 0:
-                        from indexer import create_client_index
-                        success = create_client_index(temp_dir, client_id)
-                        
-                        if not success:
-                            # Limpiar archivos temporales
-                            import shutil
-                            shutil.rmtree(temp_dir, ignore_errors=True)
-                            
-                            db.session.rollback()
-                            flash('Error al procesar los documentos. Cliente no creado.', 'error')
-                            return render_template('indexer_admin/add_client.html')
-                    
-                    # Limpiar archivos temporales
-                    import shutil
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    
-                except Exception as e:
-                    # Limpiar en caso de error
-                    import shutil
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    raise e
-            
-            db.session.commit()
+                # El trabajo se confirma junto con el cliente en la misma transacción
+                job = IngestionQueue.enqueue_files(client_id, files)
+                if not job:
+                    flash('Error al encolar los documentos. Cliente no creado.', 'error')
+                    return render_template('indexer_admin/add_client.html')
+                
+                flash(f'Cliente "{name}" creado. {len(files)} documentos en cola de indexación (trabajo #{job.id}). '
+                      f'ID público: {new_client.public_id}', 'success')
+            else:
+                db.session.commit()
+                flash(f'Cliente "{name}" creado exitosamente. ID público: {new_client.public_id}', 'success')
             
-            flash(f'Cliente "{name}" creado exitosamente. ID público: {new_client.public_id}', 'success')
             return redirect(url_for('indexer_admin.client_detail', client_id=client_id))
             
         except Exception as e:
@@ -195,7 +183,7 @@ def add_client():
 
 @indexer_bp.route('/upload-documents/<int:client_id>', methods=['POST'])
 def upload_documents(client_id):
-    """Subir documentos adicionales a un cliente existente"""
+    """Encola documentos adicionales de un cliente existente para indexación"""
     try:
         client = Client.query.get_or_404(client_id)
         
@@ -203,70 +191,96 @@ def upload_documents(client_id):
         if not uploaded_files or not uploaded_files[0].filename:
             return jsonify({'success': False, 'message': 'No se seleccionaron archivos'})
         
-        # Crear directorio temporal
-        temp_dir = os.path.join(current_app.instance_path, 'temp_uploads', str(uuid.uuid4()))
-        os.makedirs(temp_dir, exist_ok=True)
+        files = read_uploaded_files(uploaded_files)
+        if not files:
+            return jsonify({'success': False, 'message': 'No se encontraron archivos válidos'})
         
-        processed_files = 0
+        # Extracción, embeddings e índice FAISS se ejecutan en el worker de ingesta
+        from modules.ingestion_queue import IngestionQueue
         
-        try:
-            for file in uploaded_files:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(temp_dir, filename)
-                    file.save(file_path)
-                    processed_files += 1
-            
-            if processed_files == 0:
-                return jsonify({'success': False, 'message': 'No se encontraron archivos válidos'})
-            
-            # Agregar documentos al cliente existente con procesamiento automático completo
-            from modules.document_manager import DocumentManager
-            from modules.vector_manager import VectorManager
-            
-            doc_manager = DocumentManager()
-            vector_manager = VectorManager()
-            
-            added_documents = []
-            for filename in os.listdir(temp_dir):
-                file_path = os.path.join(temp_dir, filename)
-                if os.path.isfile(file_path):
-                    # 1. Agregar documento y extraer texto
-                    document = doc_manager.add_document_from_file(client_id, file_path)
-                    if document:
-                        added_documents.append(document)
-                        print(f"✅ Documento agregado: {document.filename}")
-                        
-                        # 2. Crear embeddings automáticamente
-                        embeddings = vector_manager.create_embeddings_from_document(document.id)
-                        print(f"✅ {len(embeddings)} embeddings creados para {document.filename}")
+        job = IngestionQueue.enqueue_files(client_id, files)
+        if not job:
+            return jsonify({'success': False, 'message': 'Error al encolar los documentos'})
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': url_for('indexer_admin.job_status', job_id=job.id),
+            'stream_url': url_for('indexer_admin.job_stream', job_id=job.id),
+            'message': f'{len(files)} documentos en cola de indexación (trabajo #{job.id})'
+        }), 202
+        
+    except Exception as e:
+        current_app.logger.error(f"Error subiendo documentos para cliente {client_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@indexer_bp.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Estado y progreso por documento de un trabajo de ingesta (polling)"""
+    from modules.ingestion_queue import IngestionQueue
+    
+    status = IngestionQueue.get_job_status(job_id)
+    if not status:
+        return jsonify({'success': False, 'message': 'Trabajo no encontrado'}), 404
+    
+    return jsonify({'success': True, 'job': status})
+
+@indexer_bp.route('/jobs/<int:job_id>/stream')
+def job_stream(job_id):
+    """
+    Progreso de un trabajo de ingesta como Server-Sent Events. La conexión
+    dura como máximo JOB_STREAM_MAX_SECONDS y termina con el evento
+    'reconnect' para que el navegador la vuelva a abrir.
+    """
+    from modules.ingestion_queue import IngestionQueue
+    
+    def generate():
+        last_payload = None
+        deadline = time.monotonic() + JOB_STREAM_MAX_SECONDS
+        while True:
+            db.session.expire_all()  # Leer siempre el estado confirmado por el worker
+            status = IngestionQueue.get_job_status(job_id)
             
-            # 3. Recrear índice FAISS con todos los embeddings del cliente
-            if added_documents:
-                faiss_index = vector_manager.create_faiss_index_for_client(client_id)
-                if faiss_index:
-                    print(f"✅ Índice FAISS actualizado con {faiss_index.total_vectors} vectores")
-                
-            added_count = len(added_documents)
+            if not status:
+                yield 'event: error\ndata: {"message": "Trabajo no encontrado"}\n\n'
+                return
             
-            # Limpiar archivos temporales
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            payload = json.dumps(status)
+            if payload != last_payload:
+                yield f'data: {payload}\n\n'
+                last_payload = payload
+            else:
+                yield ': keep-alive\n\n'
             
-            return jsonify({
-                'success': True, 
-                'message': f'{added_count} documentos agregados exitosamente'
-            })
+            if status['is_final']:
+                return
             
-        except Exception as e:
-            # Limpiar en caso de error
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise e
+            if time.monotonic() >= deadline:
+                yield 'event: reconnect\ndata: {}\n\n'
+                return
             
-    except Exception as e:
-        current_app.logger.error(f"Error subiendo documentos para cliente {client_id}: {str(e)}")
-        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+            time.sleep(1)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Evitar buffering en nginx
+    return response
+
+@indexer_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancela un trabajo de ingesta pendiente o en ejecución"""
+    from modules.ingestion_queue import IngestionQueue
+    
+    result = IngestionQueue.cancel_job(job_id)
+    return jsonify(result), (200 if result['success'] else 409)
+
+@indexer_bp.route('/client/<int:client_id>/jobs')
+def client_jobs(client_id):
+    """Trabajos de ingesta recientes de un cliente"""
+    from modules.ingestion_queue import IngestionQueue
+    
+    Client.query.get_or_404(client_id)
+    return jsonify({'success': True, 'jobs': IngestionQueue.list_client_jobs(client_id)})
 
 @indexer_bp.route('/reindex-client/<int:client_id>', methods=['POST'])
 def reindex_client(client_id):
@@ -0,0 +1,433 @@
+# modules/ingestion_queue.py
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import update
+from .models import IngestionJob, IngestionJobDocument
+from . import db
+
+# Estados considerados finales (el trabajo ya no cambiará)
+FINAL_JOB_STATES = ('completed', 'failed', 'cancelled')
+UNFINISHED_DOCUMENT_STATES = ('pending', 'extracting', 'embedding')
+
+
+class IngestionCancelled(Exception):
+    """Se lanza cuando un trabajo de ingesta fue cancelado durante su ejecución."""
+    pass
+
+
+class IngestionQueue:
+    """
+    Cola persistente de trabajos de ingesta respaldada por PostgreSQL.
+
+    El panel del indexador encola los archivos y responde inmediatamente;
+    los workers (`flask ingestion-worker`) toman los trabajos con
+    SELECT ... FOR UPDATE SKIP LOCKED y reportan el progreso por documento.
+    """
+
+    # Un trabajo 'running' sin latido durante este tiempo se considera abandonado
+    STALE_AFTER = timedelta(minutes=10)
+
+    @classmethod
+    def enqueue_files(cls, client_id: int, files: List[Tuple[str, bytes]],
+                      rebuild_index: bool = True) -> Optional[IngestionJob]:
+        """
+        Crea un trabajo de ingesta con los archivos recibidos.
+
+        Args:
+            client_id: ID del cliente
+            files: Lista de tuplas (nombre_archivo, contenido)
+            rebuild_index: Si True, recrea el índice FAISS al terminar
+
+        Returns:
+            IngestionJob creado o None si hay error
+        """
+        try:
+            job = IngestionJob(
+                client_id=client_id,
+                status='pending',
+                total_documents=len(files),
+                rebuild_index=rebuild_index
+            )
+
+            for filename, file_content in files:
+                job.documents.append(IngestionJobDocument(
+                    filename=filename,
+                    file_content=file_content,
+                    file_size=len(file_content),
+                    status='pending'
+                ))
+
+            db.session.add(job)
+            db.session.commit()
+
+            print(f"📥 Trabajo de ingesta {job.id} encolado: {len(files)} documentos para cliente {client_id}")
+            return job
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error encolando trabajo de ingesta: {e}")
+            return None
+
+    @classmethod
+    def get_job_status(cls, job_id: int) -> Optional[Dict]:
+        """
+        Obtiene el estado de un trabajo y el progreso de cada documento.
+        """
+        job = IngestionJob.query.get(job_id)
+        if not job:
+            return None
+
+        documents = [
+            {
+                'id': doc.id,
+                'filename': doc.filename,
+                'file_size': doc.file_size,
+                'status': doc.status,
+                'chunks_total': doc.chunks_total,
+                'chunks_done': doc.chunks_done,
+                'progress': round(doc.chunks_done / doc.chunks_total * 100, 1) if doc.chunks_total else (
+                    100.0 if doc.status in ('completed', 'skipped') else 0.0
+                ),
+                'document_id': doc.document_id,
+                'error': doc.error_message
+            }
+            for doc in job.documents
+        ]
+
+        finished = job.processed_documents + job.failed_documents
+
+        return {
+            'job_id': job.id,
+            'client_id': job.client_id,
+            'status': job.status,
+            'is_final': job.status in FINAL_JOB_STATES,
+            'total_documents': job.total_documents,
+            'processed_documents': job.processed_documents,
+            'failed_documents': job.failed_documents,
+            'progress': round(finished / job.total_documents * 100, 1) if job.total_documents else 0.0,
+            'error': job.error_message,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'documents': documents
+        }
+
+    @classmethod
+    def list_client_jobs(cls, client_id: int, limit: int = 20) -> List[Dict]:
+        """
+        Lista los trabajos más recientes de un cliente (sin detalle por documento).
+        """
+        jobs = IngestionJob.query.filter_by(client_id=client_id).order_by(
+            IngestionJob.created_at.desc()
+        ).limit(limit).all()
+
+        return [
+            {
+                'job_id': job.id,
+                'status': job.status,
+                'total_documents': job.total_documents,
+                'processed_documents': job.processed_documents,
+                'failed_documents': job.failed_documents,
+                'created_at': job.created_at.isoformat() if job.created_at else None,
+                'finished_at': job.finished_at.isoformat() if job.finished_at else None
+            }
+            for job in jobs
+        ]
+
+    @classmethod
+    def cancel_job(cls, job_id: int) -> Dict:
+        """
+        Cancela un trabajo. Los trabajos pendientes se cancelan de inmediato;
+        los que están en ejecución se detienen al terminar el documento actual.
+        """
+        try:
+            job = IngestionJob.query.with_for_update().get(job_id)
+            if not job:
+                return {'success': False, 'error': 'Trabajo no encontrado'}
+
+            if job.status in FINAL_JOB_STATES:
+                return {'success': False, 'error': f'El trabajo ya terminó ({job.status})'}
+
+            if job.status == 'pending':
+                job.status = 'cancelled'
+                job.finished_at = datetime.utcnow()
+                for doc in job.documents:
+                    doc.status = 'cancelled'
+                    doc.file_content = None
+            else:
+                job.status = 'cancel_requested'
+
+            db.session.commit()
+
+            return {'success': True, 'job_id': job_id, 'status': job.status}
+
+        except Exception as e:
+            db.session.rollback()
+            return {'success': False, 'error': f'Error cancelando trabajo: {str(e)}'}
+
+    @classmethod
+    def claim_next_job(cls, worker_id: str) -> Optional[IngestionJob]:
+        """
+        Toma el siguiente trabajo pendiente de forma atómica.
+        SKIP LOCKED permite que varios workers consulten la cola sin bloquearse.
+        """
+        try:
+            job = IngestionJob.query.filter_by(status='pending').order_by(
+                IngestionJob.created_at.asc(), IngestionJob.id.asc()
+            ).with_for_update(skip_locked=True).first()
+
+            if not job:
+                db.session.rollback()
+                return None
+
+            now = datetime.utcnow()
+            job.status = 'running'
+            job.worker_id = worker_id
+            job.started_at = now
+            job.heartbeat_at = now
+            db.session.commit()
+
+            return job
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error tomando trabajo de la cola: {e}")
+            return None
+
+    @classmethod
+    def requeue_stale_jobs(cls) -> int:
+        """
+        Devuelve a la cola los trabajos cuyo worker dejó de enviar latidos.
+        """
+        try:
+            limit = datetime.utcnow() - cls.STALE_AFTER
+            result = db.session.execute(
+                update(IngestionJob)
+                .where(IngestionJob.status == 'running', IngestionJob.heartbeat_at < limit)
+                .values(status='pending', worker_id=None)
+            )
+            db.session.commit()
+
+            if result.rowcount:
+                print(f"♻️ {result.rowcount} trabajos abandonados devueltos a la cola")
+            return result.rowcount
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error recuperando trabajos abandonados: {e}")
+            return 0
+
+    @classmethod
+    def _update_document_progress(cls, job_id: int, job_document_id: int, **values):
+        """
+        Actualiza el progreso con una conexión propia, para que sea visible
+        de inmediato sin confirmar la transacción de embeddings en curso.
+        """
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(IngestionJobDocument)
+                .where(IngestionJobDocument.id == job_document_id)
+                .values(updated_at=now, **values)
+            )
+            conn.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id)
+                .values(heartbeat_at=now)
+            )
+
+    @classmethod
+    def _is_cancel_requested(cls, job_id: int) -> bool:
+        with db.engine.connect() as conn:
+            status = conn.execute(
+                db.select(IngestionJob.status).where(IngestionJob.id == job_id)
+            ).scalar()
+        return status == 'cancel_requested'
+
+    @classmethod
+    def process_job(cls, job_id: int) -> bool:
+        """
+        Ejecuta un trabajo ya tomado: extrae texto, crea embeddings por documento
+        y recrea el índice FAISS del cliente al final.
+
+        Returns:
+            True si el trabajo terminó (completado o cancelado), False si falló
+        """
+        from .document_manager import DocumentManager
+        from .vector_manager import VectorManager
+
+        job = IngestionJob.query.get(job_id)
+        if not job:
+            print(f"❌ Trabajo de ingesta no encontrado: {job_id}")
+            return False
+
+        print(f"🚀 Procesando trabajo de ingesta {job.id} (cliente {job.client_id}, {job.total_documents} documentos)")
+
+        doc_manager = DocumentManager()
+        vector_manager = VectorManager()
+        added_documents = 0
+
+        try:
+            # Incluye documentos interrumpidos si el trabajo fue recuperado de un worker caído
+            pending_docs = [doc for doc in job.documents if doc.status in UNFINISHED_DOCUMENT_STATES]
+
+            for job_doc in pending_docs:
+                if cls._is_cancel_requested(job.id):
+                    raise IngestionCancelled()
+
+                cls._update_document_progress(job.id, job_doc.id, status='extracting')
+
+                try:
+                    def report(done, total, _job_doc_id=job_doc.id):
+                        cls._update_document_progress(job.id, _job_doc_id,
+                                                      chunks_done=done, chunks_total=total)
+
+                    # Nueva versión de un documento existente: solo se re-embeben los chunks cambiados
+                    delta = vector_manager.reindex_document_delta(
+                        job.client_id, job_doc.filename, job_doc.file_content,
+                        update_index=job.rebuild_index, progress_callback=report
+                    )
+
+                    if delta and delta.get('error'):
+                        # Fallo con versión anterior: indexarlo como nuevo duplicaría el documento
+                        raise RuntimeError(f"Re-indexación delta fallida: {delta['error']}")
+                    elif delta:
+                        job_doc.document_id = delta['document'].id
+                        job_doc.status = 'skipped' if delta['unchanged'] else 'completed'
+                        if job.rebuild_index and not delta['index_updated']:
+                            # Actualización incremental fallida: reconstrucción completa al final
+                            added_documents += 1
+                    else:
+                        document = doc_manager.add_document_from_bytes(
+                            job.client_id, job_doc.filename, job_doc.file_content
+                        )
+
+                        if not document:
+                            raise ValueError('No se pudo guardar el documento')
+
+                        job_doc.document_id = document.id
+                        if document.processed_date is not None:
+                            # Documento idéntico ya indexado para este cliente
+                            job_doc.status = 'skipped'
+                        else:
+                            cls._update_document_progress(job.id, job_doc.id, status='embedding',
+                                                          document_id=document.id)
+
+                            embeddings = vector_manager.create_embeddings_from_document(
+                                document.id, progress_callback=report
+                            )
+
+                            if embeddings:
+                                job_doc.status = 'completed'
+                                added_documents += 1
+                            else:
+                                job_doc.status = 'failed'
+                                job_doc.error_message = 'No se generaron embeddings (¿documento sin texto?)'
+
+                except Exception as e:
+                    db.session.rollback()
+                    job_doc.status = 'failed'
+                    job_doc.error_message = str(e)
+                    print(f"❌ Error procesando {job_doc.filename}: {e}")
+
+                # Liberar el contenido subido y registrar el resultado
+                job_doc.file_content = None
+                if job_doc.status == 'failed':
+                    job.failed_documents += 1
+                else:
+                    job.processed_documents += 1
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+            # Recrear índice FAISS una sola vez con todos los embeddings del cliente
+            # (los documentos re-indexados por delta ya actualizaron el índice, salvo si falló)
+            if added_documents and job.rebuild_index:
+                faiss_index = vector_manager.create_faiss_index_for_client(job.client_id)
+                if not faiss_index:
+                    raise RuntimeError('Error recreando el índice FAISS')
+                print(f"✅ Índice FAISS actualizado con {faiss_index.total_vectors} vectores")
+                added_documents = 0  # Ya indexados: la cancelación no debe reconstruir otra vez
+
+            # Releer el estado con la fila bloqueada (igual que cancel_job): una
+            # cancelación pedida durante el último documento no se sobrescribe
+            db.session.refresh(job, with_for_update=True)
+            if job.status == 'cancel_requested':
+                raise IngestionCancelled()
+
+            job.status = 'failed' if job.failed_documents == job.total_documents else 'completed'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+            print(f"✅ Trabajo {job.id} terminado: {job.processed_documents} procesados, {job.failed_documents} fallidos")
+            return job.status == 'completed'
+
+        except IngestionCancelled:
+            db.session.rollback()
+            for job_doc in job.documents:
+                if job_doc.status in UNFINISHED_DOCUMENT_STATES:
+                    job_doc.status = 'cancelled'
+                    job_doc.file_content = None
+
+            # Lo ya procesado debe quedar disponible para las búsquedas
+            if added_documents and job.rebuild_index:
+                vector_manager.create_faiss_index_for_client(job.client_id)
+
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+            print(f"🛑 Trabajo {job.id} cancelado")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+            print(f"❌ Trabajo {job.id} fallido: {e}")
+            return False
+
+    @classmethod
+    def run_worker(cls, poll_interval: float = 2.0, once: bool = False):
+        """
+        Bucle principal de un worker: recupera trabajos abandonados,
+        toma el siguiente pendiente y lo procesa.
+
+        Args:
+            poll_interval: Segundos de espera cuando la cola está vacía
+            once: Si True, procesa como máximo un trabajo y termina
+        """
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        print(f"👷 Worker de ingesta iniciado: {worker_id}")
+
+        while True:
+            cls.requeue_stale_jobs()
+            job = cls.claim_next_job(worker_id)
+
+            if job:
+                cls.process_job(job.id)
+                db.session.remove()
+            elif once:
+                return
+            else:
+                time.sleep(poll_interval)
+
+            if once:
+                return
+
+
+def run_worker_process(poll_interval: float = 2.0):
+    """
+    Punto de entrada para procesos worker independientes.
+    Cada proceso crea su propia app y su propio pool de conexiones.
+    """
+    from . import create_app
+
+    app = create_app()
+    with app.app_context():
+        IngestionQueue.run_worker(poll_interval=poll_interval)
@@ -54,6 +54,10 @@ class Conversation(db.Model):
     message_type = db.Column(db.String(20), default='text')  # 'text', 'image', 'document'
     platform = db.Column(db.String(20), default='web')      # 'web', 'telegram'
     
+    __table_args__ = (
+        db.Index('ix_conversations_client_chat_timestamp', 'client_id', 'chat_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<Conversation {self.chat_id}: {self.sender}>'
 
@@ -106,6 +110,7 @@ class Embedding(db.Model):
     # Contenido del chunk
     text_chunk = db.Column(TEXT, nullable=False)
     chunk_index = db.Column(db.Integer, nullable=False)     # Posición dentro del documento
+    chunk_hash = db.Column(db.String(64), nullable=True)    # SHA-256 del chunk, para re-indexación delta
     
     # Vector de embedding (serializado como bytes)
     embedding_vector = db.Column(BYTEA, nullable=False)     # Vector numpy serializado
@@ -118,6 +123,11 @@ class Embedding(db.Model):
     # Relación con documento (especificar foreign_keys explícitamente)
     document = db.relationship('Document', backref='embeddings', foreign_keys=[document_id])
     
+    __table_args__ = (
+        db.Index('ix_embeddings_document_chunk_hash', 'document_id', 'chunk_hash'),
+        db.Index('ix_embeddings_client_document_chunk', 'client_id', 'document_id', 'chunk_index'),
+    )
+    
     def __repr__(self):
         return f'<Embedding {self.id} - Doc: {self.document_id}>'
 
@@ -147,6 +157,10 @@ class FAISSIndex(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     version = db.Column(db.Integer, default=1)
     
+    __table_args__ = (
+        db.Index('ix_faiss_indexes_client_name_active', 'client_id', 'index_name', 'is_active'),
+    )
+    
     def __repr__(self):
         return f'<FAISSIndex {self.index_name} - Client: {self.client_id}>'
 
@@ -181,5 +195,144 @@ class QueryLog(db.Model):
     client = db.relationship('Client', backref='query_logs')
     conversation = db.relationship('Conversation', backref='query_logs')
     
+    __table_args__ = (
+        db.Index('ix_query_logs_client_timestamp', 'client_id', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<QueryLog {self.id} - Client: {self.client_id}>'
+
+class IngestionJob(db.Model):
+    """
+    Trabajo de ingesta de documentos encolado desde el panel del indexador.
+    Los workers toman los trabajos pendientes y procesan extracción, embeddings
+    e índice FAISS fuera de la petición HTTP.
+    """
+    __tablename__ = 'salesmind_ingestion_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    
+    # Estados: 'pending', 'running', 'cancel_requested', 'completed', 'failed', 'cancelled'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    
+    # Progreso agregado
+    total_documents = db.Column(db.Integer, nullable=False, default=0)
+    processed_documents = db.Column(db.Integer, nullable=False, default=0)
+    failed_documents = db.Column(db.Integer, nullable=False, default=0)
+    rebuild_index = db.Column(db.Boolean, default=True)   # Recrear índice FAISS al terminar
+    error_message = db.Column(TEXT, nullable=True)
+    
+    # Control de workers
+    worker_id = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    
+    # Fechas
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    # Relaciones
+    client = db.relationship('Client', backref='ingestion_jobs')
+    documents = db.relationship('IngestionJobDocument', backref='job', lazy=True,
+                                cascade='all, delete-orphan',
+                                order_by='IngestionJobDocument.id')
+    
+    __table_args__ = (
+        db.Index('ix_ingestion_jobs_status_created', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<IngestionJob {self.id} - Client: {self.client_id} [{self.status}]>'
+
+
+class IngestionJobDocument(db.Model):
+    """
+    Documento individual dentro de un trabajo de ingesta, con su progreso.
+    El contenido subido se guarda aquí hasta que el worker lo procesa.
+    """
+    __tablename__ = 'salesmind_ingestion_job_documents'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('salesmind_ingestion_jobs.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_content = db.Column(BYTEA, nullable=True)          # Se libera al terminar el procesamiento
+    file_size = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Estados: 'pending', 'extracting', 'embedding', 'completed', 'failed', 'cancelled', 'skipped'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    chunks_total = db.Column(db.Integer, nullable=False, default=0)
+    chunks_done = db.Column(db.Integer, nullable=False, default=0)
+    document_id = db.Column(db.Integer, db.ForeignKey('salesmind_documents.id'), nullable=True)
+    error_message = db.Column(TEXT, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<IngestionJobDocument {self.filename} - Job: {self.job_id} [{self.status}]>'
+
+
+class OCRPageCache(db.Model):
+    """
+    Texto OCR de páginas escaneadas, indexado por el hash de la página renderizada.
+    Evita repetir OCR cuando un catálogo se vuelve a subir o comparte páginas.
+    """
+    __tablename__ = 'salesmind_ocr_page_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    page_hash = db.Column(db.String(64), nullable=False)      # SHA-256 del PNG renderizado
+    language = db.Column(db.String(50), nullable=False)       # Idiomas de Tesseract, ej: 'spa+eng'
+    text = db.Column(TEXT, nullable=False)
+    engine = db.Column(db.String(50), nullable=False, default='tesseract')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('page_hash', 'language', name='unique_ocr_page_language'),
+    )
+    
+    def __repr__(self):
+        return f'<OCRPageCache {self.page_hash[:8]} [{self.language}]>'
+
+
+class DownloadToken(db.Model):
+    """
+    Tokens temporales de descarga de cotizaciones (antes en memoria del proceso).
+    Compartidos entre workers para que cualquiera sirva /secure-download/<token>.
+    """
+    __tablename__ = 'salesmind_download_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), unique=True, nullable=False)
+    filepath = db.Column(db.String(500), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DownloadToken {self.filename} - expira {self.expires_at}>'
+
+
+class Artifact(db.Model):
+    """
+    Índice de los PDFs generados (cotizaciones y facturas). Resuelve número de
+    documento -> archivo con una consulta indexada, sin recorrer directorios.
+    Varias filas pueden compartir storage_path cuando el contenido es idéntico.
+    """
+    __tablename__ = 'salesmind_artifacts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)            # 'quote' o 'invoice'
+    name = db.Column(db.String(100), nullable=False)           # Número de cotización o factura
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)       # Nombre de descarga
+    storage_path = db.Column(db.String(500), nullable=False)   # Ruta relativa a la raíz del tipo
+    content_hash = db.Column(db.String(64), index=True)        # SHA-256, se calcula al compactar
+    file_size = db.Column(db.Integer)
+    expires_at = db.Column(db.DateTime, index=True)            # Nulo = se conserva indefinidamente
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'name', name='unique_artifact_kind_name'),
+    )
+    
     def __repr__(self):
-        return f'<QueryLog {self.id} - Client: {self.client_id}>'
\ No newline at end of file
+        return f'<Artifact {self.kind}:{self.name} -> {self.storage_path}>'
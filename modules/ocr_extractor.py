@@ -0,0 +1,214 @@
+# modules/ocr_extractor.py
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .models import OCRPageCache
+from . import db
+
+# Una página con menos caracteres que esto se considera sin capa de texto
+MIN_TEXT_CHARS = 25
+# Fracción mínima de la página cubierta por imágenes para tratarla como escaneada
+MIN_IMAGE_COVERAGE = 0.5
+
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_LANGUAGE = os.environ.get('OCR_LANGUAGE', 'spa+eng')
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+# Páginas escaneadas renderizadas en memoria a la vez
+OCR_BATCH_PAGES = max(OCR_WORKERS * 2, 4)
+
+_ocr_pool = None
+
+
+def _ocr_image(args: Tuple[bytes, str]) -> str:
+    """
+    Ejecuta Tesseract sobre una imagen PNG. Función de módulo para poder
+    enviarse a los procesos del pool.
+    """
+    png_bytes, language = args
+    import pytesseract
+    from PIL import Image
+
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        return pytesseract.image_to_string(image, lang=language)
+
+
+def _get_ocr_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool de procesos compartido; se crea la primera vez que hace falta OCR."""
+    global _ocr_pool
+    if _ocr_pool is None and OCR_WORKERS > 1:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _ocr_pool
+
+
+class OCRExtractor:
+    """
+    Extracción de texto de PDFs con OCR solo para las páginas escaneadas.
+
+    Las páginas con capa de texto siguen en la ruta rápida de PyMuPDF; las
+    páginas que son solo imagen se renderizan y pasan por Tesseract en un pool
+    de procesos. El resultado de cada página se guarda en PostgreSQL por hash
+    de la imagen renderizada, así que catálogos re-subidos no repiten OCR.
+    """
+
+    @staticmethod
+    def is_ocr_available() -> bool:
+        """Indica si pytesseract y el binario de Tesseract están disponibles."""
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def classify_page(page: fitz.Page, page_text: str) -> str:
+        """
+        Clasifica una página como 'text' (tiene capa de texto útil) o 'image'
+        (escaneada: casi sin texto y cubierta mayormente por imágenes).
+        """
+        if len(page_text.strip()) >= MIN_TEXT_CHARS:
+            return 'text'
+
+        page_area = abs(page.rect)
+        if not page_area:
+            return 'text'
+
+        image_area = 0.0
+        for info in page.get_image_info():
+            image_area += abs(fitz.Rect(info['bbox']) & page.rect)
+
+        return 'image' if image_area / page_area >= MIN_IMAGE_COVERAGE else 'text'
+
+    @staticmethod
+    def calculate_page_hash(png_bytes: bytes) -> str:
+        """Hash SHA-256 de la página renderizada (clave de la caché de OCR)."""
+        return hashlib.sha256(png_bytes).hexdigest()
+
+    @classmethod
+    def _load_cached_pages(cls, page_hashes: List[str], language: str) -> Dict[str, str]:
+        if not page_hashes:
+            return {}
+        rows = db.session.query(OCRPageCache.page_hash, OCRPageCache.text).filter(
+            OCRPageCache.page_hash.in_(page_hashes),
+            OCRPageCache.language == language
+        ).all()
+        return {page_hash: text for page_hash, text in rows}
+
+    @classmethod
+    def _store_cached_pages(cls, results: Dict[str, str], language: str):
+        """
+        Guarda los textos OCR en una conexión aparte: la caché no depende de que
+        la transacción del documento termine bien, y otros workers la reutilizan.
+        """
+        if not results:
+            return
+        rows = [
+            {
+                'page_hash': page_hash,
+                'language': language,
+                'text': text,
+                'engine': 'tesseract',
+                'created_at': datetime.utcnow()
+            }
+            for page_hash, text in results.items()
+        ]
+        statement = pg_insert(OCRPageCache.__table__).values(rows).on_conflict_do_nothing(
+            constraint='unique_ocr_page_language'
+        )
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(statement)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la caché de OCR: {e}")
+
+    @classmethod
+    def ocr_images(cls, images: List[bytes], language: str = OCR_LANGUAGE) -> List[str]:
+        """
+        Ejecuta OCR sobre una lista de imágenes PNG, en paralelo si hay pool.
+        """
+        jobs = [(png_bytes, language) for png_bytes in images]
+        pool = _get_ocr_pool() if len(jobs) > 1 else None
+        if pool is None:
+            return [_ocr_image(job) for job in jobs]
+        return list(pool.map(_ocr_image, jobs))
+
+    @classmethod
+    def _resolve_image_pages(cls, image_pages: Dict[int, Tuple[str, bytes]], page_texts: List[str],
+                             language: str, stats: Dict):
+        """
+        Sustituye el texto de un lote de páginas escaneadas por su OCR,
+        usando la caché y procesando en el pool solo las páginas nuevas.
+        """
+        cached = cls._load_cached_pages([h for h, _ in image_pages.values()], language)
+        stats['ocr_cache_hits'] += sum(1 for h, _ in image_pages.values() if h in cached)
+
+        # Deduplicar páginas idénticas dentro del mismo lote
+        missing = {}
+        for page_hash, png_bytes in image_pages.values():
+            if page_hash not in cached:
+                missing.setdefault(page_hash, png_bytes)
+
+        if missing:
+            texts = cls.ocr_images(list(missing.values()), language)
+            new_results = dict(zip(missing.keys(), texts))
+            cls._store_cached_pages(new_results, language)
+            cached.update(new_results)
+            stats['ocr_pages'] += len(missing)
+
+        for page_number, (page_hash, _) in image_pages.items():
+            page_texts[page_number] = cached.get(page_hash, page_texts[page_number])
+
+    @classmethod
+    def extract_text(cls, file_content: bytes, language: str = OCR_LANGUAGE) -> Tuple[str, Dict]:
+        """
+        Extrae el texto de un PDF aplicando OCR solo a las páginas escaneadas.
+        Las páginas escaneadas se procesan por lotes para acotar la memoria
+        usada por las imágenes renderizadas.
+
+        Returns:
+            (texto completo, estadísticas por tipo de página)
+        """
+        stats = {'pages': 0, 'text_pages': 0, 'image_pages': 0, 'ocr_cache_hits': 0, 'ocr_pages': 0}
+        page_texts = []
+        batch = {}  # índice de página -> (hash, png)
+        ocr_available = None
+
+        with fitz.open(stream=io.BytesIO(file_content), filetype="pdf") as doc:
+            for page_number, page in enumerate(doc):
+                page_text = page.get_text()
+                page_texts.append(page_text)
+
+                if cls.classify_page(page, page_text) != 'image':
+                    stats['text_pages'] += 1
+                    continue
+
+                stats['image_pages'] += 1
+                if ocr_available is None:
+                    ocr_available = cls.is_ocr_available()
+                    if not ocr_available:
+                        print("⚠️ PDF con páginas escaneadas pero Tesseract no está instalado")
+                if not ocr_available:
+                    continue
+
+                png_bytes = page.get_pixmap(dpi=OCR_DPI).tobytes('png')
+                batch[page_number] = (cls.calculate_page_hash(png_bytes), png_bytes)
+
+                if len(batch) >= OCR_BATCH_PAGES:
+                    cls._resolve_image_pages(batch, page_texts, language, stats)
+                    batch = {}
+
+            if batch:
+                cls._resolve_image_pages(batch, page_texts, language, stats)
+
+        stats['pages'] = len(page_texts)
+        if stats['image_pages']:
+            print(f"🔍 OCR: {stats['image_pages']} páginas escaneadas de {stats['pages']} "
+                  f"({stats['ocr_pages']} procesadas, {stats['ocr_cache_hits']} en caché)")
+
+        full_text = "\n\n".join(text.strip() for text in page_texts if text.strip())
+        return full_text, stats
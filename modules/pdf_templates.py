@@ -0,0 +1,196 @@
+# modules/pdf_templates.py
+"""
+Capa de renderizado de PDFs (cotizaciones y facturas) con plantillas cacheadas.
+
+La parte estática de cada documento (cabecera de la empresa, términos y
+condiciones, pie) se prepara una sola vez por cliente: los estilos y los
+párrafos se parsean al crear la plantilla, y en cada PDF se dibujan una vez
+como form XObject de reportlab que todas las páginas reutilizan con doForm.
+Por documento solo se componen los flowables dinámicos (datos de la
+cotización/factura y la tabla de items).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Paragraph
+
+
+@lru_cache(maxsize=1)
+def get_base_styles():
+    """Hoja de estilos base de reportlab (se crea una sola vez por proceso)."""
+    return getSampleStyleSheet()
+
+
+@lru_cache(maxsize=None)
+def get_paragraph_style(name: str, parent: str = 'Normal', text_color: str = None,
+                        **attributes) -> ParagraphStyle:
+    """ParagraphStyle cacheado por nombre y atributos (text_color en hexadecimal)."""
+    if text_color:
+        attributes['textColor'] = colors.HexColor(text_color)
+    return ParagraphStyle(name, parent=get_base_styles()[parent], **attributes)
+
+
+def quote_styles() -> Dict[str, ParagraphStyle]:
+    """Estilos compartidos por las cotizaciones (antes recreados por instancia)."""
+    return {
+        'title': get_paragraph_style('CustomTitle', 'Heading1', fontSize=24, spaceAfter=30,
+                                     alignment=TA_CENTER, text_color='#2E86AB'),
+        'subtitle': get_paragraph_style('CustomSubtitle', 'Heading2', fontSize=16, spaceAfter=12,
+                                        text_color='#A23B72'),
+        'normal': get_paragraph_style('CustomNormal', 'Normal', fontSize=11, spaceAfter=6,
+                                      alignment=TA_LEFT),
+        'price': get_paragraph_style('PriceStyle', 'Normal', fontSize=14, spaceAfter=6,
+                                     text_color='#F18F01', alignment=TA_RIGHT),
+    }
+
+
+class CachedPageTemplate:
+    """
+    Plantilla de página con contenido estático pre-parseado.
+
+    Args:
+        key: Clave única de la plantilla (tipo de documento + cliente)
+        title: Título de la cabecera
+        header_lines: Líneas de la cabecera (datos de la empresa)
+        footer_markup: Marcado del pie (términos y condiciones)
+        accent_color: Color de la cabecera
+    """
+
+    def __init__(self, key: str, title: str, header_lines: Sequence[str], footer_markup: str,
+                 accent_color: str = '#2E86AB', pagesize: Tuple[float, float] = A4,
+                 margin: float = 54):
+        self.key = key
+        self.form_name = 'static_' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        self.pagesize = pagesize
+        self.margin = margin
+        self._lock = threading.Lock()
+
+        page_width, page_height = pagesize
+        content_width = page_width - 2 * margin
+
+        title_style = get_paragraph_style('TemplateTitle', 'Heading1', fontSize=20, alignment=TA_LEFT,
+                                          text_color=accent_color)
+        header_style = get_paragraph_style('TemplateHeader', 'Normal', fontSize=9, leading=11,
+                                           text_color='#444444')
+        footer_style = get_paragraph_style('TemplateFooter', 'Normal', fontSize=8, leading=10,
+                                           text_color='#555555')
+
+        # Parseo y medida del contenido estático: una vez por plantilla
+        self.title_paragraph = Paragraph(title, title_style)
+        self.header_paragraph = Paragraph('<br/>'.join(header_lines), header_style)
+        self.footer_paragraph = Paragraph(footer_markup, footer_style)
+
+        _, self.title_height = self.title_paragraph.wrap(content_width, page_height)
+        _, self.header_height = self.header_paragraph.wrap(content_width, page_height)
+        _, self.footer_height = self.footer_paragraph.wrap(content_width, page_height)
+
+        self.content_width = content_width
+        self.accent_color = colors.HexColor(accent_color)
+        self.top_block = self.title_height + self.header_height + 16
+        self.body_frame_rect = (
+            margin,
+            margin + self.footer_height + 20,
+            content_width,
+            page_height - 2 * margin - self.top_block - self.footer_height - 32
+        )
+
+    def _define_form(self, canvas):
+        """Dibuja la parte estática como form XObject en el documento actual."""
+        page_width, page_height = self.pagesize
+        left = self.margin
+        top = page_height - self.margin
+
+        with self._lock:
+            canvas.beginForm(self.form_name)
+
+            self.title_paragraph.drawOn(canvas, left, top - self.title_height)
+            self.header_paragraph.drawOn(canvas, left, top - self.title_height - self.header_height - 4)
+
+            canvas.setStrokeColor(self.accent_color)
+            canvas.setLineWidth(2)
+            canvas.line(left, top - self.top_block, page_width - self.margin, top - self.top_block)
+
+            canvas.setStrokeColor(colors.lightgrey)
+            canvas.setLineWidth(0.5)
+            canvas.line(left, self.margin + self.footer_height + 8,
+                        page_width - self.margin, self.margin + self.footer_height + 8)
+            self.footer_paragraph.drawOn(canvas, left, self.margin)
+
+            canvas.endForm()
+
+    def on_page(self, canvas, doc):
+        """Callback de página: referencia la forma estática y numera la página."""
+        canvas.saveState()
+        if not canvas.hasForm(self.form_name):
+            self._define_form(canvas)
+        canvas.doForm(self.form_name)
+
+        canvas.setFont('Helvetica', 8)
+        canvas.setFillColor(colors.grey)
+        canvas.drawRightString(self.pagesize[0] - self.margin, self.margin - 14, f"Página {doc.page}")
+        canvas.restoreState()
+
+    def build(self, filepath, story: List):
+        """Construye el PDF con la plantilla y los flowables dinámicos."""
+        doc = BaseDocTemplate(
+            filepath,
+            pagesize=self.pagesize,
+            leftMargin=self.margin,
+            rightMargin=self.margin,
+            topMargin=self.margin,
+            bottomMargin=self.margin
+        )
+        frame = Frame(*self.body_frame_rect, id='body', leftPadding=0, rightPadding=0,
+                      topPadding=0, bottomPadding=0)
+        doc.addPageTemplates([PageTemplate(id=self.form_name, frames=[frame], onPage=self.on_page)])
+        doc.build(story)
+
+
+class PDFTemplateCache:
+    """Caché LRU de plantillas de página, compartida por todos los generadores del proceso."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, factory: Callable[[], CachedPageTemplate]) -> CachedPageTemplate:
+        """Obtiene la plantilla de la caché o la crea con factory."""
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+        template = factory()
+
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def invalidate(self, prefix: str = ''):
+        """Descarta plantillas (ej: cuando cambian los datos fiscales de un cliente)."""
+        with self._lock:
+            for key in [key for key in self._templates if key.startswith(prefix)]:
+                del self._templates[key]
+
+    def clear(self):
+        self.invalidate()
+
+
+# Instancia global
+pdf_template_cache = PDFTemplateCache()
+
+
+def template_key(*parts) -> str:
+    """Clave de plantilla a partir de sus partes (tipo, cliente, datos estáticos)."""
+    return ':'.join(str(part) for part in parts)
@@ -1,61 +1,81 @@
 # modules/quote_generator.py
-from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 import os
 from datetime import datetime, timedelta
 import uuid
 import re
+from .pdf_templates import CachedPageTemplate, pdf_template_cache, quote_styles, template_key
+
+# Contenido estático de la plantilla de página
+QUOTE_HEADER_LINES = [
+    "<b>SalesMind Real Estate</b> · Asesoría Inmobiliaria Profesional",
+    "📧 info@salesmind.com · 📱 +1 (555) 123-4567"
+]
+
+QUOTE_TERMS = """
+<b>TÉRMINOS Y CONDICIONES:</b><br/>
+• Esta cotización es válida por 30 días.<br/>
+• Los precios están sujetos a disponibilidad.<br/>
+• Se requiere anticipo del 30% para separar la propiedad.<br/>
+• Incluye asesoría legal y acompañamiento en todo el proceso.<br/>
+• No incluye gastos notariales ni de registro.<br/>
+<b>SalesMind Real Estate</b> · Asesor Comercial · 📧 asesor@salesmind.com · 📱 +1 (555) 123-4567
+"""
+
+QUOTE_INFO_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F0F8FF'))
+])
+
+QUOTE_ITEMS_TABLE_STYLE = TableStyle([
+    # Encabezado
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86AB')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    
+    # Contenido
+    ('FONTNAME', (0, 1), (-1, -4), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -4), 10),
+    ('GRID', (0, 0), (-1, -4), 1, colors.black),
+    
+    # Totales
+    ('FONTNAME', (0, -3), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, -3), (-1, -1), 11),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#F18F01')),
+    ('TEXTCOLOR', (0, -1), (-1, -1), colors.white),
+    ('GRID', (0, -3), (-1, -1), 1, colors.black),
+])
 
 class QuoteGenerator:
     """Generador de cotizaciones PDF profesionales"""
     
     def __init__(self):
-        self.styles = getSampleStyleSheet()
-        self._create_custom_styles()
+        # Estilos compartidos por proceso (ver pdf_templates)
+        styles = quote_styles()
+        self.title_style = styles['title']
+        self.subtitle_style = styles['subtitle']
+        self.normal_style = styles['normal']
+        self.price_style = styles['price']
     
-    def _create_custom_styles(self):
-        """Crear estilos personalizados para la cotización"""
-        
-        # Estilo para el título principal
-        self.title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=self.styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#2E86AB')
-        )
-        
-        # Estilo para subtítulos
-        self.subtitle_style = ParagraphStyle(
-            'CustomSubtitle',
-            parent=self.styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.HexColor('#A23B72')
-        )
-        
-        # Estilo para texto normal
-        self.normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=self.styles['Normal'],
-            fontSize=11,
-            spaceAfter=6,
-            alignment=TA_LEFT
-        )
-        
-        # Estilo para precios destacados
-        self.price_style = ParagraphStyle(
-            'PriceStyle',
-            parent=self.styles['Normal'],
-            fontSize=14,
-            textColor=colors.HexColor('#F18F01'),
-            alignment=TA_RIGHT,
-            spaceAfter=6
+    @staticmethod
+    def get_page_template() -> CachedPageTemplate:
+        """Plantilla estática (cabecera, términos y firma), creada una vez por proceso"""
+        return pdf_template_cache.get(
+            template_key('quote'),
+            lambda: CachedPageTemplate(
+                'quote',
+                "COTIZACIÓN OFICIAL",
+                QUOTE_HEADER_LINES,
+                QUOTE_TERMS
+            )
         )
     
     def extract_quote_info(self, ai_response: str, client_name: str) -> dict:
@@ -158,42 +178,19 @@ class QuoteGenerator:
         filename = f"cotizacion_{quote_data['quote_number']}.pdf"
         filepath = os.path.join(output_dir, filename)
         
-        # Crear documento PDF
-        doc = SimpleDocTemplate(
-            filepath,
-            pagesize=A4,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=18
-        )
-        
-        # Contenido del PDF
+        # Contenido dinámico del PDF (cabecera, términos y firma van en la plantilla)
         story = []
         
-        # Encabezado
-        story.append(Paragraph("COTIZACIÓN OFICIAL", self.title_style))
-        story.append(Spacer(1, 12))
-        
-        # Información de la empresa y cotización
-        company_info = [
-            ["SalesMind Real Estate", f"Cotización N°: {quote_data['quote_number']}"],
-            ["Asesoría Inmobiliaria Profesional", f"Fecha: {quote_data['date']}"],
-            ["📧 info@salesmind.com", f"Válida hasta: {quote_data['valid_until']}"],
-            ["📱 +1 (555) 123-4567", f"Cliente: {quote_data['client_name']}"]
+        # Información de la cotización
+        quote_info = [
+            [f"Cotización N°: {quote_data['quote_number']}", f"Fecha: {quote_data['date']}"],
+            [f"Cliente: {quote_data['client_name']}", f"Válida hasta: {quote_data['valid_until']}"]
         ]
         
-        company_table = Table(company_info, colWidths=[3*inch, 2.5*inch])
-        company_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F0F8FF'))
-        ]))
+        quote_table = Table(quote_info, colWidths=[3*inch, 2.5*inch])
+        quote_table.setStyle(QUOTE_INFO_TABLE_STYLE)
         
-        story.append(company_table)
+        story.append(quote_table)
         story.append(Spacer(1, 20))
         
         # Detalles de la cotización
@@ -216,63 +213,18 @@ class QuoteGenerator:
         table_data.append(["", "", "TOTAL:", f"${quote_data['total']:,.2f}"])
         
         # Crear tabla
-        items_table = Table(table_data, colWidths=[3*inch, 0.8*inch, 1.2*inch, 1.2*inch])
-        items_table.setStyle(TableStyle([
-            # Encabezado
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2E86AB')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            
-            # Contenido
-            ('FONTNAME', (0, 1), (-1, -4), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -4), 10),
-            ('GRID', (0, 0), (-1, -4), 1, colors.black),
-            
-            # Totales
-            ('FONTNAME', (0, -3), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, -3), (-1, -1), 11),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#F18F01')),
-            ('TEXTCOLOR', (0, -1), (-1, -1), colors.white),
-            ('GRID', (0, -3), (-1, -1), 1, colors.black),
-        ]))
+        items_table = Table(table_data, colWidths=[3*inch, 0.8*inch, 1.2*inch, 1.2*inch], repeatRows=1)
+        items_table.setStyle(QUOTE_ITEMS_TABLE_STYLE)
         
         story.append(items_table)
         story.append(Spacer(1, 20))
         
-        # Notas y condiciones
+        # Notas de esta cotización
         story.append(Paragraph("INFORMACIÓN ADICIONAL", self.subtitle_style))
         story.append(Paragraph(quote_data['notes'], self.normal_style))
-        story.append(Spacer(1, 20))
-        
-        # Términos y condiciones
-        terms = """
-        <b>TÉRMINOS Y CONDICIONES:</b><br/>
-        • Esta cotización es válida por 30 días.<br/>
-        • Los precios están sujetos a disponibilidad.<br/>
-        • Se requiere anticipo del 30% para separar la propiedad.<br/>
-        • Incluye asesoría legal y acompañamiento en todo el proceso.<br/>
-        • No incluye gastos notariales ni de registro.<br/>
-        """
-        
-        story.append(Paragraph(terms, self.normal_style))
-        story.append(Spacer(1, 30))
-        
-        # Firma
-        signature_text = """
-        <br/><br/>
-        ________________________________<br/>
-        <b>SalesMind Real Estate</b><br/>
-        Asesor Comercial<br/>
-        📧 asesor@salesmind.com<br/>
-        📱 +1 (555) 123-4567
-        """
-        
-        story.append(Paragraph(signature_text, self.normal_style))
         
-        # Construir PDF
-        doc.build(story)
+        # Construir PDF sobre la plantilla cacheada
+        self.get_page_template().build(filepath, story)
         
         print(f"✅ Cotización PDF generada: {filepath}")
         return filepath
@@ -0,0 +1,388 @@
+# modules/quote_parser.py
+"""
+Parser de cotizaciones sobre las respuestas del asistente.
+
+Un único tokenizador compilado recorre la respuesta una sola vez y reconoce
+precios (con símbolo, código ISO o palabra de moneda, o precedidos de
+"precio/price/prix/Preis/preço"), cantidades y nombres de producto en
+español, inglés, francés, alemán y portugués. Los importes se interpretan
+según las convenciones de cada idioma (1.500,50 / 1,500.50 / 1 500,50 /
+1'500.50, "2 millones", "3k"...). Los items resultantes se cruzan con el
+catálogo de productos del cliente, que se cachea por proceso y se
+reconstruye solo cuando cambian sus productos.
+"""
+import re
+import threading
+from bisect import bisect_right
+import unicodedata
+from typing import Dict, List, Optional
+
+# Idiomas soportados: palabras frecuentes para detectar el idioma de la respuesta
+LANGUAGE_PATTERN = re.compile(
+    r"\b(?:"
+    r"(?P<es>el|los|las|para|con|precio|que|por|usted|incluye)"
+    r"|(?P<en>the|and|for|with|price|is|you|includes?)"
+    r"|(?P<fr>le|les|des|pour|avec|prix|est|vous|une)"
+    r"|(?P<de>der|die|das|und|für|mit|preis|ist|sie|ein|eine)"
+    r"|(?P<pt>o|e|os|do|da|com|preço|preco|não|uma|você|inclui|custa)"
+    r")\b",
+    re.IGNORECASE
+)
+
+DEFAULT_CURRENCY = 'USD'
+DEFAULT_CURRENCY_BY_LANGUAGE = {'es': 'USD', 'en': 'USD', 'fr': 'EUR', 'de': 'EUR', 'pt': 'BRL'}
+
+# Símbolos, códigos y palabras de moneda -> código ISO (None = moneda por defecto del idioma)
+CURRENCY_CODES = {
+    'us$': 'USD', '$': None, '€': 'EUR', '£': 'GBP', 'r$': 'BRL',
+    'usd': 'USD', 'eur': 'EUR', 'gbp': 'GBP', 'brl': 'BRL', 'cop': 'COP', 'mxn': 'MXN', 'chf': 'CHF',
+    'dólares': 'USD', 'dolares': 'USD', 'dollars': 'USD', 'dollar': 'USD', 'dólar': 'USD',
+    'euros': 'EUR', 'euro': 'EUR', 'reais': 'BRL', 'pesos': None, 'francs': 'CHF', 'franken': 'CHF',
+}
+
+# Multiplicadores escritos ("2 millones", "150 mil", "3k")
+MULTIPLIERS = {
+    'k': 1000, 'mil': 1000, 'thousand': 1000, 'mille': 1000, 'tausend': 1000,
+    'millón': 1000000, 'millon': 1000000, 'millones': 1000000, 'million': 1000000,
+    'millions': 1000000, 'millionen': 1000000, 'mio': 1000000, 'mio.': 1000000,
+    'milhão': 1000000, 'milhao': 1000000, 'milhões': 1000000, 'milhoes': 1000000,
+}
+
+_NUMBER = r"\d{1,3}(?:[.,'\u00a0\u202f ]\d{3})+(?:[.,]\d{1,2})?(?!\d)|\d+(?:[.,]\d{1,2})?(?!\d)"
+_CURRENCY_SYMBOL = r"US\$|R\$|\$|€|£|USD|EUR|GBP|BRL|COP|MXN|CHF"
+_CURRENCY_WORD = (r"USD|EUR|GBP|BRL|COP|MXN|CHF|€|d[óo]lares|d[óo]lar|dollars?|euros?|reais|pesos"
+                  r"|francs|franken")
+_MULTIPLIER = r"k|mil|thousand|mille|tausend|mill[óo]n(?:es)?|millions?|millionen|mio\.?|milh(?:ão|ao|ões|oes)"
+_PRICE_KEYWORD = (r"precio|valor|costo|coste|price|cost|prix|co[uû]t|tarif|preis|kosten|"
+                  r"pre[çc]o|custo|tarifa")
+_QUANTITY_UNIT = (r"x|×|unidades?|uds?\.?|units?|unités?|pcs|pieces|piezas|pièces|st[üu]ck|stk\.?|"
+                  r"peças|pecas")
+_QUANTITY_KEYWORD = r"cantidad|quantity|qty|quantité|menge|anzahl|quantidade"
+# "Casa Modelo X" necesita el calificativo; "Apartamento X" o "Lote X" no
+_PRODUCT_NOUN_QUALIFIED = r"casa|house|maison|haus|villa"
+_PRODUCT_NOUN = (r"apartamento|apartment|appartement|wohnung|lote|terrain|grundst[üu]ck|"
+                 r"oficina|bureau|b[üu]ro|escrit[óo]rio|penthouse")
+_PRODUCT_QUALIFIER = r"modelo|model|modèle|modell|tipo|type|typ"
+_PRODUCT_STOPWORD = r"de|del|of|du|des|von|do|da|con|with|avec|mit|com|en|in|à|a|para|for|pour|für"
+# Nombre del producto: una letra mayúscula sola es un modelo ("Casa Modelo A") aunque
+# coincida con una preposición; en otro caso, una palabra que no sea preposición ni importe
+_PRODUCT_NAME = rf"(?-i:[A-Z])(?![\w-])|(?!(?:{_PRODUCT_STOPWORD})\b)(?!\d+[.,]\d)[\w-]+"
+
+# Tokenizador único: el orden de las alternativas resuelve los solapes
+TOKEN_PATTERN = re.compile(
+    rf"(?P<product>\b(?:(?:{_PRODUCT_NOUN_QUALIFIED})\s+(?:{_PRODUCT_QUALIFIER})\s+(?:{_PRODUCT_NAME})"
+    rf"|(?:{_PRODUCT_NOUN})(?:\s+(?:{_PRODUCT_QUALIFIER}))?"
+    rf"(?:\s+(?:{_PRODUCT_NAME})|(?=\s*[:;,.]|\s*$))))"
+    rf"|\b(?:{_QUANTITY_KEYWORD})\s*[:=]?\s*(?P<qty_kw>\d{{1,4}})\b"
+    rf"|\b(?P<qty>\d{{1,4}})\s?(?:{_QUANTITY_UNIT})(?!\w)"
+    rf"|(?:^|(?<=\s))[x×]\s?(?P<qty_x>\d{{1,4}})\b"
+    # Entre la palabra clave y el importe no puede haber un producto ("precio del lote: $45,000")
+    rf"|(?:(?P<keyword>\b(?:{_PRICE_KEYWORD}))\b"
+    rf"(?:(?!\b(?:{_PRODUCT_NOUN_QUALIFIED}|{_PRODUCT_NOUN})\b)[^\d$€£\n]){{0,12}}?)?"
+    rf"(?:(?P<cur_pre>{_CURRENCY_SYMBOL})\s?)?"
+    rf"(?P<amount>{_NUMBER})"
+    rf"(?:\s?(?P<mult>{_MULTIPLIER})\b)?"
+    rf"(?:\s?(?P<cur_suf>{_CURRENCY_WORD})(?!\w))?",
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Fin de línea, de frase o conjunción: un precio suelto no pasa de aquí al producto siguiente
+CLAUSE_BREAK_PATTERN = re.compile(r"\n|[.;!?](?=\s|$)|\s(?:y|and|et|und|e)\s", re.IGNORECASE)
+
+# Un número de 4 cifras sin moneda ni multiplicador en este rango es un año, no un precio
+YEAR_PATTERN = re.compile(r"(?:19|20)\d{2}")
+
+# Máximo de items genéricos cuando no se reconoce ningún producto
+MAX_GENERIC_ITEMS = 5
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes, para comparar nombres de producto."""
+    return normalize_with_offsets(text)[0]
+
+
+def normalize_with_offsets(text: str) -> tuple:
+    """
+    Texto normalizado y, por cada carácter suyo, la posición en el texto original.
+
+    La normalización cambia la longitud ('…' -> '...', 'ﬁ' -> 'fi', 'İ' -> 'i'),
+    así que las posiciones encontradas en el texto normalizado se traducen con
+    este índice antes de mezclarlas con las del texto original.
+    """
+    chars, offsets = [], []
+    for index, char in enumerate(text):
+        for piece in unicodedata.normalize('NFKD', char.lower()):
+            if not unicodedata.combining(piece):
+                chars.append(piece)
+                offsets.append(index)
+    return ''.join(chars), offsets
+
+
+def detect_language(text: str) -> str:
+    """Idioma dominante (es/en/fr/de/pt) por palabras frecuentes; 'es' por defecto."""
+    counts = dict.fromkeys(DEFAULT_CURRENCY_BY_LANGUAGE, 0)
+    for match in LANGUAGE_PATTERN.finditer(text[:4000]):
+        counts[match.lastgroup] += 1
+    language = max(counts, key=counts.get)
+    return language if counts[language] else 'es'
+
+
+def parse_number(raw: str) -> Optional[float]:
+    """
+    Convierte un importe escrito con cualquier convención de separadores.
+
+    - Con punto y coma a la vez, el último separador es el decimal (1.500,50 / 1,500.50)
+    - Espacios y apóstrofos siempre agrupan miles (1 500 / 1'500)
+    - Un separador seguido de exactamente 3 dígitos agrupa miles (1.500 / 1,500)
+    - Un separador seguido de 1 o 2 dígitos es decimal (12,5 / 12.50)
+    """
+    number = re.sub(r"['\u00a0\u202f ]", '', raw)
+    last_dot, last_comma = number.rfind('.'), number.rfind(',')
+
+    if last_dot >= 0 and last_comma >= 0:
+        decimal = '.' if last_dot > last_comma else ','
+        thousands = ',' if decimal == '.' else '.'
+        number = number.replace(thousands, '').replace(decimal, '.')
+    elif last_dot >= 0 or last_comma >= 0:
+        separator = '.' if last_dot >= 0 else ','
+        groups = number.split(separator)
+        if len(groups) > 2 or len(groups[-1]) == 3:
+            number = number.replace(separator, '')
+        else:
+            number = number.replace(separator, '.')
+
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def tokenize(text: str) -> List[Dict]:
+    """
+    Tokens de precio, cantidad y producto de un texto, con su posición.
+
+    Los números sueltos (sin moneda ni palabra clave de precio) se descartan:
+    suelen ser habitaciones, metros o fechas.
+    """
+    tokens = []
+
+    for match in TOKEN_PATTERN.finditer(text):
+        position = match.start()
+        groups = match.groupdict()
+        if groups['product']:
+            tokens.append({'type': 'product', 'pos': position, 'text': ' '.join(groups['product'].split())})
+        elif groups['qty_kw'] or groups['qty'] or groups['qty_x']:
+            quantity = int(groups['qty_kw'] or groups['qty'] or groups['qty_x'])
+            if quantity > 0:
+                tokens.append({'type': 'quantity', 'pos': position, 'value': quantity})
+        elif groups['keyword'] or groups['cur_pre'] or groups['cur_suf']:
+            if (not (groups['cur_pre'] or groups['cur_suf'] or groups['mult'])
+                    and YEAR_PATTERN.fullmatch(groups['amount'])):
+                continue
+            value = parse_number(groups['amount'])
+            if value is None:
+                continue
+            if groups['mult']:
+                value *= MULTIPLIERS.get(groups['mult'].lower(), 1)
+            currency_token = (groups['cur_pre'] or groups['cur_suf'] or '').lower()
+            tokens.append({
+                'type': 'price',
+                'pos': position,
+                'value': value,
+                'currency': CURRENCY_CODES.get(currency_token)
+            })
+
+    return tokens
+
+
+class ProductCatalog:
+    """Índice de los productos activos de un cliente para reconocerlos en el texto."""
+
+    def __init__(self, products: List[Dict]):
+        self.products = {}
+        keys = {}
+
+        for product in products:
+            self.products[product['id']] = product
+            for key in (product['name'], product.get('sku')):
+                normalized = normalize_text(key or '').strip()
+                if len(normalized) >= 3:
+                    keys.setdefault(normalized, product['id'])
+
+        self._keys = keys
+        # Alternación de nombres y SKUs, los más largos primero para preferir la coincidencia completa
+        alternatives = sorted(keys, key=len, reverse=True)
+        self.pattern = re.compile(
+            r"(?<!\w)(?:" + '|'.join(re.escape(key) for key in alternatives) + r")(?!\w)"
+        ) if alternatives else None
+
+    def find(self, text: str) -> List[Dict]:
+        """Menciones de productos del catálogo (por nombre o SKU) con su posición en el texto original."""
+        if not self.pattern:
+            return []
+        normalized, offsets = normalize_with_offsets(text)
+        return [
+            {'type': 'catalog', 'pos': offsets[match.start()], 'end': offsets[match.end() - 1] + 1,
+             'product': self.products[self._keys[match.group()]]}
+            for match in self.pattern.finditer(normalized)
+        ]
+
+
+# Caché de catálogos por cliente: client_id -> (huella de los productos, catálogo)
+_catalog_cache = {}
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_stamp(client_id: int) -> tuple:
+    """
+    Huella del catálogo de un cliente: número de productos activos y última
+    modificación. Es una sola agregación, barata de consultar en cada
+    petición, y cambia con cualquier alta, baja o edición de productos.
+    """
+    from sqlalchemy import func
+    from .commercial_models import Product
+    from . import db
+
+    return tuple(db.session.query(
+        func.count(Product.id), func.max(Product.updated_at)
+    ).filter(Product.client_id == client_id, Product.is_active == True).one())
+
+
+def get_product_catalog(client_id: int) -> Optional[ProductCatalog]:
+    """
+    Catálogo del cliente. El índice solo se reconstruye cuando cambia su
+    huella (ver get_catalog_stamp).
+    """
+    from .commercial_models import Product
+    from . import db
+
+    try:
+        stamp = get_catalog_stamp(client_id)
+
+        with _catalog_lock:
+            cached = _catalog_cache.get(client_id)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        rows = db.session.query(
+            Product.id, Product.name, Product.sku, Product.base_price
+        ).filter(Product.client_id == client_id, Product.is_active == True).all()
+
+        catalog = ProductCatalog([
+            {'id': row.id, 'name': row.name, 'sku': row.sku, 'base_price': float(row.base_price or 0)}
+            for row in rows
+        ])
+
+        with _catalog_lock:
+            _catalog_cache[client_id] = (stamp, catalog)
+        return catalog
+
+    except Exception as e:
+        print(f"⚠️ Catálogo de productos no disponible para el cliente {client_id}: {e}")
+        return None
+
+
+def _build_item(description: str, price: Optional[float], quantity: int, product: Optional[Dict]) -> Dict:
+    unit_price = price if price is not None else (product['base_price'] if product else 0)
+    return {
+        'description': product['name'] if product else description,
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'total': unit_price * quantity,
+        'product_id': product['id'] if product else None,
+        'sku': product.get('sku') if product else None
+    }
+
+
+def _product_title(name: str) -> str:
+    """Nombre en formato título conservando las letras de modelo ("Casa Modelo A")"""
+    return ' '.join(word if len(word) == 1 else word.title() for word in name.split())
+
+
+def parse_quote(text: str, catalog: Optional[ProductCatalog] = None) -> Dict:
+    """
+    Extrae los items de cotización de una respuesta.
+
+    Un producto (del catálogo o reconocido por su nombre) queda pendiente
+    hasta encontrar su precio en la misma línea o en las siguientes; un
+    precio que aparece antes que su producto solo vale dentro de la misma
+    línea o cláusula. La cantidad más reciente se aplica al siguiente item.
+
+    Returns:
+        Dict con 'items', 'currency', 'language' y 'prices' (todos los importes encontrados)
+    """
+    language = detect_language(text)
+    tokens = tokenize(text)
+
+    # Menciones del catálogo intercaladas por posición (primero en caso de empate)
+    catalog_spans = []
+    if catalog:
+        catalog_tokens = catalog.find(text)
+        catalog_spans = [(token['pos'], token['end']) for token in catalog_tokens]
+        tokens = sorted(catalog_tokens + tokens, key=lambda token: token['pos'])
+
+    breaks = [match.start() for match in CLAUSE_BREAK_PATTERN.finditer(text)]
+
+    def clause(position):
+        return bisect_right(breaks, position)
+
+    items = []
+    prices = []
+    currency = None
+    pending_name = None
+    pending_product = None
+    pending_price = None  # (importe, cláusula)
+    quantity = 1
+
+    def emit(price):
+        nonlocal pending_name, pending_product, pending_price, quantity
+        items.append(_build_item(pending_name, price, quantity, pending_product))
+        pending_name, pending_product, pending_price, quantity = None, None, None, 1
+
+    def set_product(name, product, position):
+        nonlocal pending_name, pending_product, pending_price
+        # Un producto del catálogo sin precio en el texto se cotiza a su precio base
+        if pending_product:
+            emit(None)
+        price = pending_price
+        pending_name, pending_product, pending_price = name, product, None
+        # Precio encontrado antes que el nombre del producto, en la misma cláusula
+        if price is not None and price[1] == clause(position):
+            emit(price[0])
+
+    for token in tokens:
+        if token['type'] == 'catalog':
+            set_product(token['product']['name'], token['product'], token['pos'])
+        elif token['type'] == 'product':
+            # Si el nombre es parte de una mención del catálogo manda el catálogo
+            if not any(start <= token['pos'] < end for start, end in catalog_spans):
+                set_product(_product_title(token['text']), None, token['pos'])
+        elif token['type'] == 'quantity':
+            quantity = token['value']
+        elif token['type'] == 'price':
+            if token['value'] <= 0:
+                continue
+            prices.append(token['value'])
+            currency = currency or token['currency']
+            if pending_name:
+                emit(token['value'])
+            else:
+                pending_price = (token['value'], clause(token['pos']))
+
+    if pending_product:
+        emit(None)
+
+    # Sin productos reconocidos: un item genérico por cada precio distinto
+    if not items and prices:
+        unique_prices = list(dict.fromkeys(prices))[:MAX_GENERIC_ITEMS]
+        items = [
+            _build_item(f'Propiedad/Servicio {i + 1}', price, 1, None)
+            for i, price in enumerate(unique_prices)
+        ]
+
+    return {
+        'items': items,
+        'currency': currency or DEFAULT_CURRENCY_BY_LANGUAGE.get(language, DEFAULT_CURRENCY),
+        'language': language,
+        'prices': prices
+    }
@@ -0,0 +1,179 @@
+# modules/quote_renderer.py
+"""
+Servicio de renderizado de cotizaciones PDF fuera de la petición HTTP.
+
+El chat responde de inmediato con el número de cotización y un enlace
+pendiente; el PDF se construye con reportlab en un pool de procesos y se
+publica de forma atómica (archivo temporal + os.replace). El estado se
+deduce del sistema de archivos, así que cualquier proceso web puede
+responder a /quote-status/<numero>: <pdf>.pending guarda la hora de envío
+y, si el PDF no aparece en QUOTE_RENDER_TIMEOUT segundos (proceso caído,
+renderizado colgado), la cotización se informa como 'failed'.
+
+Ciclo de vida del pool: app.py llama a quote_render_service.start() al
+arrancar, antes de servir peticiones (los procesos se crean con 'spawn',
+seguro con los hilos de waitress), y start() registra shutdown() con
+atexit para esperar los renderizados en curso al apagar. Si no se llamó a
+start() (scripts, servidores de prueba), submit() usa un pool de hilos en
+lugar de crear procesos desde un hilo de petición.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict
+
+QUOTE_RENDER_WORKERS = int(os.environ.get('QUOTE_RENDER_WORKERS', 2))
+# Segundos tras los que una cotización sin PDF ni error se da por fallida
+QUOTE_RENDER_TIMEOUT = int(os.environ.get('QUOTE_RENDER_TIMEOUT', 120))
+
+# Instancia de QuoteSystemV2 por proceso del pool (estilos creados una sola vez)
+_renderer = None
+
+
+def _render_quote_pdf(quote_data: dict, filepath: str) -> int:
+    """
+    Construye el PDF en un proceso del pool. Función de módulo para poder
+    enviarse al ProcessPoolExecutor.
+
+    Returns:
+        Tamaño del archivo generado en bytes
+    """
+    global _renderer
+    from .quote_system_v2 import QuoteSystemV2
+
+    if _renderer is None:
+        _renderer = QuoteSystemV2()
+
+    temp_path = f"{filepath}.tmp"
+    _renderer.build_quote_pdf(quote_data, temp_path)
+    os.replace(temp_path, filepath)
+    return os.path.getsize(filepath)
+
+
+class QuoteRenderService:
+    """Cola de renderizado de cotizaciones respaldada por un pool de procesos."""
+
+    def __init__(self, max_workers: int = QUOTE_RENDER_WORKERS, timeout: int = QUOTE_RENDER_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+    def start(self):
+        """
+        Crea el pool de procesos (idempotente). Llamar al arrancar el
+        servidor, no desde una petición.
+        """
+        with self._lock:
+            if self._executor is None:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                except Exception as e:
+                    # Ej: procesos daemon que no pueden crear hijos
+                    print(f"⚠️ Pool de procesos no disponible para cotizaciones, usando hilos: {e}")
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                if not self._atexit_registered:
+                    atexit.register(self.shutdown)
+                    self._atexit_registered = True
+            return self._executor
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                print("⚠️ Servicio de renderizado sin iniciar (quote_render_service.start()), usando hilos")
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                if not self._atexit_registered:
+                    atexit.register(self.shutdown)
+                    self._atexit_registered = True
+            return self._executor
+
+    @staticmethod
+    def error_marker(filepath: str) -> str:
+        return f"{filepath}.error"
+
+    @staticmethod
+    def pending_marker(filepath: str) -> str:
+        return f"{filepath}.pending"
+
+    def submit(self, quote_data: dict, filepath: str) -> Future:
+        """
+        Encola el renderizado de una cotización.
+
+        Args:
+            quote_data: Datos extraídos de la cotización (ver extract_quote_data_v2)
+            filepath: Ruta final del PDF
+        """
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+
+        marker = self.error_marker(filepath)
+        if os.path.exists(marker):
+            os.remove(marker)
+
+        # Hora de envío visible para cualquier proceso web (detecta renderizados perdidos)
+        pending = self.pending_marker(filepath)
+        with open(pending, 'w', encoding='utf-8') as f:
+            f.write(datetime.utcnow().isoformat())
+
+        future = self._get_executor().submit(_render_quote_pdf, quote_data, filepath)
+
+        def on_done(done_future, _quote_number=quote_data['quote_number']):
+            error = done_future.exception()
+            try:
+                os.remove(pending)
+            except OSError:
+                pass
+            if error is None:
+                print(f"✅ PDF de cotización listo: {_quote_number}")
+                return
+            print(f"❌ Error renderizando cotización {_quote_number}: {error}")
+            try:
+                with open(marker, 'w', encoding='utf-8') as f:
+                    f.write(str(error))
+            except OSError:
+                pass
+
+        future.add_done_callback(on_done)
+        return future
+
+    def get_status(self, filepath: str) -> Dict:
+        """
+        Estado de una cotización: 'ready', 'failed' o 'pending'. Sin PDF ni
+        error, es 'pending' solo mientras no pase el timeout desde el envío.
+        """
+        if os.path.exists(filepath):
+            return {'status': 'ready', 'file_size': os.path.getsize(filepath)}
+
+        marker = self.error_marker(filepath)
+        if os.path.exists(marker):
+            with open(marker, 'r', encoding='utf-8') as f:
+                return {'status': 'failed', 'error': f.read()}
+
+        try:
+            submitted_at = os.path.getmtime(self.pending_marker(filepath))
+        except OSError:
+            return {'status': 'failed', 'error': 'No hay un renderizado en curso para esta cotización'}
+
+        elapsed = time.time() - submitted_at
+        submitted = datetime.utcfromtimestamp(submitted_at).isoformat()
+        if elapsed > self.timeout:
+            return {'status': 'failed', 'submitted_at': submitted,
+                    'error': f'El renderizado no terminó en {self.timeout} segundos'}
+        return {'status': 'pending', 'submitted_at': submitted}
+
+    def shutdown(self, wait: bool = True):
+        """Detiene el pool esperando (wait=True) los renderizados en curso; registrado con atexit."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# Instancia global
+quote_render_service = QuoteRenderService()
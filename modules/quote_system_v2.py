@@ -8,79 +8,101 @@ Sistema completamente nuevo de cotización que NO causa refresh
 y mantiene la conversación intacta.
 
 CARACTERÍSTICAS:
-✅ Base64 inline para PDFs pequeños
+✅ Enlaces de artefacto firmados y cacheables (sin base64 inline)
 ✅ Streaming de archivos grandes
 ✅ URLs con tokens temporales
 ✅ No redirecciones automáticas
 ✅ Cache control para navegadores
 """
 
-from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 import os
-import base64
+import hashlib
+import hmac
 import uuid
-import secrets
 from datetime import datetime, timedelta
-import re
+from typing import Optional
 import json
 from flask import url_for
+from config import Config
+from .pdf_templates import CachedPageTemplate, pdf_template_cache, quote_styles, template_key
+
+QUOTES_DIR = "instance/quotes"
+
+# Contenido estático de la plantilla de página
+QUOTE_HEADER_LINES = [
+    "<b>SalesMind Real Estate</b>",
+    "📧 info@salesmind.com",
+    "📱 +1 (555) 123-4567"
+]
+
+QUOTE_TERMS = """
+<b>📝 TÉRMINOS Y CONDICIONES</b><br/>
+1. Esta cotización es válida por 30 días calendario.<br/>
+2. Los precios incluyen IVA cuando aplique.<br/>
+3. Para reservar, se requiere anticipo del 30%.<br/>
+4. Los tiempos de entrega pueden variar según disponibilidad.<br/>
+5. SalesMind se reserva el derecho de modificar precios sin previo aviso.
+"""
+
+QUOTE_INFO_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.lightgrey),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#E8F4FD'))
+])
+
+QUOTE_ITEMS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('BACKGROUND', (0, -3), (-1, -1), colors.HexColor('#F0F8FF'))
+])
 
 class QuoteSystemV2:
     """Sistema de cotización completamente nuevo sin refresh"""
     
     def __init__(self):
-        self.styles = getSampleStyleSheet()
-        self._create_custom_styles()
-        self.temp_tokens = {}  # Para URLs temporales seguras
+        # Estilos compartidos por proceso (ver pdf_templates)
+        styles = quote_styles()
+        self.title_style = styles['title']
+        self.subtitle_style = styles['subtitle']
+        self.normal_style = styles['normal']
+        self.price_style = styles['price']
     
-    def _create_custom_styles(self):
-        """Crear estilos personalizados para la cotización"""
-        
-        self.title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=self.styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#2E86AB')
-        )
-        
-        self.subtitle_style = ParagraphStyle(
-            'CustomSubtitle',
-            parent=self.styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.HexColor('#A23B72')
-        )
-        
-        self.normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=self.styles['Normal'],
-            fontSize=11,
-            spaceAfter=6,
-            alignment=TA_LEFT
-        )
-        
-        self.price_style = ParagraphStyle(
-            'PriceStyle',
-            parent=self.styles['Normal'],
-            fontSize=14,
-            textColor=colors.HexColor('#F18F01'),
-            alignment=TA_RIGHT,
-            spaceAfter=6
+    @staticmethod
+    def get_page_template() -> CachedPageTemplate:
+        """Plantilla estática (cabecera de empresa y términos), creada una vez por proceso"""
+        return pdf_template_cache.get(
+            template_key('quote_v2'),
+            lambda: CachedPageTemplate(
+                'quote_v2',
+                "📄 COTIZACIÓN OFICIAL",
+                QUOTE_HEADER_LINES,
+                QUOTE_TERMS
+            )
         )
     
-    def extract_quote_data_v2(self, ai_response: str, client_name: str) -> dict:
+    def extract_quote_data_v2(self, ai_response: str, client_name: str, client_id: int = None) -> dict:
         """
-        Extrae información de cotización de forma más inteligente
+        Extrae información de cotización con el parser compilado (ver quote_parser).
+        Con client_id, los items se cruzan con el catálogo de productos del cliente.
         """
+        from .quote_parser import get_product_catalog, parse_quote
+        
+        catalog = get_product_catalog(client_id) if client_id else None
+        parsed = parse_quote(ai_response, catalog)
+        
         quote_data = {
             'client_name': client_name,
+            'client_id': client_id,
             'quote_number': f"COT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}",
             'date': datetime.now().strftime('%d/%m/%Y'),
             'valid_until': (datetime.now() + timedelta(days=30)).strftime('%d/%m/%Y'),
@@ -89,97 +111,21 @@ class QuoteSystemV2:
             'tax_rate': 0.19,
             'total': 0,
             'notes': ai_response,
-            'currency': 'USD'
+            'currency': parsed['currency'],
+            'language': parsed['language']
         }
         
-        # Patrones mejorados para extraer información
-        price_patterns = [
-            r'\$[\d,]+\.?\d*',
-            r'[\d,]+\.?\d*\s*(?:USD|usd|dólares|dollars)',
-            r'Precio[:\s]*\$?[\d,]+\.?\d*',
-            r'precio[:\s]*\$?[\d,]+\.?\d*',
-            r'Price[:\s]*\$?[\d,]+\.?\d*'
-        ]
-        
-        property_patterns = [
-            r'CASA\s+MODELO\s+(\w+)',
-            r'Casa\s+Modelo\s+(\w+)', 
-            r'APARTAMENTO\s+(\w+)',
-            r'Apartamento\s+(\w+)',
-            r'LOTE\s+(\w+)',
-            r'Lote\s+(\w+)'
-        ]
-        
-        # Extraer propiedades y precios
-        found_items = []
+        found_items = parsed['items']
         
-        # Buscar patrones de propiedad + precio
-        lines = ai_response.split('\n')
-        current_property = None
-        current_price = None
-        
-        for line in lines:
-            # Buscar nombre de propiedad
-            for pattern in property_patterns:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match:
-                    current_property = match.group().title()
-                    break
-            
-            # Buscar precio en la misma línea o líneas cercanas
-            for pattern in price_patterns:
-                price_match = re.search(pattern, line, re.IGNORECASE)
-                if price_match:
-                    price_str = price_match.group()
-                    # Limpiar y convertir precio
-                    clean_price = re.sub(r'[^\d.]', '', price_str)
-                    try:
-                        current_price = float(clean_price)
-                        break
-                    except ValueError:
-                        continue
-            
-            # Si tenemos propiedad y precio, crear item
-            if current_property and current_price:
-                found_items.append({
-                    'description': current_property,
-                    'quantity': 1,
-                    'unit_price': current_price,
-                    'total': current_price
-                })
-                current_property = None
-                current_price = None
-        
-        # Si no encontramos items estructurados, buscar todos los precios
-        if not found_items:
-            all_prices = []
-            for pattern in price_patterns:
-                matches = re.findall(pattern, ai_response, re.IGNORECASE)
-                for match in matches:
-                    clean_price = re.sub(r'[^\d.]', '', match.split()[0])
-                    try:
-                        price_value = float(clean_price)
-                        if price_value > 0:
-                            all_prices.append(price_value)
-                    except ValueError:
-                        continue
-            
-            # Crear items genéricos con precios encontrados
-            for i, price in enumerate(set(all_prices)[:5]):
-                found_items.append({
-                    'description': f'Propiedad/Servicio {i+1}',
-                    'quantity': 1,
-                    'unit_price': price,
-                    'total': price
-                })
-        
-        # Si aún no hay items, crear uno por defecto
+        # Si no hay items, crear uno por defecto
         if not found_items:
             found_items.append({
                 'description': 'Consultoría Inmobiliaria',
                 'quantity': 1,
                 'unit_price': 0,
-                'total': 0
+                'total': 0,
+                'product_id': None,
+                'sku': None
             })
         
         quote_data['items'] = found_items
@@ -189,51 +135,26 @@ class QuoteSystemV2:
         
         return quote_data
     
-    def generate_pdf_v2(self, ai_response: str, client_name: str, output_dir: str = "instance/quotes") -> dict:
+    @staticmethod
+    def get_quote_filename(quote_number: str) -> str:
+        """Nombre del archivo PDF de una cotización"""
+        return f"cotizacion_{quote_number}.pdf"
+    
+    def build_quote_pdf(self, quote_data: dict, filepath: str):
         """
-        Genera PDF y devuelve múltiples opciones de acceso SIN REFRESH
+        Construye el PDF de una cotización con reportlab en la ruta indicada.
+        Se ejecuta tanto en línea como en los procesos del servicio de renderizado.
         """
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Extraer datos de cotización
-        quote_data = self.extract_quote_data_v2(ai_response, client_name)
-        
-        # Generar PDF
-        filename = f"cotizacion_{quote_data['quote_number']}.pdf"
-        filepath = os.path.join(output_dir, filename)
-        
-        doc = SimpleDocTemplate(
-            filepath,
-            pagesize=A4,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=18
-        )
-        
         story = []
         
-        # Encabezado mejorado
-        story.append(Paragraph("📄 COTIZACIÓN OFICIAL", self.title_style))
-        story.append(Spacer(1, 20))
-        
-        # Información de la cotización
+        # Información de la cotización (la cabecera de la empresa va en la plantilla)
         info_data = [
-            ["SalesMind Real Estate", f"N°: {quote_data['quote_number']}"],
-            ["📧 info@salesmind.com", f"Fecha: {quote_data['date']}"],
-            ["📱 +1 (555) 123-4567", f"Válida: {quote_data['valid_until']}"],
-            ["", f"Cliente: {quote_data['client_name']}"]
+            [f"N°: {quote_data['quote_number']}", f"Fecha: {quote_data['date']}"],
+            [f"Cliente: {quote_data['client_name']}", f"Válida: {quote_data['valid_until']}"]
         ]
         
         info_table = Table(info_data, colWidths=[3*inch, 2.5*inch])
-        info_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.lightgrey),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#E8F4FD'))
-        ]))
+        info_table.setStyle(QUOTE_INFO_TABLE_STYLE)
         
         story.append(info_table)
         story.append(Spacer(1, 30))
@@ -256,90 +177,180 @@ class QuoteSystemV2:
         items_data.append(['', '', f'IVA ({quote_data["tax_rate"]*100:.0f}%):', f"${quote_data['tax_amount']:,.2f}"])
         items_data.append(['', '', 'TOTAL:', f"${quote_data['total']:,.2f}"])
         
-        items_table = Table(items_data, colWidths=[2.5*inch, 0.8*inch, 1.2*inch, 1*inch])
-        items_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, -3), (-1, -1), colors.HexColor('#F0F8FF'))
-        ]))
+        items_table = Table(items_data, colWidths=[2.5*inch, 0.8*inch, 1.2*inch, 1*inch], repeatRows=1)
+        items_table.setStyle(QUOTE_ITEMS_TABLE_STYLE)
         
         story.append(items_table)
-        story.append(Spacer(1, 30))
         
-        # Términos y condiciones
-        story.append(Paragraph("📝 TÉRMINOS Y CONDICIONES", self.subtitle_style))
-        terms = """
-        1. Esta cotización es válida por 30 días calendario.
-        2. Los precios incluyen IVA cuando aplique.
-        3. Para reservar, se requiere anticipo del 30%.
-        4. Los tiempos de entrega pueden variar según disponibilidad.
-        5. SalesMind se reserva el derecho de modificar precios sin previo aviso.
+        # Generar PDF sobre la plantilla cacheada
+        self.get_page_template().build(filepath, story)
+    
+    def _create_access_methods(self, quote_data: dict, filename: str, filepath: str) -> dict:
+        """Crea el token temporal y las URLs de descarga de una cotización"""
+        from .token_store import download_token_store
+        
+        # 1. Token temporal seguro (recomendado), compartido entre procesos
+        token = download_token_store.issue(filepath, filename)
+        
+        return {
+            'secure_token': f"/secure-download/{token}",
+            # 2. URL directa tradicional (fallback)
+            'direct_url': f"/download-quote/{filename}",
+            # 3. Artefacto firmado y cacheable (reemplaza el base64 inline)
+            'artifact_url': self.get_artifact_url(quote_data['quote_number']),
+            # 4. Estado del renderizado (para el widget)
+            'status_url': f"/quote-status/{quote_data['quote_number']}"
+        }
+    
+    @staticmethod
+    def _store_quote(quote_data: dict, filepath: str):
+        """
+        Encola la cotización para guardarla en la tabla quotes (escritura
+        asíncrona por lotes). Un fallo aquí no debe afectar al chat.
+        """
+        try:
+            from .commercial.quote_store import quote_store
+            quote_store.enqueue(quote_data, filepath)
+        except Exception as e:
+            print(f"⚠️ No se pudo encolar la cotización {quote_data['quote_number']} para guardarla: {e}")
+    
+    @staticmethod
+    def sign_quote_number(quote_number: str) -> str:
+        """
+        Firma HMAC del número de cotización para las URLs de artefacto.
+        Sin SECRET_KEY no se firma: una clave vacía permitiría a cualquiera
+        calcular la firma de cualquier cotización.
+        """
+        if not Config.SECRET_KEY:
+            raise RuntimeError('SECRET_KEY no configurada: no se pueden firmar URLs de cotizaciones')
+        key = Config.SECRET_KEY.encode('utf-8')
+        return hmac.new(key, quote_number.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+    
+    @classmethod
+    def verify_quote_signature(cls, quote_number: str, signature: str) -> bool:
+        """Sin SECRET_KEY ninguna firma es válida"""
+        if not Config.SECRET_KEY or not signature:
+            return False
+        return hmac.compare_digest(cls.sign_quote_number(quote_number), signature)
+    
+    @classmethod
+    def get_artifact_url(cls, quote_number: str) -> Optional[str]:
+        """
+        URL permanente del PDF de una cotización. No caduca como los tokens, así
+        que el navegador y los proxies pueden cachearla. None si no hay
+        SECRET_KEY para firmarla.
+        """
+        if not Config.SECRET_KEY:
+            print("⚠️ SECRET_KEY no configurada: se omite la URL firmada de la cotización")
+            return None
+        return f"/quote-artifact/{quote_number}?sig={cls.sign_quote_number(quote_number)}"
+    
+    def _allocate_quote_path(self, quote_data: dict, output_dir: str = None) -> str:
+        """
+        Ruta del PDF: directorio por fecha/cliente registrado en el índice de
+        artefactos, o output_dir si se indica explícitamente.
+        """
+        filename = self.get_quote_filename(quote_data['quote_number'])
+        
+        if output_dir is None:
+            from .artifact_store import artifact_store, QUOTE_ARTIFACT_TTL
+            try:
+                return artifact_store.allocate(
+                    'quote', quote_data['quote_number'], filename,
+                    client_id=quote_data.get('client_id'), ttl=QUOTE_ARTIFACT_TTL
+                )
+            except Exception as e:
+                print(f"⚠️ Índice de artefactos no disponible, usando {QUOTES_DIR}: {e}")
+                output_dir = QUOTES_DIR
+        
+        os.makedirs(output_dir, exist_ok=True)
+        return os.path.join(output_dir, filename)
+    
+    def generate_pdf_v2(self, ai_response: str, client_name: str, output_dir: str = None,
+                        client_id: int = None) -> dict:
+        """
+        Genera PDF y devuelve múltiples opciones de acceso SIN REFRESH
         """
-        story.append(Paragraph(terms, self.normal_style))
+        # Extraer datos de cotización
+        quote_data = self.extract_quote_data_v2(ai_response, client_name, client_id)
         
         # Generar PDF
-        doc.build(story)
+        filename = self.get_quote_filename(quote_data['quote_number'])
+        filepath = self._allocate_quote_path(quote_data, output_dir)
+        self.build_quote_pdf(quote_data, filepath)
+        self._store_quote(quote_data, filepath)
         
         # 📊 GENERAR MÚLTIPLES OPCIONES DE ACCESO
         result = {
             'success': True,
+            'status': 'ready',
             'quote_number': quote_data['quote_number'],
             'filename': filename,
             'filepath': filepath,
             'file_size': os.path.getsize(filepath),
-            'access_methods': {}
+            'access_methods': self._create_access_methods(quote_data, filename, filepath)
         }
         
-        # 1. Token temporal seguro (recomendado)
-        token = secrets.token_urlsafe(32)
-        self.temp_tokens[token] = {
-            'filepath': filepath,
-            'expires': datetime.now() + timedelta(hours=1),
-            'filename': filename
-        }
-        result['access_methods']['secure_token'] = f"/secure-download/{token}"
-        
-        # 2. URL directa tradicional (fallback)
-        result['access_methods']['direct_url'] = f"/download-quote/{filename}"
-        
-        # 3. Base64 inline para archivos pequeños
-        if result['file_size'] < 500000:  # 500KB
-            with open(filepath, 'rb') as f:
-                pdf_content = f.read()
-                b64_content = base64.b64encode(pdf_content).decode('utf-8')
-                result['access_methods']['base64_inline'] = f"data:application/pdf;base64,{b64_content}"
-        
-        # 4. Información adicional
+        # Información adicional
         result['quote_data'] = quote_data
         
         return result
 
-    def cleanup_expired_tokens(self):
+    def request_pdf_v2(self, ai_response: str, client_name: str, output_dir: str = None,
+                       client_id: int = None) -> dict:
+        """
+        Igual que generate_pdf_v2 pero sin bloquear: extrae los datos, encola el
+        renderizado en el servicio de procesos y devuelve de inmediato el número
+        de cotización con enlaces que quedarán disponibles al terminar el PDF.
+        """
+        from .quote_renderer import quote_render_service
+        
+        quote_data = self.extract_quote_data_v2(ai_response, client_name, client_id)
+        
+        filename = self.get_quote_filename(quote_data['quote_number'])
+        filepath = self._allocate_quote_path(quote_data, output_dir)
+        quote_render_service.submit(quote_data, filepath)
+        self._store_quote(quote_data, filepath)
+        
+        return {
+            'success': True,
+            'status': 'pending',
+            'quote_number': quote_data['quote_number'],
+            'filename': filename,
+            'filepath': filepath,
+            'access_methods': self._create_access_methods(quote_data, filename, filepath),
+            'quote_data': quote_data
+        }
+    
+    def resolve_quote_file(self, quote_number: str):
+        """Ubicación del PDF de una cotización (índice de artefactos o directorio plano anterior)"""
+        from .artifact_store import artifact_store
+        return artifact_store.resolve('quote', quote_number, legacy_filename=self.get_quote_filename(quote_number))
+    
+    def get_render_status(self, quote_number: str) -> dict:
+        """Estado del renderizado de una cotización ('pending', 'ready' o 'failed')"""
+        from .quote_renderer import quote_render_service
+        
+        artifact = self.resolve_quote_file(quote_number)
+        if artifact:
+            return quote_render_service.get_status(artifact['filepath'])
+        return quote_render_service.get_status(os.path.join(QUOTES_DIR, self.get_quote_filename(quote_number)))
+    
+    def cleanup_expired_tokens(self) -> int:
         """Limpia tokens expirados"""
-        now = datetime.now()
-        expired_tokens = [
-            token for token, data in self.temp_tokens.items()
-            if data['expires'] < now
-        ]
-        for token in expired_tokens:
-            del self.temp_tokens[token]
+        from .token_store import download_token_store
+        return download_token_store.purge_expired()
     
     def get_file_by_token(self, token: str) -> dict:
         """Recupera archivo por token seguro"""
-        self.cleanup_expired_tokens()
-        
-        if token in self.temp_tokens:
-            return self.temp_tokens[token]
-        return None
+        from .token_store import download_token_store
+        return download_token_store.get(token)
 
 # Instancia global
 quote_system_v2 = QuoteSystemV2()
 
-def generate_quote_v2_if_requested(ai_response: str, question: str, client_name: str) -> tuple:
+def generate_quote_v2_if_requested(ai_response: str, question: str, client_name: str,
+                                   client_id: int = None) -> tuple:
     """
     Versión 2 del generador de cotización SIN REFRESH
     """
@@ -353,8 +364,8 @@ def generate_quote_v2_if_requested(ai_response: str, question: str, client_name:
     
     if is_quote_request:
         try:
-            # Generar cotización con nuevo sistema
-            result = quote_system_v2.generate_pdf_v2(ai_response, client_name)
+            # Encolar cotización: el PDF se genera fuera de la petición
+            result = quote_system_v2.request_pdf_v2(ai_response, client_name, client_id=client_id)
             
             if result['success']:
                 # 📄 CREAR RESPUESTA MEJORADA SIN REFRESH
@@ -368,10 +379,10 @@ def generate_quote_v2_if_requested(ai_response: str, question: str, client_name:
                 direct_url = result['access_methods']['direct_url']
                 download_options.append(f"📁 [Descarga Directa]({direct_url})")
                 
-                # Opción 3: Vista inline (si es pequeño)
-                if 'base64_inline' in result['access_methods']:
-                    inline_url = result['access_methods']['base64_inline']
-                    download_options.append(f"👁️ [Ver en Navegador]({inline_url})")
+                # Opción 3: Vista en el navegador (enlace cacheable, sin base64 en el mensaje)
+                artifact_url = result['access_methods']['artifact_url']
+                if artifact_url:
+                    download_options.append(f"👁️ [Ver en Navegador]({artifact_url})")
                 
                 quote_info = f"""
 
@@ -382,6 +393,8 @@ def generate_quote_v2_if_requested(ai_response: str, question: str, client_name:
 ✅ **Items:** {len(result['quote_data']['items'])} productos/servicios
 ✅ **Válida hasta:** {result['quote_data']['valid_until']}
 
+⏳ **El PDF se está generando y estará listo en unos segundos.**
+
 📥 **OPCIONES DE DESCARGA:**
 {' | '.join(download_options)}
 
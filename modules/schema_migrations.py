@@ -0,0 +1,281 @@
+"""
+Migraciones versionadas del esquema de SalesMind
+
+Sustituye a los scripts sueltos (fix_database_schema.py, migrate_to_v2.py):
+cada cambio de esquema sobre tablas existentes es una migración numerada
+que se aplica una sola vez y queda registrada en schema_migrations.
+
+    flask db-upgrade        # crea tablas nuevas y aplica las migraciones pendientes
+    flask db-status         # muestra aplicadas y pendientes
+
+Para añadir una migración, define una función con @migration y la
+siguiente versión; las sentencias deben ser idempotentes (IF NOT EXISTS)
+porque una base creada con create_all ya puede tener el objeto.
+"""
+
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import text
+from . import db
+
+# Clave del advisory lock que serializa ejecuciones simultáneas (varios workers al desplegar)
+MIGRATION_LOCK_ID = 730_049
+
+_migrations: List[Dict] = []
+
+
+def migration(version: str, description: str, transactional: bool = True):
+    """
+    Registra una migración.
+
+    Args:
+        version: Número con ceros a la izquierda ('0003'); define el orden
+        description: Texto para el historial
+        transactional: False para sentencias que no admiten transacción
+                       (CREATE INDEX CONCURRENTLY); se ejecutan en autocommit
+    """
+    def register(upgrade: Callable):
+        if any(m['version'] == version for m in _migrations):
+            raise ValueError(f'Versión de migración repetida: {version}')
+        _migrations.append({
+            'version': version,
+            'description': description,
+            'transactional': transactional,
+            'upgrade': upgrade
+        })
+        _migrations.sort(key=lambda m: m['version'])
+        return upgrade
+    return register
+
+
+def _ensure_history_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(20) PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+    """))
+
+
+def _applied_versions(conn) -> Dict[str, datetime]:
+    rows = conn.execute(text("SELECT version, applied_at FROM schema_migrations"))
+    return {row.version: row.applied_at for row in rows}
+
+
+def _record(conn, entry: Dict):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+        {'version': entry['version'], 'description': entry['description']}
+    )
+
+
+def upgrade(target: Optional[str] = None, create_tables: bool = True) -> Dict:
+    """
+    Aplica en orden las migraciones pendientes (hasta target, si se indica).
+
+    Cada migración transaccional se aplica y registra en la misma
+    transacción: si falla no queda a medias y se puede reintentar. Se
+    detiene en la primera que falla.
+
+    Args:
+        target: Última versión a aplicar (por defecto, todas)
+        create_tables: Crear antes las tablas nuevas de los modelos (create_all)
+
+    Returns:
+        Dict con success, versiones aplicadas y error
+    """
+    if create_tables:
+        db.create_all()
+
+    applied = []
+    current = None
+    lock_conn = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+        _ensure_history_table(lock_conn)
+        done = _applied_versions(lock_conn)
+
+        for entry in _migrations:
+            if target and entry['version'] > target:
+                break
+            if entry['version'] in done:
+                continue
+
+            current = entry['version']
+            print(f"📝 Migración {entry['version']}: {entry['description']}...")
+            if entry['transactional']:
+                with db.engine.begin() as conn:
+                    entry['upgrade'](conn)
+                    _record(conn, entry)
+            else:
+                entry['upgrade'](lock_conn)
+                _record(lock_conn, entry)
+            applied.append(entry['version'])
+
+        print(f"✅ Esquema al día ({len(applied)} migraciones aplicadas)")
+        return {'success': True, 'applied': applied, 'error': None}
+
+    except Exception as e:
+        print(f"❌ Error en la migración {current}: {e}")
+        return {'success': False, 'applied': applied, 'error': f'{current}: {str(e)}'}
+
+    finally:
+        lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': MIGRATION_LOCK_ID})
+        lock_conn.close()
+
+
+def status() -> List[Dict]:
+    """Estado de cada migración registrada (aplicada o pendiente)"""
+    with db.engine.begin() as conn:
+        _ensure_history_table(conn)
+        done = _applied_versions(conn)
+
+    return [
+        {
+            'version': entry['version'],
+            'description': entry['description'],
+            'applied_at': done[entry['version']].isoformat() if entry['version'] in done else None
+        }
+        for entry in _migrations
+    ]
+
+
+def _create_index_concurrently(conn, name: str, definition: str):
+    """
+    CREATE INDEX CONCURRENTLY sin bloquear escrituras en tablas grandes.
+    Un intento anterior interrumpido deja el índice INVALID: se elimina y
+    se vuelve a crear, porque IF NOT EXISTS lo daría por bueno.
+    """
+    invalid = conn.execute(text("""
+        SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = :name AND NOT i.indisvalid
+    """), {'name': name}).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+
+# ==================== MIGRACIONES ====================
+
+@migration('0001', 'Esquema base: columnas e índices de fix_database_schema.py')
+def _baseline(conn):
+    # index_path nullable (índices FAISS en PostgreSQL)
+    conn.execute(text("ALTER TABLE client ALTER COLUMN index_path DROP NOT NULL;"))
+    conn.execute(text("""
+        UPDATE client
+        SET index_path = 'postgresql_storage'
+        WHERE index_path IS NULL;
+    """))
+
+    # Hash por chunk para la re-indexación delta de documentos
+    conn.execute(text("""
+        ALTER TABLE embeddings
+        ADD COLUMN IF NOT EXISTS chunk_hash VARCHAR(64);
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_embeddings_document_chunk_hash
+        ON embeddings (document_id, chunk_hash);
+    """))
+
+    # Cotizaciones del chat persistidas en quotes/quote_items
+    conn.execute(text("""
+        ALTER TABLE quotes
+        ADD COLUMN IF NOT EXISTS currency VARCHAR(3),
+        ADD COLUMN IF NOT EXISTS source VARCHAR(20) NOT NULL DEFAULT 'engine',
+        ADD COLUMN IF NOT EXISTS pdf_path VARCHAR(500);
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_quotes_client_source_created
+        ON quotes (client_id, source, created_at);
+    """))
+    conn.execute(text("""
+        ALTER TABLE quote_items
+        ALTER COLUMN product_id DROP NOT NULL,
+        ADD COLUMN IF NOT EXISTS description VARCHAR(255);
+    """))
+
+    # Historial de movimientos por producto (rollup diario y consultas)
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_inventory_movements_product_created
+        ON inventory_movements (product_id, created_at);
+    """))
+
+    # Búsqueda de leads por trigramas
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+    conn.execute(text("""
+        ALTER TABLE leads
+        ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+            lower(coalesce(name, '') || ' ' || coalesce(company, '') || ' ' || coalesce(email, ''))
+        ) STORED,
+        ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(50) GENERATED ALWAYS AS (
+            regexp_replace(coalesce(phone, ''), '[^0-9]', '', 'g')
+        ) STORED;
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_leads_search_text_trgm
+        ON leads USING gin (search_text gin_trgm_ops);
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_leads_phone_digits_trgm
+        ON leads USING gin (phone_digits gin_trgm_ops);
+    """))
+
+    # Paginación por cursor de los listados comerciales (client_id, created_at, id)
+    for table in ('orders', 'invoices', 'quotes', 'leads'):
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_{table}_client_created_id
+            ON {table} (client_id, created_at, id);
+        """))
+
+    # Cotizaciones y órdenes relacionadas con un lead (detalle del lead)
+    for table in ('quotes', 'orders'):
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_{table}_client_customer_email
+            ON {table} (client_id, customer_email);
+        """))
+
+
+@migration('0002', 'Índice único products (client_id, sku) para la sincronización de catálogo')
+def _products_client_sku(conn):
+    duplicates = conn.execute(text("""
+        SELECT client_id, sku, COUNT(*) FROM products
+        WHERE sku IS NOT NULL AND sku <> ''
+        GROUP BY client_id, sku HAVING COUNT(*) > 1;
+    """)).fetchall()
+    if duplicates:
+        listed = ', '.join(f'cliente {client_id} SKU {sku} ({count})' for client_id, sku, count in duplicates[:20])
+        raise RuntimeError(f'{len(duplicates)} SKUs repetidos; corrígelos y vuelve a ejecutar: {listed}')
+
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_products_client_sku
+        ON products (client_id, sku)
+        WHERE sku IS NOT NULL AND sku <> '';
+    """))
+
+
+# Índices compuestos de los filtros más frecuentes (nombre, tabla y columnas)
+HOT_FILTER_INDEXES = [
+    ('ix_conversations_client_chat_timestamp', 'salesmind_conversations', 'client_id, chat_id, timestamp'),
+    ('ix_query_logs_client_timestamp', 'query_logs', 'client_id, timestamp'),
+    ('ix_embeddings_client_document_chunk', 'embeddings', 'client_id, document_id, chunk_index'),
+    ('ix_faiss_indexes_client_name_active', 'faiss_indexes', 'client_id, index_name, is_active'),
+    ('ix_leads_client_status_next_action', 'leads', 'client_id, status, next_action_date'),
+    ('ix_invoices_client_due_status', 'invoices', 'client_id, due_date, status'),
+    ('ix_inventory_movements_reference', 'inventory_movements', 'reference_type, reference_id'),
+]
+
+
+@migration('0003', 'Índices compuestos de filtros frecuentes (conversaciones, logs, embeddings, CRM, facturas)',
+           transactional=False)
+def _hot_filter_indexes(conn):
+    # Tablas grandes y con escrituras constantes: construir sin bloquearlas
+    for name, table, columns in HOT_FILTER_INDEXES:
+        _create_index_concurrently(conn, name, f'{table} ({columns})')
+
+
+@migration('0004', 'Índices de deduplicación de leads por email y teléfono normalizados (pipeline chat -> CRM)',
+           transactional=False)
+def _lead_dedupe_indexes(conn):
+    _create_index_concurrently(conn, 'ix_leads_client_email_normalized', 'leads (client_id, lower(trim(email)))')
+    _create_index_concurrently(conn, 'ix_leads_client_phone_digits', 'leads (client_id, phone_digits)')
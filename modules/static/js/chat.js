@@ -252,6 +252,34 @@ document.addEventListener('DOMContentLoaded', () => {
         return messageWrapper;
     };
 
+    /**
+     * Consulta el estado de una cotización hasta que su PDF esté listo.
+     */
+    const watchQuote = async (quote, attempt = 0) => {
+        if (attempt >= 40) {
+            addMessage(`La cotización ${quote.quote_number} está tardando más de lo normal. Intenta la descarga en unos minutos.`, 'ai');
+            return;
+        }
+
+        try {
+            const response = await fetch(quote.status_url, { cache: 'no-store' });
+            const status = await response.json();
+
+            if (status.status === 'ready') {
+                addMessage(`Tu cotización ${quote.quote_number} está lista: <a href="${quote.download_url}" target="_blank" class="pdf-download-btn">📄 Descargar Cotización PDF</a>`, 'ai');
+                return;
+            }
+            if (status.status === 'failed') {
+                addMessage(`No se pudo generar el PDF de la cotización ${quote.quote_number}.`, 'ai');
+                return;
+            }
+        } catch (error) {
+            console.error('Error consultando cotización:', error);
+        }
+
+        setTimeout(() => watchQuote(quote, attempt + 1), 1500);
+    };
+
     /**
      * Maneja el envío de un mensaje al backend y la recepción de la respuesta.
      */
@@ -308,6 +336,11 @@ document.addEventListener('DOMContentLoaded', () => {
             
             addMessage(responseText, 'ai', false, data.sources);
 
+            // Cotización en renderizado: avisar cuando el PDF esté listo
+            if (data.quote && data.quote.status === 'pending') {
+                watchQuote(data.quote);
+            }
+
         } catch (error) {
             console.error('Error en fetch:', error);
             
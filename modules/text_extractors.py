@@ -0,0 +1,194 @@
+# modules/text_extractors.py
+import csv
+import io
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Registro extensión -> función que recibe los bytes del archivo y devuelve texto
+EXTRACTORS: Dict[str, Callable[[bytes], str]] = {}
+
+# Filas de hojas de cálculo a leer como máximo por hoja
+MAX_SHEET_ROWS = 100000
+
+
+def register_extractor(*extensions: str):
+    """
+    Registra una función de extracción para una o varias extensiones.
+
+    Uso:
+        @register_extractor('md', 'txt')
+        def extract_plain_text(file_content: bytes) -> str: ...
+    """
+    def decorator(func: Callable[[bytes], str]):
+        for extension in extensions:
+            EXTRACTORS[extension.lower()] = func
+        return func
+    return decorator
+
+
+def get_extractor(filename: str) -> Optional[Callable[[bytes], str]]:
+    """Obtiene el extractor registrado para la extensión del archivo."""
+    extension = filename.lower().rsplit('.', 1)[-1] if '.' in filename else ''
+    return EXTRACTORS.get(extension)
+
+
+def supported_extensions() -> List[str]:
+    """Extensiones con extractor registrado."""
+    return sorted(EXTRACTORS)
+
+
+def decode_text(file_content: bytes) -> str:
+    """Decodifica texto probando UTF-8 (con BOM) y luego Windows-1252/Latin-1."""
+    for encoding in ('utf-8-sig', 'cp1252', 'latin-1'):
+        try:
+            return file_content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return file_content.decode('utf-8', errors='ignore')
+
+
+def _format_cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def rows_to_text(rows: Iterable[Iterable], title: str = '') -> str:
+    """
+    Convierte filas de una lista de precios en líneas autocontenidas
+    ("Producto: X | Precio: Y"), para que cada fila conserve el significado
+    de sus columnas aunque quede en un chunk distinto al de la cabecera.
+    """
+    headers = None
+    lines = [f"Hoja: {title}"] if title else []
+
+    for row in rows:
+        cells = [_format_cell(value) for value in row]
+        if not any(cells):
+            continue
+
+        if headers is None:
+            headers = [cell or f"Columna {i + 1}" for i, cell in enumerate(cells)]
+            continue
+
+        pairs = [
+            f"{headers[i] if i < len(headers) else f'Columna {i + 1}'}: {cell}"
+            for i, cell in enumerate(cells) if cell
+        ]
+        lines.append(' | '.join(pairs))
+
+    return '\n'.join(lines)
+
+
+@register_extractor('pdf')
+def extract_pdf(file_content: bytes) -> str:
+    """PDF con PyMuPDF y OCR para las páginas escaneadas."""
+    from .ocr_extractor import OCRExtractor
+    extracted_text, stats = OCRExtractor.extract_text(file_content)
+    return extracted_text
+
+
+@register_extractor('txt', 'md')
+def extract_plain_text(file_content: bytes) -> str:
+    """Texto plano."""
+    return decode_text(file_content).strip()
+
+
+@register_extractor('docx')
+def extract_docx(file_content: bytes) -> str:
+    """Word (DOCX): párrafos y tablas en orden de aparición."""
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    document = docx.Document(io.BytesIO(file_content))
+    parts = []
+
+    for block in document.element.body.iterchildren():
+        tag = block.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            text = Paragraph(block, document).text.strip()
+            if text:
+                parts.append(text)
+        elif tag == 'tbl':
+            table = Table(block, document)
+            table_text = rows_to_text([cell.text for cell in row.cells] for row in table.rows)
+            if table_text:
+                parts.append(table_text)
+
+    return '\n\n'.join(parts)
+
+
+@register_extractor('csv')
+def extract_csv(file_content: bytes) -> str:
+    """Lista de precios en CSV (detecta separador ',' o ';')."""
+    text = decode_text(file_content)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return rows_to_text(csv.reader(io.StringIO(text), dialect))
+
+
+@register_extractor('xlsx', 'xlsm')
+def extract_xlsx(file_content: bytes) -> str:
+    """Lista de precios en Excel, leída en modo read-only fila a fila."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(max_row=MAX_SHEET_ROWS, values_only=True)
+            sheet_text = rows_to_text(rows, title=sheet.title)
+            if sheet_text:
+                sheets.append(sheet_text)
+        return '\n\n'.join(sheets)
+    finally:
+        workbook.close()
+
+
+class _HTMLTextParser(HTMLParser):
+    """Extrae el texto visible de un HTML, separando bloques por líneas."""
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'head', 'template'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'section', 'article', 'table', 'ul', 'ol', 'header', 'footer'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag in ('td', 'th'):
+            self.parts.append(' | ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+    def get_text(self) -> str:
+        lines = (' '.join(line.split()).strip(' |') for line in ''.join(self.parts).splitlines())
+        return '\n'.join(line for line in lines if line)
+
+
+@register_extractor('html', 'htm')
+def extract_html(file_content: bytes) -> str:
+    """Página HTML (catálogos exportados de la web del cliente)."""
+    parser = _HTMLTextParser()
+    parser.feed(decode_text(file_content))
+    parser.close()
+    return parser.get_text()
@@ -0,0 +1,134 @@
+# modules/token_store.py
+"""
+Almacén de tokens de descarga temporales compartido entre procesos.
+
+Los tokens se guardan en PostgreSQL (tabla salesmind_download_tokens), así que
+cualquier worker puede servir /secure-download/<token> y sobreviven a los
+reinicios. Cada proceso mantiene además una caché local con un heap ordenado
+por expiración: caducar tokens solo mira la cabeza del heap, en lugar de
+recorrer todo el diccionario en cada consulta.
+"""
+import heapq
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import delete, insert, select
+from .models import DownloadToken
+from . import db
+
+DEFAULT_TOKEN_TTL = timedelta(hours=1)
+# Cada cuánto se borran de PostgreSQL los tokens caducados
+PURGE_INTERVAL = timedelta(minutes=10)
+
+
+class DownloadTokenStore:
+    """Tokens de descarga con caché local por expiración y respaldo en PostgreSQL."""
+
+    def __init__(self, max_cached: int = 10000):
+        self.max_cached = max_cached
+        self._cache = {}   # token -> datos
+        self._heap = []    # (expira, token)
+        self._lock = threading.Lock()
+        self._last_purge = datetime.utcnow()
+
+    def _cache_put(self, token: str, data: Dict):
+        with self._lock:
+            self._expire_cached(datetime.utcnow())
+            if len(self._cache) >= self.max_cached:
+                # Caché llena: descartar el token más próximo a expirar (sigue en PostgreSQL)
+                _, oldest = heapq.heappop(self._heap)
+                self._cache.pop(oldest, None)
+            self._cache[token] = data
+            heapq.heappush(self._heap, (data['expires'], token))
+
+    def _expire_cached(self, now: datetime):
+        """Retira de la caché local los tokens caducados (solo la cabeza del heap)."""
+        while self._heap and self._heap[0][0] <= now:
+            _, token = heapq.heappop(self._heap)
+            self._cache.pop(token, None)
+
+    def issue(self, filepath: str, filename: str, ttl: timedelta = DEFAULT_TOKEN_TTL) -> str:
+        """
+        Crea un token de descarga para un archivo.
+
+        Returns:
+            Token URL-safe
+        """
+        token = secrets.token_urlsafe(32)
+        data = {
+            'filepath': filepath,
+            'filename': filename,
+            'expires': datetime.utcnow() + ttl
+        }
+
+        try:
+            # Conexión propia: el token existe aunque la petición que lo crea haga rollback
+            with db.engine.begin() as conn:
+                conn.execute(insert(DownloadToken.__table__).values(
+                    token=token,
+                    filepath=filepath,
+                    filename=filename,
+                    expires_at=data['expires'],
+                    created_at=datetime.utcnow()
+                ))
+        except Exception as e:
+            print(f"⚠️ Token de descarga solo en memoria local (PostgreSQL no disponible): {e}")
+
+        self._cache_put(token, data)
+        self._maybe_purge()
+        return token
+
+    def get(self, token: str) -> Optional[Dict]:
+        """
+        Recupera los datos de un token vigente (de la caché local o de PostgreSQL).
+        """
+        now = datetime.utcnow()
+
+        with self._lock:
+            self._expire_cached(now)
+            data = self._cache.get(token)
+        if data:
+            return data
+
+        try:
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    select(DownloadToken.filepath, DownloadToken.filename, DownloadToken.expires_at)
+                    .where(DownloadToken.token == token, DownloadToken.expires_at > now)
+                ).first()
+        except Exception as e:
+            print(f"⚠️ Error consultando token de descarga: {e}")
+            return None
+
+        if not row:
+            return None
+
+        data = {'filepath': row.filepath, 'filename': row.filename, 'expires': row.expires_at}
+        self._cache_put(token, data)
+        return data
+
+    def purge_expired(self) -> int:
+        """Borra los tokens caducados de la caché local y de PostgreSQL."""
+        now = datetime.utcnow()
+        with self._lock:
+            self._expire_cached(now)
+            self._last_purge = now
+
+        try:
+            with db.engine.begin() as conn:
+                result = conn.execute(
+                    delete(DownloadToken.__table__).where(DownloadToken.expires_at <= now)
+                )
+            return result.rowcount or 0
+        except Exception as e:
+            print(f"⚠️ Error limpiando tokens de descarga: {e}")
+            return 0
+
+    def _maybe_purge(self):
+        if datetime.utcnow() - self._last_purge >= PURGE_INTERVAL:
+            self.purge_expired()
+
+
+# Instancia global
+download_token_store = DownloadTokenStore()
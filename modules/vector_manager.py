@@ -4,6 +4,7 @@ import faiss
 import pickle
 import io
 import json
+import hashlib
 from datetime import datetime
 from typing import List, Dict, Tuple, Optional, Union
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,10 +12,16 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.schema.document import Document as LangchainDoc
 from langchain_community.embeddings import OllamaEmbeddings
 
-from .models import Embedding, FAISSIndex, Document, Client
+from .models import Embedding, FAISSIndex, Document, Client, IngestionJobDocument
+from .bulk_writer import BulkWriter
+from .ocr_extractor import MIN_TEXT_CHARS
+from sqlalchemy import text
 from . import db
 from config import Config
 
+# Espacio de nombres del advisory lock por cliente (escrituras del índice FAISS activo)
+FAISS_INDEX_LOCK = 7305027
+
 class VectorManager:
     """
     Gestor de vectores y embeddings que almacena todo en PostgreSQL.
@@ -62,12 +69,18 @@ class VectorManager:
         import pickle
         return pickle.loads(vector_bytes)
     
-    def create_embeddings_from_document(self, document_id: int) -> List[Embedding]:
+    @staticmethod
+    def calculate_chunk_hash(chunk_text: str) -> str:
+        """Calcula el hash SHA-256 del texto de un chunk."""
+        return hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()
+    
+    def create_embeddings_from_document(self, document_id: int, progress_callback=None) -> List[Embedding]:
         """
         Crea embeddings para un documento y los guarda en PostgreSQL.
         
         Args:
             document_id: ID del documento en PostgreSQL
+            progress_callback: Función opcional (procesados, total) llamada tras cada chunk
             
         Returns:
             Lista de embeddings creados
@@ -94,43 +107,53 @@ class VectorManager:
             # Obtener modelo de embeddings
             embedding_model = self._get_embedding_model()
             
-            # Crear embeddings para cada chunk
+            # Crear embeddings para cada chunk; las filas se escriben por lotes
             embeddings_created = []
+            writer = BulkWriter(Embedding, use_copy=False)
+            pending_rows = []
             
             for i, chunk_text in enumerate(chunks):
                 try:
                     # Generar embedding para el chunk
                     chunk_vector = embedding_model.embed_query(chunk_text)
+                except Exception as e:
+                    print(f"❌ Error procesando chunk {i}: {e}")
+                    chunk_vector = None
+                
+                # La escritura queda fuera del try: si falla un lote, falla el
+                # documento (la transacción ya no es utilizable para otros chunks)
+                if chunk_vector is not None:
                     vector_array = np.array(chunk_vector, dtype=np.float32)
                     
-                    # Serializar vector para PostgreSQL
-                    serialized_vector = self._serialize_vector(vector_array)
-                    
-                    # Crear embedding en PostgreSQL
-                    embedding = Embedding(
-                        client_id=document.client_id,
-                        document_id=document_id,
-                        text_chunk=chunk_text,
-                        chunk_index=i,
-                        embedding_vector=serialized_vector,
-                        vector_dimension=len(chunk_vector),
-                        model_used="text-embedding-004"
-                    )
-                    
-                    db.session.add(embedding)
-                    embeddings_created.append(embedding)
-                    
-                    if (i + 1) % 10 == 0:  # Log cada 10 chunks
-                        print(f"   - Procesados {i + 1}/{len(chunks)} chunks")
+                    row = {
+                        'client_id': document.client_id,
+                        'document_id': document_id,
+                        'text_chunk': chunk_text,
+                        'chunk_index': i,
+                        'chunk_hash': self.calculate_chunk_hash(chunk_text),
+                        'embedding_vector': self._serialize_vector(vector_array),
+                        'vector_dimension': len(chunk_vector),
+                        'model_used': "text-embedding-004"
+                    }
+                    pending_rows.append(row)
+                    inserted_ids = writer.add(row)
+                    if inserted_ids:
+                        embeddings_created.extend(self._embeddings_from_rows(pending_rows, inserted_ids))
+                        pending_rows = []
                 
-                except Exception as e:
-                    print(f"❌ Error procesando chunk {i}: {e}")
-                    continue
+                if (i + 1) % 10 == 0:  # Log cada 10 chunks
+                    print(f"   - Procesados {i + 1}/{len(chunks)} chunks")
+                
+                if progress_callback:
+                    try:
+                        progress_callback(i + 1, len(chunks))
+                    except Exception as e:
+                        print(f"⚠️ Error reportando progreso: {e}")
             
-            # Commit todos los embeddings
-            db.session.commit()
+            # Escribir el último lote y marcar documento como procesado
+            inserted_ids = writer.flush()
+            embeddings_created.extend(self._embeddings_from_rows(pending_rows, inserted_ids))
             
-            # Marcar documento como procesado
             document.processed_date = datetime.utcnow()
             db.session.commit()
             
@@ -142,6 +165,25 @@ class VectorManager:
             print(f"❌ Error creando embeddings para documento {document_id}: {e}")
             return []
     
+    @staticmethod
+    def _embeddings_from_rows(rows: List[Dict], inserted_ids: List[int]) -> List[Embedding]:
+        """
+        Construye objetos Embedding (fuera de la sesión) a partir de filas ya
+        insertadas por BulkWriter, para devolverlos sin volver a leer los vectores.
+        """
+        return [Embedding(id=emb_id, **row) for row, emb_id in zip(rows, inserted_ids)]
+    
+    @staticmethod
+    def _lock_client_index(client_id: int):
+        """
+        Serializa hasta el commit la lectura y sustitución del índice activo
+        de un cliente entre workers (reconstrucción completa o incremental).
+        """
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :client_id)"),
+            {'namespace': FAISS_INDEX_LOCK, 'client_id': client_id}
+        )
+    
     def create_faiss_index_for_client(self, client_id: int, index_name: str = "main_index") -> Optional[FAISSIndex]:
         """
         Crea un índice FAISS desde todos los embeddings de un cliente y lo guarda en PostgreSQL.
@@ -154,6 +196,8 @@ class VectorManager:
             FAISSIndex creado o None si hay error
         """
         try:
+            self._lock_client_index(client_id)
+            
             # Obtener todos los embeddings del cliente
             embeddings = Embedding.query.filter_by(client_id=client_id).all()
             
@@ -184,11 +228,6 @@ class VectorManager:
             
             print(f"   - Vectores añadidos al índice: {index.ntotal}")
             
-            # Serializar índice FAISS para PostgreSQL
-            index_buffer = io.BytesIO()
-            faiss.write_index(index, faiss.PyCallbackIOWriter(index_buffer.write))
-            index_data = index_buffer.getvalue()
-            
             # Crear metadatos
             metadata = {
                 "embedding_ids": [emb.id for emb in embeddings],
@@ -198,43 +237,284 @@ class VectorManager:
                 "chunk_overlap": 200
             }
             
-            # Desactivar índice anterior si existe
-            old_index = FAISSIndex.query.filter_by(
-                client_id=client_id, 
+            new_index = self._store_faiss_index(client_id, index_name, index, vector_dimension, metadata)
+            db.session.commit()
+            
+            print(f"✅ Índice FAISS creado y guardado en PostgreSQL")
+            print(f"   - ID del índice: {new_index.id}")
+            print(f"   - Tamaño: {len(new_index.index_data):,} bytes")
+            
+            return new_index
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error creando índice FAISS para cliente {client_id}: {e}")
+            return None
+    
+    def _store_faiss_index(self, client_id: int, index_name: str, index: faiss.Index,
+                           vector_dimension: int, metadata: Dict) -> FAISSIndex:
+        """
+        Serializa un índice FAISS, desactiva la versión activa anterior y añade
+        el nuevo registro a la sesión (el commit queda a cargo del llamador).
+        """
+        # Serializar índice FAISS para PostgreSQL
+        index_buffer = io.BytesIO()
+        faiss.write_index(index, faiss.PyCallbackIOWriter(index_buffer.write))
+        index_data = index_buffer.getvalue()
+        
+        # Desactivar índice anterior si existe
+        old_index = FAISSIndex.query.filter_by(
+            client_id=client_id, 
+            index_name=index_name,
+            is_active=True
+        ).first()
+        
+        if old_index:
+            old_index.is_active = False
+            old_index.version += 1
+        
+        # Crear nuevo índice en PostgreSQL
+        new_index = FAISSIndex(
+            client_id=client_id,
+            index_name=index_name,
+            index_data=index_data,
+            index_metadata=json.dumps(metadata),
+            vector_dimension=vector_dimension,
+            total_vectors=index.ntotal,
+            index_type="IndexFlatL2",
+            is_active=True,
+            version=1
+        )
+        
+        db.session.add(new_index)
+        return new_index
+    
+    def update_faiss_index_incremental(self, client_id: int, added_embeddings: List[Embedding],
+                                       removed_embedding_ids: List[int],
+                                       index_name: str = "main_index") -> Optional[FAISSIndex]:
+        """
+        Actualiza el índice FAISS activo de un cliente sin reconstruirlo:
+        elimina los vectores retirados y añade los nuevos al final.
+        Si no hay un índice activo coherente, hace una reconstrucción completa.
+        
+        Args:
+            client_id: ID del cliente
+            added_embeddings: Embeddings nuevos a añadir al índice
+            removed_embedding_ids: IDs de embeddings retirados
+            index_name: Nombre del índice
+            
+        Returns:
+            FAISSIndex actualizado o None si hay error
+        """
+        try:
+            # Sin el lock, dos workers leerían la misma versión y uno perdería sus vectores
+            self._lock_client_index(client_id)
+            
+            record = FAISSIndex.query.filter_by(
+                client_id=client_id,
                 index_name=index_name,
                 is_active=True
             ).first()
             
-            if old_index:
-                old_index.is_active = False
-                old_index.version += 1
+            metadata = json.loads(record.index_metadata or '{}') if record else {}
+            embedding_ids = metadata.get("embedding_ids")
+            
+            if not record or embedding_ids is None or len(embedding_ids) != record.total_vectors:
+                print(f"⚠️ Sin índice activo coherente para cliente {client_id}, reconstruyendo completo")
+                return self.create_faiss_index_for_client(client_id, index_name)
+            
+            index_buffer = io.BytesIO(record.index_data)
+            index = faiss.read_index(faiss.PyCallbackIOReader(index_buffer.read))
+            
+            # 1. Retirar vectores (IndexFlat compacta conservando el orden restante)
+            removed = set(removed_embedding_ids)
+            positions = [pos for pos, emb_id in enumerate(embedding_ids) if emb_id in removed]
+            if positions:
+                index.remove_ids(np.array(positions, dtype=np.int64))
+                embedding_ids = [emb_id for emb_id in embedding_ids if emb_id not in removed]
+            
+            # 2. Añadir vectores nuevos
+            if added_embeddings:
+                if any(emb.vector_dimension != record.vector_dimension for emb in added_embeddings):
+                    print(f"⚠️ Dimensión de vectores distinta al índice, reconstruyendo completo")
+                    return self.create_faiss_index_for_client(client_id, index_name)
+                
+                vectors_matrix = np.vstack([
+                    self._deserialize_vector(emb.embedding_vector) for emb in added_embeddings
+                ]).astype(np.float32)
+                index.add(vectors_matrix)
+                embedding_ids.extend(emb.id for emb in added_embeddings)
+            
+            metadata["embedding_ids"] = embedding_ids
+            metadata["updated_date"] = datetime.utcnow().isoformat()
+            
+            new_index = self._store_faiss_index(client_id, index_name, index, record.vector_dimension, metadata)
+            db.session.commit()
+            
+            print(f"✅ Índice FAISS actualizado incrementalmente: -{len(positions)} / +{len(added_embeddings)} vectores "
+                  f"({new_index.total_vectors} en total)")
+            return new_index
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error actualizando índice FAISS para cliente {client_id}: {e}")
+            return None
+    
+    def reindex_document_delta(self, client_id: int, filename: str, file_content: bytes,
+                               index_name: str = "main_index", update_index: bool = True,
+                               progress_callback=None) -> Optional[Dict]:
+        """
+        Reemplaza las versiones anteriores de un documento (mismo nombre de archivo)
+        re-embebiendo solo los chunks cuyo hash cambió. Los chunks idénticos
+        conservan su vector, los eliminados se retiran y el índice FAISS se
+        actualiza de forma incremental.
+        
+        Args:
+            client_id: ID del cliente
+            filename: Nombre del archivo
+            file_content: Contenido binario de la nueva versión
+            index_name: Nombre del índice a actualizar
+            update_index: Si True, aplica el delta sobre el índice FAISS activo
+            progress_callback: Función opcional (chunks_hechos, chunks_totales)
+            
+        Returns:
+            Diccionario con el documento, contadores de chunks e index_updated;
+            None si no hay versión anterior y debe usarse la indexación completa.
+            Si falla, diccionario con document None y error: no debe indexarse
+            como documento nuevo (duplicaría el documento)
+        """
+        from .document_manager import DocumentManager
+        
+        try:
+            previous_docs = DocumentManager.get_previous_versions(client_id, filename)
+            if not previous_docs:
+                return None
             
-            # Crear nuevo índice en PostgreSQL
-            new_index = FAISSIndex(
+            content_hash = DocumentManager.calculate_file_hash(file_content)
+            identical = Document.query.filter_by(client_id=client_id, content_hash=content_hash).first()
+            if identical:
+                print(f"⚠️ Documento sin cambios: {filename} (hash: {content_hash[:8]}...)")
+                return {'document': identical, 'unchanged': True, 'added': 0, 'reused': 0, 'retired': 0,
+                        'index_updated': True}
+            
+            extracted_text = DocumentManager.extract_text(filename, file_content)
+            chunks = self.text_splitter.split_text(extracted_text) if extracted_text else []
+            
+            print(f"🔁 Re-indexación delta: {filename} ({len(previous_docs)} versiones anteriores, {len(chunks)} chunks nuevos)")
+            
+            # Embeddings existentes agrupados por hash de chunk
+            previous_ids = [doc.id for doc in previous_docs]
+            existing_by_hash = {}
+            for embedding in Embedding.query.filter(
+                Embedding.client_id == client_id,
+                Embedding.document_id.in_(previous_ids)
+            ).order_by(Embedding.chunk_index).all():
+                chunk_hash = embedding.chunk_hash or self.calculate_chunk_hash(embedding.text_chunk)
+                existing_by_hash.setdefault(chunk_hash, []).append(embedding)
+            
+            # Nueva versión del documento
+            new_document = Document(
                 client_id=client_id,
-                index_name=index_name,
-                index_data=index_data,
-                index_metadata=json.dumps(metadata),
-                vector_dimension=vector_dimension,
-                total_vectors=len(vectors),
-                index_type="IndexFlatL2",
-                is_active=True,
-                version=1
+                filename=filename,
+                file_type=filename.lower().split('.')[-1] if '.' in filename else 'unknown',
+                file_size=len(file_content),
+                file_content=file_content,
+                extracted_text=extracted_text,
+                content_hash=content_hash,
+                is_processed=len(extracted_text.strip()) >= MIN_TEXT_CHARS
             )
+            db.session.add(new_document)
+            db.session.flush()
+            
+            embedding_model = None
+            added_embeddings = []
+            writer = BulkWriter(Embedding, use_copy=False)
+            pending_rows = []
+            reused = 0
+            
+            for i, chunk_text in enumerate(chunks):
+                chunk_hash = self.calculate_chunk_hash(chunk_text)
+                candidates = existing_by_hash.get(chunk_hash)
+                
+                if candidates:
+                    # Chunk sin cambios: se reasigna el vector existente
+                    embedding = candidates.pop(0)
+                    embedding.document_id = new_document.id
+                    embedding.chunk_index = i
+                    embedding.chunk_hash = chunk_hash
+                    reused += 1
+                else:
+                    if embedding_model is None:
+                        embedding_model = self._get_embedding_model()
+                    
+                    chunk_vector = embedding_model.embed_query(chunk_text)
+                    vector_array = np.array(chunk_vector, dtype=np.float32)
+                    
+                    row = {
+                        'client_id': client_id,
+                        'document_id': new_document.id,
+                        'text_chunk': chunk_text,
+                        'chunk_index': i,
+                        'chunk_hash': chunk_hash,
+                        'embedding_vector': self._serialize_vector(vector_array),
+                        'vector_dimension': len(chunk_vector),
+                        'model_used': "text-embedding-004"
+                    }
+                    pending_rows.append(row)
+                    inserted_ids = writer.add(row)
+                    if inserted_ids:
+                        added_embeddings.extend(self._embeddings_from_rows(pending_rows, inserted_ids))
+                        pending_rows = []
+                
+                if progress_callback:
+                    try:
+                        progress_callback(i + 1, len(chunks))
+                    except Exception as callback_error:
+                        print(f"⚠️ Error reportando progreso: {callback_error}")
+            
+            inserted_ids = writer.flush()
+            added_embeddings.extend(self._embeddings_from_rows(pending_rows, inserted_ids))
             
-            db.session.add(new_index)
+            # Retirar los chunks que ya no existen en la nueva versión
+            retired_ids = [emb.id for candidates in existing_by_hash.values() for emb in candidates]
+            db.session.flush()
+            
+            if retired_ids:
+                Embedding.query.filter(Embedding.id.in_(retired_ids)).delete(synchronize_session=False)
+            
+            # Reapuntar referencias de trabajos de ingesta y eliminar versiones anteriores
+            IngestionJobDocument.query.filter(IngestionJobDocument.document_id.in_(previous_ids)).update(
+                {'document_id': new_document.id}, synchronize_session=False
+            )
+            for doc in previous_docs:
+                db.session.expunge(doc)
+            Document.query.filter(Document.id.in_(previous_ids)).delete(synchronize_session=False)
+            
+            new_document.processed_date = datetime.utcnow()
             db.session.commit()
             
-            print(f"✅ Índice FAISS creado y guardado en PostgreSQL")
-            print(f"   - ID del índice: {new_index.id}")
-            print(f"   - Tamaño: {len(index_data):,} bytes")
+            print(f"✅ Delta aplicado: {len(added_embeddings)} chunks nuevos, {reused} reutilizados, {len(retired_ids)} retirados")
             
-            return new_index
+            # Los chunks ya están guardados: si el índice no se actualiza, el llamador debe reconstruirlo
+            index_updated = False
+            if update_index:
+                index_updated = self.update_faiss_index_incremental(
+                    client_id, added_embeddings, retired_ids, index_name
+                ) is not None
+            
+            return {
+                'document': new_document,
+                'unchanged': False,
+                'added': len(added_embeddings),
+                'reused': reused,
+                'retired': len(retired_ids),
+                'index_updated': index_updated
+            }
             
         except Exception as e:
             db.session.rollback()
-            print(f"❌ Error creando índice FAISS para cliente {client_id}: {e}")
-            return None
+            print(f"❌ Error en re-indexación delta de {filename}: {e}")
+            return {'document': None, 'error': str(e)}
     
     def load_faiss_index_for_client(self, client_id: int, index_name: str = "main_index") -> Optional[Tuple[faiss.Index, List[Embedding]]]:
         """
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# test_quote_parser.py
+"""Pruebas unitarias del parser de cotizaciones (python -m pytest test_quote_parser.py)"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules.quote_parser import ProductCatalog, parse_quote, tokenize
+
+
+def items_of(text, catalog=None):
+    return [(item['description'], item['quantity'], item['unit_price'])
+            for item in parse_quote(text, catalog)['items']]
+
+
+def test_modelo_de_una_letra_y_precio_por_linea():
+    """'A' es el modelo, no una preposición; cada precio va con el producto de su línea"""
+    text = "La Casa Modelo A tiene un precio de $150,000 USD.\nEl Apartamento B cuesta $85.000."
+    assert items_of(text) == [('Casa Modelo A', 1, 150000.0), ('Apartamento B', 1, 85000.0)]
+
+
+def test_precio_anterior_al_producto_en_la_misma_clausula():
+    text = "Precio del lote: $45,000 y el precio del apartamento 2: $90,000"
+    assert items_of(text) == [('Lote', 1, 45000.0), ('Apartamento 2', 1, 90000.0)]
+
+
+def test_precio_suelto_no_pasa_a_la_linea_siguiente():
+    text = "Precio especial $30,000.\nApartamento C"
+    assert ('Apartamento C', 1, 30000.0) not in items_of(text)
+
+
+def test_anio_sin_moneda_no_es_precio():
+    assert items_of("precio 2024") == []
+    assert [t for t in tokenize("precio 2024") if t['type'] == 'price'] == []
+
+
+def test_anio_con_moneda_si_es_precio():
+    assert [t['value'] for t in tokenize("precio $2024") if t['type'] == 'price'] == [2024.0]
+
+
+def test_a_minuscula_no_es_modelo():
+    assert 'Casa Modelo A' not in [name for name, _, _ in items_of("Casa modelo a la venta por $100")]
+
+
+def test_cantidad_y_precio_con_multiplicador():
+    assert items_of("Cotización: 2 unidades Apartamento 5B a $80,000 cada uno") == [('Apartamento 5B', 2, 80000.0)]
+    assert items_of("Lote 12 precio 2 millones") == [('Lote 12', 1, 2000000.0)]
+
+
+def test_catalogo_con_texto_que_cambia_de_longitud_al_normalizar():
+    """'…' y 'ﬁ' se expanden al normalizar; las posiciones del catálogo siguen siendo las del texto original"""
+    catalog = ProductCatalog([
+        {'id': 1, 'name': 'Lote Sol', 'sku': None, 'base_price': 100},
+        {'id': 2, 'name': 'Casa Aurora', 'sku': None, 'base_price': 100},
+    ])
+    text = 'Opciones……………………: Lote Sol $1,000. Casa Aurora $250,000'
+    assert items_of(text, catalog) == [('Lote Sol', 1, 1000.0), ('Casa Aurora', 1, 250000.0)]
+    text = 'Oﬁcina ﬁnal……: Lote Sol $1,000. Casa Aurora $250,000'
+    assert items_of(text, catalog) == [('Lote Sol', 1, 1000.0), ('Casa Aurora', 1, 250000.0)]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# test_sequence_allocator.py
+"""
+Numeración sin huecos tras un rollback (python -m pytest test_sequence_allocator.py)
+Necesita la base PostgreSQL de config.py con al menos un cliente.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import literal, text
+from modules import create_app, db
+from modules.commercial.sequence_allocator import SequenceAllocator
+
+
+@pytest.fixture
+def app_client_id():
+    app = create_app()
+    with app.app_context():
+        try:
+            client_id = db.session.execute(text("SELECT min(id) FROM client")).scalar()
+        except Exception as e:
+            pytest.skip(f"PostgreSQL no disponible: {e}")
+        if client_id is None:
+            pytest.skip("No hay clientes en la base de datos")
+        yield client_id
+
+
+def test_rollback_de_la_primera_factura_no_repite_numeros(app_client_id):
+    sequence_name = f"test-{uuid.uuid4().hex[:8]}"
+    allocator = SequenceAllocator()
+    try:
+        # Primera factura con numeración existente hasta 41; su transacción hace rollback
+        assert allocator.next_gap_free(app_client_id, sequence_name, seed=literal(41)) == 42
+        db.session.rollback()
+
+        # El contador sembrado sobrevive al rollback y el número 42 se libera
+        assert allocator.next_gap_free(app_client_id, sequence_name, seed=literal(41)) == 42
+        db.session.commit()
+
+        # Otro worker (sin claves en memoria) continúa la numeración
+        assert SequenceAllocator().next_gap_free(app_client_id, sequence_name, seed=literal(41)) == 43
+        db.session.commit()
+    finally:
+        db.session.rollback()
+        db.session.execute(
+            text("DELETE FROM document_sequences WHERE client_id = :client_id AND sequence_name = :name"),
+            {'client_id': app_client_id, 'name': sequence_name}
+        )
+        db.session.commit()